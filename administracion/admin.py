@@ -26,10 +26,11 @@ class RolPersonalizadoAdmin(admin.ModelAdmin):
 
 @admin.register(SystemBackup)
 class SystemBackupAdmin(admin.ModelAdmin):
-    list_display = ('name', 'backup_type', 'status', 'created_by', 'created_at', 'completed_at', 'size_bytes')
-    list_filter = ('backup_type', 'status', 'created_at')
+    list_display = ('name', 'backup_type', 'is_incremental', 'status', 'created_by', 'created_at', 'completed_at', 'size_bytes')
+    list_filter = ('backup_type', 'is_incremental', 'status', 'created_at')
     search_fields = ('name', 'notes')
-    readonly_fields = ('file_path', 'created_at', 'completed_at', 'size_bytes', 'status')
+    readonly_fields = ('file_path', 'created_at', 'completed_at', 'size_bytes', 'status',
+                       'logical_size_bytes', 'chunk_count', 'new_chunk_count')
     date_hierarchy = 'created_at'
     
     def has_change_permission(self, request, obj=None):
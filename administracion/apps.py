@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class AdministracionConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'administracion'
+
+    def ready(self):
+        from django.conf import settings
+
+        # Las trazas se instalan antes de que Django monte los middlewares
+        if settings.TRACING_ENABLED:
+            from core.tracing import instrument
+            instrument()
@@ -0,0 +1,439 @@
+"""
+Almacén de respaldos incrementales deduplicados por contenido.
+
+En lugar de guardar un volcado gzip completo en cada respaldo, la imagen de
+la base de datos (el volcado SQL) se divide en fragmentos definidos por su
+contenido. Cada fragmento se guarda una sola vez, direccionado por su hash
+SHA-256, y cada respaldo queda descrito por un manifiesto JSON con la lista
+ordenada de fragmentos que lo componen.
+
+Como los cortes dependen del contenido y no de la posición, insertar o
+modificar filas solo altera los fragmentos cercanos al cambio: un respaldo
+diario cuesta aproximadamente lo mismo que los datos que cambiaron ese día.
+
+Estructura dentro del almacenamiento:
+
+    chunks/ab/cd/abcd....gz     fragmento comprimido con gzip
+    manifests/<nombre>.json     manifiesto de un respaldo
+
+El almacenamiento es cualquier backend de Django: por defecto el sistema de
+archivos local (BACKUP_STORE_LOCATION), o el definido en STORAGES['backups']
+para usar django-storages (S3, Google Cloud, etc.).
+"""
+import gzip
+import hashlib
+import json
+import os
+import subprocess
+import zlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, storages
+from django.db import connections
+from django.utils import timezone
+
+# Tamaños de fragmento (bytes). El tamaño medio es el que controla la
+# granularidad de la deduplicación.
+CHUNK_MIN_SIZE = 16 * 1024
+CHUNK_AVG_SIZE = 64 * 1024
+CHUNK_MAX_SIZE = 512 * 1024
+
+MANIFEST_VERSION = 1
+
+# Un respaldo que sigue 'in_progress' pasado este tiempo se considera
+# abandonado y ya no detiene la recolección de fragmentos
+ABANDONED_BACKUP_AGE = timedelta(hours=24)
+
+
+def get_backup_storage():
+    """Devuelve el backend de almacenamiento configurado para los respaldos"""
+    if 'backups' in settings.STORAGES:
+        return storages['backups']
+    location = getattr(
+        settings, 'BACKUP_STORE_LOCATION',
+        os.path.join(settings.BASE_DIR, 'backups', 'store')
+    )
+    return FileSystemStorage(location=location)
+
+
+def iter_chunks(lines, min_size=CHUNK_MIN_SIZE, avg_size=CHUNK_AVG_SIZE, max_size=CHUNK_MAX_SIZE):
+    """
+    Agrupa un flujo de líneas (bytes) en fragmentos definidos por contenido.
+
+    Los volcados SQL tienen una sentencia por línea, así que los cortes se
+    hacen al final de una línea cuando su CRC32 cae por debajo de un umbral
+    proporcional a su longitud. Así la probabilidad de corte por byte es
+    constante (tamaño medio ~avg_size) y la decisión depende únicamente del
+    contenido de la línea, no de su posición en el archivo.
+    """
+    scale = (1 << 32) / avg_size
+    buffer = []
+    size = 0
+
+    for line in lines:
+        # Líneas enormes (blobs) se parten para respetar el tamaño máximo
+        while len(line) > max_size:
+            if buffer:
+                yield b''.join(buffer)
+                buffer, size = [], 0
+            yield line[:max_size]
+            line = line[max_size:]
+
+        if size + len(line) > max_size and buffer:
+            yield b''.join(buffer)
+            buffer, size = [], 0
+
+        buffer.append(line)
+        size += len(line)
+
+        if size >= min_size and zlib.crc32(line) < len(line) * scale:
+            yield b''.join(buffer)
+            buffer, size = [], 0
+
+    if buffer:
+        yield b''.join(buffer)
+
+
+def iter_database_image(alias='default'):
+    """
+    Genera la imagen lógica de la base de datos como líneas SQL (bytes).
+
+    - SQLite: usa iterdump() del módulo sqlite3, sin depender del binario.
+    - PostgreSQL: lee la salida estándar de pg_dump en streaming.
+    """
+    connection = connections[alias]
+    db_settings = connection.settings_dict
+
+    if connection.vendor == 'sqlite':
+        connection.ensure_connection()
+        for statement in connection.connection.iterdump():
+            yield (statement + '\n').encode('utf-8')
+        return
+
+    env = os.environ.copy()
+    env['PGPASSWORD'] = db_settings.get('PASSWORD') or ''
+    pg_cmd = [
+        'pg_dump',
+        '--clean',
+        '--if-exists',
+        '--format=plain',
+        f"--host={db_settings.get('HOST')}",
+        f"--port={db_settings.get('PORT') or '5432'}",
+        f"--username={db_settings.get('USER')}",
+        db_settings['NAME'],
+    ]
+    process = subprocess.Popen(pg_cmd, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    try:
+        for line in process.stdout:
+            yield line
+    finally:
+        process.stdout.close()
+        stderr = process.stderr.read()
+        process.stderr.close()
+        if process.wait() != 0:
+            raise Exception(f"Error al ejecutar pg_dump: {stderr.decode('utf-8', 'replace')}")
+
+
+def iter_file_lines(path):
+    """Lee un archivo binario en líneas sin cargarlo completo en memoria"""
+    with open(path, 'rb') as f:
+        for line in f:
+            yield line
+
+
+class ChunkStore:
+    """
+    Almacén de fragmentos direccionados por hash y de manifiestos de respaldo
+    """
+
+    def __init__(self, storage=None):
+        self.storage = storage or get_backup_storage()
+
+    # Fragmentos ---------------------------------------------------------
+
+    @staticmethod
+    def chunk_name(digest):
+        return f"chunks/{digest[:2]}/{digest[2:4]}/{digest}.gz"
+
+    def has_chunk(self, digest):
+        return self.storage.exists(self.chunk_name(digest))
+
+    def put_chunk(self, data):
+        """
+        Guarda un fragmento si no existe todavía.
+        Devuelve (digest, bytes_escritos); bytes_escritos es 0 si ya existía.
+
+        Un fragmento reutilizado se marca como reciente para que la
+        recolección no lo borre antes de que se escriba el manifiesto.
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        name = self.chunk_name(digest)
+        if self.storage.exists(name):
+            self.touch(name)
+            return digest, 0
+        compressed = gzip.compress(data, mtime=0)
+        self.storage.save(name, ContentFile(compressed))
+        return digest, len(compressed)
+
+    def touch(self, name):
+        """Actualiza la fecha de modificación (solo en almacenamientos locales)"""
+        try:
+            os.utime(self.storage.path(name))
+        except (NotImplementedError, OSError):
+            pass
+
+    def get_chunk(self, digest):
+        with self.storage.open(self.chunk_name(digest), 'rb') as f:
+            data = gzip.decompress(f.read())
+        if hashlib.sha256(data).hexdigest() != digest:
+            raise Exception(f"Fragmento corrupto en el almacén: {digest}")
+        return data
+
+    def iter_chunk_names(self):
+        """Recorre todos los archivos bajo chunks/ del almacenamiento"""
+        pending = ['chunks']
+        while pending:
+            current = pending.pop()
+            dirs, files = self._listdir(current)
+            for d in dirs:
+                pending.append(f"{current}/{d}")
+            for f in files:
+                yield f"{current}/{f}"
+
+    def _listdir(self, path):
+        # En almacenamientos de objetos (S3) los directorios no existen como
+        # tales, así que un prefijo vacío equivale a un directorio vacío
+        try:
+            return self.storage.listdir(path)
+        except (FileNotFoundError, OSError):
+            return [], []
+
+    # Manifiestos --------------------------------------------------------
+
+    @staticmethod
+    def manifest_name(name):
+        return f"manifests/{name}.json"
+
+    def write_manifest(self, name, manifest):
+        path = self.manifest_name(name)
+        if self.storage.exists(path):
+            self.storage.delete(path)
+        self.storage.save(path, ContentFile(json.dumps(manifest).encode('utf-8')))
+        return path
+
+    def read_manifest(self, path):
+        with self.storage.open(path, 'rb') as f:
+            return json.loads(f.read().decode('utf-8'))
+
+    def delete_manifest(self, path):
+        if path and self.storage.exists(path):
+            self.storage.delete(path)
+
+    def iter_manifests(self):
+        _, files = self._listdir('manifests')
+        for f in files:
+            if f.endswith('.json'):
+                yield f"manifests/{f}"
+
+    # Escritura y lectura de flujos ---------------------------------------
+
+    def store_stream(self, lines, stats):
+        """
+        Fragmenta y guarda un flujo de líneas. Devuelve la lista de
+        [digest, tamaño] y acumula estadísticas en el diccionario stats.
+        """
+        entries = []
+        for chunk in iter_chunks(lines):
+            digest, written = self.put_chunk(chunk)
+            entries.append([digest, len(chunk)])
+            stats['chunks'] += 1
+            stats['logical_bytes'] += len(chunk)
+            if written:
+                stats['new_chunks'] += 1
+                stats['new_bytes'] += written
+        return entries
+
+    def iter_stream(self, entries):
+        for digest, _size in entries:
+            yield self.get_chunk(digest)
+
+    def write_stream_to(self, entries, path):
+        with open(path, 'wb') as f:
+            for data in self.iter_stream(entries):
+                f.write(data)
+
+    # Recolección de basura ----------------------------------------------
+
+    def referenced_digests(self):
+        referenced = set()
+        for path in self.iter_manifests():
+            manifest = self.read_manifest(path)
+            for digest, _size in manifest.get('database', []):
+                referenced.add(digest)
+            for entry in manifest.get('media', []):
+                for digest, _size in entry['chunks']:
+                    referenced.add(digest)
+        return referenced
+
+    def collect_garbage(self, grace=timedelta(hours=6)):
+        """
+        Elimina los fragmentos que ningún manifiesto referencia.
+
+        Los fragmentos más recientes que el período de gracia se conservan:
+        pueden pertenecer a un respaldo en curso cuyo manifiesto todavía no
+        se ha escrito. Mientras haya un respaldo incremental en curso no se
+        borra nada: en almacenamientos remotos un fragmento reutilizado no
+        se puede marcar como reciente. Un respaldo que lleva más de
+        ABANDONED_BACKUP_AGE en curso se da por abandonado.
+        """
+        from .models import SystemBackup
+
+        running = SystemBackup.objects.filter(
+            is_incremental=True, status='in_progress', created_at__gt=timezone.now() - ABANDONED_BACKUP_AGE,
+        )
+        if running.exists():
+            return 0
+        limit = timezone.now() - grace
+        referenced = self.referenced_digests()
+        deleted = 0
+        for name in list(self.iter_chunk_names()):
+            digest = os.path.basename(name)[:-len('.gz')]
+            if digest in referenced:
+                continue
+            try:
+                if self.storage.get_modified_time(name) > limit:
+                    continue
+            except (NotImplementedError, OSError):
+                continue
+            self.storage.delete(name)
+            deleted += 1
+        return deleted
+
+
+def create_incremental_backup(backup, store=None):
+    """
+    Realiza un respaldo incremental y actualiza el registro SystemBackup.
+
+    La base de datos se incluye en los tipos 'full' y 'data'; los archivos
+    media en 'full' y 'media', cada archivo fragmentado por separado.
+    """
+    store = store or ChunkStore()
+    stats = {'chunks': 0, 'new_chunks': 0, 'logical_bytes': 0, 'new_bytes': 0}
+    created = timezone.now()
+    manifest = {
+        'version': MANIFEST_VERSION,
+        'backup_id': backup.id,
+        'name': backup.name,
+        'backup_type': backup.backup_type,
+        'created_at': created.isoformat(),
+        'engine': connections['default'].vendor,
+        'database': [],
+        'media': [],
+    }
+
+    if backup.backup_type in ('full', 'data'):
+        manifest['database'] = store.store_stream(iter_database_image(), stats)
+
+    if backup.backup_type in ('full', 'media'):
+        media_dir = settings.MEDIA_ROOT
+        if os.path.isdir(media_dir):
+            for dirpath, dirnames, filenames in os.walk(media_dir):
+                dirnames.sort()
+                for filename in sorted(filenames):
+                    full_path = os.path.join(dirpath, filename)
+                    manifest['media'].append({
+                        'path': os.path.relpath(full_path, media_dir),
+                        'chunks': store.store_stream(iter_file_lines(full_path), stats),
+                    })
+
+    manifest['stats'] = stats
+    name = f"{backup.name}_{created.strftime('%Y%m%d_%H%M%S')}_{backup.id}"
+    manifest_path = store.write_manifest(name, manifest)
+
+    backup.file_path = manifest_path
+    backup.size_bytes = stats['new_bytes']
+    backup.logical_size_bytes = stats['logical_bytes']
+    backup.chunk_count = stats['chunks']
+    backup.new_chunk_count = stats['new_chunks']
+    return manifest
+
+
+def restore_database_dump(backup, path, store=None):
+    """Reconstruye el volcado SQL de un respaldo incremental en 'path'"""
+    store = store or ChunkStore()
+    manifest = store.read_manifest(backup.file_path)
+    store.write_stream_to(manifest['database'], path)
+    return manifest
+
+
+def restore_media(backup, media_dir, store=None):
+    """Reconstruye los archivos media de un respaldo incremental"""
+    store = store or ChunkStore()
+    manifest = store.read_manifest(backup.file_path)
+    for entry in manifest['media']:
+        target = os.path.join(media_dir, entry['path'])
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        store.write_stream_to(entry['chunks'], target)
+    return manifest
+
+
+def select_backups_to_keep(backups, daily=7, weekly=4, monthly=6):
+    """
+    Aplica una política de retención abuelo-padre-hijo.
+
+    Recibe respaldos ordenados del más reciente al más antiguo y conserva el
+    más reciente de cada uno de los últimos N días, N semanas ISO y N meses.
+    El respaldo más reciente se conserva siempre.
+    """
+    keep = set()
+    buckets = {'daily': set(), 'weekly': set(), 'monthly': set()}
+    limits = {'daily': daily, 'weekly': weekly, 'monthly': monthly}
+
+    for index, backup in enumerate(backups):
+        if index == 0:
+            keep.add(backup.id)
+        moment = timezone.localtime(backup.created_at)
+        keys = {
+            'daily': moment.date(),
+            'weekly': moment.isocalendar()[:2],
+            'monthly': (moment.year, moment.month),
+        }
+        for period, key in keys.items():
+            if key not in buckets[period] and len(buckets[period]) < limits[period]:
+                buckets[period].add(key)
+                keep.add(backup.id)
+    return keep
+
+
+def apply_retention(policy=None, store=None, collect=True):
+    """
+    Elimina los respaldos incrementales que la política no conserva y,
+    opcionalmente, los fragmentos que quedaron sin referencia.
+    """
+    from .models import SystemBackup
+
+    policy = policy or getattr(settings, 'BACKUP_RETENTION', {})
+    store = store or ChunkStore()
+    backups = list(
+        SystemBackup.objects.filter(is_incremental=True, status='completed')
+        .order_by('-created_at')
+    )
+    keep = select_backups_to_keep(
+        backups,
+        daily=policy.get('daily', 7),
+        weekly=policy.get('weekly', 4),
+        monthly=policy.get('monthly', 6),
+    )
+
+    removed = []
+    for backup in backups:
+        if backup.id in keep:
+            continue
+        store.delete_manifest(backup.file_path)
+        removed.append(backup.name)
+        backup.delete()
+
+    deleted_chunks = store.collect_garbage() if collect else 0
+    return {'removed_backups': removed, 'deleted_chunks': deleted_chunks}
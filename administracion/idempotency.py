@@ -0,0 +1,153 @@
+"""
+Cabecera Idempotency-Key para los POST/PUT/PATCH de la API.
+
+Con conexiones inestables el frontend reintenta operaciones como
+letras/bulk_create/ o marcar_pagada, y cada reintento repetía el cambio
+(letras duplicadas, monto_pagado sumado dos veces). Si la petición trae
+Idempotency-Key:
+
+- La primera vez se reserva la clave (por usuario) en IdempotencyKey, se
+  ejecuta la vista y se guarda la respuesta durante IDEMPOTENCY_TTL_HOURS.
+- Un reintento con la misma clave recibe la respuesta guardada, con la
+  cabecera Idempotent-Replayed: true, sin volver a ejecutar la vista.
+- Si la primera petición sigue en curso, el duplicado espera a que termine
+  (hasta IDEMPOTENCY_WAIT_SECONDS; después 409 y el cliente reintenta).
+  La reserva es una fila en la base, así que funciona entre workers.
+- La misma clave con otro cuerpo o en otra ruta es un error del cliente (422).
+- Las respuestas 5xx no se guardan: la clave se libera y el reintento se
+  ejecuta de nuevo. Una reserva en curso más antigua que
+  IDEMPOTENCY_LOCK_SECONDS se da por abandonada (worker caído).
+
+Las claves vencidas se borran con 'python manage.py purgar_idempotencia'
+(desde cron, como compactar_cambios).
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse, JsonResponse
+from django.utils import timezone
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+
+from .models import IdempotencyKey
+
+IDEMPOTENT_METHODS = ('POST', 'PUT', 'PATCH')
+# Cabeceras de la respuesta original que se repiten en los reintentos
+STORED_HEADERS = ('Content-Type', 'Location', 'ETag')
+POLL_INTERVAL = 0.1  # segundos entre comprobaciones de una clave en curso
+
+
+def fingerprint(request):
+    """Huella del método, la ruta y el cuerpo de la petición"""
+    digest = hashlib.sha256(f"{request.method} {request.get_full_path()}\n".encode())
+    digest.update(request.body)
+    return digest.hexdigest()
+
+
+def _authenticate(request):
+    # El middleware va antes de DRF: la clave es por usuario, así que se
+    # valida aquí el token (sin token válido la vista responde 401 sola)
+    try:
+        resultado = TokenAuthentication().authenticate(request)
+    except AuthenticationFailed:
+        return None
+    return resultado[0] if resultado else None
+
+
+def _replay(registro):
+    response = HttpResponse(bytes(registro.response_body), status=registro.response_status)
+    for nombre, valor in registro.response_headers.items():
+        response[nombre] = valor
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def _error(mensaje, status, **cabeceras):
+    response = JsonResponse({'error': mensaje}, status=status)
+    for nombre, valor in cabeceras.items():
+        response[nombre] = valor
+    return response
+
+
+class IdempotencyMiddleware:
+    """
+    Reserva la clave, ejecuta la vista una sola vez y repite su respuesta.
+    Va antes de QueryBudgetMiddleware para que sus consultas no cuenten en
+    el presupuesto de la vista.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        key = request.META.get('HTTP_IDEMPOTENCY_KEY')
+        if not key or request.method not in IDEMPOTENT_METHODS or not request.path.startswith('/api/'):
+            return self.get_response(request)
+        if len(key) > 255:
+            return _error('Idempotency-Key admite como máximo 255 caracteres', 400)
+        user = _authenticate(request)
+        if user is None:
+            return self.get_response(request)
+
+        huella = fingerprint(request)
+        espera = getattr(settings, 'IDEMPOTENCY_WAIT_SECONDS', 10)
+        limite = time.monotonic() + espera
+        while True:
+            registro, creado = self.claim(user, key, request, huella)
+            if creado:
+                break
+            if registro.fingerprint != huella:
+                return _error('Idempotency-Key ya usada con otra petición', 422)
+            if registro.status == 'completed':
+                return _replay(registro)
+            if time.monotonic() >= limite:
+                return _error('Hay una petición con la misma Idempotency-Key en curso', 409,
+                              **{'Retry-After': str(max(int(espera), 1))})
+            time.sleep(POLL_INTERVAL)
+
+        try:
+            response = self.get_response(request)
+        except Exception:
+            registro.delete()
+            raise
+        if response.status_code >= 500 or response.streaming:
+            registro.delete()
+            return response
+
+        IdempotencyKey.objects.filter(pk=registro.pk).update(
+            status='completed',
+            response_status=response.status_code,
+            response_headers={h: response[h] for h in STORED_HEADERS if h in response},
+            response_body=response.content,
+        )
+        return response
+
+    def claim(self, user, key, request, huella):
+        """
+        Reserva la clave y devuelve (registro, True), o (registro existente,
+        False). Las claves vencidas o abandonadas se borran y se reservan
+        de nuevo.
+        """
+        ahora = timezone.now()
+        ttl = timezone.timedelta(hours=getattr(settings, 'IDEMPOTENCY_TTL_HOURS', 24))
+        abandono = ahora - timezone.timedelta(seconds=getattr(settings, 'IDEMPOTENCY_LOCK_SECONDS', 60))
+        while True:
+            try:
+                with transaction.atomic():
+                    return IdempotencyKey.objects.create(
+                        user=user, key=key, method=request.method, path=request.path[:500],
+                        fingerprint=huella, expires_at=ahora + ttl,
+                    ), True
+            except IntegrityError:
+                pass
+            registro = IdempotencyKey.objects.filter(user=user, key=key).first()
+            if registro is None:
+                continue
+            vencida = registro.expires_at <= ahora
+            abandonada = registro.status == 'in_progress' and registro.created_at < abandono
+            if not (vencida or abandonada):
+                return registro, False
+            # El filtro por created_at evita borrar una reserva nueva de otro worker
+            IdempotencyKey.objects.filter(pk=registro.pk, created_at=registro.created_at).delete()
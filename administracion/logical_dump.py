@@ -0,0 +1,426 @@
+"""
+Exportación e importación lógica de datos, independiente del motor.
+
+Cada tabla de modelo se vuelca como JSON Lines comprimido con gzip (una fila
+por línea, como lista de valores en el orden de 'fields' del manifiesto).
+El formato no depende de SQLite ni de PostgreSQL, así que sirve para mover
+un sistema entre motores sin los binarios sqlite3/pg_dump/psql:
+
+    python manage.py exportar_datos /ruta/volcado          # desde SQLite
+    DATABASE_URL=postgres://... python manage.py migrate
+    DATABASE_URL=postgres://... python manage.py importar_datos /ruta/volcado --reemplazar
+
+- La exportación recorre cada tabla por lotes ordenados por clave primaria
+  (keyset: pk > último visto), sin OFFSET ni cargar la tabla en memoria.
+- Las tablas se agrupan en niveles según sus claves foráneas; las tablas de
+  un mismo nivel son independientes y se procesan en paralelo.
+- La importación usa bulk_create por lotes dentro de una transacción por
+  tabla y, al terminar, compara el conteo de filas y las sumas de columnas
+  numéricas con las registradas en el manifiesto.
+"""
+import base64
+import datetime
+import decimal
+import gzip
+import json
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.apps import apps
+from django.core.management.color import no_style
+from django.db import connections, models, transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+FORMAT_VERSION = 1
+DEFAULT_BATCH_SIZE = 5000
+MANIFEST_FILENAME = 'manifest.json'
+
+# Columnas cuyas sumas se registran para verificar la importación
+SUMMABLE_FIELDS = (
+    models.DecimalField,
+    models.IntegerField,
+    models.BigIntegerField,
+    models.SmallIntegerField,
+    models.PositiveIntegerField,
+    models.PositiveBigIntegerField,
+    models.PositiveSmallIntegerField,
+)
+
+
+class LogicalDumpError(Exception):
+    pass
+
+
+def encode_value(value):
+    """Convierte un valor de la base de datos en un valor JSON sin perder precisión"""
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, datetime.timedelta):
+        return value.total_seconds()
+    if isinstance(value, decimal.Decimal):
+        return str(value)
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    if isinstance(value, (bytes, memoryview)):
+        return base64.b64encode(bytes(value)).decode('ascii')
+    return value
+
+
+def decode_value(field, value):
+    """Convierte un valor JSON al tipo Python del campo"""
+    if value is None:
+        return None
+    if isinstance(field, models.BinaryField):
+        return base64.b64decode(value)
+    if isinstance(field, models.DurationField):
+        return datetime.timedelta(seconds=value)
+    if isinstance(field, models.JSONField):
+        return value
+    if isinstance(field, models.ForeignKey):
+        return decode_value(field.target_field, value)
+    return field.to_python(value)
+
+
+def get_dump_fields(model):
+    """Campos concretos con columna propia en el orden en que se vuelcan"""
+    return [f for f in model._meta.concrete_fields]
+
+
+def get_dump_models(app_labels=None):
+    """Modelos con tabla propia (incluye tablas intermedias de ManyToMany)"""
+    result = []
+    for model in apps.get_models(include_auto_created=True):
+        opts = model._meta
+        if opts.proxy or not opts.managed:
+            continue
+        if app_labels and opts.app_label not in app_labels:
+            continue
+        result.append(model)
+    return result
+
+
+def dependency_levels(model_list):
+    """
+    Agrupa los modelos en niveles: cada modelo solo depende (por clave
+    foránea) de modelos de niveles anteriores. Las dependencias circulares
+    se rompen colocando los modelos restantes en un último nivel.
+    """
+    included = set(model_list)
+    pending = {}
+    for model in model_list:
+        deps = set()
+        for field in model._meta.concrete_fields:
+            if field.remote_field and field.related_model in included and field.related_model is not model:
+                deps.add(field.related_model)
+        pending[model] = deps
+
+    levels = []
+    done = set()
+    while pending:
+        ready = [m for m, deps in pending.items() if deps <= done]
+        if not ready:
+            ready = list(pending)
+        ready.sort(key=lambda m: m._meta.label)
+        levels.append(ready)
+        for model in ready:
+            done.add(model)
+            del pending[model]
+    return levels
+
+
+def table_filename(model):
+    return f"{model._meta.label_lower}.jsonl.gz"
+
+
+# Exportación --------------------------------------------------------------
+
+def export_table(model, directory, using='default', batch_size=DEFAULT_BATCH_SIZE, snapshot=None):
+    """Vuelca una tabla completa por lotes keyset y devuelve su entrada de manifiesto"""
+    fields = get_dump_fields(model)
+    attnames = [f.attname for f in fields]
+    pk_attname = model._meta.pk.attname
+    summable = [f.attname for f in fields if isinstance(f, SUMMABLE_FIELDS) and not f.remote_field]
+    sums = {name: 0 for name in summable}
+    sum_index = [(name, attnames.index(name)) for name in summable]
+    pk_index = attnames.index(pk_attname)
+    rows = 0
+    started = time.monotonic()
+
+    def write_rows(out):
+        nonlocal rows
+        queryset = model._base_manager.using(using).order_by(pk_attname)
+        last_pk = None
+        while True:
+            batch_qs = queryset if last_pk is None else queryset.filter(**{f"{pk_attname}__gt": last_pk})
+            batch = list(batch_qs.values_list(*attnames)[:batch_size])
+            if not batch:
+                break
+            lines = []
+            for row in batch:
+                for name, index in sum_index:
+                    if row[index] is not None:
+                        sums[name] += row[index]
+                lines.append(json.dumps([encode_value(v) for v in row], ensure_ascii=False, separators=(',', ':')))
+            out.write(('\n'.join(lines) + '\n').encode('utf-8'))
+            rows += len(batch)
+            last_pk = batch[-1][pk_index]
+            if len(batch) < batch_size:
+                break
+
+    path = os.path.join(directory, table_filename(model))
+    with gzip.open(path, 'wb', compresslevel=3) as out:
+        if snapshot:
+            # PostgreSQL: todos los hilos leen la misma instantánea exportada
+            with transaction.atomic(using=using):
+                with connections[using].cursor() as cursor:
+                    cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+                    cursor.execute("SET TRANSACTION SNAPSHOT %s", [snapshot])
+                write_rows(out)
+        else:
+            write_rows(out)
+
+    return {
+        'model': model._meta.label,
+        'file': table_filename(model),
+        'fields': attnames,
+        'rows': rows,
+        'sums': {name: encode_value(value) for name, value in sums.items()},
+        'seconds': round(time.monotonic() - started, 3),
+    }
+
+
+def _run_in_thread(func, *args, **kwargs):
+    """Ejecuta func y cierra la conexión propia del hilo al terminar"""
+    try:
+        return func(*args, **kwargs)
+    finally:
+        connections.close_all()
+
+
+def export_data(directory, using='default', app_labels=None, workers=4,
+                batch_size=DEFAULT_BATCH_SIZE, log=None):
+    """
+    Exporta todas las tablas a 'directory' y escribe el manifiesto.
+
+    En PostgreSQL las tablas de cada nivel se vuelcan en paralelo sobre una
+    instantánea común (pg_export_snapshot), así el volcado es consistente.
+    En SQLite se vuelca todo en una sola transacción de lectura.
+    """
+    os.makedirs(directory, exist_ok=True)
+    connection = connections[using]
+    levels = dependency_levels(get_dump_models(app_labels))
+    tables = []
+
+    def record(entry, level):
+        entry['level'] = level
+        tables.append(entry)
+        if log:
+            log(f"  {entry['model']}: {entry['rows']} filas ({entry['seconds']} s)")
+
+    if connection.vendor == 'postgresql' and workers > 1:
+        with transaction.atomic(using=using):
+            with connection.cursor() as cursor:
+                cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+                cursor.execute("SELECT pg_export_snapshot()")
+                snapshot = cursor.fetchone()[0]
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                for level, level_models in enumerate(levels):
+                    futures = [
+                        executor.submit(_run_in_thread, export_table, model, directory,
+                                        using, batch_size, snapshot)
+                        for model in level_models
+                    ]
+                    for future in futures:
+                        record(future.result(), level)
+    else:
+        with transaction.atomic(using=using):
+            for level, level_models in enumerate(levels):
+                for model in level_models:
+                    record(export_table(model, directory, using, batch_size), level)
+
+    manifest = {
+        'version': FORMAT_VERSION,
+        'created_at': timezone.now().isoformat(),
+        'engine': connection.vendor,
+        'tables': tables,
+    }
+    with open(os.path.join(directory, MANIFEST_FILENAME), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    return manifest
+
+
+# Importación --------------------------------------------------------------
+
+class _disabled_auto_now:
+    """Desactiva auto_now/auto_now_add para conservar las fechas originales"""
+
+    def __init__(self, model):
+        self.fields = [
+            f for f in model._meta.concrete_fields
+            if getattr(f, 'auto_now', False) or getattr(f, 'auto_now_add', False)
+        ]
+        self.saved = []
+
+    def __enter__(self):
+        for field in self.fields:
+            self.saved.append((field, field.auto_now, field.auto_now_add))
+            field.auto_now = field.auto_now_add = False
+
+    def __exit__(self, *exc):
+        for field, auto_now, auto_now_add in self.saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+def read_manifest(directory):
+    path = os.path.join(directory, MANIFEST_FILENAME)
+    if not os.path.exists(path):
+        raise LogicalDumpError(f"No se encontró {MANIFEST_FILENAME} en {directory}")
+    with open(path, encoding='utf-8') as f:
+        manifest = json.load(f)
+    if manifest.get('version') != FORMAT_VERSION:
+        raise LogicalDumpError(f"Versión de formato no soportada: {manifest.get('version')}")
+    return manifest
+
+
+def import_table(entry, directory, using='default', batch_size=DEFAULT_BATCH_SIZE):
+    """Carga una tabla con bulk_create por lotes dentro de una transacción"""
+    model = apps.get_model(entry['model'])
+    fields_by_attname = {f.attname: f for f in get_dump_fields(model)}
+    missing = [name for name in entry['fields'] if name not in fields_by_attname]
+    if missing:
+        raise LogicalDumpError(f"{entry['model']}: columnas desconocidas {missing}")
+    fields = [fields_by_attname[name] for name in entry['fields']]
+    started = time.monotonic()
+    rows = 0
+
+    path = os.path.join(directory, entry['file'])
+    with _disabled_auto_now(model), transaction.atomic(using=using):
+        manager = model._base_manager.using(using)
+        batch = []
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                values = json.loads(line)
+                batch.append(model(**{
+                    field.attname: decode_value(field, value)
+                    for field, value in zip(fields, values)
+                }))
+                if len(batch) >= batch_size:
+                    manager.bulk_create(batch)
+                    rows += len(batch)
+                    batch = []
+        if batch:
+            manager.bulk_create(batch)
+            rows += len(batch)
+
+    return {'model': entry['model'], 'rows': rows, 'seconds': round(time.monotonic() - started, 3)}
+
+
+def sums_match(field, actual, expected):
+    """
+    Compara una suma de la base con la del manifiesto. SQLite suma las
+    columnas decimales como float (66161215.8100001 en vez de 66161215.81),
+    así que los DecimalField se comparan redondeados a sus decimales.
+    """
+    actual = decimal.Decimal(str(actual))
+    expected = decimal.Decimal(str(expected))
+    if isinstance(field, models.DecimalField):
+        exponent = decimal.Decimal(1).scaleb(-field.decimal_places)
+        return actual.quantize(exponent) == expected.quantize(exponent)
+    return actual == expected
+
+
+def verify_table(entry, using='default'):
+    """Compara conteo y sumas de la tabla importada con el manifiesto"""
+    model = apps.get_model(entry['model'])
+    queryset = model._base_manager.using(using)
+    errors = []
+
+    count = queryset.count()
+    if count != entry['rows']:
+        errors.append(f"filas: esperado {entry['rows']}, encontrado {count}")
+
+    if entry['sums']:
+        fields = {f.attname: f for f in get_dump_fields(model)}
+        aggregates = queryset.aggregate(**{name: Sum(name) for name in entry['sums']})
+        for name, expected in entry['sums'].items():
+            actual = aggregates[name] or 0
+            expected = decode_value(fields[name], expected)
+            if not sums_match(fields[name], actual, expected):
+                errors.append(f"suma de {name}: esperado {expected}, encontrado {actual}")
+    return errors
+
+
+def flush_tables(model_list, using='default'):
+    """Vacía las tablas destino antes de cargar (equivale a 'flush' limitado)"""
+    connection = connections[using]
+    tables = [m._meta.db_table for m in model_list]
+    sql_list = connection.ops.sql_flush(no_style(), tables, reset_sequences=True, allow_cascade=True)
+    connection.ops.execute_sql_flush(sql_list)
+
+
+def reset_sequences(model_list, using='default'):
+    """Ajusta las secuencias de claves autoincrementales tras insertar con pk explícita"""
+    connection = connections[using]
+    statements = connection.ops.sequence_reset_sql(no_style(), model_list)
+    if statements:
+        with transaction.atomic(using=using):
+            with connection.cursor() as cursor:
+                for sql in statements:
+                    cursor.execute(sql)
+
+
+def import_data(directory, using='default', workers=None, batch_size=DEFAULT_BATCH_SIZE,
+                replace=False, verify=True, log=None):
+    """
+    Importa un volcado lógico en la base de datos 'using'.
+
+    Las tablas de un mismo nivel de dependencias se cargan en paralelo. En
+    SQLite se usa un solo hilo, ya que las escrituras no son concurrentes.
+    Devuelve un diccionario con los tiempos y los errores de verificación.
+    """
+    manifest = read_manifest(directory)
+    connection = connections[using]
+    if workers is None:
+        workers = 1 if connection.vendor == 'sqlite' else 4
+
+    entries = sorted(manifest['tables'], key=lambda e: (e['level'], e['model']))
+    levels = {}
+    for entry in entries:
+        levels.setdefault(entry['level'], []).append(entry)
+    model_list = [apps.get_model(e['model']) for e in entries]
+
+    if replace:
+        flush_tables(model_list, using)
+
+    results = []
+    for level in sorted(levels):
+        level_entries = levels[level]
+        if workers > 1 and len(level_entries) > 1:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = [
+                    executor.submit(_run_in_thread, import_table, entry, directory, using, batch_size)
+                    for entry in level_entries
+                ]
+                level_results = [future.result() for future in futures]
+        else:
+            level_results = [import_table(entry, directory, using, batch_size) for entry in level_entries]
+        for result in level_results:
+            results.append(result)
+            if log:
+                log(f"  {result['model']}: {result['rows']} filas ({result['seconds']} s)")
+
+    reset_sequences(model_list, using)
+
+    errors = {}
+    if verify:
+        for entry in entries:
+            table_errors = verify_table(entry, using)
+            if table_errors:
+                errors[entry['model']] = table_errors
+
+    return {'tables': results, 'errors': errors}
@@ -0,0 +1,136 @@
+import copy
+import json
+import statistics
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.utils import load_backend
+
+
+def _percentil(valores, p):
+    ordenados = sorted(valores)
+    indice = min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))
+    return ordenados[indice]
+
+
+class Command(BaseCommand):
+    help = (
+        "Mide la latencia por petición abriendo una conexión nueva en cada una "
+        "(comportamiento actual, CONN_MAX_AGE=0), con conexiones persistentes "
+        "y con el pool de psycopg (solo PostgreSQL)"
+    )
+
+    MODOS = ('sin_pool', 'persistente', 'pool')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default', help='Alias de la base a medir')
+        parser.add_argument('--peticiones', type=int, default=200,
+                            help='Peticiones simuladas por hilo (por defecto: 200)')
+        parser.add_argument('--hilos', type=int, default=4,
+                            help='Hilos concurrentes, como los threads de un worker (por defecto: 4)')
+        parser.add_argument('--consultas', type=int, default=3,
+                            help='Consultas por petición (por defecto: 3)')
+        parser.add_argument('--modos', nargs='+', choices=self.MODOS, default=list(self.MODOS))
+        parser.add_argument('--pool-max', type=int, default=None,
+                            help='Tamaño máximo del pool (por defecto: el de settings o el número de hilos)')
+        parser.add_argument('--json', action='store_true', help='Imprimir el resultado en JSON')
+
+    def handle(self, *args, **options):
+        alias = options['database']
+        if alias not in connections.settings:
+            raise CommandError(f"La base '{alias}' no está configurada")
+        base_settings = connections[alias].settings_dict
+
+        resultados = []
+        for modo in options['modos']:
+            if modo == 'pool' and base_settings['ENGINE'] != 'django.db.backends.postgresql':
+                self.stderr.write("Modo 'pool' omitido: requiere PostgreSQL con psycopg 3")
+                continue
+            resultados.append(self.medir(modo, base_settings, options))
+
+        if options['json']:
+            self.stdout.write(json.dumps(resultados, indent=2))
+            return
+
+        self.stdout.write(
+            f"{'modo':<12} {'peticiones':>10} {'media ms':>9} {'p50 ms':>8} "
+            f"{'p95 ms':>8} {'p99 ms':>8} {'pet/s':>9}"
+        )
+        for r in resultados:
+            self.stdout.write(
+                f"{r['modo']:<12} {r['peticiones']:>10} {r['media_ms']:>9.2f} {r['p50_ms']:>8.2f} "
+                f"{r['p95_ms']:>8.2f} {r['p99_ms']:>8.2f} {r['peticiones_por_segundo']:>9.1f}"
+            )
+
+    def crear_conexion(self, modo, base_settings, options):
+        """Crea un DatabaseWrapper independiente configurado para el modo"""
+        settings_dict = copy.deepcopy(base_settings)
+        opciones = settings_dict.setdefault('OPTIONS', {})
+        pool = opciones.pop('pool', None)
+        settings_dict['CONN_MAX_AGE'] = 0
+        if modo == 'pool':
+            pool = dict(pool) if isinstance(pool, dict) else {}
+            pool['max_size'] = options['pool_max'] or pool.get('max_size') or options['hilos']
+            pool['min_size'] = min(pool.get('min_size', 1), pool['max_size'])
+            opciones['pool'] = pool
+        elif modo == 'persistente':
+            settings_dict['CONN_MAX_AGE'] = None
+        backend = load_backend(settings_dict['ENGINE'])
+        # Alias propio para no compartir el pool de la aplicación
+        return backend.DatabaseWrapper(settings_dict, f"benchmark_{modo}")
+
+    def medir(self, modo, base_settings, options):
+        latencias = []
+        lock = threading.Lock()
+        errores = []
+
+        def trabajador():
+            conexion = self.crear_conexion(modo, base_settings, options)
+            propias = []
+            try:
+                for _ in range(options['peticiones']):
+                    inicio = time.perf_counter()
+                    # Lo mismo que hace Django al empezar y terminar una petición
+                    conexion.close_if_unusable_or_obsolete()
+                    with conexion.cursor() as cursor:
+                        for _ in range(options['consultas']):
+                            cursor.execute("SELECT 1")
+                            cursor.fetchone()
+                    conexion.close_if_unusable_or_obsolete()
+                    if modo != 'persistente':
+                        conexion.close()
+                    propias.append(time.perf_counter() - inicio)
+            except Exception as e:
+                errores.append(str(e))
+            finally:
+                conexion.close()
+                with lock:
+                    latencias.extend(propias)
+
+        hilos = [threading.Thread(target=trabajador) for _ in range(options['hilos'])]
+        inicio = time.perf_counter()
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        duracion = time.perf_counter() - inicio
+
+        if modo == 'pool':
+            self.crear_conexion(modo, base_settings, options).close_pool()
+        if errores:
+            raise CommandError(f"Error en modo '{modo}': {errores[0]}")
+
+        ms = [l * 1000 for l in latencias]
+        return {
+            'modo': modo,
+            'hilos': options['hilos'],
+            'peticiones': len(ms),
+            'consultas_por_peticion': options['consultas'],
+            'media_ms': statistics.mean(ms),
+            'p50_ms': _percentil(ms, 50),
+            'p95_ms': _percentil(ms, 95),
+            'p99_ms': _percentil(ms, 99),
+            'peticiones_por_segundo': len(ms) / duracion if duracion else 0.0,
+        }
@@ -0,0 +1,159 @@
+import json
+import os
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connections, transaction
+
+from .benchmark_conexiones import _percentil
+
+
+class Command(BaseCommand):
+    help = (
+        "Escrituras concurrentes sobre un SQLite temporal con el backend estándar "
+        "y con el modo de concurrencia (WAL, busy_timeout, escrituras serializadas). "
+        "Informa tasa de errores 'database is locked' y rendimiento"
+    )
+
+    MODOS = ('estandar', 'concurrente')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hilos', type=int, default=8, help='Hilos escritores (por defecto: 8)')
+        parser.add_argument('--operaciones', type=int, default=200,
+                            help='Operaciones por hilo (por defecto: 200)')
+        parser.add_argument('--timeout', type=float, default=5,
+                            help='Segundos de espera ante un bloqueo, en ambos modos (por defecto: 5)')
+        parser.add_argument('--modos', nargs='+', choices=self.MODOS, default=list(self.MODOS))
+        parser.add_argument('--json', action='store_true', help='Imprimir el resultado en JSON')
+
+    def handle(self, *args, **options):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            resultados = [
+                self.medir(modo, os.path.join(tmpdir, f"{modo}.sqlite3"), options)
+                for modo in options['modos']
+            ]
+        finally:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+        if options['json']:
+            self.stdout.write(json.dumps(resultados, indent=2))
+            return
+
+        self.stdout.write(
+            f"{'modo':<12} {'ok':>7} {'errores':>8} {'% error':>8} {'ops/s':>9} "
+            f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"
+        )
+        for r in resultados:
+            self.stdout.write(
+                f"{r['modo']:<12} {r['ok']:>7} {r['errores']:>8} {r['tasa_error'] * 100:>7.1f}% "
+                f"{r['operaciones_por_segundo']:>9.1f} {r['p50_ms']:>8.2f} {r['p95_ms']:>8.2f} {r['p99_ms']:>8.2f}"
+            )
+
+    def configurar(self, modo, path, timeout):
+        if modo == 'estandar':
+            return {
+                'ENGINE': 'django.db.backends.sqlite3',
+                'NAME': path,
+                'OPTIONS': {'timeout': timeout},
+            }
+        return {
+            'ENGINE': 'core.db_backends.sqlite3',
+            'NAME': path,
+            'OPTIONS': {
+                'timeout': timeout,
+                'transaction_mode': 'IMMEDIATE',
+                'init_command': (
+                    'PRAGMA journal_mode=WAL;'
+                    'PRAGMA synchronous=NORMAL;'
+                    f'PRAGMA busy_timeout={int(timeout * 1000)};'
+                    'PRAGMA mmap_size=268435456'
+                ),
+            },
+        }
+
+    def medir(self, modo, path, options):
+        alias = f"benchmark_{modo}"
+        connections.settings[alias] = connections.configure_settings({
+            'default': {},
+            alias: self.configurar(modo, path, options['timeout']),
+        })[alias]
+        try:
+            with connections[alias].cursor() as cursor:
+                cursor.execute(
+                    "CREATE TABLE letra (id INTEGER PRIMARY KEY, pedido INTEGER, numero INTEGER, monto INTEGER)"
+                )
+                cursor.execute("CREATE TABLE pedido (id INTEGER PRIMARY KEY, monto_total INTEGER)")
+                cursor.execute("CREATE TABLE actividad (id INTEGER PRIMARY KEY, descripcion TEXT)")
+                cursor.executemany("INSERT INTO pedido (id, monto_total) VALUES (%s, 0)",
+                                   [(i,) for i in range(10)])
+            connections[alias].close()
+            return self.ejecutar(modo, alias, options)
+        finally:
+            connections[alias].close()
+            del connections[alias]
+            del connections.settings[alias]
+
+    def ejecutar(self, modo, alias, options):
+        latencias = []
+        errores = []
+        lock = threading.Lock()
+
+        def crear_letra(cursor, pedido):
+            # Lee y luego escribe en la misma transacción, como Letra.save()
+            cursor.execute("SELECT COALESCE(MAX(numero), 0) FROM letra WHERE pedido = %s", [pedido])
+            numero = cursor.fetchone()[0] + 1
+            cursor.execute("INSERT INTO letra (pedido, numero, monto) VALUES (%s, %s, 100)", [pedido, numero])
+            cursor.execute("UPDATE pedido SET monto_total = monto_total + 100 WHERE id = %s", [pedido])
+
+        def trabajador(indice):
+            propias, fallos = [], []
+            try:
+                for n in range(options['operaciones']):
+                    inicio = time.perf_counter()
+                    try:
+                        if n % 2:
+                            # Registro de actividad: INSERT suelto en autocommit
+                            with connections[alias].cursor() as cursor:
+                                cursor.execute("INSERT INTO actividad (descripcion) VALUES (%s)",
+                                               [f"hilo {indice} operación {n}"])
+                        else:
+                            with transaction.atomic(using=alias):
+                                with connections[alias].cursor() as cursor:
+                                    crear_letra(cursor, (indice + n) % 10)
+                        propias.append(time.perf_counter() - inicio)
+                    except OperationalError as e:
+                        fallos.append(str(e))
+            finally:
+                connections[alias].close()
+                with lock:
+                    latencias.extend(propias)
+                    errores.extend(fallos)
+
+        hilos = [threading.Thread(target=trabajador, args=(i,)) for i in range(options['hilos'])]
+        inicio = time.perf_counter()
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        duracion = time.perf_counter() - inicio
+
+        total = len(latencias) + len(errores)
+        ms = [l * 1000 for l in latencias] or [0.0]
+        return {
+            'modo': modo,
+            'hilos': options['hilos'],
+            'ok': len(latencias),
+            'errores': len(errores),
+            'tasa_error': len(errores) / total if total else 0.0,
+            'primer_error': errores[0] if errores else None,
+            'operaciones_por_segundo': len(latencias) / duracion if duracion else 0.0,
+            'media_ms': statistics.mean(ms),
+            'p50_ms': _percentil(ms, 50),
+            'p95_ms': _percentil(ms, 95),
+            'p99_ms': _percentil(ms, 99),
+        }
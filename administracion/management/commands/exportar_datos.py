@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from administracion.logical_dump import DEFAULT_BATCH_SIZE, export_data
+
+
+class Command(BaseCommand):
+    help = (
+        "Exporta todas las tablas como JSON Lines comprimido (formato lógico "
+        "independiente del motor, para migrar entre SQLite y PostgreSQL)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('directorio', help='Carpeta de destino del volcado')
+        parser.add_argument('--database', default='default', help='Alias de la base de datos de origen')
+        parser.add_argument('--apps', nargs='*', help='Limitar a estas aplicaciones (app_label)')
+        parser.add_argument('--workers', type=int, default=4,
+                            help='Hilos para volcar tablas independientes (solo PostgreSQL)')
+        parser.add_argument('--lote', type=int, default=DEFAULT_BATCH_SIZE, help='Filas por lote')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        self.stdout.write(f"Exportando datos a {options['directorio']}...")
+        manifest = export_data(
+            options['directorio'],
+            using=options['database'],
+            app_labels=options['apps'],
+            workers=options['workers'],
+            batch_size=options['lote'],
+            log=self.stdout.write,
+        )
+        total_rows = sum(t['rows'] for t in manifest['tables'])
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(manifest['tables'])} tablas, {total_rows} filas exportadas "
+            f"en {time.monotonic() - started:.1f} s"
+        ))
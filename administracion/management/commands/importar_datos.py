@@ -0,0 +1,49 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from administracion.logical_dump import DEFAULT_BATCH_SIZE, LogicalDumpError, import_data
+
+
+class Command(BaseCommand):
+    help = (
+        "Importa un volcado generado con 'exportar_datos' y verifica filas y "
+        "sumas de control. La base de destino debe estar migrada."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('directorio', help='Carpeta con manifest.json y los archivos .jsonl.gz')
+        parser.add_argument('--database', default='default', help='Alias de la base de datos de destino')
+        parser.add_argument('--reemplazar', action='store_true',
+                            help='Vaciar las tablas destino antes de cargar')
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Hilos para cargar tablas independientes (por defecto 1 en SQLite, 4 en PostgreSQL)')
+        parser.add_argument('--lote', type=int, default=DEFAULT_BATCH_SIZE, help='Filas por bulk_create')
+        parser.add_argument('--sin-verificar', action='store_true', help='Omitir la verificación posterior')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        self.stdout.write(f"Importando datos desde {options['directorio']}...")
+        try:
+            result = import_data(
+                options['directorio'],
+                using=options['database'],
+                workers=options['workers'],
+                batch_size=options['lote'],
+                replace=options['reemplazar'],
+                verify=not options['sin_verificar'],
+                log=self.stdout.write,
+            )
+        except LogicalDumpError as e:
+            raise CommandError(str(e))
+
+        total_rows = sum(t['rows'] for t in result['tables'])
+        self.stdout.write(f"{total_rows} filas cargadas en {time.monotonic() - started:.1f} s")
+
+        if result['errors']:
+            for model, errors in result['errors'].items():
+                for error in errors:
+                    self.stderr.write(f"  {model}: {error}")
+            raise CommandError("La verificación encontró diferencias con el volcado")
+        if not options['sin_verificar']:
+            self.stdout.write(self.style.SUCCESS("Verificación correcta: filas y sumas coinciden"))
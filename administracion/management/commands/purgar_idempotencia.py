@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from administracion.models import IdempotencyKey
+
+
+class Command(BaseCommand):
+    help = (
+        "Borra las claves de idempotencia vencidas (IDEMPOTENCY_TTL_HOURS) y sus "
+        "respuestas guardadas (pensado para ejecutarse cada hora desde cron)"
+    )
+
+    def handle(self, *args, **options):
+        borradas, _ = IdempotencyKey.objects.filter(expires_at__lte=timezone.now()).delete()
+        self.stdout.write(self.style.SUCCESS(
+            f"{borradas} claves de idempotencia vencidas eliminadas; quedan {IdempotencyKey.objects.count()}"
+        ))
@@ -0,0 +1,60 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from administracion.backup_store import ChunkStore, apply_retention
+from administracion.models import SystemBackup
+from administracion.views import perform_backup
+
+
+class Command(BaseCommand):
+    help = (
+        "Crea un respaldo incremental deduplicado y aplica la política de "
+        "retención (pensado para ejecutarse a diario desde cron)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--nombre', default=None, help='Nombre del respaldo')
+        parser.add_argument('--tipo', choices=['full', 'data', 'media'], default='data',
+                            help='Tipo de respaldo (por defecto: data)')
+        parser.add_argument('--sin-respaldo', action='store_true',
+                            help='No crear respaldo, solo aplicar retención y limpieza')
+        parser.add_argument('--retencion', action='store_true',
+                            help='Aplicar la política BACKUP_RETENTION tras el respaldo')
+        parser.add_argument('--diarios', type=int, help='Respaldos diarios a conservar')
+        parser.add_argument('--semanales', type=int, help='Respaldos semanales a conservar')
+        parser.add_argument('--mensuales', type=int, help='Respaldos mensuales a conservar')
+        parser.add_argument('--gc', action='store_true',
+                            help='Eliminar fragmentos sin referencia aunque no se aplique retención')
+
+    def handle(self, *args, **options):
+        if not options['sin_respaldo']:
+            backup = SystemBackup.objects.create(
+                name=options['nombre'] or f"incremental_{timezone.now().strftime('%Y%m%d')}",
+                backup_type=options['tipo'],
+                is_incremental=True,
+            )
+            perform_backup(backup.id)
+            backup.refresh_from_db()
+            if backup.status != 'completed':
+                raise CommandError(f"El respaldo falló: {backup.notes}")
+
+            self.stdout.write(self.style.SUCCESS(
+                f"Respaldo '{backup.name}' completado: {backup.chunk_count} fragmentos "
+                f"({backup.new_chunk_count} nuevos), {backup.logical_size_bytes} bytes lógicos, "
+                f"{backup.size_bytes} bytes escritos"
+            ))
+
+        if options['retencion']:
+            policy = dict(getattr(settings, 'BACKUP_RETENTION', {}))
+            for option, period in (('diarios', 'daily'), ('semanales', 'weekly'), ('mensuales', 'monthly')):
+                if options[option] is not None:
+                    policy[period] = options[option]
+            result = apply_retention(policy)
+            self.stdout.write(
+                f"Retención {policy}: {len(result['removed_backups'])} respaldos eliminados, "
+                f"{result['deleted_chunks']} fragmentos depurados"
+            )
+        elif options['gc']:
+            deleted = ChunkStore().collect_garbage()
+            self.stdout.write(f"{deleted} fragmentos depurados")
@@ -15,6 +15,7 @@ class ActivityLogMiddleware(MiddlewareMixin):
         r'^/media/',
         r'^/api/admin/logs/',  # Evitar recursión al consultar logs
         r'^/admin/jsi18n/',    # No registrar peticiones de internacionalización
+        r'^/api/batch/',       # Lotes de GET (core/batch.py): no modifican datos
     ]
     
     # Lista de patrones de URL que siempre queremos registrar
@@ -0,0 +1,33 @@
+# Generated by Django 5.2 on 2026-10-19 17:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('administracion', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='systembackup',
+            name='chunk_count',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='systembackup',
+            name='is_incremental',
+            field=models.BooleanField(default=False, help_text='Guardar en el almacén deduplicado en lugar de un volcado completo'),
+        ),
+        migrations.AddField(
+            model_name='systembackup',
+            name='logical_size_bytes',
+            field=models.BigIntegerField(blank=True, help_text='Tamaño sin deduplicar ni comprimir del respaldo', null=True),
+        ),
+        migrations.AddField(
+            model_name='systembackup',
+            name='new_chunk_count',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+    ]
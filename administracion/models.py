@@ -81,6 +81,12 @@ class SystemBackup(models.Model):
     - 'media/respaldos': almacena en carpeta media (accesible vía web)
     - Ruta personalizada: cualquier ruta dentro del proyecto
     
+    Respaldos incrementales (is_incremental=True):
+    La imagen de la base de datos se divide en fragmentos deduplicados que se
+    guardan una sola vez en el almacén de respaldos (ver backup_store.py).
+    En ese caso 'file_path' apunta al manifiesto dentro del almacén y
+    'size_bytes' refleja solo los bytes nuevos que aportó este respaldo.
+    
     IMPORTANTE PARA POSTGRESQL EN RENDER:
     La carpeta 'media/' en Render es persistente entre despliegues pero no
     entre instancias. Para respaldos permanentes en producción, considere
@@ -110,6 +116,13 @@ class SystemBackup(models.Model):
     notes = models.TextField(blank=True)
     carpeta = models.CharField(max_length=255, blank=True, null=True, 
                              help_text="Carpeta personalizada para el respaldo. Si está vacía, se usará la predeterminada.")
+    # Respaldos incrementales deduplicados
+    is_incremental = models.BooleanField(default=False,
+                                         help_text="Guardar en el almacén deduplicado en lugar de un volcado completo")
+    logical_size_bytes = models.BigIntegerField(null=True, blank=True,
+                                                help_text="Tamaño sin deduplicar ni comprimir del respaldo")
+    chunk_count = models.IntegerField(null=True, blank=True)
+    new_chunk_count = models.IntegerField(null=True, blank=True)
     
     class Meta:
         verbose_name = "Respaldo del Sistema"
@@ -118,3 +131,36 @@ class SystemBackup(models.Model):
     
     def __str__(self):
         return f"{self.name} ({self.get_backup_type_display()}) - {self.created_at.strftime('%d/%m/%Y %H:%M')}"
+
+
+class IdempotencyKey(models.Model):
+    """
+    Respuesta guardada de una petición con cabecera Idempotency-Key, para
+    repetirla si el cliente reintenta (ver administracion/idempotency.py)
+    """
+    STATUS_CHOICES = [
+        ('in_progress', 'En curso'),
+        ('completed', 'Completada'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='idempotency_keys')
+    key = models.CharField(max_length=255)
+    method = models.CharField(max_length=10)
+    path = models.CharField(max_length=500)
+    fingerprint = models.CharField(max_length=64, help_text="SHA-256 del método, la ruta y el cuerpo")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='in_progress')
+    response_status = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_headers = models.JSONField(default=dict, blank=True)
+    response_body = models.BinaryField(blank=True, default=b'')
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        verbose_name = "Clave de Idempotencia"
+        verbose_name_plural = "Claves de Idempotencia"
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='idempotency_key_unica_por_usuario'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} - {self.key} ({self.get_status_display()})"
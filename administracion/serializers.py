@@ -172,7 +172,8 @@ class SystemBackupSerializer(serializers.ModelSerializer):
     class Meta:
         model = SystemBackup
         fields = '__all__'
-        read_only_fields = ['status', 'file_path', 'completed_at', 'size_bytes']
+        read_only_fields = ['status', 'file_path', 'completed_at', 'size_bytes',
+                            'logical_size_bytes', 'chunk_count', 'new_chunk_count']
     
     def get_created_by_username(self, obj):
         if obj.created_by:
@@ -1,3 +1,258 @@
-from django.test import TestCase
+import functools
+import json
+import os
+import shutil
+import tempfile
+from datetime import date, timedelta
+from decimal import Decimal
+from io import StringIO
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from django.core.files.storage import FileSystemStorage
+from django.core.management import call_command
+from django.db.models import Sum
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from calendarBackend.models import DistribucionFinal, Empresa, Letra, Pedido, Proveedor
+from calendarBackend.tests import crear_usuario
+from . import idempotency
+from .backup_store import (
+    ChunkStore, apply_retention, create_incremental_backup, iter_chunks, iter_database_image,
+    restore_database_dump, select_backups_to_keep,
+)
+from .logical_dump import export_data, sums_match, verify_table
+from .models import IdempotencyKey, SystemBackup, UserActivity
+from .views import perform_incremental_restore
+
+
+class RespaldoIncrementalTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command('generar_datos', empresas=2, vendedores=3, proveedores=5, pedidos=30,
+                     letras=200, semilla=17, stdout=StringIO())
+
+    def setUp(self):
+        self.directorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directorio, ignore_errors=True)
+        self.store = ChunkStore(FileSystemStorage(location=os.path.join(self.directorio, 'store')))
+        # Fragmentos pequeños para que el volcado de prueba tenga varios
+        fragmentar = functools.partial(iter_chunks, min_size=1024, avg_size=4096, max_size=32 * 1024)
+        patcher = mock.patch('administracion.backup_store.iter_chunks', fragmentar)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.admin, _ = crear_usuario('admin_respaldo', 'admin')
+
+    def respaldar(self, nombre, tipo='data', dias=0):
+        """(respaldo, imagen de la base en el momento del respaldo)"""
+        backup = SystemBackup.objects.create(name=nombre, backup_type=tipo, is_incremental=True,
+                                             created_by=self.admin)
+        imagen = b''.join(iter_database_image())
+        create_incremental_backup(backup, store=self.store)
+        backup.status = 'completed'
+        backup.save()
+        SystemBackup.objects.filter(pk=backup.pk).update(created_at=timezone.now() - timedelta(days=dias))
+        backup.refresh_from_db()
+        return backup, imagen
+
+    def volcado(self, backup):
+        ruta = os.path.join(self.directorio, f'{backup.pk}.sql')
+        restore_database_dump(backup, ruta, store=self.store)
+        with open(ruta, 'rb') as f:
+            return f.read()
+
+    def test_restaurar_devuelve_la_misma_imagen(self):
+        backup, imagen = self.respaldar('completo')
+        self.assertGreater(backup.chunk_count, 1)
+        self.assertEqual(backup.new_chunk_count, backup.chunk_count)
+        self.assertEqual(backup.logical_size_bytes, len(imagen))
+        self.assertEqual(self.volcado(backup), imagen)
+
+    def test_segundo_respaldo_reutiliza_los_fragmentos(self):
+        primero, imagen_primero = self.respaldar('lunes')
+        Letra.objects.filter(pk=Letra.objects.order_by('numero_unico').values('pk')[:1]).update(estado='pagado')
+
+        segundo, imagen = self.respaldar('martes')
+        self.assertNotEqual(imagen, imagen_primero)
+        # Solo cambian los fragmentos cercanos a la letra y al nuevo respaldo
+        self.assertGreater(segundo.new_chunk_count, 0)
+        self.assertLess(segundo.new_chunk_count * 4, segundo.chunk_count)
+        self.assertLess(segundo.size_bytes * 4, primero.size_bytes)
+        self.assertEqual(self.volcado(segundo), imagen)
+        self.assertEqual(self.volcado(primero), imagen_primero)
+
+    def test_retencion_y_recoleccion_con_periodo_de_gracia(self):
+        antiguo, _ = self.respaldar('antiguo', dias=3)
+        Letra.objects.filter(pk__in=Letra.objects.values_list('pk', flat=True)[:50]).update(estado='atrasado')
+        reciente, imagen = self.respaldar('reciente')
+        fragmentos = set(self.store.iter_chunk_names())
+
+        resultado = apply_retention({'daily': 1, 'weekly': 0, 'monthly': 0}, store=self.store)
+        self.assertEqual(resultado['removed_backups'], ['antiguo'])
+        self.assertFalse(SystemBackup.objects.filter(pk=antiguo.pk).exists())
+        # Los fragmentos huérfanos son recientes: el período de gracia los conserva
+        self.assertEqual(resultado['deleted_chunks'], 0)
+        self.assertEqual(set(self.store.iter_chunk_names()), fragmentos)
+
+        borrados = self.store.collect_garbage(grace=timedelta(0))
+        self.assertGreater(borrados, 0)
+        referenciados = {ChunkStore.chunk_name(digest) for digest in self.store.referenced_digests()}
+        self.assertEqual(set(self.store.iter_chunk_names()), referenciados)
+        self.assertEqual(self.volcado(reciente), imagen)
+
+    def test_recoleccion_no_borra_fragmentos_reutilizados_en_curso(self):
+        antiguo, _ = self.respaldar('antiguo', dias=3)
+        # El manifiesto se borró (retención) y sus fragmentos son antiguos
+        self.store.delete_manifest(antiguo.file_path)
+        hace_dos_dias = (timezone.now() - timedelta(days=2)).timestamp()
+        for nombre in self.store.iter_chunk_names():
+            os.utime(self.store.storage.path(nombre), (hace_dos_dias, hace_dos_dias))
+
+        # Un respaldo en curso los reutiliza antes de escribir su manifiesto
+        lineas = list(iter_database_image())
+        stats = {'chunks': 0, 'new_chunks': 0, 'logical_bytes': 0, 'new_bytes': 0}
+        entradas = self.store.store_stream(lineas, stats)
+        self.assertLess(stats['new_chunks'] * 4, stats['chunks'])
+        self.store.collect_garbage(grace=timedelta(hours=1))
+        ruta = os.path.join(self.directorio, 'en_curso.sql')
+        self.store.write_stream_to(entradas, ruta)
+        with open(ruta, 'rb') as f:
+            self.assertEqual(f.read(), b''.join(lineas))
+
+    def test_recoleccion_espera_a_los_respaldos_en_curso(self):
+        antiguo, _ = self.respaldar('antiguo', dias=3)
+        self.store.delete_manifest(antiguo.file_path)
+        SystemBackup.objects.create(name='en curso', backup_type='data', is_incremental=True,
+                                    status='in_progress', created_by=self.admin)
+        self.assertEqual(self.store.collect_garbage(grace=timedelta(0)), 0)
+        SystemBackup.objects.filter(status='in_progress').update(status='failed')
+        self.assertGreater(self.store.collect_garbage(grace=timedelta(0)), 0)
+
+    def test_politica_de_retencion(self):
+        ahora = timezone.now()
+        respaldos = [SimpleNamespace(id=dias, created_at=ahora - timedelta(days=dias)) for dias in range(0, 120, 2)]
+        conservar = select_backups_to_keep(respaldos, daily=3, weekly=0, monthly=0)
+        self.assertEqual(conservar, {0, 2, 4})
+        # El más reciente se conserva siempre; las semanas y meses, el más nuevo de cada uno
+        conservar = select_backups_to_keep(respaldos, daily=0, weekly=2, monthly=2)
+        self.assertIn(0, conservar)
+        self.assertLessEqual(len(conservar), 4)
+        self.assertEqual(select_backups_to_keep([], daily=1), set())
+
+    def test_restauracion_de_archivos_media(self):
+        origen = os.path.join(self.directorio, 'media')
+        os.makedirs(os.path.join(origen, 'facturas'))
+        contenido = os.urandom(50 * 1024) + b'\nfin\n'
+        with open(os.path.join(origen, 'facturas', 'f001.pdf'), 'wb') as f:
+            f.write(contenido)
+        with override_settings(MEDIA_ROOT=origen):
+            backup, _ = self.respaldar('archivos', tipo='media')
+        shutil.rmtree(origen)
+
+        destino = os.path.join(self.directorio, 'restaurado')
+        with override_settings(MEDIA_ROOT=destino), \
+                mock.patch('administracion.backup_store.ChunkStore', return_value=self.store):
+            self.assertEqual(perform_incremental_restore(backup, self.admin.id)[0], True)
+        with open(os.path.join(destino, 'facturas', 'f001.pdf'), 'rb') as f:
+            self.assertEqual(f.read(), contenido)
+        self.assertTrue(UserActivity.objects.filter(action_type='restore', entity_id=str(backup.pk)).exists())
+
+
+class VolcadoLogicoTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command('generar_datos', empresas=3, vendedores=4, proveedores=6, pedidos=40,
+                     letras=400, semilla=13, stdout=StringIO())
+
+    def setUp(self):
+        self.directorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directorio, ignore_errors=True)
+
+    def test_exportar_e_importar_verifica_filas_y_sumas(self):
+        antes = {
+            'letras': Letra.objects.count(),
+            'monto': Letra.objects.aggregate(total=Sum('monto'))['total'],
+            'pagado': sorted(Pedido.objects.values_list('id', 'monto_pagado')),
+        }
+        manifiesto = export_data(self.directorio, app_labels=['calendarBackend'], workers=1)
+        entrada = next(t for t in manifiesto['tables'] if t['model'] == 'calendarBackend.Letra')
+        self.assertEqual(entrada['rows'], antes['letras'])
+
+        salida = StringIO()
+        call_command('importar_datos', self.directorio, reemplazar=True, stdout=salida, stderr=StringIO())
+        self.assertIn('Verificación correcta', salida.getvalue())
+        self.assertEqual(Letra.objects.count(), antes['letras'])
+        self.assertEqual(Letra.objects.aggregate(total=Sum('monto'))['total'], antes['monto'])
+        self.assertEqual(sorted(Pedido.objects.values_list('id', 'monto_pagado')), antes['pagado'])
+
+    def test_detecta_diferencias_con_el_manifiesto(self):
+        manifiesto = export_data(self.directorio, app_labels=['calendarBackend'], workers=1)
+        entrada = next(t for t in manifiesto['tables'] if t['model'] == 'calendarBackend.Letra')
+        self.assertEqual(verify_table(entrada), [])
+        # Un céntimo de diferencia en la suma de control ya es un error
+        alterada = dict(entrada, sums=dict(entrada['sums'], monto=str(Decimal(entrada['sums']['monto']) + Decimal('0.01'))))
+        self.assertEqual(len(verify_table(alterada)), 1)
+        Letra.objects.filter(pk=Letra.objects.values_list('pk', flat=True).first()).delete()
+        self.assertTrue(any(error.startswith('filas') for error in verify_table(entrada)))
+
+    def test_sumas_decimales_con_error_de_float(self):
+        # SQLite suma los decimales como float
+        monto = Letra._meta.get_field('monto')
+        self.assertTrue(sums_match(monto, Decimal('66161215.8100001'), '66161215.81'))
+        self.assertTrue(sums_match(monto, 81580251.0000001, '81580251.00'))
+        self.assertFalse(sums_match(monto, Decimal('66161215.8200001'), '66161215.81'))
+        self.assertFalse(sums_match(Letra._meta.get_field('dias_retraso'), 11, 10))
+
+
+class IdempotenciaTests(TestCase):
+
+    def setUp(self):
+        self.user, self.client = crear_usuario('admin_idempotencia', 'admin')
+        empresa = Empresa.objects.create(nombre='Empresa Norte', ruc='20111111111')
+        self.pedido = Pedido.objects.create(proveedor=Proveedor.objects.create(nombre='Importaciones Pacífico'),
+                                            monto_total_pedido=1000, fecha_pedido=date(2026, 1, 10))
+        self.distribucion = DistribucionFinal.objects.create(pedido=self.pedido, empresa=empresa, monto_final=1000)
+        self.letra = Letra.objects.create(distribucion=self.distribucion, monto=100, fecha_pago=date(2026, 3, 10))
+
+    def post(self, ruta, datos, clave):
+        return self.client.post(ruta, datos, format='json', HTTP_IDEMPOTENCY_KEY=clave)
+
+    def test_reintento_repite_la_respuesta(self):
+        ruta = f'/api/letras/{self.letra.pk}/marcar_pagada/'
+        primera = self.post(ruta, {'banco': 'BCP'}, 'pago-1')
+        monto_pagado = Pedido.objects.get(pk=self.pedido.pk).monto_pagado
+        segunda = self.post(ruta, {'banco': 'BCP'}, 'pago-1')
+        self.assertEqual(segunda.status_code, primera.status_code)
+        self.assertEqual(segunda.json(), primera.json())
+        self.assertEqual(segunda['Idempotent-Replayed'], 'true')
+        self.assertEqual(Pedido.objects.get(pk=self.pedido.pk).monto_pagado, monto_pagado)
+
+        pedido = {'proveedor': self.pedido.proveedor_id, 'monto_total_pedido': 500, 'fecha_pedido': '2026-02-01'}
+        for _ in range(2):
+            self.assertEqual(self.post('/api/pedidos/', pedido, 'pedido-1').status_code, 201)
+        self.assertEqual(Pedido.objects.count(), 2)
+        self.assertEqual(self.post(ruta, {'banco': 'Interbank'}, 'pago-1').status_code, 422)
+
+    def test_clave_en_curso_y_purga(self):
+        ruta = f'/api/letras/{self.letra.pk}/marcar_pagada/'
+        datos = json.dumps({'banco': 'BCP'}).encode()
+        huella = idempotency.fingerprint(SimpleNamespace(method='POST', get_full_path=lambda: ruta, body=datos))
+        registro = IdempotencyKey.objects.create(user=self.user, key='en-curso', method='POST', path=ruta,
+                                                 fingerprint=huella, expires_at=timezone.now() + timedelta(hours=1))
+        def post():
+            return self.client.post(ruta, datos, content_type='application/json', HTTP_IDEMPOTENCY_KEY='en-curso')
+
+        with override_settings(IDEMPOTENCY_WAIT_SECONDS=0):
+            self.assertEqual(post().status_code, 409)
+
+        # Una reserva abandonada (worker caído) se vuelve a ejecutar
+        IdempotencyKey.objects.filter(pk=registro.pk).update(created_at=timezone.now() - timedelta(minutes=5))
+        self.assertEqual(post().status_code, 200)
+        self.assertEqual(IdempotencyKey.objects.get(key='en-curso').status, 'completed')
+
+        IdempotencyKey.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        call_command('purgar_idempotencia', stdout=StringIO())
+        self.assertFalse(IdempotencyKey.objects.exists())
@@ -8,7 +8,14 @@ from .views import (
     RolPersonalizadoViewSet,
     SystemBackupViewSet,
     UserActivityViewSet,
-    asignar_permisos_usuario
+    asignar_permisos_usuario,
+    estado_conexiones,
+    metricas,
+    consultas_lentas,
+    peticiones_lentas,
+    perfiles,
+    perfil_detalle,
+    perfil_descargar
 )
 
 # Configurar el router
@@ -27,4 +34,11 @@ urlpatterns = [
     
     # Rutas personalizadas
     path('usuarios/asignar-permisos/', asignar_permisos_usuario, name='asignar-permisos-usuario'),
+    path('conexiones/estado/', estado_conexiones, name='estado-conexiones'),
+    path('metrics', metricas, name='metricas'),
+    path('rendimiento/consultas-lentas/', consultas_lentas, name='consultas-lentas'),
+    path('rendimiento/peticiones-lentas/', peticiones_lentas, name='peticiones-lentas'),
+    path('rendimiento/perfiles/', perfiles, name='perfiles'),
+    path('rendimiento/perfiles/<str:profile_id>/', perfil_detalle, name='perfil-detalle'),
+    path('rendimiento/perfiles/<str:profile_id>/descargar/', perfil_descargar, name='perfil-descargar'),
 ] 
\ No newline at end of file
@@ -324,6 +324,152 @@ def asignar_permisos_usuario(request):
             'message': str(e)
         }, status=status.HTTP_400_BAD_REQUEST)
 
+@api_view(['GET'])
+@permission_classes([IsSuperAdmin])
+def estado_conexiones(request):
+    """
+    Estado de las conexiones a base de datos del worker que atiende la
+    petición: configuración de cada alias y, si usa el pool de psycopg,
+    sus estadísticas (cada worker de gunicorn tiene su propio pool).
+    """
+    from django.conf import settings
+    from django.db import connections
+
+    bases = []
+    for alias in connections:
+        conn = connections[alias]
+        info = {
+            'alias': alias,
+            'vendor': conn.vendor,
+            'conn_max_age': conn.settings_dict.get('CONN_MAX_AGE'),
+            'conn_health_checks': conn.settings_dict.get('CONN_HEALTH_CHECKS'),
+            'pooled': False,
+        }
+        pool = getattr(conn, 'pool', None)
+        if pool is not None:
+            info['pooled'] = True
+            info['pool'] = {
+                'min_size': pool.min_size,
+                'max_size': pool.max_size,
+                'timeout': pool.timeout,
+                'stats': pool.get_stats(),
+            }
+        bases.append(info)
+
+    return Response({
+        'profile': getattr(settings, 'DATABASE_PROFILE', 'sqlite'),
+        'pid': os.getpid(),
+        'databases': bases,
+    })
+
+@api_view(['GET'])
+@permission_classes([IsSuperAdmin])
+def metricas(request):
+    """
+    Métricas de todos los workers en formato de texto de Prometheus
+    (latencias por ruta, consultas SQL, serialización, tamaños y errores).
+    """
+    from core.metrics import render_prometheus
+
+    return HttpResponse(render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@api_view(['GET', 'DELETE'])
+@permission_classes([IsSuperAdmin])
+def consultas_lentas(request):
+    """
+    Consultas SQL lentas agrupadas por huella (SQL normalizado), con un
+    ejemplo reciente de cada grupo: parámetros, vista y pila de llamadas.
+
+    Parámetros: orden (total, max, veces, media), limite, vista.
+    DELETE vacía el registro.
+    """
+    from django.conf import settings
+    from core import slow_queries
+
+    if request.method == 'DELETE':
+        slow_queries.clear_store()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    orden = request.query_params.get('orden', 'total')
+    if orden not in slow_queries.ORDENES:
+        return Response({'error': f"Orden no válido. Opciones: {', '.join(slow_queries.ORDENES)}"},
+                        status=status.HTTP_400_BAD_REQUEST)
+    try:
+        limite = int(request.query_params.get('limite', 20))
+    except ValueError:
+        return Response({'error': 'El límite debe ser un número'}, status=status.HTTP_400_BAD_REQUEST)
+
+    return Response({
+        'umbral_ms': getattr(settings, 'SLOW_QUERY_THRESHOLD_MS', 100),
+        'consultas': slow_queries.top_queries(orden, limite, request.query_params.get('vista')),
+    })
+
+@api_view(['GET'])
+@permission_classes([IsSuperAdmin])
+def peticiones_lentas(request):
+    """Peticiones más recientes que superaron SLOW_REQUEST_THRESHOLD_MS"""
+    from django.conf import settings
+    from core import slow_queries
+
+    try:
+        limite = int(request.query_params.get('limite', 50))
+    except ValueError:
+        return Response({'error': 'El límite debe ser un número'}, status=status.HTTP_400_BAD_REQUEST)
+    return Response({
+        'umbral_ms': getattr(settings, 'SLOW_REQUEST_THRESHOLD_MS', 1000),
+        'peticiones': slow_queries.recent_requests(limite),
+    })
+
+@api_view(['GET'])
+@permission_classes([IsSuperAdmin])
+def perfiles(request):
+    """Perfiles de peticiones guardados, del más reciente al más antiguo"""
+    from core import profiling
+
+    return Response(profiling.list_profiles())
+
+@api_view(['GET', 'DELETE'])
+@permission_classes([IsSuperAdmin])
+def perfil_detalle(request, profile_id):
+    """
+    Metadatos de un perfil y sus funciones más costosas. Parámetros:
+    orden (cumulative, tottime, calls) y top.
+    """
+    from core import profiling
+
+    if request.method == 'DELETE':
+        profiling.delete_profile(profile_id)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    orden = request.query_params.get('orden', 'cumulative')
+    if orden not in ('cumulative', 'tottime', 'calls'):
+        return Response({'error': 'Orden no válido'}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        top = int(request.query_params.get('top', 30))
+    except ValueError:
+        return Response({'error': 'El top debe ser un número'}, status=status.HTTP_400_BAD_REQUEST)
+    info = profiling.get_profile(profile_id, top, orden)
+    if info is None:
+        return Response({'error': 'Perfil no encontrado'}, status=status.HTTP_404_NOT_FOUND)
+    return Response(info)
+
+@api_view(['GET'])
+@permission_classes([IsSuperAdmin])
+def perfil_descargar(request, profile_id):
+    """Descarga un perfil como volcado de pstats o como pilas colapsadas (formato=collapsed)"""
+    from django.http import FileResponse
+    from core import profiling
+
+    formato = request.query_params.get('formato', 'pstats')
+    if formato not in ('pstats', 'collapsed'):
+        return Response({'error': 'Formato no válido. Opciones: pstats, collapsed'},
+                        status=status.HTTP_400_BAD_REQUEST)
+    path = profiling.profile_file(profile_id, formato)
+    if path is None:
+        return Response({'error': 'Perfil no encontrado'}, status=status.HTTP_404_NOT_FOUND)
+    return FileResponse(open(path, 'rb'), as_attachment=True, filename=os.path.basename(path),
+                        content_type='application/octet-stream' if formato == 'pstats' else 'text/plain')
+
 # Funciones para el sistema de respaldo
 def perform_backup(backup_id):
     """
@@ -335,6 +481,15 @@ def perform_backup(backup_id):
         backup.status = 'in_progress'
         backup.save()
         
+        # Respaldo incremental: se guarda deduplicado en el almacén de fragmentos
+        if backup.is_incremental:
+            from .backup_store import create_incremental_backup
+            create_incremental_backup(backup)
+            backup.status = 'completed'
+            backup.completed_at = timezone.now()
+            backup.save()
+            return
+        
         # Crear directorio de respaldos si no existe
         from django.conf import settings
         
@@ -511,12 +666,16 @@ def perform_restore(backup_id, user_id):
         if backup.status != 'completed':
             raise Exception("No se puede restaurar desde un respaldo que no está completado")
         
+        from django.conf import settings
+        
+        # Respaldo incremental: reconstruir el volcado desde el almacén
+        if backup.is_incremental:
+            return perform_incremental_restore(backup, user_id)
+        
         # Verificar que exista el archivo
         if not backup.file_path or not os.path.exists(backup.file_path):
             raise Exception("El archivo de respaldo no se encuentra en el sistema")
         
-        from django.conf import settings
-        
         # Determinar el tipo de base de datos
         is_sqlite = 'sqlite' in settings.DATABASES['default']['ENGINE']
         
@@ -530,7 +689,10 @@ def perform_restore(backup_id, user_id):
             antes de restaurar la base de datos, ya que es un único archivo.
             """
             # Para SQLite, debemos cerrar todas las conexiones antes de reemplazar el archivo
-            from django.db import connections
+            # (antes se vuelca el WAL para que la copia .bak esté completa)
+            from django.db import connection, connections
+            from core.db_backends.sqlite3.base import wal_checkpoint
+            wal_checkpoint(connection)
             connections.close_all()
             
             db_path = settings.DATABASES['default']['NAME']
@@ -727,6 +889,70 @@ def perform_restore(backup_id, user_id):
             
         return False, f"Error: {error_msg}"
 
+def perform_incremental_restore(backup, user_id):
+    """
+    Restaura un respaldo incremental reconstruyendo el volcado SQL y los
+    archivos media a partir de los fragmentos del almacén
+    """
+    import shutil
+    import tempfile
+    from django.conf import settings
+    from django.db import connection, connections
+    from core.db_backends.sqlite3.base import wal_checkpoint
+    from .backup_store import restore_database_dump, restore_media
+    
+    if backup.backup_type in ('full', 'data'):
+        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.sql')
+        temp_file.close()
+        try:
+            restore_database_dump(backup, temp_file.name)
+            
+            if 'sqlite' in settings.DATABASES['default']['ENGINE']:
+                wal_checkpoint(connection)
+                connections.close_all()
+                db_path = settings.DATABASES['default']['NAME']
+                db_backup = f"{db_path}.bak"
+                shutil.copy2(db_path, db_backup)
+                try:
+                    command = f"sqlite3 {db_path} < {temp_file.name}"
+                    result = subprocess.run(command, shell=True, capture_output=True)
+                    if result.returncode != 0:
+                        shutil.copy2(db_backup, db_path)
+                        raise Exception(f"Error al restaurar: {result.stderr.decode('utf-8')}")
+                finally:
+                    if os.path.exists(db_backup):
+                        os.unlink(db_backup)
+            else:
+                db_settings = settings.DATABASES['default']
+                env = os.environ.copy()
+                env['PGPASSWORD'] = db_settings['PASSWORD']
+                psql_cmd = [
+                    'psql',
+                    f"--host={db_settings['HOST']}",
+                    f"--port={db_settings.get('PORT', '5432')}",
+                    f"--username={db_settings['USER']}",
+                    f"--dbname={db_settings['NAME']}",
+                    f'--file={temp_file.name}'
+                ]
+                subprocess.run(psql_cmd, env=env, check=True, capture_output=True)
+        finally:
+            os.unlink(temp_file.name)
+    
+    if backup.backup_type in ('full', 'media'):
+        restore_media(backup, settings.MEDIA_ROOT)
+    
+    user = User.objects.get(id=user_id)
+    UserActivity.objects.create(
+        user=user,
+        action_type='restore',
+        entity_type='SystemBackup',
+        entity_id=str(backup.id),
+        description=f"Restauración del sistema desde respaldo incremental: {backup.name}",
+        ip_address="sistema"
+    )
+    
+    return True, "Restauración completada exitosamente"
+
 class SystemBackupViewSet(viewsets.ModelViewSet):
     """
     API para gestionar respaldos del sistema
@@ -759,8 +985,10 @@ class SystemBackupViewSet(viewsets.ModelViewSet):
        - Considerar tamaño y tiempo de ejecución para respaldos grandes
     
     2. LIMPIEZA:
-       - Los respaldos no se eliminan automáticamente
-       - Implemente una política de retención y limpieza periódica
+       - Los respaldos completos no se eliminan automáticamente
+       - Los respaldos incrementales (is_incremental=True) se guardan
+         deduplicados y se depuran con la política BACKUP_RETENTION mediante
+         la acción 'aplicar_retencion' o el comando 'respaldo_incremental'
     """
     queryset = SystemBackup.objects.all().order_by('-created_at')
     serializer_class = SystemBackupSerializer
@@ -893,8 +1121,16 @@ class SystemBackupViewSet(viewsets.ModelViewSet):
             backup_thread.start()
     
     def perform_destroy(self, instance):
+        # En respaldos incrementales solo se elimina el manifiesto; los
+        # fragmentos huérfanos se depuran en la recolección de basura
+        if instance.is_incremental:
+            try:
+                from .backup_store import ChunkStore
+                ChunkStore().delete_manifest(instance.file_path)
+            except Exception as e:
+                print(f"Error al eliminar manifiesto de respaldo: {str(e)}")
         # Eliminar el archivo si existe
-        if instance.file_path and os.path.exists(instance.file_path):
+        elif instance.file_path and os.path.exists(instance.file_path):
             try:
                 if os.path.isfile(instance.file_path):
                     os.remove(instance.file_path)
@@ -951,6 +1187,9 @@ class SystemBackupViewSet(viewsets.ModelViewSet):
                 'success': False,
                 'message': 'El respaldo no está completado'
             }, status=status.HTTP_400_BAD_REQUEST)
+        
+        if backup.is_incremental:
+            return self._download_incremental(request, backup)
             
         if not backup.file_path or not os.path.exists(backup.file_path):
             return Response({
@@ -1007,6 +1246,74 @@ class SystemBackupViewSet(viewsets.ModelViewSet):
                 response['Content-Disposition'] = f'attachment; filename="{filename}"'
                 return response
 
+    def _download_incremental(self, request, backup):
+        """Reconstruye el volcado SQL de un respaldo incremental y lo descarga comprimido"""
+        import gzip
+        import tempfile
+        from .backup_store import ChunkStore
+        
+        store = ChunkStore()
+        try:
+            manifest = store.read_manifest(backup.file_path)
+        except Exception:
+            return Response({
+                'success': False,
+                'message': 'Manifiesto de respaldo no encontrado'
+            }, status=status.HTTP_404_NOT_FOUND)
+        
+        register_activity(
+            request, 'other', 'SystemBackup', 
+            str(backup.id), f"Descarga de respaldo incremental: {backup.name}"
+        )
+        
+        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.sql.gz')
+        temp_file.close()
+        try:
+            with gzip.open(temp_file.name, 'wb') as f_out:
+                for data in store.iter_stream(manifest['database']):
+                    f_out.write(data)
+            with open(temp_file.name, 'rb') as f:
+                filename = f"{backup.name}_{backup.created_at.strftime('%Y%m%d_%H%M%S')}.sql.gz"
+                response = HttpResponse(f.read(), content_type='application/gzip')
+                response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        finally:
+            os.unlink(temp_file.name)
+        return response
+    
+    @action(detail=False, methods=['post'])
+    def aplicar_retencion(self, request):
+        """
+        Aplica la política de retención a los respaldos incrementales y
+        elimina los fragmentos que quedaron sin referencia
+        """
+        from django.conf import settings
+        from .backup_store import apply_retention
+        
+        policy = dict(getattr(settings, 'BACKUP_RETENTION', {}))
+        for period in ('daily', 'weekly', 'monthly'):
+            if period in request.data:
+                try:
+                    policy[period] = int(request.data[period])
+                except (TypeError, ValueError):
+                    return Response({
+                        'success': False,
+                        'message': f"Valor inválido para '{period}'"
+                    }, status=status.HTTP_400_BAD_REQUEST)
+        
+        result = apply_retention(policy)
+        
+        register_activity(
+            request, 'delete', 'SystemBackup',
+            description=f"Retención de respaldos: {len(result['removed_backups'])} eliminados, "
+                        f"{result['deleted_chunks']} fragmentos depurados"
+        )
+        
+        return Response({
+            'success': True,
+            'policy': policy,
+            **result
+        })
+
 class UserActivityViewSet(viewsets.ReadOnlyModelViewSet):
     """
     API para consultar el registro de actividades (solo lectura)
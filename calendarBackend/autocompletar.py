@@ -0,0 +1,259 @@
+"""
+Autocompletado por prefijo para los selectores de proveedor, empresa y
+vendedor de los formularios.
+
+Cada worker guarda en memoria, por tipo, una lista ordenada de claves
+normalizadas (sin tildes ni mayúsculas) y busca el prefijo con bisect:
+responde sin tocar la base de datos y en microsegundos.
+
+Claves de cada objeto:
+- el nombre completo y el nombre desde cada una de sus palabras, para que
+  'pacif' encuentre 'Importaciones Pacífico';
+- el identificador corto y el RUC.
+
+El índice se construye en la primera consulta de cada tipo. La versión de
+cada tipo es un contador en un SQLite local (AUTOCOMPLETAR_STORE_PATH)
+compartido por los workers de la máquina, como el almacén de core/metrics.py.
+Se incrementa con un UPDATE ... RETURNING, que es atómico: dos workers que
+escriben a la vez obtienen versiones distintas. Las señales (tras el commit)
+lo incrementan y actualizan el índice del worker que escribió:
+
+- Si el contador pasó justo de la versión local a la siguiente, nadie más
+  cambió el tipo entretanto: se aplica el cambio y se adopta la versión.
+- Si no, el índice local ya no tenía cambios de otros workers: se marca
+  como desactualizado y se reconstruye en la siguiente consulta.
+
+Los demás workers ven la versión distinta en su siguiente consulta y
+reconstruyen ese tipo (una sola consulta SQL).
+"""
+import bisect
+import os
+import secrets
+import sqlite3
+import tempfile
+import threading
+
+from django.conf import settings
+
+from .busqueda import normalizar
+from .models import Empresa, Vendedor, Proveedor
+
+# Coincidencias que se revisan como mucho antes de ordenar y recortar a top-k
+MAX_ESCANEO = 500
+
+# Prioridad de cada tipo de clave: menor va antes en los resultados
+PRIORIDAD_INICIO = 0  # nombre completo o identificador
+PRIORIDAD_PALABRA = 1  # nombre desde una palabra intermedia
+PRIORIDAD_RUC = 2
+
+
+def _claves_nombre(nombre):
+    palabras = normalizar(nombre).split()
+    return [
+        (' '.join(palabras[i:]), PRIORIDAD_INICIO if i == 0 else PRIORIDAD_PALABRA)
+        for i in range(len(palabras))
+    ]
+
+
+class Fuente:
+    """Qué campos del modelo se indexan y cómo se arman claves y resultado"""
+
+    def __init__(self, modelo, campos, claves, detalle):
+        self.modelo = modelo
+        self.campos = campos
+        self.claves = claves
+        self.detalle = detalle
+
+    def entradas(self, queryset):
+        """(id, datos, claves) de cada objeto, en una sola consulta"""
+        for valores in queryset.order_by().values_list('pk', 'activo', *self.campos):
+            datos = dict(zip(self.campos, valores[2:]))
+            resultado = {'id': valores[0], 'nombre': datos['nombre'], 'detalle': self.detalle(datos),
+                         'activo': valores[1]}
+            yield valores[0], resultado, self.claves(datos)
+
+
+FUENTES = {
+    'proveedor': Fuente(
+        Proveedor,
+        ['nombre', 'identificador', 'ruc'],
+        lambda d: _claves_nombre(d['nombre']) + [
+            (normalizar(d['identificador']), PRIORIDAD_INICIO), (normalizar(d['ruc']), PRIORIDAD_RUC),
+        ],
+        lambda d: ' · '.join(v for v in (d['identificador'], d['ruc']) if v),
+    ),
+    'empresa': Fuente(
+        Empresa,
+        ['nombre', 'ruc'],
+        lambda d: _claves_nombre(d['nombre']) + [(normalizar(d['ruc']), PRIORIDAD_RUC)],
+        lambda d: d['ruc'],
+    ),
+    'vendedor': Fuente(
+        Vendedor,
+        ['nombre'],
+        lambda d: _claves_nombre(d['nombre']),
+        lambda d: '',
+    ),
+}
+
+TIPO_POR_MODELO = {fuente.modelo: tipo for tipo, fuente in FUENTES.items()}
+
+
+_local = threading.local()
+
+
+def _store_path():
+    return getattr(settings, 'AUTOCOMPLETAR_STORE_PATH', None) or os.path.join(
+        tempfile.gettempdir(), 'calendarwebapp_autocompletar.sqlite3'
+    )
+
+
+def _connect():
+    """Conexión del hilo al almacén de versiones (se reabre si cambia la ruta)"""
+    path = _store_path()
+    if getattr(_local, 'path', None) != path:
+        db = sqlite3.connect(path, timeout=5, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("CREATE TABLE IF NOT EXISTS version (tipo TEXT PRIMARY KEY, valor INTEGER NOT NULL)")
+        _local.path, _local.db = path, db
+    return _local.db
+
+
+def leer_version(tipo):
+    """Versión actual del tipo; la crea si no existe"""
+    db = _connect()
+    # Primer uso: si dos workers compiten gana el primero. Empieza al azar
+    # para no repetir versiones de un almacén anterior.
+    db.execute("INSERT OR IGNORE INTO version (tipo, valor) VALUES (?, ?)", (tipo, secrets.randbits(62)))
+    return db.execute("SELECT valor FROM version WHERE tipo = ?", (tipo,)).fetchone()[0]
+
+
+def incrementar_version(tipo):
+    """Suma 1 a la versión del tipo y devuelve la nueva, en una sola sentencia"""
+    db = _connect()
+    db.execute("INSERT OR IGNORE INTO version (tipo, valor) VALUES (?, ?)", (tipo, secrets.randbits(62)))
+    return db.execute("UPDATE version SET valor = valor + 1 WHERE tipo = ? RETURNING valor", (tipo,)).fetchone()[0]
+
+
+class IndicePrefijos:
+    """
+    Índice de un tipo. 'claves' es una lista ordenada de tuplas
+    (clave, prioridad, id) y 'objetos' guarda el resultado de cada id.
+    Las escrituras van con lock y nunca modifican las estructuras
+    publicadas: arman copias y las reemplazan, así las lecturas no
+    necesitan el lock.
+    """
+
+    def __init__(self, tipo):
+        self.tipo = tipo
+        self.fuente = FUENTES[tipo]
+        self.lock = threading.Lock()
+        self.version = None
+        self.claves = []
+        self.objetos = {}
+        self.claves_por_id = {}
+
+    def construir(self, version):
+        claves, objetos, claves_por_id = [], {}, {}
+        for pk, resultado, claves_objeto in self.fuente.entradas(self.fuente.modelo.objects.all()):
+            propias = [(clave, prioridad, pk) for clave, prioridad in claves_objeto if clave]
+            claves.extend(propias)
+            objetos[pk] = resultado
+            claves_por_id[pk] = propias
+        claves.sort()
+        with self.lock:
+            # Se reemplazan las estructuras enteras: una lectura en curso sigue con las anteriores
+            self.claves, self.objetos, self.claves_por_id = claves, objetos, claves_por_id
+            self.version = version
+
+    def _reemplazar(self, pk, propias=(), resultado=None):
+        """Publica copias de las estructuras sin las claves de pk (y con las nuevas, si hay)"""
+        with self.lock:
+            anteriores = set(self.claves_por_id.get(pk, ()))
+            claves = [entrada for entrada in self.claves if entrada not in anteriores]
+            for entrada in propias:
+                bisect.insort(claves, entrada)
+            objetos, claves_por_id = dict(self.objetos), dict(self.claves_por_id)
+            objetos.pop(pk, None)
+            claves_por_id.pop(pk, None)
+            if resultado is not None:
+                objetos[pk] = resultado
+                claves_por_id[pk] = propias
+            # 'objetos' antes que 'claves': una lectura nunca ve una clave sin su objeto
+            self.objetos, self.claves_por_id = objetos, claves_por_id
+            self.claves = claves
+
+    def quitar(self, pk):
+        self._reemplazar(pk)
+
+    def actualizar(self, pk):
+        for pk, resultado, claves_objeto in self.fuente.entradas(self.fuente.modelo.objects.filter(pk=pk)):
+            propias = [(clave, prioridad, pk) for clave, prioridad in claves_objeto if clave]
+            self._reemplazar(pk, propias, resultado)
+            return
+        self.quitar(pk)
+
+    def buscar(self, prefijo, limite, incluir_inactivos=False):
+        claves, objetos = self.claves, self.objetos
+        mejores = {}
+        posicion = bisect.bisect_left(claves, (prefijo,))
+        fin = min(len(claves), posicion + MAX_ESCANEO)
+        while posicion < fin and claves[posicion][0].startswith(prefijo):
+            _, prioridad, pk = claves[posicion]
+            posicion += 1
+            objeto = objetos.get(pk)
+            if objeto is None or not (incluir_inactivos or objeto['activo']):
+                continue
+            if prioridad < mejores.get(pk, (prioridad + 1,))[0]:
+                mejores[pk] = (prioridad, objeto)
+        ordenados = sorted(mejores.values(), key=lambda p: (p[0], normalizar(p[1]['nombre'])))
+        return [dict(objeto, tipo=self.tipo) for _, objeto in ordenados[:limite]]
+
+
+class Autocompletado:
+    """Índices de todos los tipos del proceso, reconstruidos si cambió su versión"""
+
+    def __init__(self):
+        self.indices = {tipo: IndicePrefijos(tipo) for tipo in FUENTES}
+
+    def _vigente(self, tipo):
+        indice = self.indices[tipo]
+        version = leer_version(tipo)
+        if indice.version != version:
+            indice.construir(version)
+        return indice
+
+    def buscar(self, texto, tipos=None, limite=10, incluir_inactivos=False):
+        prefijo = normalizar(texto)
+        if not prefijo:
+            return []
+        resultados = []
+        for tipo in tipos or FUENTES:
+            resultados.extend(self._vigente(tipo).buscar(prefijo, limite, incluir_inactivos))
+        if len(resultados) > limite:
+            # Con varios tipos, primero los que empiezan por el texto
+            resultados.sort(key=lambda r: not normalizar(r['nombre']).startswith(prefijo))
+        return resultados[:limite]
+
+    def cambio(self, modelo, pk, borrado=False):
+        """Aplica un guardado o borrado al índice local y avisa a los demás workers"""
+        tipo = TIPO_POR_MODELO[modelo]
+        indice = self.indices[tipo]
+        version = incrementar_version(tipo)
+        if indice.version is None:
+            return  # este worker aún no lo construyó: lo hará al consultarlo
+        if version != indice.version + 1:
+            # Otro worker cambió el tipo desde la última versión local
+            indice.version = None
+            return
+        if borrado:
+            indice.quitar(pk)
+        else:
+            indice.actualizar(pk)
+        indice.version = version
+
+    def limpiar(self):
+        self.__init__()
+
+
+autocompletado = Autocompletado()
@@ -0,0 +1,364 @@
+"""
+Búsqueda de texto completo sobre pedidos, letras, proveedores, guías y
+facturas.
+
+Cada objeto tiene una fila en IndiceBusqueda con el texto de sus campos y
+de sus relaciones (proveedor, empresa, guía...) ya normalizado, así buscar
+no necesita joins ni LIKE '%x%' sobre varias tablas:
+
+- SQLite: tabla FTS5 con ranking bm25.
+- PostgreSQL: tsvector con ranking ts_rank más similitud de trigramas, que
+  también encuentra coincidencias parciales o con errores de tipeo.
+- Otros motores: LIKE sobre el índice (sin ranking).
+
+Las señales de calendarBackend/signals.py mantienen el índice al guardar o
+borrar; 'python manage.py indexar_busqueda' lo reconstruye (necesario tras
+cargas masivas con bulk_create, como generar_datos).
+"""
+import re
+import unicodedata
+
+from django.db import connections, router
+from django.db.models import Case, When, Value, IntegerField, Q
+from django.db.models.expressions import RawSQL
+from django.utils import timezone
+from rest_framework import filters
+
+from .models import (
+    Proveedor, Pedido, Letra, GuiaDeRemision, Factura, IndiceBusqueda
+)
+
+# Resultados de ?search= que se ordenan por relevancia; el resto de las
+# coincidencias (sin límite) va después, en el orden del listado
+MAX_RESULTADOS_RANGO = 1000
+
+_PALABRA_RE = re.compile(r'\w+')
+
+
+def normalizar(texto):
+    """Minúsculas, sin tildes y solo palabras separadas por espacios"""
+    texto = unicodedata.normalize('NFKD', str(texto or '')).encode('ascii', 'ignore').decode()
+    return ' '.join(_PALABRA_RE.findall(texto.lower()))
+
+
+class Documento:
+    """
+    Cómo se indexa un modelo: los campos (con sus relaciones) que forman el
+    texto, y cómo se arma el título a partir de ellos.
+    """
+
+    def __init__(self, modelo, campos, titulo):
+        self.modelo = modelo
+        self.campos = campos
+        self.titulo = titulo
+
+    def filas(self, queryset):
+        """(objeto_id, titulo, contenido) de cada objeto, en una sola consulta"""
+        for valores in queryset.order_by().values_list('pk', *self.campos):
+            datos = dict(zip(self.campos, valores[1:]))
+            yield (
+                str(valores[0]),
+                self.titulo(datos)[:200],
+                normalizar(' '.join(str(v) for v in valores[1:] if v not in (None, ''))),
+            )
+
+
+def _unir(*partes):
+    return ' - '.join(str(p) for p in partes if p)
+
+
+DOCUMENTOS = {
+    'pedido': Documento(
+        Pedido,
+        ['numero_pedido', 'proveedor__nombre', 'proveedor__identificador', 'proveedor__ruc', 'descripcion'],
+        lambda d: _unir(f"Pedido {d['numero_pedido'] or ''}".strip(), d['proveedor__nombre']),
+    ),
+    'letra': Documento(
+        Letra,
+        ['numero_unico', 'empresa__nombre', 'pedido__numero_pedido', 'proveedor__nombre',
+         'banco', 'numero_operacion', 'notas'],
+        lambda d: _unir(f"Letra {d['numero_unico'] or ''}".strip(), d['empresa__nombre'], d['proveedor__nombre']),
+    ),
+    'proveedor': Documento(
+        Proveedor,
+        ['nombre', 'identificador', 'ruc', 'vendedor__nombre', 'email', 'notas'],
+        lambda d: d['nombre'],
+    ),
+    'guia': Documento(
+        GuiaDeRemision,
+        ['numero_guia', 'empresa__nombre', 'pedido__numero_pedido', 'pedido__proveedor__nombre',
+         'transportista', 'notas'],
+        lambda d: _unir(f"Guía {d['numero_guia']}", d['empresa__nombre']),
+    ),
+    'factura': Documento(
+        Factura,
+        ['numero_factura', 'guia_remision__numero_guia', 'empresa__nombre', 'proveedor__nombre',
+         'condicion_pago', 'notas'],
+        lambda d: _unir(f"Factura {d['numero_factura']}", d['empresa__nombre']),
+    ),
+}
+
+TIPO_POR_MODELO = {documento.modelo: tipo for tipo, documento in DOCUMENTOS.items()}
+
+# Documentos que incluyen texto de otro modelo: (tipo, lookup hasta ese modelo)
+DEPENDIENTES = {
+    'Proveedor': [('pedido', 'proveedor'), ('letra', 'proveedor'), ('guia', 'pedido__proveedor'),
+                  ('factura', 'proveedor')],
+    'Empresa': [('letra', 'empresa'), ('guia', 'empresa'), ('factura', 'empresa')],
+    'Vendedor': [('proveedor', 'vendedor')],
+    'Pedido': [('letra', 'pedido'), ('guia', 'pedido'), ('factura', 'guia_remision__pedido')],
+    'GuiaDeRemision': [('factura', 'guia_remision')],
+}
+
+
+def campos_indexados(modelo):
+    """Campos del modelo que aparecen en algún documento (propio o de otro)"""
+    campos = set()
+    for documento in DOCUMENTOS.values():
+        for ruta in documento.campos:
+            actual = documento.modelo
+            for parte in ruta.split('__'):
+                if actual is modelo:
+                    campos.add(parte)
+                actual = actual._meta.get_field(parte).related_model
+                if actual is None:
+                    break
+    return campos
+
+
+# Mantenimiento del índice ----------------------------------------------------
+
+def indexar(tipo, queryset=None):
+    """Inserta o actualiza en el índice los objetos del queryset (por defecto, todos)"""
+    documento = DOCUMENTOS[tipo]
+    if queryset is None:
+        queryset = documento.modelo.objects.all()
+    ahora = timezone.now()
+    filas = [
+        IndiceBusqueda(tipo=tipo, objeto_id=objeto_id, titulo=titulo, contenido=contenido, actualizado=ahora)
+        for objeto_id, titulo, contenido in documento.filas(queryset)
+    ]
+    if filas:
+        IndiceBusqueda.objects.bulk_create(
+            filas,
+            update_conflicts=True,
+            unique_fields=['tipo', 'objeto_id'],
+            update_fields=['titulo', 'contenido', 'actualizado'],
+        )
+    return len(filas)
+
+
+def desindexar(tipo, ids):
+    IndiceBusqueda.objects.filter(tipo=tipo, objeto_id__in=[str(i) for i in ids]).delete()
+
+
+_campos_por_modelo = {}
+
+
+def actualizar_indice(instance, creado, update_fields=None):
+    """
+    Reindexa el objeto guardado y los documentos que copian su texto.
+    Los guardados con update_fields que no tocan campos indexados (montos,
+    estados...) no hacen nada.
+    """
+    modelo = type(instance)
+    if update_fields is not None:
+        if modelo not in _campos_por_modelo:
+            _campos_por_modelo[modelo] = campos_indexados(modelo)
+        if not _campos_por_modelo[modelo] & set(update_fields):
+            return
+    tipo = TIPO_POR_MODELO.get(modelo)
+    if tipo is not None:
+        indexar(tipo, modelo.objects.filter(pk=instance.pk))
+    if not creado:
+        for tipo_dependiente, lookup in DEPENDIENTES.get(modelo.__name__, []):
+            indexar(tipo_dependiente, DOCUMENTOS[tipo_dependiente].modelo.objects.filter(**{lookup: instance}))
+
+
+def quitar_del_indice(instance):
+    tipo = TIPO_POR_MODELO.get(type(instance))
+    if tipo is not None:
+        desindexar(tipo, [instance.pk])
+
+
+# Consulta --------------------------------------------------------------------
+
+def _conexion():
+    # Respeta la réplica de lectura si la petición la usa
+    return connections[router.db_for_read(IndiceBusqueda)]
+
+
+def _consulta_fts(palabras):
+    # Cada palabra es un prefijo entre comillas: sin operadores de FTS5
+    return ' '.join(f'"{p}"*' for p in palabras)
+
+
+def _consulta_tsquery(palabras):
+    return ' & '.join(f"{p}:*" for p in palabras)
+
+
+def _buscar_sqlite(palabras, tipos, limite):
+    consulta = _consulta_fts(palabras)
+    filtro_tipos = ''
+    params = [consulta]
+    if tipos:
+        filtro_tipos = f"AND i.tipo IN ({', '.join(['%s'] * len(tipos))})"
+        params += list(tipos)
+    params.append(limite)
+    sql = (
+        'SELECT i.tipo, i.objeto_id, i.titulo, bm25("calendarBackend_indicebusqueda_fts") AS rango '
+        'FROM "calendarBackend_indicebusqueda_fts" '
+        'JOIN "calendarBackend_indicebusqueda" i ON i.id = "calendarBackend_indicebusqueda_fts".rowid '
+        f'WHERE "calendarBackend_indicebusqueda_fts" MATCH %s {filtro_tipos} '
+        'ORDER BY rango LIMIT %s'
+    )
+    with _conexion().cursor() as cursor:
+        cursor.execute(sql, params)
+        # bm25 es menor cuanto mejor: se invierte para que más alto sea mejor
+        return [(tipo, objeto_id, titulo, -rango) for tipo, objeto_id, titulo, rango in cursor.fetchall()]
+
+
+def _buscar_postgres(palabras, tipos, limite):
+    consulta = _consulta_tsquery(palabras)
+    texto = ' '.join(palabras)
+    filtro_tipos = ''
+    params = [consulta, texto, consulta, texto]
+    if tipos:
+        filtro_tipos = 'AND tipo = ANY(%s)'
+        params.append(list(tipos))
+    params.append(limite)
+    sql = (
+        'SELECT tipo, objeto_id, titulo, '
+        "ts_rank(vector, to_tsquery('simple', %s)) + similarity(contenido, %s) AS rango "
+        'FROM "calendarBackend_indicebusqueda" '
+        f"WHERE (vector @@ to_tsquery('simple', %s) OR contenido %% %s) {filtro_tipos} "
+        'ORDER BY rango DESC LIMIT %s'
+    )
+    with _conexion().cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+
+def _buscar_generico(palabras, tipos, limite):
+    queryset = IndiceBusqueda.objects.using(router.db_for_read(IndiceBusqueda))
+    for palabra in palabras:
+        queryset = queryset.filter(contenido__contains=palabra)
+    if tipos:
+        queryset = queryset.filter(tipo__in=tipos)
+    return [(t, o, titulo, 0.0) for t, o, titulo in queryset.values_list('tipo', 'objeto_id', 'titulo')[:limite]]
+
+
+def buscar(texto, tipos=None, limite=20):
+    """
+    Busca en el índice y devuelve diccionarios con tipo, id, título y rango,
+    del más relevante al menos relevante.
+    """
+    palabras = normalizar(texto).split()
+    if not palabras:
+        return []
+    vendor = _conexion().vendor
+    if vendor == 'sqlite':
+        filas = _buscar_sqlite(palabras, tipos, limite)
+    elif vendor == 'postgresql':
+        filas = _buscar_postgres(palabras, tipos, limite)
+    else:
+        filas = _buscar_generico(palabras, tipos, limite)
+    return [
+        {'tipo': tipo, 'id': objeto_id, 'titulo': titulo, 'rango': float(rango)}
+        for tipo, objeto_id, titulo, rango in filas
+    ]
+
+
+def _objeto_id_como_pk(modelo, connection):
+    """objeto_id (texto) convertido al tipo de la clave primaria del modelo"""
+    tipo = modelo._meta.pk.get_internal_type()
+    if tipo == 'UUIDField':
+        # Sin tipo uuid nativo Django guarda los UUID como 32 hexadecimales sin guiones
+        if connection.features.has_native_uuid_field:
+            return 'CAST(i.objeto_id AS uuid)'
+        return "REPLACE(i.objeto_id, '-', '')"
+    if tipo in ('AutoField', 'BigAutoField', 'SmallAutoField', 'IntegerField', 'BigIntegerField'):
+        return 'CAST(i.objeto_id AS BIGINT)'
+    return 'i.objeto_id'
+
+
+def subconsulta_ids(texto, tipo, connection):
+    """
+    (sql, params) con las claves primarias de todos los objetos del tipo que
+    coinciden con el texto, para filtrar un listado sin traer los ids
+    """
+    palabras = normalizar(texto).split()
+    columna = _objeto_id_como_pk(DOCUMENTOS[tipo].modelo, connection)
+    if connection.vendor == 'sqlite':
+        return (
+            f'SELECT {columna} FROM "calendarBackend_indicebusqueda_fts" '
+            'JOIN "calendarBackend_indicebusqueda" i ON i.id = "calendarBackend_indicebusqueda_fts".rowid '
+            'WHERE "calendarBackend_indicebusqueda_fts" MATCH %s AND i.tipo = %s',
+            [_consulta_fts(palabras), tipo],
+        )
+    if connection.vendor == 'postgresql':
+        return (
+            f'SELECT {columna} FROM "calendarBackend_indicebusqueda" i '
+            "WHERE (i.vector @@ to_tsquery('simple', %s) OR i.contenido %% %s) AND i.tipo = %s",
+            [_consulta_tsquery(palabras), ' '.join(palabras), tipo],
+        )
+    condiciones = ' AND '.join(['i.contenido LIKE %s'] * len(palabras))
+    return (
+        f'SELECT {columna} FROM "calendarBackend_indicebusqueda" i WHERE i.tipo = %s AND {condiciones}',
+        [tipo] + [f'%{palabra}%' for palabra in palabras],
+    )
+
+
+class IndiceSearchFilter(filters.SearchFilter):
+    """
+    ?search= resuelto con el índice de búsqueda en los ViewSets que
+    declaran 'search_index' (el tipo de documento). Sin 'search_index' se
+    comporta como el SearchFilter de DRF.
+
+    - El índice busca palabras por prefijo. Los campos de
+      'search_substring_fields' (números de letra, pedido, guía...) se
+      siguen buscando por subcadena, como el SearchFilter.
+    - Si el índice no encuentra nada se usa el SearchFilter de DRF
+      (subcadena en 'search_fields'), así una parte de palabra como
+      'dustrias' sigue encontrando resultados.
+    - Todas las coincidencias se filtran con una subconsulta, sin límite.
+      Las MAX_RESULTADOS_RANGO más relevantes van primero salvo que se pida
+      otro orden con ?ordering=.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        tipo = getattr(view, 'search_index', None)
+        texto = request.query_params.get(self.search_param, '')
+        if tipo is None or not normalizar(texto):
+            return super().filter_queryset(request, queryset, view)
+
+        # La misma consulta da el orden por relevancia y dice si el índice encontró algo
+        ids = [r['id'] for r in buscar(texto, [tipo], MAX_RESULTADOS_RANGO)]
+        if not ids:
+            return super().filter_queryset(request, queryset, view)
+
+        sql, params = subconsulta_ids(texto, tipo, connections[queryset.db])
+        filtro = Q(pk__in=RawSQL(sql, params))
+        for campo in getattr(view, 'search_substring_fields', []):
+            filtro |= Q(**{f'{campo}__icontains': texto.strip()})
+        queryset = queryset.filter(filtro)
+        if 'ordering' in request.query_params:
+            return queryset
+        orden = Case(
+            *[When(pk=pk, then=Value(posicion)) for posicion, pk in enumerate(ids)],
+            default=Value(len(ids)),
+            output_field=IntegerField(),
+        )
+        return queryset.annotate(rango_busqueda=orden).order_by('rango_busqueda', *getattr(view, 'ordering', None) or ['pk'])
+
+
+class RelevanciaOrderingFilter(filters.OrderingFilter):
+    """
+    OrderingFilter que no pisa el orden por relevancia de IndiceSearchFilter
+    con el 'ordering' por defecto del ViewSet (solo con ?ordering= explícito).
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        if 'rango_busqueda' in queryset.query.annotations and not request.query_params.get(self.ordering_param):
+            return queryset
+        return super().filter_queryset(request, queryset, view)
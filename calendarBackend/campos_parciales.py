@@ -0,0 +1,167 @@
+"""
+Respuestas parciales: ?fields= y ?omit= en los ViewSets de calendarBackend.
+
+    GET /api/letras/?fields=id,fecha_pago,monto,estado
+    GET /api/proveedores/?omit=notas,pedidos_count
+
+Los campos que no se piden se quitan del serializer antes de serializar
+(sus get_* no se ejecutan) y la consulta se ajusta a lo que queda:
+
+- .only() con las columnas que usan los campos pedidos (las TextField como
+  'notas' o 'descripcion' no se leen si no hacen falta).
+- select_related solo de las relaciones que esos campos recorren.
+- prefetch_related solo de las relaciones que esos campos usan.
+
+Cada serializer declara en 'dependencias' qué usan sus campos calculados
+(lookups del modelo; una relación a muchos es un prefetch):
+
+    dependencias = {
+        'proveedor': ['pedido__proveedor__nombre'],
+        'dias_restantes': ['estado', 'fecha_pago'],
+    }
+
+Los campos del modelo y los de 'source' con puntos se deducen solos. Si
+queda un campo cuyas dependencias no se conocen (un get_* sin declarar,
+source='*'), la consulta no se toca: se pierde la optimización pero no se
+provoca un N+1. Con serializers anidados se recortan los prefetch pero no
+las columnas. Sin ?fields= ni ?omit= no cambia nada; solo se aplican al
+listado y al detalle.
+"""
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework import serializers
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import SAFE_METHODS
+
+
+def _lista(valor):
+    return [nombre.strip() for nombre in (valor or '').split(',') if nombre.strip()]
+
+
+def campos_solicitados(params, disponibles):
+    """
+    Campos que quedan tras ?fields= y ?omit= (en el orden del serializer),
+    o None si no se pidió ninguno de los dos. 'id' se conserva siempre.
+    """
+    if 'fields' not in params and 'omit' not in params:
+        return None
+    fields, omit = _lista(params.get('fields')), _lista(params.get('omit'))
+    desconocidos = [nombre for nombre in fields + omit if nombre not in disponibles]
+    if desconocidos:
+        raise ValidationError({
+            'fields': f"Campos desconocidos: {', '.join(desconocidos)}. Disponibles: {', '.join(disponibles)}"
+        })
+    elegidos = set(fields) if fields else set(disponibles)
+    elegidos -= set(omit)
+    elegidos.add('id')
+    return [nombre for nombre in disponibles if nombre in elegidos]
+
+
+def _recorrer(modelo, lookup):
+    """
+    ('columna', ruta) si el lookup termina en una columna (siguiendo claves
+    foráneas) o ('prefetch', ruta hasta la relación a muchos).
+    """
+    actual, ruta = modelo, []
+    partes = lookup.split('__')
+    for posicion, parte in enumerate(partes):
+        campo = actual._meta.get_field(parte)
+        if campo.one_to_many or campo.many_to_many:
+            return 'prefetch', '__'.join(ruta + [parte])
+        if not campo.concrete:
+            raise FieldDoesNotExist(f"{lookup} no es una columna")
+        ruta.append(parte)
+        if posicion < len(partes) - 1:
+            if not campo.is_relation:
+                raise FieldDoesNotExist(f"{lookup} no es una relación")
+            actual = campo.related_model
+    return 'columna', '__'.join(ruta)
+
+
+def _dependencias(serializer, nombre, campo):
+    """Lookups que usa el campo, o None si no se pueden saber"""
+    declaradas = getattr(serializer, 'dependencias', {})
+    if nombre in declaradas:
+        return list(declaradas[nombre])
+    if isinstance(campo, serializers.SerializerMethodField) or campo.source == '*':
+        return None
+    return ['__'.join(campo.source_attrs)]
+
+
+def _raiz(lookup):
+    return getattr(lookup, 'prefetch_to', lookup)
+
+
+def restringir_queryset(queryset, serializer, campos):
+    """Ajusta columnas, select_related y prefetch_related a los campos que quedan"""
+    columnas, prefetch = set(), set()
+    columnas_conocidas = prefetch_conocido = True
+    for nombre in campos:
+        campo = serializer.fields[nombre]
+        lookups = _dependencias(serializer, nombre, campo)
+        if lookups is None:
+            columnas_conocidas = prefetch_conocido = False
+            continue
+        if isinstance(campo, serializers.BaseSerializer):
+            # Los serializers anidados pueden recorrer relaciones del padre
+            columnas_conocidas = False
+        for lookup in lookups:
+            try:
+                tipo, ruta = _recorrer(queryset.model, lookup)
+            except FieldDoesNotExist:
+                columnas_conocidas = prefetch_conocido = False
+                continue
+            (columnas if tipo == 'columna' else prefetch).add(ruta)
+
+    if prefetch_conocido:
+        conservados = [
+            lookup for lookup in queryset._prefetch_related_lookups
+            if any(_raiz(lookup) == raiz or _raiz(lookup).startswith(raiz + '__') for raiz in prefetch)
+        ]
+        queryset = queryset.prefetch_related(None).prefetch_related(*conservados)
+    if columnas_conocidas:
+        relaciones = {ruta.rsplit('__', 1)[0] for ruta in columnas if '__' in ruta}
+        queryset = queryset.select_related(None)
+        if relaciones:
+            queryset = queryset.select_related(*relaciones)
+        queryset = queryset.only(*columnas)
+    return queryset
+
+
+class CamposParcialesMixin:
+    """
+    Mixin para ViewSets: ?fields= y ?omit= en list y retrieve (las demás
+    acciones devuelven otros datos y los ignoran).
+    """
+    acciones_campos_parciales = ('list', 'retrieve')
+
+    def campos_pedidos(self):
+        """Campos que se devolverán, o None si se devuelven todos"""
+        if not hasattr(self, '_campos_pedidos'):
+            self._campos_pedidos = None
+            if self.request.method in SAFE_METHODS and self.action in self.acciones_campos_parciales:
+                serializer = self.get_serializer_class()(context=self.get_serializer_context())
+                self._campos_pedidos = campos_solicitados(self.request.query_params, list(serializer.fields))
+        return self._campos_pedidos
+
+    def campo_incluido(self, nombre):
+        """Para que get_queryset anote o una solo lo que se va a devolver"""
+        campos = self.campos_pedidos()
+        return campos is None or nombre in campos
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        campos = self.campos_pedidos()
+        if campos is None:
+            return queryset
+        serializer = self.get_serializer_class()(context=self.get_serializer_context())
+        return restringir_queryset(queryset, serializer, campos)
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = super().get_serializer(*args, **kwargs)
+        campos = self.campos_pedidos()
+        if campos is not None:
+            declarados = serializer.child.fields if isinstance(serializer, serializers.ListSerializer) else serializer.fields
+            for nombre in list(declarados):
+                if nombre not in campos:
+                    declarados.pop(nombre)
+        return serializer
@@ -0,0 +1,76 @@
+"""
+Concurrencia optimista en los ViewSets de calendarBackend.
+
+Cada objeto tiene una columna 'version' (VersionadoMixin en models.py) que
+la API devuelve en el cuerpo y como ETag ("3") al crear, obtener o
+modificar un objeto. Para no pisar el cambio de otro usuario, el frontend
+envía la versión que editó:
+
+    PATCH /api/distribuciones-finales/12/
+    If-Match: "3"
+
+- Si la versión ya no es la actual, la respuesta es 412 con la versión
+  vigente (el frontend recarga el objeto y vuelve a aplicar su cambio).
+- Si coincide, el guardado se hace con UPDATE ... WHERE version = 3; si
+  otro escribió entre la lectura y el guardado, ese UPDATE no afecta
+  ninguna fila y también se responde 412. No se bloquea ninguna fila.
+
+Sin If-Match (o con If-Match: *) el guardado es el de siempre. En DELETE y
+en las acciones (marcar_pagada...) If-Match se compara con la versión leída,
+sin UPDATE condicional.
+"""
+import re
+
+from rest_framework import status
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.response import Response
+
+from .models import ConflictoVersion
+
+_ETAG_RE = re.compile(r'^(?:W/)?"?(\d+)"?$')
+
+ACCIONES_CON_ETAG = ('create', 'retrieve', 'update', 'partial_update')
+
+
+def etag(version):
+    return f'"{version}"'
+
+
+def version_if_match(valor):
+    """Versión de una cabecera If-Match ('"3"', 'W/"3"' o '3'), o None si no es válida"""
+    coincidencia = _ETAG_RE.match(valor.strip())
+    return int(coincidencia.group(1)) if coincidencia else None
+
+
+class ConcurrenciaOptimistaMixin:
+    """
+    Mixin para ViewSets de modelos con VersionadoMixin: aplica If-Match a
+    las escrituras sobre un objeto y añade la cabecera ETag.
+    """
+
+    def get_object(self):
+        obj = super().get_object()
+        valor = self.request.headers.get('If-Match', '').strip()
+        if valor and valor != '*' and self.request.method not in SAFE_METHODS:
+            version = version_if_match(valor)
+            if version != obj.version:
+                raise ConflictoVersion(type(obj), obj.pk)
+            obj.version_esperada = version
+        return obj
+
+    def handle_exception(self, exc):
+        if not isinstance(exc, ConflictoVersion):
+            return super().handle_exception(exc)
+        actual = exc.modelo._base_manager.filter(pk=exc.pk).values_list('version', flat=True).first()
+        response = Response({'error': str(exc), 'version': actual}, status=status.HTTP_412_PRECONDITION_FAILED)
+        if actual is not None:
+            response['ETag'] = etag(actual)
+        return response
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        data = getattr(response, 'data', None)
+        if (getattr(self, 'action', None) in ACCIONES_CON_ETAG and response.status_code < 300
+                and isinstance(data, dict) and 'version' in data):
+            response['ETag'] = etag(data['version'])
+        return response
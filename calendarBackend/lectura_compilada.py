@@ -0,0 +1,206 @@
+"""
+Serialización compilada para listados grandes de solo lectura.
+
+En listados como /api/letras/ (el calendario entero) la mayor parte del
+tiempo se va en crear una instancia del modelo por fila y en recorrer los
+campos del ModelSerializer uno por uno. compilar() convierte el serializer
+en un plan plano, una sola vez por clase y conjunto de campos:
+
+- las columnas a pedir con values_list() (con los joins de los 'source' con
+  puntos, p. ej. empresa.nombre -> empresa__nombre),
+- la función de salida de cada campo (el to_representation del propio
+  campo de DRF, así fechas y decimales salen con el mismo formato),
+- los campos calculados, con el método leer_<campo>(fila) del serializer,
+  que recibe un diccionario {lookup: valor} con sus 'dependencias'
+  (ver campos_parciales.py). Los valores fijos por petición, como la
+  fecha de hoy, van en el contexto ('hoy').
+
+Después cada fila se arma directamente desde la tupla, sin instancias del
+modelo. Si el serializer tiene algo que no se puede compilar (un get_* sin
+leer_*, serializers anidados, source='*', relaciones a muchos) compilar()
+devuelve None y la vista usa el serializer normal.
+
+Los ViewSets lo activan por acción con 'lectura_compilada' (como
+'replica_actions'); 'python manage.py benchmark_serializacion' compara
+ambos caminos y los tests comprueban que la salida es idéntica.
+"""
+from django.core.exceptions import FieldDoesNotExist
+from django.utils import timezone
+from rest_framework import serializers
+from rest_framework.fields import empty
+
+from core.json_stream import json_list_response
+from core.metrics import medir_serializacion
+
+# Planes ya compilados por (clase del serializer, campos)
+_planes = {}
+
+# Marca de un campo que DRF omitiría (relación nula en un 'source' con puntos)
+_OMITIR = object()
+
+
+class PlanLectura:
+    """Columnas a leer y cómo convertir cada tupla en el diccionario de salida"""
+
+    def __init__(self, lookups, salidas, calculados):
+        self.lookups = lookups
+        self.salidas = salidas
+        self.calculados = calculados
+
+    def filas(self, valores, serializer):
+        """Convierte las tuplas de values_list(*self.lookups) en diccionarios"""
+        with medir_serializacion():
+            return self._filas(valores, serializer)
+
+    def _filas(self, valores, serializer):
+        resultado = []
+        lookups, salidas = self.lookups, self.salidas
+        for tupla in valores:
+            fila = dict(zip(lookups, tupla)) if self.calculados else None
+            datos = {}
+            for nombre, tipo, indice, extra in salidas:
+                if tipo == 'columna':
+                    valor = tupla[indice]
+                    datos[nombre] = None if valor is None else extra(valor)
+                elif tipo == 'relacion':
+                    if any(tupla[i] is None for i in extra[1]):
+                        valor = extra[2]
+                        if valor is _OMITIR:
+                            continue
+                        datos[nombre] = valor
+                    else:
+                        valor = tupla[indice]
+                        datos[nombre] = None if valor is None else extra[0](valor)
+                else:
+                    datos[nombre] = getattr(serializer, f'leer_{nombre}')(fila)
+            resultado.append(datos)
+        return resultado
+
+
+def _columna(modelo, source_attrs):
+    """
+    (lookup, lookups de las relaciones intermedias) para un 'source', o
+    FieldDoesNotExist si no es una columna alcanzable por claves foráneas.
+    """
+    actual, ruta, intermedias = modelo, [], []
+    for posicion, attr in enumerate(source_attrs):
+        campo = actual._meta.get_field(attr)
+        if not campo.concrete or campo.many_to_many:
+            raise FieldDoesNotExist(attr)
+        ruta.append(attr)
+        if posicion < len(source_attrs) - 1:
+            if not campo.is_relation:
+                raise FieldDoesNotExist(attr)
+            intermedias.append('__'.join(ruta))
+            actual = campo.related_model
+    return '__'.join(ruta), intermedias
+
+
+def _valor_si_falta(campo):
+    # Lo que hace Field.get_attribute de DRF cuando la relación es nula
+    if campo.default is not empty:
+        return campo.get_default()
+    if campo.allow_null:
+        return None
+    return _OMITIR
+
+
+def compilar(serializer):
+    """Plan de lectura para los campos del serializer, o None si no se puede compilar"""
+    clave = (type(serializer), tuple(serializer.fields))
+    if clave in _planes:
+        return _planes[clave]
+
+    modelo = serializer.Meta.model
+    dependencias = getattr(serializer, 'dependencias', {})
+    lookups, salidas, calculados = [], [], False
+
+    def indice(lookup):
+        if lookup not in lookups:
+            lookups.append(lookup)
+        return lookups.index(lookup)
+
+    plan = None
+    try:
+        for nombre, campo in serializer.fields.items():
+            if campo.write_only:
+                continue
+            if isinstance(campo, serializers.SerializerMethodField):
+                if not hasattr(serializer, f'leer_{nombre}') or nombre not in dependencias:
+                    raise FieldDoesNotExist(nombre)
+                for lookup in dependencias[nombre]:
+                    indice(_columna(modelo, lookup.split('__'))[0])
+                salidas.append((nombre, 'calculado', None, None))
+                calculados = True
+                continue
+            if isinstance(campo, (serializers.BaseSerializer, serializers.ManyRelatedField)) or campo.source == '*':
+                raise FieldDoesNotExist(nombre)
+
+            lookup, intermedias = _columna(modelo, campo.source_attrs)
+            if isinstance(campo, serializers.PrimaryKeyRelatedField):
+                # values_list de una clave foránea ya devuelve el id
+                convertir = (lambda valor: valor) if campo.pk_field is None else campo.pk_field.to_representation
+            else:
+                convertir = campo.to_representation
+            if intermedias:
+                salidas.append((nombre, 'relacion', indice(lookup),
+                                (convertir, [indice(i) for i in intermedias], _valor_si_falta(campo))))
+            else:
+                salidas.append((nombre, 'columna', indice(lookup), convertir))
+        plan = PlanLectura(lookups, salidas, calculados)
+    except FieldDoesNotExist:
+        plan = None
+    _planes[clave] = plan
+    return plan
+
+
+def serializar(serializer, queryset):
+    """
+    Lista serializada del queryset con el plan compilado del serializer (una
+    instancia sin datos), o con el serializer normal si no se puede compilar.
+    """
+    plan = compilar(serializer)
+    if plan is None:
+        return type(serializer)(queryset, many=True, context=serializer.context).data
+    return plan.filas(queryset.prefetch_related(None).values_list(*plan.lookups), serializer)
+
+
+class LecturaCompiladaMixin:
+    """
+    Mixin para ViewSets: las acciones listadas en 'lectura_compilada'
+    serializan con el plan compilado (el listado, y las acciones que
+    devuelvan respuesta_lectura()). Respeta ?fields= y ?omit=; ?since= usa
+    el serializer normal. Los listados sin paginar grandes van en
+    streaming (core/json_stream.py).
+    """
+    lectura_compilada = []
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        # Una sola fecha por petición para los campos calculados (dias_restantes)
+        context.setdefault('hoy', timezone.now().date())
+        return context
+
+    def respuesta_lectura(self, queryset):
+        """
+        Response con el listado del queryset: compilado si la acción lo
+        permite y en streaming si es grande (ver core/json_stream.py).
+        """
+        serializer = self.get_serializer() if self.action in self.lectura_compilada else None
+        plan = compilar(serializer) if serializer is not None else None
+        if plan is None:
+            return json_list_response(self.request, queryset,
+                                      lambda filas: self.get_serializer(filas, many=True).data)
+        filas = queryset.prefetch_related(None).values_list(*plan.lookups)
+        return json_list_response(self.request, filas, lambda bloque: plan.filas(bloque, serializer))
+
+    def list(self, request, *args, **kwargs):
+        serializer = self.get_serializer() if self.action in self.lectura_compilada else None
+        plan = compilar(serializer) if serializer is not None else None
+        if plan is None or 'since' in request.query_params:
+            return super().list(request, *args, **kwargs)
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset.prefetch_related(None).values_list(*plan.lookups))
+        if page is not None:
+            return self.get_paginated_response(plan.filas(page, serializer))
+        return self.respuesta_lectura(queryset)
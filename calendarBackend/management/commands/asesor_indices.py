@@ -0,0 +1,482 @@
+import json
+import re
+import time
+from datetime import date
+
+from django.apps import apps
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from django.db.migrations import Migration, AddIndex
+from django.db.migrations.loader import MigrationLoader
+from django.db.migrations.writer import MigrationWriter
+from django.db.models import Index, Q
+from django.test import Client
+
+from core.slow_queries import fingerprint, normalize_sql
+from calendarBackend.management.commands.benchmark_api import Command as Benchmark, endpoints_por_defecto
+from calendarBackend.models import Empresa, Proveedor, Pedido
+
+# Referencias a columnas: "tabla"."columna" o ALIAS."columna"
+_COLUMNA = r'(?:"(?P<tabla>\w+)"|(?P<alias>\w+))\."(?P<columna>\w+)"'
+_PREDICADO_RE = re.compile(_COLUMNA + r'\s*(?P<op>=|>=|<=|>|<|IN\s*\(|BETWEEN|IS\s+NULL)', re.IGNORECASE)
+_FIN_ORDER_BY_RE = re.compile(r'\bLIMIT\b|\bOFFSET\b|\)')
+_ALIAS_RE = re.compile(r'(?:FROM|JOIN)\s+"(\w+)"\s+(?:AS\s+)?(\w+)', re.IGNORECASE)
+_PLAN_SQLITE_RE = re.compile(r'^(?P<tipo>SCAN|SEARCH) (?P<tabla>\S+)(?: AS \S+)?(?P<resto>.*)$')
+
+RANGOS = {'>', '<', '>=', '<=', 'BETWEEN'}
+
+
+def _expresiones_select(sql):
+    """Expresiones de la lista del SELECT principal (para ORDER BY 6, que usa values_list)"""
+    inicio = sql.find('SELECT')
+    if inicio < 0:
+        return []
+    expresiones, actual, nivel = [], '', 0
+    for posicion in range(inicio + 6, len(sql)):
+        caracter = sql[posicion]
+        if nivel == 0 and sql.startswith(' FROM ', posicion):
+            break
+        nivel += caracter == '('
+        nivel -= caracter == ')'
+        if caracter == ',' and nivel == 0:
+            expresiones.append(actual)
+            actual = ''
+        else:
+            actual += caracter
+    return expresiones + [actual]
+
+
+def endpoints_asesor():
+    """Los endpoints del benchmark más los filtros de los listados que no cubre"""
+    hoy = date.today()
+    return endpoints_por_defecto() + [
+        '/api/letras/?empresa={empresa}&estado=pendiente',
+        '/api/letras/?proveedor={proveedor}',
+        f'/api/letras/?estado=pendiente&fecha_desde={hoy}',
+        '/api/facturas/?empresa={empresa}&estado=emitida',
+        '/api/facturas/?vencidas=true',
+        '/api/guias-remision/?empresa={empresa}&estado=emitida',
+        '/api/pedidos/?proveedor={proveedor}',
+    ]
+
+
+class Consulta:
+    """Una huella de SQL: cuántas veces se vio y un ejemplo con sus parámetros"""
+
+    def __init__(self, sql, params, alias):
+        self.sql = sql
+        self.params = list(params or ())
+        self.alias = alias
+        self.veces = 0
+
+    def predicados(self, tabla):
+        """Columnas de la tabla usadas por igualdad, por rango y en el ORDER BY, con sus valores"""
+        alias = {a: t for t, a in _ALIAS_RE.findall(self.sql)}
+        igualdad, rango, orden = {}, [], []
+        for match in _PREDICADO_RE.finditer(self.sql):
+            if (match['tabla'] or alias.get(match['alias'])) != tabla:
+                continue
+            op = match['op'].upper()
+            columna = match['columna']
+            if re.match(_COLUMNA, self.sql[match.end():].lstrip()):
+                continue  # condición de JOIN entre columnas, no un filtro
+            if op == '=' or op.startswith('IN') or op.startswith('IS'):
+                valor = None
+                if op == '=' and self.sql[match.end():].lstrip().startswith('%s'):
+                    # El parámetro es el que ocupa la posición de este %s
+                    indice = self.sql[:match.end()].count('%s')
+                    valor = self.params[indice] if indice < len(self.params) else None
+                igualdad.setdefault(columna, valor)
+            elif op in RANGOS and columna not in rango:
+                rango.append(columna)
+        # El ORDER BY de la consulta principal es el último
+        posicion = self.sql.rfind('ORDER BY')
+        if posicion >= 0:
+            columnas = _FIN_ORDER_BY_RE.split(self.sql[posicion + 8:], 1)[0]
+            if re.search(r'(?:^|,)\s*\d+\b', columnas):
+                # ORDER BY por posición en la lista del SELECT
+                select = _expresiones_select(self.sql)
+                columnas = re.sub(
+                    r'(?<![\w."])(\d+)\b',
+                    lambda m: select[int(m[1]) - 1] if 0 < int(m[1]) <= len(select) else m[0],
+                    columnas,
+                )
+            for columna in re.finditer(_COLUMNA, columnas):
+                if (columna['tabla'] or alias.get(columna['alias'])) == tabla:
+                    orden.append(columna['columna'])
+        return igualdad, [c for c in rango if c not in igualdad], orden
+
+
+# Planes de ejecución ---------------------------------------------------------
+
+def explicar(connection, sql, params):
+    """
+    Pasos del plan como (tipo, tabla o None, columnas del índice, texto):
+    'scan' (recorrido completo), 'temp_btree' (ordenación aparte) o
+    'indice' (búsqueda por índice).
+    """
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            return _problemas_sqlite([fila[-1] for fila in cursor.fetchall()], sql)
+        if connection.vendor == 'postgresql':
+            cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+            plan = cursor.fetchone()[0]
+            plan = json.loads(plan) if isinstance(plan, str) else plan
+            return _problemas_postgres(plan[0]['Plan'])
+    raise CommandError(f"El asesor no sabe leer planes de {connection.vendor}")
+
+
+def _problemas_sqlite(detalles, sql):
+    alias = {a: t for t, a in _ALIAS_RE.findall(sql)}
+    problemas = []
+    for detalle in detalles:
+        match = _PLAN_SQLITE_RE.match(detalle)
+        if detalle.startswith('USE TEMP B-TREE'):
+            problemas.append(('temp_btree', None, [], detalle))
+        elif match:
+            tabla = alias.get(match['tabla'], match['tabla'])
+            resto = match['resto']
+            if match['tipo'] == 'SCAN' and 'INDEX' not in resto:
+                problemas.append(('scan', tabla, [], detalle))
+            else:
+                usadas = re.findall(r'(\w+)[=<>]', resto.split('(', 1)[-1]) if '(' in resto else []
+                problemas.append(('indice', tabla, usadas, detalle))
+    return problemas
+
+
+def _problemas_postgres(nodo):
+    problemas = []
+    tipo = nodo.get('Node Type')
+    tabla = nodo.get('Relation Name')
+    if tipo == 'Seq Scan':
+        problemas.append(('scan', tabla, [], tipo))
+    elif tipo in ('Sort', 'Incremental Sort'):
+        problemas.append(('temp_btree', None, [], tipo))
+    elif tabla and 'Index Cond' in nodo:
+        usadas = re.findall(r'\((\w+)\s*[=<>]', nodo['Index Cond'])
+        problemas.append(('indice', tabla, usadas, f"{tipo} using {nodo.get('Index Name')}"))
+    for hijo in nodo.get('Plans', []):
+        problemas.extend(_problemas_postgres(hijo))
+    return problemas
+
+
+def tiempo(connection, sql, params, repeticiones):
+    """Mejor tiempo (ms) de varias ejecuciones"""
+    mejor = None
+    with connection.cursor() as cursor:
+        for _ in range(repeticiones):
+            inicio = time.perf_counter()
+            cursor.execute(sql, params)
+            cursor.fetchall()
+            duracion = (time.perf_counter() - inicio) * 1000
+            mejor = duracion if mejor is None else min(mejor, duracion)
+    return mejor
+
+
+# Asesor ----------------------------------------------------------------------
+
+class Asesor:
+    """
+    Analiza los planes de las consultas capturadas y, para cada problema,
+    prueba los índices candidatos y se queda con el que lo resuelve en
+    menos tiempo. Las propuestas se agrupan por nombre de índice.
+    """
+
+    def __init__(self, connection, app_label, repeticiones):
+        self.connection = connection
+        self.repeticiones = repeticiones
+        self.modelos = {m._meta.db_table: m for m in apps.get_app_config(app_label).get_models()}
+        self.propuestas = {}
+        self.hallazgos = []
+
+    def indices_existentes(self, tabla):
+        with self.connection.cursor() as cursor:
+            restricciones = self.connection.introspection.get_constraints(cursor, tabla)
+        return [r['columns'] for r in restricciones.values() if (r['index'] or r['unique'] or r['primary_key'])]
+
+    def candidatos(self, modelo, igualdad, rango, orden, problema):
+        """
+        Índices posibles: columnas de igualdad, después la de orden (si el
+        problema es ordenar) o la de rango. Si una igualdad compara con un
+        valor de 'choices' también se propone un índice parcial para ese valor.
+        """
+        por_columna = {f.column: f for f in modelo._meta.concrete_fields}
+        igualdades = [c for c in igualdad if c in por_columna]
+        colas = []
+        if problema == 'temp_btree' and orden:
+            colas.append(orden[:1])
+        colas.append(rango[:1] or [c for c in orden[:1] if c not in igualdades])
+        existentes = self.indices_existentes(modelo._meta.db_table)
+
+        vistos = []
+        for cola in colas:
+            columnas = igualdades + [c for c in cola if c not in igualdades]
+            if columnas and not any(e[:len(columnas)] == columnas for e in existentes):
+                vistos.append((columnas, None))
+            for columna in igualdades:
+                campo, valor = por_columna[columna], igualdad[columna]
+                resto = [c for c in columnas if c != columna]
+                if campo.choices and isinstance(valor, str) and resto:
+                    vistos.append((resto, (campo.name, valor)))
+
+        resultado = []
+        for columnas, condicion in vistos:
+            campos = [por_columna[c].name for c in columnas]
+            indice = Index(fields=campos, name='tmp', condition=Q(**dict([condicion])) if condicion else None)
+            indice.set_name_with_model(modelo)
+            if condicion:
+                indice.name = indice.name[:-4] + '_par'
+            if all(r.name != indice.name for r in resultado):
+                resultado.append(indice)
+        return resultado
+
+    def medir(self, consulta, modelo, indice, problema, igualdad):
+        """
+        Crea el índice dentro de una transacción que se deshace y devuelve
+        el tiempo con él y si el plan lo usa y deja de tener el problema.
+        El CREATE INDEX se ejecuta a mano: el schema editor de SQLite no
+        puede abrirse dentro de atomic().
+        """
+        sql_indice = str(indice.create_sql(modelo, self.connection.schema_editor()))
+        with transaction.atomic(using=self.connection.alias):
+            with self.connection.cursor() as cursor:
+                cursor.execute(sql_indice)
+            plan = explicar(self.connection, consulta.sql, consulta.params)
+            despues_ms = tiempo(self.connection, consulta.sql, consulta.params, self.repeticiones)
+            transaction.set_rollback(True, using=self.connection.alias)
+        tabla = modelo._meta.db_table
+        pasos = [paso for paso in plan if paso[0] == 'indice' and indice.name in paso[3]]
+        if problema == 'temp_btree':
+            resuelto = not any(paso[0] == 'temp_btree' for paso in plan)
+        elif problema == 'filtro_residual':
+            cubiertas = set(pasos[0][2]) if pasos else set()
+            if indice.condition is not None:
+                cubiertas.add(modelo._meta.get_field(indice.condition.children[0][0]).column)
+            resuelto = set(igualdad) <= cubiertas
+        else:
+            resuelto = not any(paso[0] == 'scan' and paso[1] == tabla for paso in plan)
+        return despues_ms, bool(pasos) and resuelto
+
+    def analizar(self, consulta):
+        problemas = explicar(self.connection, consulta.sql, consulta.params)
+        tablas = {}
+        for problema, tabla, usadas, _ in problemas:
+            if problema == 'scan':
+                tablas.setdefault(tabla, problema)
+            elif problema == 'temp_btree':
+                for tabla_orden in self.modelos:
+                    if consulta.predicados(tabla_orden)[2]:
+                        tablas.setdefault(tabla_orden, problema)
+            elif problema == 'indice' and tabla in self.modelos:
+                # Índice usado, pero quedan igualdades que se filtran fila a fila
+                igualdad = consulta.predicados(tabla)[0]
+                if set(igualdad) - set(usadas):
+                    tablas.setdefault(tabla, 'filtro_residual')
+
+        for tabla, problema in tablas.items():
+            modelo = self.modelos.get(tabla)
+            if modelo is None:
+                continue
+            igualdad, rango, orden = consulta.predicados(tabla)
+            if not (igualdad or rango or (orden and problema == 'temp_btree')):
+                continue  # listado completo sin filtros: un índice no lo evita
+            antes_ms = tiempo(self.connection, consulta.sql, consulta.params, self.repeticiones)
+            hallazgo = {
+                'huella': fingerprint(consulta.sql), 'sql': normalize_sql(consulta.sql)[:500],
+                'veces': consulta.veces, 'tabla': tabla, 'problema': problema, 'antes_ms': round(antes_ms, 3),
+                'propuesta': None,
+            }
+            self.hallazgos.append(hallazgo)
+
+            mejor = None
+            for indice in self.candidatos(modelo, igualdad, rango, orden, problema):
+                despues_ms, resuelve = self.medir(consulta, modelo, indice, problema, igualdad)
+                # Decide el plan: con pocos datos el tiempo es sobre todo ruido
+                if resuelve and (mejor is None or despues_ms < mejor[1]):
+                    mejor = (indice, despues_ms)
+            if mejor is None:
+                continue
+            indice, despues_ms = mejor
+            hallazgo.update(propuesta=indice.name, despues_ms=round(despues_ms, 3))
+            propuesta = self.propuestas.setdefault(indice.name, {
+                'modelo': modelo, 'indice': indice, 'consultas': [], 'ahorro_ms': 0.0,
+                'fraccion_filas': self.fraccion(modelo, indice),
+            })
+            propuesta['consultas'].append(hallazgo['huella'])
+            # Beneficio estimado: lo que se ahorra por ejecución por las veces que la carga la repite
+            propuesta['ahorro_ms'] += max(antes_ms - despues_ms, 0) * consulta.veces
+
+    def fraccion(self, modelo, indice):
+        """Proporción de filas que cubre un índice parcial (1 si no es parcial)"""
+        if indice.condition is None:
+            return 1.0
+        total = modelo._default_manager.using(self.connection.alias).count()
+        return round(modelo._default_manager.using(self.connection.alias).filter(indice.condition).count() / total, 4) if total else 0.0
+
+
+def indice_como_codigo(indice):
+    texto = f"models.Index(fields={indice.fields!r}, name={indice.name!r}"
+    if indice.condition is not None:
+        (campo, valor), = indice.condition.children
+        texto += f", condition=models.Q({campo}={valor!r})"
+    return texto + ")"
+
+
+class Command(BaseCommand):
+    help = (
+        "Reproduce la carga del benchmark (o la suite de tests), obtiene el plan de "
+        "cada consulta distinta, señala recorridos completos, ordenaciones con tablas "
+        "temporales y filtros fuera del índice, mide índices compuestos o parciales "
+        "candidatos y puede escribir la migración con los que mejoran el plan"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--origen', choices=['benchmark', 'tests'], default='benchmark',
+                            help='Carga a reproducir (por defecto: benchmark)')
+        parser.add_argument('--endpoint', action='append', dest='endpoints', default=None,
+                            help='Endpoint a reproducir (repetible; con --origen benchmark)')
+        parser.add_argument('--test', action='append', dest='tests', default=None,
+                            help='Etiqueta de tests a ejecutar (repetible; con --origen tests)')
+        parser.add_argument('--app', default='calendarBackend', help='App cuyos modelos se analizan')
+        parser.add_argument('--repeticiones', type=int, default=5,
+                            help='Ejecuciones para medir cada consulta antes y después (por defecto: 5)')
+        parser.add_argument('--migracion', action='store_true',
+                            help='Escribir una migración con los índices propuestos para revisarla')
+        parser.add_argument('--salida', default=None, help='Archivo JSON donde guardar el informe')
+
+    def handle(self, *args, **options):
+        consultas = self.capturar(options)
+        connection = connections['default']
+        asesor = Asesor(connection, options['app'], options['repeticiones'])
+        tablas = tuple(f'"{tabla}"' for tabla in asesor.modelos)
+
+        analizadas = 0
+        for consulta in consultas.values():
+            if consulta.sql.lstrip().upper().startswith('SELECT') and any(t in consulta.sql for t in tablas):
+                asesor.analizar(consulta)
+                analizadas += 1
+        self.stdout.write(f"{len(consultas)} consultas distintas, {analizadas} de {options['app']} analizadas, "
+                          f"{len(asesor.hallazgos)} con problemas en el plan\n")
+
+        for hallazgo in asesor.hallazgos:
+            mejora = (f"-> {hallazgo['propuesta']} {hallazgo['despues_ms']:.3f} ms"
+                      if hallazgo['propuesta'] else '(ningún índice candidato lo resuelve)')
+            self.stdout.write(f"[{hallazgo['problema']}] {hallazgo['tabla']} x{hallazgo['veces']} "
+                              f"{hallazgo['antes_ms']:.3f} ms {mejora}  huella {hallazgo['huella']}")
+            if options['verbosity'] > 1:
+                self.stdout.write(f"    {hallazgo['sql']}")
+
+        propuestas = sorted(asesor.propuestas.values(), key=lambda p: p['ahorro_ms'], reverse=True)
+        if propuestas:
+            self.stdout.write("\nÍndices propuestos (añadir también a Meta.indexes del modelo):")
+        for propuesta in propuestas:
+            self.stdout.write(
+                f"  {propuesta['modelo'].__name__}: {indice_como_codigo(propuesta['indice'])}\n"
+                f"      ahorro estimado {propuesta['ahorro_ms']:.3f} ms por reproducción, "
+                f"{len(propuesta['consultas'])} consulta(s), filas cubiertas {propuesta['fraccion_filas']:.0%}"
+            )
+
+        if options['salida']:
+            informe = {
+                'hallazgos': asesor.hallazgos,
+                'propuestas': [{
+                    'modelo': p['modelo'].__name__, 'indice': indice_como_codigo(p['indice']),
+                    'ahorro_ms': round(p['ahorro_ms'], 3), 'consultas': p['consultas'],
+                    'fraccion_filas': p['fraccion_filas'],
+                } for p in propuestas],
+            }
+            with open(options['salida'], 'w') as f:
+                json.dump(informe, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Informe guardado en {options['salida']}"))
+
+        if options['migracion'] and propuestas:
+            ruta = self.escribir_migracion(options['app'], propuestas)
+            self.stdout.write(self.style.SUCCESS(f"Migración para revisar: {ruta}"))
+
+    # Captura -------------------------------------------------------------
+
+    def capturar(self, options):
+        consultas = {}
+
+        def registrar(alias):
+            def wrapper(execute, sql, params, many, context):
+                if not many:
+                    huella = fingerprint(sql)
+                    if huella not in consultas:
+                        consultas[huella] = Consulta(sql, params, alias)
+                    consultas[huella].veces += 1
+                return execute(sql, params, many, context)
+            return wrapper
+
+        wrappers = [connections[alias].execute_wrapper(registrar(alias)) for alias in connections]
+        for wrapper in wrappers:
+            wrapper.__enter__()
+        try:
+            if options['origen'] == 'tests':
+                self.reproducir_tests(options['tests'])
+            else:
+                self.reproducir_benchmark(options['endpoints'])
+        finally:
+            for wrapper in reversed(wrappers):
+                wrapper.__exit__(None, None, None)
+        return consultas
+
+    def reproducir_benchmark(self, endpoints):
+        valores = {
+            'pedido': Pedido.objects.values_list('id', flat=True).first(),
+            'empresa': Empresa.objects.values_list('id', flat=True).first(),
+            'proveedor': Proveedor.objects.values_list('id', flat=True).first(),
+        }
+        if valores['pedido'] is None:
+            raise CommandError("No hay datos para reproducir la carga (use generar_datos)")
+        # El usuario del benchmark (staff, con token) se borra al terminar si no existía
+        existia = User.objects.filter(username='benchmark_admin').exists()
+        client = Client(raise_request_exception=False,
+                        HTTP_AUTHORIZATION=f"Token {Benchmark().token_local('admin')}")
+        try:
+            for endpoint in endpoints or endpoints_asesor():
+                for clave, valor in valores.items():
+                    endpoint = endpoint.replace('{' + clave + '}', str(valor))
+                response = client.get(endpoint)
+                try:
+                    # Las consultas de un listado en streaming se hacen al leer el cuerpo
+                    if response.streaming:
+                        b''.join(response)
+                finally:
+                    response.close()
+                if response.status_code != 200:
+                    self.stderr.write(f"{endpoint}: {response.status_code}")
+        finally:
+            if not existia:
+                User.objects.filter(username='benchmark_admin').delete()
+
+    def reproducir_tests(self, etiquetas):
+        """
+        Ejecuta los tests capturando su SQL. Los planes se obtienen después
+        sobre la base configurada (no la de tests, que ya no existe), así que
+        conviene tenerla con datos representativos.
+        """
+        from django.test.runner import DiscoverRunner
+
+        DiscoverRunner(verbosity=0, interactive=False).run_tests(etiquetas or [])
+
+    # Migración -----------------------------------------------------------
+
+    def escribir_migracion(self, app_label, propuestas):
+        loader = MigrationLoader(None, ignore_no_migrations=True)
+        hojas = loader.graph.leaf_nodes(app_label)
+        numero = max((int(nombre.split('_', 1)[0]) for _, nombre in hojas if nombre[:4].isdigit()), default=0) + 1
+        nombre = f"{numero:04d}_asesor_indices"
+
+        migracion = Migration(nombre, app_label)
+        migracion.dependencies = hojas
+        migracion.operations = [
+            AddIndex(model_name=p['modelo']._meta.model_name, index=p['indice'])
+            for p in propuestas if p['modelo']._meta.app_label == app_label
+        ]
+        writer = MigrationWriter(migracion)
+        with open(writer.path, 'w') as f:
+            f.write(writer.as_string())
+        return writer.path
@@ -0,0 +1,370 @@
+import asyncio
+import json
+import platform
+import statistics
+import subprocess
+import threading
+import time
+import urllib.error
+import urllib.request
+from datetime import date, timedelta
+
+import django
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import AsyncClient, Client
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from calendarBackend.models import (
+    Empresa, Vendedor, Proveedor, Pedido, DistribucionFinal,
+    Letra, GuiaDeRemision, Factura
+)
+
+
+def endpoints_por_defecto():
+    """Endpoints principales de la API; las rutas con {pedido} usan un pedido real"""
+    hoy = date.today()
+    desde, hasta = hoy.replace(day=1), hoy.replace(day=1) + timedelta(days=31)
+    return [
+        '/api/empresas/',
+        '/api/vendedores/',
+        '/api/proveedores/',
+        '/api/proveedores/listado_ordenado/',
+        '/api/pedidos/',
+        '/api/pedidos/?estado=pendiente',
+        '/api/pedidos/{pedido}/',
+        '/api/pedidos/{pedido}/resumen/',
+        f'/api/letras/?fecha_desde={desde}&fecha_hasta={hasta}',
+        '/api/letras/?estado=atrasado',
+        '/api/letras/proximas_vencer/',
+        '/api/distribuciones/no-asignadas/',
+        '/api/guias-remision/',
+        '/api/facturas/',
+        '/api/dashboard/estadisticas/',
+    ]
+
+
+def endpoints_async():
+    """Endpoints con variante async (views_async.py), cada uno junto a su versión síncrona"""
+    hoy = date.today()
+    desde, hasta = hoy.replace(day=1), hoy.replace(day=1) + timedelta(days=31)
+    pares = [
+        ('/api/dashboard/estadisticas/', '/api/async/dashboard/estadisticas/'),
+        (f'/api/letras/?fecha_desde={desde}&fecha_hasta={hasta}',
+         f'/api/async/letras/?fecha_desde={desde}&fecha_hasta={hasta}'),
+        ('/api/letras/proximas_vencer/', '/api/async/letras/proximas_vencer/'),
+        ('/api/pedidos/{pedido}/resumen/', '/api/async/pedidos/{pedido}/resumen/'),
+    ]
+    return [endpoint for par in pares for endpoint in par]
+
+
+def percentiles(valores):
+    if len(valores) < 2:
+        v = valores[0] if valores else 0.0
+        return v, v, v
+    cortes = statistics.quantiles(valores, n=100, method='inclusive')
+    return cortes[49], cortes[94], cortes[98]
+
+
+class Command(BaseCommand):
+    help = (
+        "Ejecuta peticiones concurrentes contra los endpoints principales (cliente de "
+        "pruebas de Django o un servidor con --url) y guarda latencias p50/p95/p99, "
+        "consultas por petición y bytes de respuesta en un JSON comparable entre versiones"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default=None,
+                            help='URL base de un servidor en marcha (ej: http://127.0.0.1:8000). '
+                                 'Sin ella se usa el cliente de pruebas en este proceso')
+        parser.add_argument('--token', default=None, help='Token de autenticación (obligatorio con --url)')
+        parser.add_argument('--rol', choices=['superadmin', 'admin', 'lectura'], default='admin',
+                            help='Rol del usuario de benchmark en modo local (por defecto: admin)')
+        parser.add_argument('--endpoint', action='append', dest='endpoints', default=None,
+                            help='Endpoint a medir (repetible); por defecto los principales')
+        parser.add_argument('--peticiones', type=int, default=20,
+                            help='Peticiones por endpoint (por defecto: 20)')
+        parser.add_argument('--hilos', type=int, default=4, help='Hilos concurrentes (por defecto: 4)')
+        parser.add_argument('--asgi', action='store_true',
+                            help='En modo local, usar el cliente ASGI con --hilos peticiones concurrentes '
+                                 'en un bucle de asyncio; por defecto mide los endpoints con variante '
+                                 'async junto a sus versiones síncronas')
+        parser.add_argument('--calentamiento', type=int, default=1,
+                            help='Peticiones previas sin medir por endpoint (por defecto: 1)')
+        parser.add_argument('--salida', default=None, help='Archivo JSON donde guardar el resultado')
+        parser.add_argument('--comparar', default=None,
+                            help='JSON de una ejecución anterior para mostrar la variación del p95')
+
+    def handle(self, *args, **options):
+        if options['url'] and not options['token']:
+            raise CommandError("--token es obligatorio junto con --url")
+
+        pedido = Pedido.objects.values_list('id', flat=True).first()
+        endpoints = []
+        por_defecto = endpoints_async() if options['asgi'] else endpoints_por_defecto()
+        for endpoint in options['endpoints'] or por_defecto:
+            if '{pedido}' in endpoint:
+                if pedido is None:
+                    self.stderr.write(f"Omitido {endpoint}: no hay pedidos (use generar_datos)")
+                    continue
+                endpoint = endpoint.replace('{pedido}', str(pedido))
+            endpoints.append(endpoint)
+
+        if options['url']:
+            peticion = self.peticion_remota(options['url'].rstrip('/'), options['token'])
+        elif options['asgi']:
+            peticion = self.peticion_asgi(self.token_local(options['rol']))
+        else:
+            peticion = self.peticion_local(self.token_local(options['rol']))
+        medir = self.medir_asgi if options['asgi'] and not options['url'] else self.medir
+
+        resultados = {}
+        for endpoint in endpoints:
+            if medir == self.medir_asgi:
+                # Con la misma concurrencia: el modo en serie y el concurrente no se mezclan
+                if options['calentamiento']:
+                    medir(peticion, endpoint, options['calentamiento'], options['hilos'])
+            else:
+                for _ in range(options['calentamiento']):
+                    peticion(endpoint)
+            resultados[endpoint] = medir(peticion, endpoint, options['peticiones'], options['hilos'])
+            r = resultados[endpoint]
+            self.stdout.write(
+                f"{endpoint:<60} p50 {r['p50_ms']:>8.1f}  p95 {r['p95_ms']:>8.1f}  p99 {r['p99_ms']:>8.1f} ms  "
+                f"{r['consultas_media'] if r['consultas_media'] is not None else '-':>6} consultas  "
+                f"{r['bytes_media']:>9.0f} B  {r['estados']}"
+            )
+
+        artefacto = {
+            'metadatos': self.metadatos(options),
+            'datos': self.conteos(),
+            'endpoints': resultados,
+        }
+        if options['salida']:
+            with open(options['salida'], 'w') as f:
+                json.dump(artefacto, f, indent=2, sort_keys=True, default=str)
+            self.stdout.write(self.style.SUCCESS(f"Resultado guardado en {options['salida']}"))
+        if options['comparar']:
+            self.comparar(options['comparar'], resultados)
+
+    def token_local(self, rol):
+        from django.contrib.auth.models import User
+        from rest_framework.authtoken.models import Token
+        from authentication.models import PerfilUsuario
+
+        user, creado = User.objects.get_or_create(
+            username=f"benchmark_{rol}",
+            defaults={'is_staff': rol != 'lectura', 'is_superuser': rol == 'superadmin'},
+        )
+        PerfilUsuario.objects.update_or_create(user=user, defaults={'rol': rol})
+        return Token.objects.get_or_create(user=user)[0].key
+
+    def peticion_local(self, token):
+        locales = threading.local()
+
+        def peticion(endpoint):
+            if not hasattr(locales, 'client'):
+                locales.client = Client(raise_request_exception=False, HTTP_AUTHORIZATION=f"Token {token}")
+            with CaptureQueriesContext(connection) as consultas:
+                inicio = time.perf_counter()
+                response = locales.client.get(endpoint)
+                contenido = b''.join(response) if response.streaming else response.content
+                duracion = time.perf_counter() - inicio
+            return response.status_code, duracion, len(contenido), len(consultas)
+        return peticion
+
+    def peticion_asgi(self, token):
+        """
+        Petición por ASGI. Con 'aislada' pasa por ASGIHandler como en un
+        servidor (cada petición con su hilo y su conexión); sin ella usa el
+        cliente de pruebas, que corre en el hilo actual y ve los datos de
+        una transacción abierta (tests).
+        """
+        client = AsyncClient(raise_request_exception=False)
+        aplicacion = ASGIHandler()
+
+        async def peticion(endpoint, aislada):
+            inicio = time.perf_counter()
+            if aislada:
+                estado, cabeceras, contenido = await self.llamar_asgi(aplicacion, endpoint, token)
+            else:
+                response = await client.get(endpoint, headers={'Authorization': f"Token {token}"})
+                if response.streaming:
+                    contenido = b''.join([parte async for parte in response.streaming_content])
+                else:
+                    contenido = response.content
+                estado, cabeceras = response.status_code, response.headers
+            duracion = time.perf_counter() - inicio
+            # Las consultas pueden correr en otros hilos: se cuentan con la cabecera del presupuesto
+            consultas = cabeceras.get('X-Query-Count')
+            return estado, duracion, len(contenido), int(consultas) if consultas else None
+        return peticion
+
+    async def llamar_asgi(self, aplicacion, endpoint, token):
+        ruta, _, query = endpoint.partition('?')
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+            'scheme': 'http', 'path': ruta, 'raw_path': ruta.encode(), 'query_string': query.encode(),
+            'root_path': '', 'client': ('127.0.0.1', 0), 'server': ('localhost', 80),
+            'headers': [(b'host', b'localhost'), (b'authorization', f"Token {token}".encode())],
+        }
+        pedido = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+        respuesta = {'estado': None, 'cabeceras': {}, 'partes': []}
+
+        async def receive():
+            if pedido:
+                return pedido.pop()
+            await asyncio.Event().wait()  # el cliente no se desconecta: Django cancela la espera al terminar
+
+        async def send(mensaje):
+            if mensaje['type'] == 'http.response.start':
+                respuesta['estado'] = mensaje['status']
+                respuesta['cabeceras'] = {k.decode().title(): v.decode() for k, v in mensaje['headers']}
+            elif mensaje['type'] == 'http.response.body':
+                respuesta['partes'].append(mensaje.get('body', b''))
+
+        await aplicacion(scope, receive, send)
+        return respuesta['estado'], respuesta['cabeceras'], b''.join(respuesta['partes'])
+
+    def peticion_remota(self, base, token):
+        def peticion(endpoint):
+            request = urllib.request.Request(base + endpoint, headers={
+                'Authorization': f"Token {token}",
+                'Accept-Encoding': 'identity',
+            })
+            inicio = time.perf_counter()
+            try:
+                with urllib.request.urlopen(request) as response:
+                    contenido = response.read()
+                    estado = response.status
+                    consultas = response.headers.get('X-Query-Count')
+            except urllib.error.HTTPError as e:
+                contenido, estado, consultas = e.read(), e.code, e.headers.get('X-Query-Count')
+            duracion = time.perf_counter() - inicio
+            return estado, duracion, len(contenido), int(consultas) if consultas else None
+        return peticion
+
+    def medir(self, peticion, endpoint, total, hilos):
+        muestras = []
+        lock = threading.Lock()
+        errores = []
+        pendientes = iter(range(total))
+
+        def trabajador():
+            propias = []
+            try:
+                while True:
+                    with lock:
+                        if next(pendientes, None) is None:
+                            break
+                    propias.append(peticion(endpoint))
+            except Exception as e:
+                errores.append(repr(e))
+            finally:
+                with lock:
+                    muestras.extend(propias)
+
+        def trabajador_en_hilo():
+            try:
+                trabajador()
+            finally:
+                connection.close()
+
+        inicio = time.perf_counter()
+        if hilos <= 1:
+            # En el hilo actual: ve los datos de una transacción abierta (tests)
+            trabajador()
+        else:
+            threads = [threading.Thread(target=trabajador_en_hilo) for _ in range(hilos)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        duracion = time.perf_counter() - inicio
+        if errores:
+            raise CommandError(f"Error midiendo {endpoint}: {errores[0]}")
+
+        return self.resumen(muestras, duracion)
+
+    def medir_asgi(self, peticion, endpoint, total, concurrencia):
+        """Como medir(), con 'concurrencia' peticiones a la vez en un bucle de asyncio"""
+        async def medir():
+            muestras = []
+            pendientes = iter(range(total))
+
+            async def trabajador():
+                while next(pendientes, None) is not None:
+                    muestras.append(await peticion(endpoint, concurrencia > 1))
+
+            inicio = time.perf_counter()
+            await asyncio.gather(*(trabajador() for _ in range(max(concurrencia, 1))))
+            return muestras, time.perf_counter() - inicio
+
+        try:
+            # Concurrente, en un bucle propio como el de un servidor ASGI; en
+            # serie, dentro de async_to_sync para que el código síncrono corra
+            # en el hilo actual
+            muestras, duracion = asyncio.run(medir()) if concurrencia > 1 else async_to_sync(medir)()
+        except Exception as e:
+            raise CommandError(f"Error midiendo {endpoint}: {e!r}")
+        return self.resumen(muestras, duracion)
+
+    def resumen(self, muestras, duracion):
+        ms = [m[1] * 1000 for m in muestras]
+        consultas = [m[3] for m in muestras if m[3] is not None]
+        estados = {}
+        for m in muestras:
+            estados[str(m[0])] = estados.get(str(m[0]), 0) + 1
+        p50, p95, p99 = percentiles(ms)
+        return {
+            'peticiones': len(muestras),
+            'estados': estados,
+            'media_ms': round(statistics.mean(ms), 3) if ms else 0.0,
+            'p50_ms': round(p50, 3),
+            'p95_ms': round(p95, 3),
+            'p99_ms': round(p99, 3),
+            'peticiones_por_segundo': round(len(muestras) / duracion, 2) if duracion else 0.0,
+            'consultas_media': round(statistics.mean(consultas), 2) if consultas else None,
+            'consultas_max': max(consultas) if consultas else None,
+            'bytes_media': statistics.mean([m[2] for m in muestras]) if muestras else 0,
+        }
+
+
+    def metadatos(self, options):
+        try:
+            commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                                    text=True, cwd=settings.BASE_DIR).stdout.strip() or None
+        except OSError:
+            commit = None
+        return {
+            'fecha': timezone.now().isoformat(),
+            'commit': commit,
+            'modo': 'servidor' if options['url'] else 'cliente_asgi' if options['asgi'] else 'cliente_pruebas',
+            'url': options['url'],
+            'hilos': options['hilos'],
+            'peticiones_por_endpoint': options['peticiones'],
+            'base_de_datos': connection.vendor,
+            'django': django.get_version(),
+            'python': platform.python_version(),
+        }
+
+    def conteos(self):
+        return {
+            modelo._meta.model_name: modelo.objects.count()
+            for modelo in (Empresa, Vendedor, Proveedor, Pedido, DistribucionFinal, Letra, GuiaDeRemision, Factura)
+        }
+
+    def comparar(self, ruta, resultados):
+        with open(ruta) as f:
+            anterior = json.load(f)['endpoints']
+        self.stdout.write(f"\nVariación del p95 respecto a {ruta}:")
+        for endpoint, r in resultados.items():
+            if endpoint not in anterior or not anterior[endpoint]['p95_ms']:
+                continue
+            base = anterior[endpoint]['p95_ms']
+            cambio = (r['p95_ms'] - base) / base * 100
+            self.stdout.write(f"  {endpoint:<60} {base:>8.1f} -> {r['p95_ms']:>8.1f} ms ({cambio:+.1f}%)")
@@ -0,0 +1,94 @@
+import json
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from calendarBackend.lectura_compilada import compilar, serializar
+from calendarBackend.models import Letra
+from calendarBackend.serializers import LetraSerializer
+
+
+class Command(BaseCommand):
+    help = (
+        "Compara el tiempo de serializar el listado de letras con LetraSerializer "
+        "(instancias del modelo) y con el plan compilado de lectura_compilada.py "
+        "(values_list), y comprueba que ambas salidas son idénticas"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeticiones', type=int, default=5,
+                            help='Veces que se serializa el listado con cada camino (por defecto: 5)')
+        parser.add_argument('--limite', type=int, default=None,
+                            help='Máximo de letras a serializar (por defecto: todas)')
+        parser.add_argument('--fields', default='',
+                            help='Campos a serializar separados por comas, como ?fields= (por defecto: todos)')
+        parser.add_argument('--json', action='store_true', help='Imprimir el resultado en JSON')
+
+    def handle(self, *args, **options):
+        queryset = Letra.objects.select_related('pedido__proveedor', 'empresa', 'distribucion').order_by('fecha_pago')
+        if options['limite']:
+            queryset = queryset[:options['limite']]
+        context = {'hoy': timezone.now().date()}
+
+        serializer = LetraSerializer(context=context)
+        campos = [nombre.strip() for nombre in options['fields'].split(',') if nombre.strip()]
+        if campos:
+            desconocidos = [nombre for nombre in campos if nombre not in serializer.fields]
+            if desconocidos:
+                raise CommandError(f"Campos desconocidos: {', '.join(desconocidos)}")
+            for nombre in list(serializer.fields):
+                if nombre not in campos and nombre != 'id':
+                    serializer.fields.pop(nombre)
+        if compilar(serializer) is None:
+            raise CommandError("LetraSerializer no se puede compilar con esos campos")
+
+        def estandar():
+            lista = LetraSerializer(queryset.all(), many=True, context=context)
+            for nombre in list(lista.child.fields):
+                if nombre not in serializer.fields:
+                    lista.child.fields.pop(nombre)
+            return lista.data
+
+        def compilado():
+            return serializar(serializer, queryset.all())
+
+        renderer = JSONRenderer()
+        iguales = renderer.render(estandar()) == renderer.render(compilado())
+        resultados = [self.medir(nombre, funcion, options['repeticiones'])
+                      for nombre, funcion in (('serializer', estandar), ('compilado', compilado))]
+        mejora = resultados[0]['mediana_ms'] / resultados[1]['mediana_ms'] if resultados[1]['mediana_ms'] else 0.0
+
+        if options['json']:
+            self.stdout.write(json.dumps({'resultados': resultados, 'mejora': round(mejora, 2),
+                                          'salidas_iguales': iguales}, indent=2))
+            return
+
+        self.stdout.write(f"{'camino':<12} {'filas':>7} {'mediana ms':>11} {'mín ms':>9} {'filas/s':>10}")
+        for r in resultados:
+            self.stdout.write(
+                f"{r['camino']:<12} {r['filas']:>7} {r['mediana_ms']:>11.2f} {r['min_ms']:>9.2f} "
+                f"{r['filas_por_segundo']:>10.0f}"
+            )
+        self.stdout.write(f"Mejora: x{mejora:.2f}")
+        if iguales:
+            self.stdout.write(self.style.SUCCESS("Las dos salidas son idénticas"))
+        else:
+            self.stdout.write(self.style.ERROR("Las salidas NO coinciden"))
+
+    def medir(self, camino, funcion, repeticiones):
+        tiempos, filas = [], 0
+        for _ in range(max(repeticiones, 1)):
+            inicio = time.perf_counter()
+            filas = len(funcion())
+            tiempos.append((time.perf_counter() - inicio) * 1000)
+        mediana = statistics.median(tiempos)
+        return {
+            'camino': camino,
+            'filas': filas,
+            'mediana_ms': round(mediana, 3),
+            'min_ms': round(min(tiempos), 3),
+            'filas_por_segundo': round(filas / (mediana / 1000), 1) if mediana else 0.0,
+        }
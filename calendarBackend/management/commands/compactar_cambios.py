@@ -0,0 +1,42 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from calendarBackend.models import RegistroCambio
+
+
+class Command(BaseCommand):
+    help = (
+        "Compacta el registro de cambios de la sincronización incremental: deja "
+        "solo el último cambio de cada objeto y descarta los anteriores al periodo "
+        "de retención (pensado para ejecutarse a diario desde cron)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dias', type=int, default=getattr(settings, 'SYNC_RETENCION_DIAS', 30),
+                            help='Días de cambios a conservar (por defecto: SYNC_RETENCION_DIAS)')
+
+    def handle(self, *args, **options):
+        limite = timezone.now() - timezone.timedelta(days=options['dias'])
+        with transaction.atomic():
+            # Todo lo anterior al corte se descarta; la fila del corte queda
+            # como marca 'compact' y los clientes con una marca anterior
+            # reciben 410 y recargan los listados completos
+            corte = RegistroCambio.objects.filter(creado__lt=limite).aggregate(corte=Max('id'))['corte']
+            antiguos = 0
+            if corte is not None:
+                antiguos, _ = RegistroCambio.objects.filter(id__lt=corte).delete()
+                RegistroCambio.objects.filter(id=corte).update(modelo='', objeto_id='', accion='compact')
+
+            # De cada objeto basta su último cambio: una marca anterior a los
+            # descartados igual recibe el objeto por ese último cambio
+            ultimos = (RegistroCambio.objects.exclude(accion='compact')
+                       .values('modelo', 'objeto_id').annotate(ultimo=Max('id')).values('ultimo'))
+            repetidos, _ = RegistroCambio.objects.exclude(accion='compact').exclude(id__in=ultimos).delete()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{antiguos} cambios anteriores a {options['dias']} días y {repetidos} repetidos eliminados; "
+            f"quedan {RegistroCambio.objects.count()}"
+        ))
@@ -0,0 +1,315 @@
+import random
+import uuid
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from calendarBackend.models import (
+    Empresa, Vendedor, Proveedor, Pedido, DistribucionFinal,
+    Letra, GuiaDeRemision, Factura
+)
+
+# Cantidades por escala. --letras es aproximado: cada distribución recibe un
+# número aleatorio de letras alrededor del promedio necesario.
+ESCALAS = {
+    'pequena': {'empresas': 3, 'vendedores': 20, 'proveedores': 100, 'pedidos': 2000, 'letras': 10000},
+    'mediana': {'empresas': 5, 'vendedores': 100, 'proveedores': 1000, 'pedidos': 20000, 'letras': 100000},
+    'grande': {'empresas': 8, 'vendedores': 500, 'proveedores': 10000, 'pedidos': 200000, 'letras': 1000000},
+}
+
+PROPORCION_CONTADO = 0.15
+
+PREFIJOS = ['Distribuidora', 'Comercial', 'Importaciones', 'Inversiones', 'Corporación', 'Industrias', 'Textil']
+NOMBRES = ['Andina', 'del Sur', 'Pacífico', 'Norteña', 'San Martín', 'Los Olivos', 'Santa Rosa', 'Inca',
+           'Miraflores', 'El Sol', 'Amazonía', 'Chavín', 'Huascarán', 'Costa Verde', 'La Unión']
+SUFIJOS = ['S.A.C.', 'E.I.R.L.', 'S.A.', 'S.R.L.']
+PERSONAS = ['Carlos', 'María', 'José', 'Rosa', 'Luis', 'Ana', 'Jorge', 'Lucía', 'Pedro', 'Carmen', 'Miguel', 'Elena']
+APELLIDOS = ['Quispe', 'Flores', 'Huamán', 'Mamani', 'Rojas', 'García', 'Torres', 'Chávez', 'Vargas', 'Ramos']
+BANCOS = ['BCP', 'BBVA', 'Interbank', 'Scotiabank', 'BanBif']
+TRANSPORTISTAS = ['Transportes Cruz del Sur', 'Shalom', 'Olva Courier', 'Marvisur', 'Flota propia']
+
+
+class Command(BaseCommand):
+    help = (
+        "Genera un conjunto de datos sintético y reproducible (misma semilla, mismos "
+        "datos) para pruebas de carga: empresas, vendedores, proveedores, pedidos, "
+        "distribuciones, letras, guías de remisión y facturas"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--escala', choices=list(ESCALAS), default='pequena',
+                            help='Tamaño base del conjunto (por defecto: pequena)')
+        for nombre in ('empresas', 'vendedores', 'proveedores', 'pedidos', 'letras'):
+            parser.add_argument(f'--{nombre}', type=int, default=None,
+                                help=f'Cantidad de {nombre} (reemplaza la de la escala)')
+        parser.add_argument('--guias-por-pedido', type=float, default=0.5,
+                            help='Promedio de guías de remisión por pedido (por defecto: 0.5)')
+        parser.add_argument('--semilla', type=int, default=42, help='Semilla aleatoria (por defecto: 42)')
+        parser.add_argument('--lote', type=int, default=2000,
+                            help='Pedidos por lote de inserción (por defecto: 2000)')
+        parser.add_argument('--limpiar', action='store_true',
+                            help='Eliminar antes los datos existentes de calendarBackend')
+
+    def handle(self, *args, **options):
+        cantidades = dict(ESCALAS[options['escala']])
+        for nombre in cantidades:
+            if options[nombre] is not None:
+                cantidades[nombre] = options[nombre]
+        if min(cantidades['empresas'], cantidades['proveedores']) < 1 and cantidades['pedidos']:
+            raise CommandError("Se necesita al menos una empresa y un proveedor para generar pedidos")
+
+        self.rng = random.Random(options['semilla'])
+        self.hoy = date.today()
+        if options['limpiar']:
+            self.limpiar()
+        # Los números únicos continúan desde lo ya existente, así se puede
+        # ejecutar varias veces sin --limpiar
+        self.contadores = {
+            'letras': Letra.objects.count(),
+            'guias': GuiaDeRemision.objects.count(),
+            'facturas': Factura.objects.count(),
+        }
+
+        empresas = self.crear_empresas(cantidades['empresas'])
+        vendedores = self.crear_vendedores(cantidades['vendedores'])
+        proveedores = self.crear_proveedores(cantidades['proveedores'], vendedores)
+
+        total = cantidades['pedidos']
+        # Promedio de letras por distribución a crédito: cada pedido tiene de
+        # 1 a 3 distribuciones y los pedidos al contado no tienen letras
+        distribuciones_por_pedido = sum(min(len(empresas), k) for k in (1, 2, 3)) / 3
+        distribuciones_credito = total * distribuciones_por_pedido * (1 - PROPORCION_CONTADO)
+        letras_por_distribucion = cantidades['letras'] / max(1, distribuciones_credito)
+        creados = {'pedidos': 0, 'distribuciones': 0, 'letras': 0, 'guias': 0, 'facturas': 0}
+        for inicio in range(0, total, options['lote']):
+            n = min(options['lote'], total - inicio)
+            lote = self.crear_lote(inicio, n, empresas, proveedores, letras_por_distribucion,
+                                   options['guias_por_pedido'])
+            for clave, valor in lote.items():
+                creados[clave] += valor
+            self.stdout.write(f"  {inicio + n}/{total} pedidos")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Generado (semilla {options['semilla']}): {len(empresas)} empresas, {len(vendedores)} vendedores, "
+            f"{len(proveedores)} proveedores, {creados['pedidos']} pedidos, "
+            f"{creados['distribuciones']} distribuciones, {creados['letras']} letras, "
+            f"{creados['guias']} guías, {creados['facturas']} facturas"
+        ))
+
+    def limpiar(self):
+        # De hijos a padres por las FK con PROTECT
+        for modelo in (Factura, GuiaDeRemision, Letra, DistribucionFinal, Pedido, Proveedor, Vendedor, Empresa):
+            modelo.objects.all().delete()
+
+    def uuid(self):
+        return uuid.UUID(int=self.rng.getrandbits(128), version=4)
+
+    def razon_social(self):
+        return f"{self.rng.choice(PREFIJOS)} {self.rng.choice(NOMBRES)} {self.rng.choice(SUFIJOS)}"
+
+    def persona(self):
+        return f"{self.rng.choice(PERSONAS)} {self.rng.choice(APELLIDOS)}"
+
+    def telefono(self):
+        return f"9{self.rng.randint(10000000, 99999999)}"
+
+    def ruc(self, prefijo, n):
+        return f"{prefijo}{n:09d}"
+
+    def crear_empresas(self, cantidad):
+        existentes = Empresa.objects.count()
+        empresas = [
+            Empresa(
+                nombre=f"{self.razon_social()} #{existentes + i + 1}",
+                ruc=self.ruc('20', self.rng.randint(0, 10 ** 9 - 1)),
+                direccion=f"Av. {self.rng.choice(NOMBRES)} {self.rng.randint(100, 2500)}",
+                telefono=self.telefono(),
+            )
+            for i in range(cantidad)
+        ]
+        Empresa.objects.bulk_create(empresas, batch_size=500)
+        return list(Empresa.objects.all())
+
+    def crear_vendedores(self, cantidad):
+        vendedores = [
+            Vendedor(nombre=self.persona(), telefono=self.telefono(),
+                     activo=self.rng.random() > 0.1)
+            for _ in range(cantidad)
+        ]
+        Vendedor.objects.bulk_create(vendedores, batch_size=1000)
+        return list(Vendedor.objects.values_list('id', flat=True))
+
+    def crear_proveedores(self, cantidad, vendedores):
+        proveedores = []
+        for _ in range(cantidad):
+            nombre = self.razon_social()
+            proveedores.append(Proveedor(
+                nombre=nombre,
+                identificador=nombre[:4].upper(),
+                vendedor_id=self.rng.choice(vendedores) if vendedores else None,
+                color=f"#{self.rng.randint(0, 0xFFFFFF):06x}",
+                ruc=self.ruc('20', self.rng.randint(0, 10 ** 9 - 1)),
+                plazo_credito_default=self.rng.choice([30, 45, 60, 90, 120]),
+                activo=self.rng.random() > 0.05,
+            ))
+        Proveedor.objects.bulk_create(proveedores, batch_size=1000)
+        return list(Proveedor.objects.values_list('id', 'identificador'))
+
+    @transaction.atomic
+    def crear_lote(self, inicio, cantidad, empresas, proveedores, letras_por_distribucion, guias_por_pedido):
+        """
+        Crea un lote de pedidos con sus distribuciones, letras, guías y
+        facturas. Los campos que calculan los save() de los modelos
+        (número de pedido, montos disponibles, fecha con gracia) se calculan
+        aquí, porque bulk_create no llama a save().
+        """
+        rng = self.rng
+        pedidos, distribuciones, letras_por_dist = [], [], []
+        guias, facturas = [], []
+
+        for i in range(cantidad):
+            proveedor_id, identificador = rng.choice(proveedores)
+            fecha = self.hoy - timedelta(days=rng.randint(0, 730))
+            es_contado = rng.random() < PROPORCION_CONTADO
+            plazo = 0 if es_contado else rng.choice([60, 90, 120])
+            pedido = Pedido(
+                id=self.uuid(),
+                proveedor_id=proveedor_id,
+                fecha_pedido=fecha,
+                plazo_dias=plazo,
+                es_contado=es_contado,
+                numero_pedido=f"{identificador}{fecha:%d%m%y}{(inicio + i) % 100:02d}",
+                descripcion=f"Pedido de temporada {fecha.year}",
+                monto_total_pedido=Decimal(0),
+            )
+
+            monto_pedido = Decimal(0)
+            pagado_pedido = Decimal(0)
+            empresas_pedido = rng.sample(empresas, k=min(len(empresas), rng.randint(1, 3)))
+            for empresa in empresas_pedido:
+                monto = Decimal(rng.randint(500, 50000))
+                dist = DistribucionFinal(pedido=pedido, empresa=empresa, monto_final=monto)
+                letras = [] if es_contado else self.crear_letras(dist, fecha, plazo, letras_por_distribucion)
+                dist.monto_en_letras = sum((l.monto for l in letras), Decimal(0))
+                dist.monto_disponible = monto - dist.monto_en_letras
+                dist.completado = dist.monto_disponible <= 0
+                pagado_pedido += sum((l.monto for l in letras if l.estado == 'pagado'), Decimal(0))
+                monto_pedido += monto
+                distribuciones.append(dist)
+                letras_por_dist.append(letras)
+
+                for _ in range(self.cantidad_aleatoria(guias_por_pedido / len(empresas_pedido))):
+                    guia, facturas_guia = self.crear_guia(pedido, empresa, fecha, monto)
+                    guias.append(guia)
+                    facturas.extend(facturas_guia)
+
+            pedido.monto_total_pedido = monto_pedido
+            pedido.monto_final_pedido = monto_pedido
+            pedido.monto_pagado = pagado_pedido
+            completas = all(d.completado for d in distribuciones[-len(empresas_pedido):])
+            pedido.estado = 'completado' if completas else rng.choice(['pendiente', 'asignado'])
+            pedido.completado = completas
+            pedidos.append(pedido)
+
+        Pedido.objects.bulk_create(pedidos, batch_size=1000)
+        # DistribucionFinal usa id autoincremental: en SQLite y PostgreSQL
+        # bulk_create devuelve los ids, que las letras necesitan
+        DistribucionFinal.objects.bulk_create(distribuciones, batch_size=1000)
+        letras = []
+        for dist, letras_dist in zip(distribuciones, letras_por_dist):
+            for letra in letras_dist:
+                letra.distribucion = dist
+                letras.append(letra)
+        Letra.objects.bulk_create(letras, batch_size=2000)
+        GuiaDeRemision.objects.bulk_create(guias, batch_size=1000)
+        Factura.objects.bulk_create(facturas, batch_size=1000)
+
+        return {'pedidos': len(pedidos), 'distribuciones': len(distribuciones),
+                'letras': len(letras), 'guias': len(guias), 'facturas': len(facturas)}
+
+    def crear_letras(self, dist, fecha_pedido, plazo, promedio):
+        rng = self.rng
+        cantidad = self.cantidad_aleatoria(promedio)
+        if not cantidad:
+            return []
+        # Casi siempre se reparte todo el monto; a veces queda saldo sin asignar
+        asignado = dist.monto_final if rng.random() < 0.8 else (dist.monto_final * Decimal('0.6')).quantize(Decimal('1'))
+        cuota = (asignado / cantidad).quantize(Decimal('0.01'))
+        letras = []
+        for n in range(cantidad):
+            monto = cuota if n < cantidad - 1 else asignado - cuota * (cantidad - 1)
+            fecha_pago = fecha_pedido + timedelta(days=plazo * (n + 1) // cantidad or 30)
+            gracia = self.fecha_con_gracia(fecha_pago)
+            if gracia < self.hoy:
+                estado = 'pagado' if rng.random() < 0.9 else 'atrasado'
+            else:
+                estado = 'pendiente'
+            self.contadores['letras'] += 1
+            letras.append(Letra(
+                id=self.uuid(),
+                numero_unico=f"SYN{self.contadores['letras']:010d}",
+                pedido=dist.pedido,
+                empresa=dist.empresa,
+                proveedor_id=dist.pedido.proveedor_id,
+                monto=monto,
+                fecha_pago=fecha_pago,
+                fecha_vencimiento_gracia=gracia,
+                estado=estado,
+                dias_retraso=max(0, (self.hoy - gracia).days) if estado == 'atrasado' else 0,
+                fecha_pago_real=fecha_pago + timedelta(days=rng.randint(0, 8)) if estado == 'pagado' else None,
+                banco=rng.choice(BANCOS) if estado == 'pagado' else '',
+            ))
+        return letras
+
+    def crear_guia(self, pedido, empresa, fecha, monto):
+        rng = self.rng
+        self.contadores['guias'] += 1
+        emision = fecha + timedelta(days=rng.randint(0, 15))
+        guia = GuiaDeRemision(
+            id=self.uuid(),
+            pedido=pedido,
+            empresa=empresa,
+            numero_guia=f"SYN-T001-{self.contadores['guias']:08d}",
+            fecha_emision=emision,
+            fecha_recepcion=emision + timedelta(days=rng.randint(1, 7)) if emision < self.hoy else None,
+            estado=rng.choice(['emitida', 'en_transito', 'recibida', 'recibida', 'recibida']),
+            transportista=rng.choice(TRANSPORTISTAS),
+        )
+        facturas = []
+        for _ in range(rng.randint(1, 2)):
+            self.contadores['facturas'] += 1
+            vencimiento = emision + timedelta(days=rng.choice([0, 30, 60, 90]))
+            facturas.append(Factura(
+                id=self.uuid(),
+                guia_remision=guia,
+                empresa=guia.empresa,
+                proveedor_id=pedido.proveedor_id,
+                numero_factura=f"SYN-F001-{self.contadores['facturas']:08d}",
+                monto_factura=(monto * Decimal(rng.uniform(0.2, 0.6))).quantize(Decimal('0.01')),
+                fecha_emision=emision,
+                fecha_vencimiento=vencimiento,
+                estado='pagada' if vencimiento < self.hoy and rng.random() < 0.85 else 'emitida',
+                condicion_pago='Contado' if vencimiento == emision else f"Crédito {(vencimiento - emision).days} días",
+            ))
+        return guia, facturas
+
+    def cantidad_aleatoria(self, promedio):
+        """Entero no negativo con media 'promedio' y algo de dispersión"""
+        entero = int(promedio)
+        cantidad = entero + (1 if self.rng.random() < promedio - entero else 0)
+        if entero > 1:
+            cantidad += self.rng.choice([-1, 0, 0, 1])
+        return cantidad
+
+    @staticmethod
+    def fecha_con_gracia(fecha_pago):
+        # Igual que Letra.save(): 9 días hábiles después de la fecha de pago
+        dias_habiles = 0
+        fecha = fecha_pago
+        while dias_habiles < 9:
+            fecha += timedelta(days=1)
+            if fecha.weekday() < 5:
+                dias_habiles += 1
+        return fecha
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from calendarBackend.busqueda import DOCUMENTOS, indexar
+from calendarBackend.models import IndiceBusqueda
+
+
+class Command(BaseCommand):
+    help = (
+        "Reconstruye el índice de búsqueda de texto completo (pedidos, letras, "
+        "proveedores, guías y facturas). Necesario tras cargas masivas que no "
+        "disparan señales, como generar_datos o loaddata"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tipo', choices=list(DOCUMENTOS), action='append',
+                            help='Indexar solo este tipo (se puede repetir; por defecto: todos)')
+        parser.add_argument('--limpiar', action='store_true',
+                            help='Vaciar antes el índice de los tipos indexados')
+        parser.add_argument('--lote', type=int, default=2000,
+                            help='Objetos por lote de inserción (por defecto: 2000)')
+
+    def handle(self, *args, **options):
+        lote = options['lote']
+        for tipo in options['tipo'] or list(DOCUMENTOS):
+            modelo = DOCUMENTOS[tipo].modelo
+            if options['limpiar']:
+                IndiceBusqueda.objects.filter(tipo=tipo).delete()
+            else:
+                # Quita del índice los objetos que ya no existen
+                existentes = {str(pk) for pk in modelo.objects.values_list('pk', flat=True)}
+                huerfanos = [
+                    objeto_id for objeto_id in IndiceBusqueda.objects.filter(tipo=tipo).values_list('objeto_id', flat=True)
+                    if objeto_id not in existentes
+                ]
+                IndiceBusqueda.objects.filter(tipo=tipo, objeto_id__in=huerfanos).delete()
+
+            pks = list(modelo.objects.order_by('pk').values_list('pk', flat=True))
+            total = 0
+            for inicio in range(0, len(pks), lote):
+                with transaction.atomic():
+                    total += indexar(tipo, modelo.objects.filter(pk__in=pks[inicio:inicio + lote]))
+                self.stdout.write(f"  {tipo}: {total}/{len(pks)}")
+            self.stdout.write(self.style.SUCCESS(f"{tipo}: {total} documentos indexados"))
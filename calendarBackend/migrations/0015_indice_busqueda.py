@@ -0,0 +1,80 @@
+# Generated by Django 5.2 on 2026-10-19 17:29
+
+from django.db import migrations, models
+
+TABLA = '"calendarBackend_indicebusqueda"'
+FTS = '"calendarBackend_indicebusqueda_fts"'
+
+# SQLite: tabla FTS5 de contenido externo sincronizada con triggers. Si se
+# altera IndiceBusqueda en otra migración, SQLite rehace la tabla y los
+# triggers se pierden: hay que volver a crearlos.
+SQLITE_CREAR = [
+    f"CREATE VIRTUAL TABLE {FTS} USING fts5(contenido, content={TABLA}, content_rowid='id', "
+    f"tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+    f"CREATE TRIGGER indice_busqueda_ai AFTER INSERT ON {TABLA} BEGIN "
+    f"INSERT INTO {FTS} (rowid, contenido) VALUES (new.id, new.contenido); END",
+    f"CREATE TRIGGER indice_busqueda_ad AFTER DELETE ON {TABLA} BEGIN "
+    f"INSERT INTO {FTS} ({FTS}, rowid, contenido) VALUES ('delete', old.id, old.contenido); END",
+    f"CREATE TRIGGER indice_busqueda_au AFTER UPDATE ON {TABLA} BEGIN "
+    f"INSERT INTO {FTS} ({FTS}, rowid, contenido) VALUES ('delete', old.id, old.contenido); "
+    f"INSERT INTO {FTS} (rowid, contenido) VALUES (new.id, new.contenido); END",
+]
+SQLITE_BORRAR = [
+    "DROP TRIGGER IF EXISTS indice_busqueda_ai",
+    "DROP TRIGGER IF EXISTS indice_busqueda_ad",
+    "DROP TRIGGER IF EXISTS indice_busqueda_au",
+    f"DROP TABLE IF EXISTS {FTS}",
+]
+
+# PostgreSQL: tsvector generado con índice GIN y trigramas para coincidencias parciales
+POSTGRES_CREAR = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    f"ALTER TABLE {TABLA} ADD COLUMN vector tsvector "
+    f"GENERATED ALWAYS AS (to_tsvector('simple', contenido)) STORED",
+    f"CREATE INDEX indice_busqueda_vector ON {TABLA} USING GIN (vector)",
+    f"CREATE INDEX indice_busqueda_trgm ON {TABLA} USING GIN (contenido gin_trgm_ops)",
+]
+POSTGRES_BORRAR = [
+    "DROP INDEX IF EXISTS indice_busqueda_trgm",
+    "DROP INDEX IF EXISTS indice_busqueda_vector",
+    f"ALTER TABLE {TABLA} DROP COLUMN IF EXISTS vector",
+]
+
+
+def ejecutar(sentencias):
+    def operacion(apps, schema_editor):
+        vendor = schema_editor.connection.vendor
+        for sql in sentencias.get(vendor, []):
+            schema_editor.execute(sql)
+    return operacion
+
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calendarBackend', '0014_remove_notas_from_distribucion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IndiceBusqueda',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(choices=[('pedido', 'Pedido'), ('letra', 'Letra'), ('proveedor', 'Proveedor'), ('guia', 'Guía de Remisión'), ('factura', 'Factura')], max_length=10)),
+                ('objeto_id', models.CharField(max_length=36)),
+                ('titulo', models.CharField(max_length=200)),
+                ('contenido', models.TextField()),
+                ('actualizado', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Índice de búsqueda',
+                'verbose_name_plural': 'Índice de búsqueda',
+                'constraints': [models.UniqueConstraint(fields=('tipo', 'objeto_id'), name='indice_busqueda_objeto_unico')],
+            },
+        ),
+        migrations.RunPython(
+            ejecutar({'sqlite': SQLITE_CREAR, 'postgresql': POSTGRES_CREAR}),
+            ejecutar({'sqlite': SQLITE_BORRAR, 'postgresql': POSTGRES_BORRAR}),
+        ),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 5.2 on 2026-10-19 17:36
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def rellenar(apps, schema_editor):
+    """Copia proveedor y empresa desde el pedido y la guía con un UPDATE por columna"""
+    Pedido = apps.get_model('calendarBackend', 'Pedido')
+    GuiaDeRemision = apps.get_model('calendarBackend', 'GuiaDeRemision')
+    Letra = apps.get_model('calendarBackend', 'Letra')
+    Factura = apps.get_model('calendarBackend', 'Factura')
+    db = schema_editor.connection.alias
+
+    Letra.objects.using(db).filter(pedido__isnull=False).update(
+        proveedor=Subquery(Pedido.objects.filter(pk=OuterRef('pedido_id')).values('proveedor_id')[:1])
+    )
+    guias = GuiaDeRemision.objects.filter(pk=OuterRef('guia_remision_id'))
+    Factura.objects.using(db).update(
+        empresa=Subquery(guias.values('empresa_id')[:1]),
+        proveedor=Subquery(guias.values('pedido__proveedor_id')[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calendarBackend', '0015_indice_busqueda'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='factura',
+            name='empresa',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='facturas', to='calendarBackend.empresa'),
+        ),
+        migrations.AddField(
+            model_name='factura',
+            name='proveedor',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='facturas', to='calendarBackend.proveedor'),
+        ),
+        migrations.AddField(
+            model_name='letra',
+            name='proveedor',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='letras', to='calendarBackend.proveedor'),
+        ),
+        # Los índices se crean después de rellenar: más rápido que mantenerlos fila a fila
+        migrations.RunPython(rellenar, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='factura',
+            index=models.Index(fields=['empresa', 'estado', 'fecha_emision'], name='factura_emp_estado_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='factura',
+            index=models.Index(fields=['proveedor', 'estado', 'fecha_emision'], name='factura_prov_estado_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='letra',
+            index=models.Index(fields=['proveedor', 'estado', 'fecha_pago'], name='letra_prov_estado_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='letra',
+            index=models.Index(fields=['empresa', 'estado', 'fecha_pago'], name='letra_emp_estado_fecha_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2 on 2026-10-19 17:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calendarBackend', '0016_proveedor_empresa_desnormalizados'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RegistroCambio',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('modelo', models.CharField(max_length=30)),
+                ('objeto_id', models.CharField(max_length=36)),
+                ('accion', models.CharField(choices=[('upsert', 'Alta o modificación'), ('delete', 'Borrado'), ('compact', 'Compactado hasta aquí')], max_length=10)),
+                ('creado', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Registro de cambio',
+                'verbose_name_plural': 'Registro de cambios',
+                'indexes': [models.Index(fields=['modelo', 'id'], name='registro_cambio_modelo_idx'), models.Index(fields=['creado'], name='registro_cambio_creado_idx')],
+            },
+        ),
+    ]
@@ -1,9 +1,106 @@
 import uuid
-from django.db import models
+from django.db import models, router, transaction
+from django.db.models import F
 from django.utils import timezone
 from django.contrib.auth.models import User
 
-class Empresa(models.Model):
+
+class CamposCargadosMixin:
+    """
+    Recuerda los valores con que se cargó el objeto de la base de datos
+    para saber qué campos cambiaron al guardarlo (eventos de cambio, ver
+    signals.py). Los campos auto_now y la versión no cuentan: cambian en
+    cada guardado.
+    """
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._valores_cargados = {
+            nombre: valor for nombre, valor in zip(field_names, values) if valor is not models.DEFERRED
+        }
+        return instance
+
+    def campos_cambiados(self):
+        """Nombres de los campos modificados desde la carga, o None si no vino de la base"""
+        cargados = getattr(self, '_valores_cargados', None)
+        if cargados is None:
+            return None
+        return [
+            campo.name for campo in self._meta.concrete_fields
+            if campo.attname in cargados and not getattr(campo, 'auto_now', False) and campo.name != 'version'
+            and getattr(self, campo.attname) != cargados[campo.attname]
+        ]
+
+    def marcar_cargado(self):
+        """Toma los valores actuales como los de referencia (tras guardar)"""
+        self._valores_cargados = {
+            campo.attname: getattr(self, campo.attname) for campo in self._meta.concrete_fields
+            if campo.attname in self.__dict__
+        }
+
+
+class GuardadoAtomicoMixin:
+    """
+    save() y delete() en una transacción, para que las filas que escriben
+    las señales (registro de cambios, ver sincronizacion.py) y los guardados
+    en cascada se confirmen o se descarten junto con el objeto.
+    """
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic(using=kwargs.get('using') or router.db_for_write(type(self), instance=self)):
+            super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic(using=kwargs.get('using') or router.db_for_write(type(self), instance=self)):
+            return super().delete(*args, **kwargs)
+
+
+class ConflictoVersion(Exception):
+    """El objeto cambió en la base desde que se leyó: su versión ya no es la esperada"""
+
+    def __init__(self, modelo, pk):
+        super().__init__(f"{modelo._meta.verbose_name} {pk} fue modificado por otro usuario")
+        self.modelo = modelo
+        self.pk = pk
+
+
+class VersionadoMixin(models.Model):
+    """
+    Columna 'version' para la concurrencia optimista (ver concurrencia.py).
+    Cada UPDATE del objeto la incrementa en la propia consulta
+    (version = version + 1). Si el objeto tiene 'version_esperada', el
+    UPDATE además lleva WHERE version = <esperada> y, si otro lo modificó
+    antes, lanza ConflictoVersion en vez de pisar su cambio. No hace falta
+    bloquear la fila: el conflicto se detecta con la misma consulta.
+    """
+    version = models.PositiveIntegerField(default=1, editable=False)
+
+    version_esperada = None
+
+    class Meta:
+        abstract = True
+
+    def _do_update(self, base_qs, using, pk_val, values, update_fields, forced_update):
+        campo = self._meta.get_field('version')
+        values = [valor for valor in values if valor[0] is not campo] + [(campo, None, F('version') + 1)]
+        esperada = self.version_esperada
+        if esperada is not None:
+            base_qs = base_qs.filter(version=esperada)
+        actualizado = super()._do_update(base_qs, using, pk_val, values, update_fields, forced_update)
+        if not actualizado:
+            if esperada is not None and type(self)._base_manager.using(using).filter(pk=pk_val).exists():
+                raise ConflictoVersion(type(self), pk_val)
+            return actualizado
+        if esperada is not None:
+            # Los guardados siguientes del mismo objeto siguen siendo condicionales
+            self.version = self.version_esperada = esperada + 1
+        elif campo.attname in self.__dict__:
+            self.version += 1
+        return actualizado
+
+
+class Empresa(GuardadoAtomicoMixin, VersionadoMixin):
     nombre = models.CharField(max_length=100, unique=True)
     ruc = models.CharField(max_length=11, unique=True)
     # Nuevos campos
@@ -29,7 +126,7 @@ class Empresa(models.Model):
     def __str__(self):
         return self.nombre
 
-class Vendedor(models.Model):
+class Vendedor(GuardadoAtomicoMixin, VersionadoMixin):
     nombre = models.CharField(max_length=100)
     telefono = models.CharField(max_length=20)
     contacto_opcional = models.CharField(max_length=100, blank=True, null=True)
@@ -55,7 +152,7 @@ class Vendedor(models.Model):
     def __str__(self):
         return self.nombre
 
-class Proveedor(models.Model):
+class Proveedor(GuardadoAtomicoMixin, VersionadoMixin):
     nombre = models.CharField(max_length=100)
     vendedor = models.ForeignKey(Vendedor, on_delete=models.SET_NULL, null=True, blank=True)
     identificador = models.CharField(max_length=10, help_text="Código corto para identificar al proveedor (ej: PION, RED)", blank=True)
@@ -98,7 +195,7 @@ class Proveedor(models.Model):
             self.identificador = self.nombre[:4].upper()
         super().save(*args, **kwargs)
 
-class Pedido(models.Model):
+class Pedido(GuardadoAtomicoMixin, CamposCargadosMixin, VersionadoMixin):
     ESTADO_CHOICES = [
         ('pendiente', 'Pendiente'),
         ('asignado', 'Asignado'),
@@ -194,7 +291,7 @@ class Pedido(models.Model):
         self.save(update_fields=['monto_final_pedido'])
         return total_distribuciones
 
-class DistribucionFinal(models.Model):
+class DistribucionFinal(GuardadoAtomicoMixin, CamposCargadosMixin, VersionadoMixin):
     pedido = models.ForeignKey(Pedido, on_delete=models.CASCADE, related_name='distribuciones_finales')
     empresa = models.ForeignKey(Empresa, on_delete=models.PROTECT, related_name='distribuciones')
     monto_final = models.DecimalField(max_digits=12, decimal_places=2)
@@ -253,7 +350,7 @@ class DistribucionFinal(models.Model):
             self.monto_disponible = self.monto_final
             self.save(update_fields=['monto_disponible'])
 
-class Letra(models.Model):
+class Letra(GuardadoAtomicoMixin, CamposCargadosMixin, VersionadoMixin):
     ESTADO_CHOICES = [
         ('pendiente', 'Pendiente'),
         ('pagado', 'Pagado'),
@@ -265,6 +362,9 @@ class Letra(models.Model):
     pedido = models.ForeignKey('Pedido', on_delete=models.CASCADE, null=True, blank=True, related_name='letras')
     distribucion = models.ForeignKey('DistribucionFinal', on_delete=models.CASCADE, related_name='letras')
     empresa = models.ForeignKey('Empresa', on_delete=models.PROTECT, null=True, blank=True, related_name='letras')
+    # Copia de pedido.proveedor para filtrar y agrupar sin join (la mantienen save() y signals.py)
+    proveedor = models.ForeignKey('Proveedor', on_delete=models.PROTECT, null=True, blank=True,
+                                  editable=False, related_name='letras')
     monto = models.DecimalField(max_digits=10, decimal_places=2)
     fecha_pago = models.DateField()
     estado = models.CharField(max_length=10, choices=ESTADO_CHOICES, default='pendiente')
@@ -292,13 +392,16 @@ class Letra(models.Model):
             models.Index(fields=['fecha_pago']),
             models.Index(fields=['estado']),
             models.Index(fields=['fecha_vencimiento_gracia']),
+            models.Index(fields=['proveedor', 'estado', 'fecha_pago'], name='letra_prov_estado_fecha_idx'),
+            models.Index(fields=['empresa', 'estado', 'fecha_pago'], name='letra_emp_estado_fecha_idx'),
         ]
 
     def save(self, *args, **kwargs):
-        # Asignar empresa y pedido desde distribución
+        # Asignar empresa, pedido y proveedor desde distribución
         if self.distribucion:
             self.empresa = self.distribucion.empresa
             self.pedido = self.distribucion.pedido
+            self.proveedor_id = self.pedido.proveedor_id
             
             # Calcular fecha de vencimiento con gracia (9 días hábiles)
             # Esto es una implementación básica que deberá ser refinada para considerar feriados
@@ -335,7 +438,7 @@ class Letra(models.Model):
 
         return f"{numero} - {empresa} - {proveedor} - S/ {self.monto}"
 
-class GuiaDeRemision(models.Model):
+class GuiaDeRemision(GuardadoAtomicoMixin, VersionadoMixin):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     pedido = models.ForeignKey(Pedido, on_delete=models.CASCADE, related_name='guias_remision')
     empresa = models.ForeignKey(Empresa, on_delete=models.PROTECT, related_name='guias_remision')
@@ -367,9 +470,15 @@ class GuiaDeRemision(models.Model):
     def __str__(self):
         return f"Guía {self.numero_guia} ({self.empresa.nombre})"
 
-class Factura(models.Model):
+class Factura(GuardadoAtomicoMixin, CamposCargadosMixin, VersionadoMixin):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     guia_remision = models.ForeignKey(GuiaDeRemision, on_delete=models.CASCADE, related_name='facturas')
+    # Copias de guia_remision.empresa y guia_remision.pedido.proveedor para
+    # filtrar y agrupar sin joins (las mantienen save() y signals.py)
+    empresa = models.ForeignKey(Empresa, on_delete=models.PROTECT, null=True, blank=True,
+                                editable=False, related_name='facturas')
+    proveedor = models.ForeignKey(Proveedor, on_delete=models.PROTECT, null=True, blank=True,
+                                  editable=False, related_name='facturas')
     numero_factura = models.CharField(max_length=50, unique=True)
     monto_factura = models.DecimalField(max_digits=10, decimal_places=2)
     fecha_emision = models.DateField()
@@ -396,7 +505,77 @@ class Factura(models.Model):
             models.Index(fields=['fecha_emision']),
             models.Index(fields=['estado']),
             models.Index(fields=['fecha_vencimiento']),
+            models.Index(fields=['empresa', 'estado', 'fecha_emision'], name='factura_emp_estado_fecha_idx'),
+            models.Index(fields=['proveedor', 'estado', 'fecha_emision'], name='factura_prov_estado_fecha_idx'),
         ]
 
     def __str__(self):
         return f"Factura {self.numero_factura} ({self.guia_remision.empresa.nombre})"
+
+    def save(self, *args, **kwargs):
+        if self.guia_remision_id:
+            self.empresa_id = self.guia_remision.empresa_id
+            self.proveedor_id = self.guia_remision.pedido.proveedor_id
+        super().save(*args, **kwargs)
+
+
+class IndiceBusqueda(models.Model):
+    """
+    Índice de búsqueda desnormalizado: una fila por pedido, letra,
+    proveedor, guía o factura con su texto ya normalizado (minúsculas y sin
+    tildes). En SQLite lo indexa una tabla FTS5 y en PostgreSQL un tsvector
+    y un índice de trigramas (ver migración 0015 y calendarBackend/busqueda.py).
+    """
+    TIPO_CHOICES = [
+        ('pedido', 'Pedido'),
+        ('letra', 'Letra'),
+        ('proveedor', 'Proveedor'),
+        ('guia', 'Guía de Remisión'),
+        ('factura', 'Factura'),
+    ]
+
+    tipo = models.CharField(max_length=10, choices=TIPO_CHOICES)
+    objeto_id = models.CharField(max_length=36)
+    titulo = models.CharField(max_length=200)
+    contenido = models.TextField()
+    actualizado = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Índice de búsqueda"
+        verbose_name_plural = "Índice de búsqueda"
+        constraints = [
+            models.UniqueConstraint(fields=['tipo', 'objeto_id'], name='indice_busqueda_objeto_unico'),
+        ]
+
+    def __str__(self):
+        return f"{self.tipo}: {self.titulo}"
+
+
+class RegistroCambio(models.Model):
+    """
+    Registro de solo inserción de altas, modificaciones y borrados de los
+    modelos de calendarBackend, para la sincronización incremental de los
+    listados (?since=, ver calendarBackend/sincronizacion.py). El id es la
+    marca: crece con cada cambio. 'compactar_cambios' lo mantiene acotado.
+    """
+    ACCION_CHOICES = [
+        ('upsert', 'Alta o modificación'),
+        ('delete', 'Borrado'),
+        ('compact', 'Compactado hasta aquí'),
+    ]
+
+    modelo = models.CharField(max_length=30)
+    objeto_id = models.CharField(max_length=36)
+    accion = models.CharField(max_length=10, choices=ACCION_CHOICES)
+    creado = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Registro de cambio"
+        verbose_name_plural = "Registro de cambios"
+        indexes = [
+            models.Index(fields=['modelo', 'id'], name='registro_cambio_modelo_idx'),
+            models.Index(fields=['creado'], name='registro_cambio_creado_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.id}: {self.accion} {self.modelo} {self.objeto_id}"
@@ -13,6 +13,11 @@ from django.db.models import Sum
 from django.utils import timezone
 from datetime import timedelta
 
+def _prefetched(obj, relacion):
+    """Indica si la relación ya viene cargada con prefetch_related"""
+    return relacion in getattr(obj, '_prefetched_objects_cache', {})
+
+
 # EMPRESA
 class EmpresaSerializer(serializers.ModelSerializer):
     total_letras = serializers.SerializerMethodField()
@@ -26,27 +31,40 @@ class EmpresaSerializer(serializers.ModelSerializer):
             'id', 'nombre', 'ruc', 'direccion', 'telefono', 
             'email_contacto', 'activo', 'total_letras', 'total_facturado',
             'letras_pendientes', 'facturas_emitidas', 'created_at', 
-            'updated_at', 'created_by', 'updated_by'
+            'updated_at', 'created_by', 'updated_by', 'version'
         ]
         read_only_fields = ['created_at', 'updated_at', 'created_by', 'updated_by']
 
+    # Columnas y relaciones que usan los campos calculados (?fields=, ver
+    # campos_parciales.py). Los get_* usan las anotaciones de
+    # EmpresaViewSet.get_queryset si existen, y si no consultan la base
+    dependencias = {
+        'total_letras': [], 'total_facturado': [], 'letras_pendientes': [], 'facturas_emitidas': [],
+    }
+
     def get_total_letras(self, obj):
         """Calcula el monto total de las letras asociadas a la empresa."""
+        if hasattr(obj, 'suma_letras'):
+            return obj.suma_letras or 0
         return obj.letras.aggregate(total=Sum('monto'))['total'] or 0
 
     def get_total_facturado(self, obj):
         """Calcula el monto total facturado para la empresa."""
-        return Factura.objects.filter(
-            guia_remision__empresa=obj
-        ).aggregate(total=Sum('monto_factura'))['total'] or 0
+        if hasattr(obj, 'suma_facturas'):
+            return obj.suma_facturas or 0
+        return obj.facturas.aggregate(total=Sum('monto_factura'))['total'] or 0
 
     def get_letras_pendientes(self, obj):
         """Devuelve el número de letras pendientes de pago."""
+        if hasattr(obj, 'num_letras_pendientes'):
+            return obj.num_letras_pendientes or 0
         return obj.letras.filter(estado='pendiente').count()
 
     def get_facturas_emitidas(self, obj):
         """Devuelve el número de facturas emitidas para la empresa."""
-        return Factura.objects.filter(guia_remision__empresa=obj).count()
+        if hasattr(obj, 'num_facturas'):
+            return obj.num_facturas or 0
+        return obj.facturas.count()
 
     def validate_ruc(self, value):
         """Valida que el RUC tenga exactamente 11 dígitos numéricos."""
@@ -63,9 +81,13 @@ class VendedorSerializer(serializers.ModelSerializer):
         model = Vendedor
         fields = '__all__'
         read_only_fields = ['created_at', 'updated_at', 'created_by', 'updated_by']
+
+    dependencias = {'proveedores_count': []}
         
     def get_proveedores_count(self, obj):
         """Devuelve la cantidad de proveedores asociados a este vendedor."""
+        if hasattr(obj, 'num_proveedores'):
+            return obj.num_proveedores
         return obj.proveedor_set.count()
         
     def validate_telefono(self, value):
@@ -87,16 +109,26 @@ class ProveedorSerializer(serializers.ModelSerializer):
         fields = '__all__'
         read_only_fields = ['created_at', 'updated_at', 'created_by', 'updated_by']
 
+    # Los get_* usan las anotaciones de ProveedorViewSet.get_queryset si
+    # existen, y si no consultan la base
+    dependencias = {'pedidos_count': [], 'pedidos_pendientes': [], 'monto_total_pedidos': []}
+
     def get_pedidos_count(self, obj):
         """Devuelve la cantidad total de pedidos del proveedor."""
+        if hasattr(obj, 'num_pedidos'):
+            return obj.num_pedidos
         return obj.pedidos.count()
         
     def get_pedidos_pendientes(self, obj):
         """Devuelve la cantidad de pedidos pendientes."""
+        if hasattr(obj, 'num_pedidos_pendientes'):
+            return obj.num_pedidos_pendientes
         return obj.pedidos.filter(completado=False).count()
         
     def get_monto_total_pedidos(self, obj):
         """Calcula el monto total de pedidos del proveedor."""
+        if hasattr(obj, 'suma_pedidos'):
+            return obj.suma_pedidos or 0
         return obj.pedidos.aggregate(total=Sum('monto_total_pedido'))['total'] or 0
         
     def validate_color(self, value):
@@ -121,6 +153,11 @@ class LetraSerializer(serializers.ModelSerializer):
         model = Letra
         fields = '__all__'
         read_only_fields = ['created_at', 'updated_at', 'created_by', 'updated_by']
+
+    dependencias = {
+        'proveedor': ['pedido__proveedor__nombre'],
+        'dias_restantes': ['estado', 'fecha_pago'],
+    }
         
     def get_proveedor(self, obj):
         """Obtiene el nombre del proveedor asociado a esta letra."""
@@ -132,8 +169,18 @@ class LetraSerializer(serializers.ModelSerializer):
         """Calcula los días restantes hasta la fecha de pago."""
         if obj.estado == 'pagado':
             return 0
-        today = timezone.now().date()
+        today = self.context.get('hoy') or timezone.now().date()
         return (obj.fecha_pago - today).days
+
+    # Versiones de los campos calculados para lectura_compilada.py: reciben
+    # las columnas de 'dependencias' ya leídas con values_list()
+    def leer_proveedor(self, fila):
+        return fila['pedido__proveedor__nombre']
+
+    def leer_dias_restantes(self, fila):
+        if fila['estado'] == 'pagado':
+            return 0
+        return (fila['fecha_pago'] - (self.context.get('hoy') or timezone.now().date())).days
         
     def validate(self, data):
         """Validación a nivel de objeto para la letra."""
@@ -168,13 +215,30 @@ class DistribucionFinalSerializer(serializers.ModelSerializer):
         model = DistribucionFinal
         fields = '__all__'
 
+    dependencias = {
+        'pedido_resumen': ['pedido__proveedor__nombre', 'pedido__fecha_pedido'],
+        'total_letras': ['letras'],
+        'letras_pendientes': ['letras'],
+    }
+
     def get_pedido_resumen(self, obj):
         return f"{obj.pedido.proveedor.nombre} - {obj.pedido.fecha_pedido}"
 
+    # get_total_letras y get_letras_pendientes usan, por este orden, las
+    # anotaciones de distribuciones_pendientes, las letras ya cargadas con
+    # prefetch_related o una consulta a la base
     def get_total_letras(self, obj):
+        if hasattr(obj, 'suma_letras'):
+            return obj.suma_letras or 0
+        if _prefetched(obj, 'letras'):
+            return sum(letra.monto for letra in obj.letras.all())
         return obj.letras.aggregate(total=Sum('monto'))['total'] or 0
         
     def get_letras_pendientes(self, obj):
+        if hasattr(obj, 'num_letras_pendientes'):
+            return obj.num_letras_pendientes
+        if _prefetched(obj, 'letras'):
+            return sum(1 for letra in obj.letras.all() if letra.estado == 'pendiente')
         return obj.letras.filter(estado='pendiente').count()
         
     def validate(self, data):
@@ -197,6 +261,13 @@ class FacturaSerializer(serializers.ModelSerializer):
         fields = '__all__'
         read_only_fields = ['created_at', 'updated_at', 'created_by', 'updated_by']
 
+    dependencias = {
+        'empresa': ['guia_remision__empresa__nombre'],
+        'guia': ['guia_remision__numero_guia'],
+        'proveedor': ['guia_remision__pedido__proveedor__nombre'],
+        'dias_vencimiento': ['fecha_vencimiento'],
+    }
+
     def get_empresa(self, obj):
         return obj.guia_remision.empresa.nombre
 
@@ -243,6 +314,8 @@ class GuiaDeRemisionSerializer(serializers.ModelSerializer):
         model = GuiaDeRemision
         fields = '__all__'
         read_only_fields = ['created_at', 'updated_at', 'created_by', 'updated_by']
+
+    dependencias = {'facturas_count': ['facturas'], 'monto_total_facturas': ['facturas']}
         
     def get_facturas_count(self, obj):
         """Devuelve la cantidad de facturas asociadas a esta guía."""
@@ -250,6 +323,8 @@ class GuiaDeRemisionSerializer(serializers.ModelSerializer):
         
     def get_monto_total_facturas(self, obj):
         """Calcula el monto total de las facturas asociadas a esta guía."""
+        if _prefetched(obj, 'facturas'):
+            return sum(factura.monto_factura for factura in obj.facturas.all())
         return obj.facturas.aggregate(total=Sum('monto_factura'))['total'] or 0
         
     def validate_numero_guia(self, value):
@@ -282,6 +357,14 @@ class PedidoSerializer(serializers.ModelSerializer):
         model = Pedido
         fields = '__all__'
         read_only_fields = ['created_at', 'updated_at', 'created_by', 'updated_by']
+
+    dependencias = {
+        'letras_count': ['letras'],
+        'guias_count': ['guias_remision'],
+        'distribuciones_count': ['distribuciones_finales'],
+        'porcentaje_pagado': ['monto_pagado', 'monto_total_pedido'],
+        'tipo_pedido': ['es_contado'],
+    }
         
     def get_letras_count(self, obj):
         """Devuelve la cantidad de letras asociadas a este pedido."""
@@ -1,13 +1,38 @@
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
-from .models import GuiaDeRemision, Factura, DistribucionFinal, Letra
+from .models import (
+    Empresa, Vendedor, Proveedor, Pedido, GuiaDeRemision, Factura, DistribucionFinal, Letra
+)
+from . import busqueda, sincronizacion
+from .autocompletar import autocompletado
+from core.events import broadcaster
 
 @receiver(post_save, sender=GuiaDeRemision)
-def actualizar_empresa_en_facturas(sender, instance, **kwargs):
-    for factura in instance.facturas.all():
-        if factura.empresa != instance.empresa:
-            factura.empresa = instance.empresa
-            factura.save()
+def actualizar_empresa_en_facturas(sender, instance, created, raw=False, **kwargs):
+    # Copias de empresa y proveedor en las facturas de la guía (Factura.save las pone al crearlas)
+    if created or raw:
+        return
+    proveedor_id = instance.pedido.proveedor_id
+    ids = list(instance.facturas.exclude(empresa_id=instance.empresa_id, proveedor_id=proveedor_id)
+               .values_list('pk', flat=True))
+    if ids:
+        Factura.objects.filter(pk__in=ids).update(empresa_id=instance.empresa_id, proveedor_id=proveedor_id,
+                                                     version=F('version') + 1)
+        sincronizacion.registrar(Factura, ids)
+
+@receiver(post_save, sender=Pedido)
+def actualizar_proveedor_en_letras_y_facturas(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    # Si el pedido cambia de proveedor, se corrigen las copias de sus letras y facturas
+    if created or raw or (update_fields is not None and 'proveedor' not in update_fields):
+        return
+    for modelo, pedido_lookup in ((Letra, 'pedido'), (Factura, 'guia_remision__pedido')):
+        ids = list(modelo.objects.filter(**{pedido_lookup: instance}).exclude(proveedor_id=instance.proveedor_id)
+                   .values_list('pk', flat=True))
+        if ids:
+            modelo.objects.filter(pk__in=ids).update(proveedor_id=instance.proveedor_id, version=F('version') + 1)
+            sincronizacion.registrar(modelo, ids)
 
 @receiver(post_save, sender=DistribucionFinal)
 def actualizar_empresa_en_letras(sender, instance, **kwargs):
@@ -26,3 +51,92 @@ def actualizar_empresa_en_letras(sender, instance, **kwargs):
 
         if cambios:
             letra.save()
+
+
+# Índice de búsqueda (ver busqueda.py)
+MODELOS_INDEXADOS = (Empresa, Vendedor, Proveedor, Pedido, Letra, GuiaDeRemision, Factura)
+
+
+def actualizar_indice_busqueda(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    # Las cargas con loaddata se indexan después con indexar_busqueda
+    if not raw:
+        busqueda.actualizar_indice(instance, created, update_fields)
+
+
+def quitar_del_indice_busqueda(sender, instance, **kwargs):
+    busqueda.quitar_del_indice(instance)
+
+
+for modelo in MODELOS_INDEXADOS:
+    post_save.connect(actualizar_indice_busqueda, sender=modelo, dispatch_uid=f'indice_busqueda_{modelo.__name__}')
+    post_delete.connect(quitar_del_indice_busqueda, sender=modelo,
+                        dispatch_uid=f'indice_busqueda_borrar_{modelo.__name__}')
+
+
+# Autocompletado de los selectores (ver autocompletar.py). Se aplica tras el
+# commit para no indexar cambios que luego se deshacen.
+def actualizar_autocompletado(sender, instance, raw=False, **kwargs):
+    if not raw:
+        pk = instance.pk
+        transaction.on_commit(lambda: autocompletado.cambio(sender, pk))
+
+
+def quitar_del_autocompletado(sender, instance, **kwargs):
+    # Django pone pk a None tras el borrado: se guarda antes del commit
+    pk = instance.pk
+    transaction.on_commit(lambda: autocompletado.cambio(sender, pk, borrado=True))
+
+
+for modelo in (Empresa, Vendedor, Proveedor):
+    post_save.connect(actualizar_autocompletado, sender=modelo, dispatch_uid=f'autocompletar_{modelo.__name__}')
+    post_delete.connect(quitar_del_autocompletado, sender=modelo,
+                        dispatch_uid=f'autocompletar_borrar_{modelo.__name__}')
+
+
+# Eventos de cambio para los clientes conectados por SSE (ver core/events.py
+# y la vista 'eventos'). Se publican tras el commit; los update() masivos no
+# disparan señales y no generan eventos.
+MODELOS_CON_EVENTOS = (Pedido, DistribucionFinal, Letra, Factura)
+
+
+def publicar_guardado(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    if raw:
+        return
+    if created:
+        campos = None
+    elif update_fields is not None:
+        campos = sorted(update_fields)
+    else:
+        campos = instance.campos_cambiados()
+        if campos == []:
+            return  # guardado sin cambios
+    instance.marcar_cargado()
+    evento = {'model': sender._meta.model_name, 'id': str(instance.pk),
+              'action': 'created' if created else 'updated', 'fields': campos}
+    transaction.on_commit(lambda: broadcaster.publish(evento))
+
+
+def publicar_borrado(sender, instance, **kwargs):
+    evento = {'model': sender._meta.model_name, 'id': str(instance.pk), 'action': 'deleted', 'fields': None}
+    transaction.on_commit(lambda: broadcaster.publish(evento))
+
+
+for modelo in MODELOS_CON_EVENTOS:
+    post_save.connect(publicar_guardado, sender=modelo, dispatch_uid=f'eventos_{modelo.__name__}')
+    post_delete.connect(publicar_borrado, sender=modelo, dispatch_uid=f'eventos_borrar_{modelo.__name__}')
+
+
+# Registro de cambios para la sincronización incremental (?since=, ver
+# sincronizacion.py). Va en la misma transacción que el guardado.
+def registrar_guardado(sender, instance, raw=False, **kwargs):
+    if not raw:
+        sincronizacion.registrar(sender, [instance.pk])
+
+
+def registrar_borrado(sender, instance, **kwargs):
+    sincronizacion.registrar(sender, [instance.pk], 'delete')
+
+
+for modelo in (Empresa, Vendedor, Proveedor, Pedido, DistribucionFinal, Letra, GuiaDeRemision, Factura):
+    post_save.connect(registrar_guardado, sender=modelo, dispatch_uid=f'sincronizacion_{modelo.__name__}')
+    post_delete.connect(registrar_borrado, sender=modelo, dispatch_uid=f'sincronizacion_borrar_{modelo.__name__}')
@@ -0,0 +1,117 @@
+"""
+Sincronización incremental de los listados de calendarBackend.
+
+Las señales (signals.py) anotan en RegistroCambio cada alta, modificación
+('upsert') o borrado ('delete'), en la misma transacción que el cambio
+(los modelos guardan con GuardadoAtomicoMixin). El id del registro es la
+marca de agua:
+
+1. El cliente carga el listado completo; la respuesta trae la marca en la
+   cabecera X-Sync-Watermark (leída antes que los datos: un cambio
+   intermedio se vuelve a enviar, no se pierde).
+2. Después pide ?since=<marca> y recibe solo los objetos cambiados desde
+   entonces, los ids a quitar ('deleted': borrados o que ya no cumplen los
+   filtros del listado) y la nueva marca.
+3. Si el registro ya se compactó más allá de su marca, o hay más de
+   SYNC_MAX_CAMBIOS cambios, la respuesta es 410 y vuelve al paso 1.
+
+Los update() masivos no disparan señales: quien los use debe llamar a
+registrar() (como signals.py al corregir las copias desnormalizadas).
+Las cargas con bulk_create (generar_datos, restauraciones) no se anotan y
+los clientes deben recargar los listados completos.
+
+En PostgreSQL los ids de una secuencia se asignan al insertar pero se ven
+al confirmar, así que una transacción lenta podría hacer visible una marca
+menor que otra ya leída. registrar() toma un lock de transacción para que
+las escrituras del registro se confirmen en orden; en SQLite las
+escrituras ya van de una en una.
+"""
+from django.conf import settings
+from django.db import router, transaction
+from django.db.models import Q
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import RegistroCambio
+
+# Clave del pg_advisory_xact_lock que ordena las escrituras del registro
+CLAVE_LOCK_POSTGRES = 7_041_042
+
+
+def registrar(modelo, ids, accion='upsert'):
+    """Anota el cambio de los objetos 'ids' del modelo"""
+    filas = [
+        RegistroCambio(modelo=modelo._meta.model_name, objeto_id=str(pk), accion=accion)
+        for pk in ids
+    ]
+    if not filas:
+        return
+    alias = router.db_for_write(RegistroCambio)
+    with transaction.atomic(using=alias):
+        conexion = transaction.get_connection(alias)
+        if conexion.vendor == 'postgresql':
+            with conexion.cursor() as cursor:
+                cursor.execute('SELECT pg_advisory_xact_lock(%s)', [CLAVE_LOCK_POSTGRES])
+        RegistroCambio.objects.using(alias).bulk_create(filas)
+
+
+def marca_actual():
+    """Última marca registrada (0 si el registro está vacío)"""
+    return RegistroCambio.objects.order_by('-id').values_list('id', flat=True).first() or 0
+
+
+def cambios_desde(modelo, since):
+    """
+    Devuelve (marca, {objeto_id: última acción}) con los cambios del modelo
+    posteriores a 'since', o None si el registro ya no llega tan atrás.
+    """
+    filas = RegistroCambio.objects.filter(
+        Q(modelo=modelo._meta.model_name) | Q(accion='compact'), id__gt=since
+    ).order_by('id').values_list('id', 'objeto_id', 'accion')
+    marca, acciones = since, {}
+    for id_cambio, objeto_id, accion in filas:
+        if accion == 'compact':
+            return None
+        acciones[objeto_id] = accion
+        marca = id_cambio
+    return marca, acciones
+
+
+class SincronizacionMixin:
+    """
+    Mixin para ViewSets: el listado admite ?since=<marca> y devuelve solo
+    lo cambiado desde esa marca, sin paginar:
+
+        {"watermark": 120, "results": [...], "deleted": ["<id>", ...]}
+
+    Sin ?since= el listado es el de siempre, con la marca en la cabecera
+    X-Sync-Watermark.
+    """
+
+    def list(self, request, *args, **kwargs):
+        since = request.query_params.get('since')
+        if since is None:
+            marca = marca_actual()
+            response = super().list(request, *args, **kwargs)
+            response['X-Sync-Watermark'] = str(marca)
+            return response
+
+        if not since.isdigit():
+            return Response({'error': 'since debe ser una marca (número entero)'}, status=status.HTTP_400_BAD_REQUEST)
+        cambios = cambios_desde(self.get_queryset().model, int(since))
+        if cambios is None or len(cambios[1]) > getattr(settings, 'SYNC_MAX_CAMBIOS', 1000):
+            return Response(
+                {'error': 'Demasiados cambios desde esa marca: recargue el listado completo', 'resync': True},
+                status=status.HTTP_410_GONE
+            )
+
+        marca, acciones = cambios
+        ids = [objeto_id for objeto_id, accion in acciones.items() if accion == 'upsert']
+        objetos = self.filter_queryset(self.get_queryset()).filter(pk__in=ids) if ids else []
+        resultados = self.get_serializer(objetos, many=True).data
+        presentes = {str(objeto['id']) for objeto in resultados}
+        return Response({
+            'watermark': marca,
+            'results': resultados,
+            'deleted': sorted(objeto_id for objeto_id in acciones if objeto_id not in presentes),
+        })
@@ -1,3 +1,1379 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import importlib
+import json
+import os
+import runpy
+import shutil
+import tempfile
+import threading
+from datetime import date, timedelta
+from io import StringIO
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+import brotli
+from asgiref.sync import async_to_sync, sync_to_async
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import OperationalError, connection, connections, transaction
+from django.db.models import Count
+from django.http import HttpResponse
+from django.test import AsyncClient, RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework import serializers
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from administracion.management.commands.benchmark_escrituras import Command as BenchmarkEscrituras
+from calendarBackend.management.commands.asesor_indices import Command as AsesorIndices
+from administracion.models import UserActivity
+from authentication.models import PerfilUsuario
+from core.compression import CompressionMiddleware, negotiate
+from core.db_backends.sqlite3.base import get_write_lock
+from core.events import Broadcaster, broadcaster
+from core.db_routers import current_read_alias
+from core.metrics import registry, render_prometheus
+from core.slow_queries import fingerprint, normalize_sql
+from core.query_budget import QueryBudgetExceeded, sweep_query_budgets
+from .autocompletar import autocompletado, incrementar_version, leer_version
+from .busqueda import buscar
+from .lectura_compilada import compilar, serializar
+from .models import (
+    Empresa, Vendedor, Proveedor, Pedido, DistribucionFinal, Letra, GuiaDeRemision, Factura, IndiceBusqueda,
+    RegistroCambio, ConflictoVersion
+)
+from .serializers import DistribucionFinalSerializer, EmpresaSerializer, LetraSerializer, VendedorSerializer
+from .views import ProveedorViewSet
+
+
+def crear_usuario(username, rol):
+    """Crea un usuario con perfil y devuelve un APIClient autenticado por token"""
+    user = User.objects.create_user(username, f"{username}@example.com", 'clave-segura-123')
+    if rol in ('admin', 'superadmin'):
+        user.is_staff = True
+        user.is_superuser = rol == 'superadmin'
+        user.save()
+    PerfilUsuario.objects.create(user=user, rol=rol)
+    token = Token.objects.create(user=user)
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION=f"Token {token.key}")
+    return user, client
+
+
+@override_settings(REPLICA_STICKY_SECONDS=30)
+class ReplicaRoutingTests(TestCase):
+    """
+    Usa dos bases SQLite distintas: la base de pruebas como principal y un
+    archivo temporal migrado como réplica. Cada una tiene un proveedor que
+    la otra no, así se sabe de cuál leyó cada petición.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        # La réplica se registra y se migra antes de que TestCase abra sus
+        # transacciones sobre los alias de 'databases'. No se declara como
+        # atributo de clase para que el runner no intente crearla.
+        cls.databases = {'default', 'replica'}
+        cls.tmpdir = tempfile.mkdtemp()
+        connections.settings['replica'] = connections.configure_settings({
+            'default': {},
+            'replica': {
+                'ENGINE': 'django.db.backends.sqlite3',
+                'NAME': os.path.join(cls.tmpdir, 'replica.sqlite3'),
+            },
+        })['replica']
+        call_command('migrate', database='replica', verbosity=0)
+        Proveedor.objects.using('replica').create(nombre='Solo en replica')
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections['replica'].close()
+        del connections['replica']
+        del connections.settings['replica']
+        shutil.rmtree(cls.tmpdir, ignore_errors=True)
+
+    def setUp(self):
+        caches['compartida'].clear()
+        Proveedor.objects.create(nombre='Solo en principal')
+        self.admin, self.admin_client = crear_usuario('admin_replica', 'admin')
+        self.lector, self.lector_client = crear_usuario('lector_replica', 'lectura')
+
+    def nombres(self, response):
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        if isinstance(data, dict):
+            data = data['results']
+        return {p['nombre'] for p in data}
+
+    def test_accion_marcada_lee_de_replica(self):
+        response = self.admin_client.get('/api/proveedores/listado_ordenado/')
+        self.assertEqual(self.nombres(response), {'Solo en replica'})
+
+    def test_accion_no_marcada_lee_de_principal(self):
+        response = self.admin_client.get('/api/proveedores/')
+        self.assertEqual(self.nombres(response), {'Solo en principal'})
+
+    def test_usuario_lectura_siempre_lee_de_replica(self):
+        response = self.lector_client.get('/api/proveedores/')
+        self.assertEqual(self.nombres(response), {'Solo en replica'})
+
+    def test_lee_lo_propio_tras_escribir(self):
+        response = self.admin_client.post('/api/proveedores/', {'nombre': 'Nuevo', 'color': '#123456'})
+        self.assertEqual(response.status_code, 201)
+
+        response = self.admin_client.get('/api/proveedores/listado_ordenado/')
+        self.assertEqual(self.nombres(response), {'Solo en principal', 'Nuevo'})
+
+        # Otro usuario no queda afectado por la escritura del primero
+        response = self.lector_client.get('/api/proveedores/')
+        self.assertEqual(self.nombres(response), {'Solo en replica'})
+
+    @override_settings(REPLICA_STICKY_SECONDS=0)
+    def test_sin_ventana_vuelve_a_la_replica(self):
+        self.admin_client.post('/api/proveedores/', {'nombre': 'Nuevo', 'color': '#123456'})
+        response = self.admin_client.get('/api/proveedores/listado_ordenado/')
+        self.assertEqual(self.nombres(response), {'Solo en replica'})
+
+    def test_el_contexto_se_restablece_tras_la_peticion(self):
+        self.admin_client.get('/api/proveedores/listado_ordenado/')
+        self.assertIsNone(current_read_alias())
+        self.assertEqual(Proveedor.objects.get().nombre, 'Solo en principal')
+
+
+class GenerarDatosTests(TestCase):
+
+    def generar(self, semilla=1):
+        call_command('generar_datos', empresas=2, vendedores=3, proveedores=5, pedidos=40,
+                     letras=120, semilla=semilla, limpiar=True, stdout=StringIO())
+        return list(Letra.objects.order_by('numero_unico').values_list('id', 'monto', 'fecha_pago', 'estado'))
+
+    def test_misma_semilla_mismos_datos(self):
+        self.assertEqual(self.generar(), self.generar())
+        self.assertNotEqual(self.generar(), self.generar(semilla=2))
+
+    def test_campos_calculados_consistentes(self):
+        self.generar()
+        self.assertEqual(Pedido.objects.count(), 40)
+        for dist in DistribucionFinal.objects.prefetch_related('letras'):
+            total = sum(l.monto for l in dist.letras.all())
+            self.assertEqual(dist.monto_en_letras, total)
+            self.assertEqual(dist.monto_disponible, dist.monto_final - total)
+            for letra in dist.letras.all():
+                self.assertEqual(letra.empresa_id, dist.empresa_id)
+                self.assertEqual(letra.pedido_id, dist.pedido_id)
+
+    def test_benchmark_guarda_artefacto(self):
+        self.generar()
+        salida = os.path.join(tempfile.mkdtemp(), 'benchmark.json')
+        self.addCleanup(shutil.rmtree, os.path.dirname(salida))
+        call_command('benchmark_api', endpoint=['/api/empresas/', '/api/pedidos/{pedido}/resumen/'],
+                     peticiones=3, hilos=1, salida=salida, stdout=StringIO())
+        with open(salida) as f:
+            artefacto = json.load(f)
+        self.assertEqual(artefacto['datos']['pedido'], 40)
+        self.assertEqual(len(artefacto['endpoints']), 2)
+        for resultado in artefacto['endpoints'].values():
+            self.assertEqual(resultado['estados'], {'200': 3})
+            self.assertGreater(resultado['consultas_media'], 0)
+
+
+class PresupuestoConsultasTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command('generar_datos', empresas=3, vendedores=5, proveedores=10, pedidos=40,
+                     letras=200, semilla=5, stdout=StringIO())
+
+    def setUp(self):
+        self.admin, self.client = crear_usuario('admin_presupuesto', 'admin')
+
+    def test_endpoints_dentro_del_presupuesto(self):
+        resultados = sweep_query_budgets(self.client)
+        excedidos = [f"{r['path']}: {r['queries']}/{r['limit']}" for r in resultados if r['exceeded']]
+        self.assertEqual(excedidos, [])
+
+        # Todo endpoint GET de la API principal declara su presupuesto
+        sin_presupuesto = [
+            r['path'] for r in resultados
+            if r['budget'] is None and r['path'] != '/api/'
+            and not r['path'].startswith(('/api/admin/', '/api/auth/'))
+        ]
+        self.assertEqual(sin_presupuesto, [])
+
+    def test_modo_raise_falla_al_superar(self):
+        with override_settings(QUERY_BUDGET_MODE='raise'):
+            with self.assertRaises(QueryBudgetExceeded):
+                with mock.patch('calendarBackend.views.ProveedorViewSet.query_budget', {'list': 1}):
+                    self.client.get('/api/proveedores/')
+
+    def test_totales_anotados_iguales_a_los_consultados(self):
+        # Sin anotaciones los get_* del serializer consultan la base por objeto
+        for ruta, serializer, objetos in (
+            ('/api/empresas/', EmpresaSerializer, Empresa.objects.all()),
+            ('/api/vendedores/', VendedorSerializer, Vendedor.objects.all()),
+            ('/api/distribuciones/no-asignadas/', DistribucionFinalSerializer, DistribucionFinal.objects.all()),
+        ):
+            with self.subTest(ruta=ruta):
+                data = self.client.get(ruta).json()
+                if isinstance(data, dict):
+                    data = data['results']
+                esperados = {str(d['id']): d for d in json.loads(JSONRenderer().render(serializer(objetos, many=True).data))}
+                self.assertTrue(data)
+                for item in data:
+                    self.assertEqual(item, esperados[str(item['id'])])
+
+    def test_cabeceras_de_conteo(self):
+        with override_settings(QUERY_BUDGET_MODE='header'):
+            response = self.client.get('/api/letras/proximas_vencer/')
+        self.assertIn('X-Query-Count', response)
+        self.assertEqual(response['X-Query-Budget'], '3')
+        self.assertNotIn('X-Query-Budget-Exceeded', response)
+
+
+class MetricasTests(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.override = override_settings(
+            METRICS_ENABLED=True,
+            METRICS_STORE_PATH=os.path.join(self.tmpdir, 'metricas.sqlite3'),
+        )
+        self.override.enable()
+        self.superadmin, self.client = crear_usuario('superadmin_metricas', 'superadmin')
+
+    def tearDown(self):
+        self.override.disable()
+        registry.reset()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def test_exposicion_prometheus(self):
+        self.client.get('/api/letras/proximas_vencer/')
+        self.client.get('/api/letras/proximas_vencer/')
+        response = self.client.get('/api/admin/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+
+        texto = response.content.decode()
+        ruta = 'route="/api/letras/proximas_vencer/"'
+        self.assertIn('# TYPE calendarwebapp_http_request_duration_seconds histogram', texto)
+        self.assertIn(f'calendarwebapp_http_requests_total{{method="GET",{ruta},status="200"}} 2', texto)
+        self.assertIn(f'calendarwebapp_http_request_duration_seconds_count{{method="GET",{ruta}}} 2', texto)
+        self.assertIn(f'calendarwebapp_db_queries_per_request_bucket{{{ruta},le="+Inf"}} 2', texto)
+        self.assertIn(f'calendarwebapp_serializer_duration_seconds_count{{{ruta}}} 2', texto)
+
+    def test_suma_los_deltas_de_varios_workers(self):
+        # Dos volcados equivalen a dos workers escribiendo en el almacén
+        for _ in range(2):
+            registry.inc('http_requests_total', {'route': '/x', 'method': 'GET', 'status': '200'})
+            registry.flush(force=True)
+        self.assertIn('calendarwebapp_http_requests_total{method="GET",route="/x",status="200"} 2',
+                      render_prometheus())
+
+    def test_solo_superadmin(self):
+        _, client = crear_usuario('lectura_metricas', 'lectura')
+        self.assertEqual(client.get('/api/admin/metrics').status_code, 403)
+
+
+class ConsultasLentasTests(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.override = override_settings(
+            SLOW_QUERY_ENABLED=True,
+            SLOW_QUERY_THRESHOLD_MS=0,
+            SLOW_REQUEST_THRESHOLD_MS=0,
+            SLOW_QUERY_STORE_PATH=os.path.join(self.tmpdir, 'lentas.sqlite3'),
+        )
+        self.override.enable()
+        self.superadmin, self.client = crear_usuario('superadmin_lentas', 'superadmin')
+
+    def tearDown(self):
+        self.override.disable()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def test_huella_ignora_literales_y_parametros(self):
+        a = 'SELECT * FROM "letra" WHERE "id" IN (%s, %s, %s) AND "estado" = \'pagado\' LIMIT 21'
+        b = 'SELECT *  FROM "letra" WHERE "id" IN (%s, %s) AND "estado" = \'pendiente\' LIMIT 5'
+        self.assertEqual(normalize_sql(a), 'SELECT * FROM "letra" WHERE "id" IN (...) AND "estado" = ? LIMIT ?')
+        self.assertEqual(fingerprint(a), fingerprint(b))
+        self.assertNotEqual(fingerprint(a), fingerprint(a.replace('"letra"', '"factura"')))
+
+    def test_agrupa_por_huella_con_vista_y_pila(self):
+        Proveedor.objects.create(nombre='Proveedor lento', ruc='20999999991')
+        for _ in range(2):
+            self.client.get('/api/proveedores/')
+
+        response = self.client.get('/api/admin/rendimiento/consultas-lentas/?orden=veces')
+        self.assertEqual(response.status_code, 200)
+        grupo = next(c for c in response.data['consultas'] if 'calendarBackend_proveedor' in c['sql_normalizado']
+                     and 'proveedor-list' in c['vistas'])
+        self.assertGreaterEqual(grupo['veces'], 2)
+        self.assertNotIn('%s', grupo['sql_normalizado'])
+        self.assertTrue(any('calendarBackend' in marco for marco in grupo['ejemplo']['pila']))
+
+        response = self.client.get('/api/admin/rendimiento/peticiones-lentas/')
+        rutas = [p['path'] for p in response.data['peticiones']]
+        self.assertIn('/api/proveedores/', rutas)
+
+    def test_orden_no_valido(self):
+        response = self.client.get('/api/admin/rendimiento/consultas-lentas/?orden=otro')
+        self.assertEqual(response.status_code, 400)
+
+
+class PerfiladoTests(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.override = override_settings(PROFILER_STORE_LOCATION=self.tmpdir)
+        self.override.enable()
+        self.superadmin, self.client = crear_usuario('superadmin_perfil', 'superadmin')
+
+    def tearDown(self):
+        self.override.disable()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def test_perfil_solicitado_por_superadmin(self):
+        response = self.client.get('/api/letras/proximas_vencer/', HTTP_X_PROFILE='1')
+        profile_id = response['X-Profile-Id']
+
+        listado = self.client.get('/api/admin/rendimiento/perfiles/')
+        self.assertEqual([p['id'] for p in listado.data], [profile_id])
+        self.assertEqual(listado.data[0]['trigger'], 'solicitado')
+
+        detalle = self.client.get(f'/api/admin/rendimiento/perfiles/{profile_id}/?top=200')
+        self.assertIn('proximas_vencer', detalle.data['resumen'])
+        self.assertEqual(self.client.get(f'/api/admin/rendimiento/perfiles/{profile_id}/?top=abc').status_code, 400)
+
+        descarga = self.client.get(f'/api/admin/rendimiento/perfiles/{profile_id}/descargar/?formato=collapsed')
+        for linea in b''.join(descarga.streaming_content).decode().splitlines():
+            pila, microsegundos = linea.rsplit(' ', 1)
+            self.assertTrue(pila.split(';')[0].startswith('inner ('))
+            self.assertTrue(microsegundos.isdigit())
+
+    def test_usuario_normal_no_genera_perfil(self):
+        _, client = crear_usuario('lectura_perfil', 'lectura')
+        response = client.get('/api/letras/proximas_vencer/?_profile=1')
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertEqual(os.listdir(self.tmpdir), [])
+
+    def test_sin_token_de_superadmin_no_se_perfila(self):
+        _, lectura = crear_usuario('lectura_sin_perfil', 'lectura')
+        invalido = APIClient()
+        invalido.credentials(HTTP_AUTHORIZATION='Token inexistente')
+        # La marca se ignora antes de la vista: ni siquiera se crea el perfilador
+        with mock.patch('core.profiling.cProfile.Profile') as profile:
+            for client in (APIClient(), invalido, lectura):
+                client.get('/api/letras/proximas_vencer/', HTTP_X_PROFILE='1')
+        profile.assert_not_called()
+
+    @override_settings(PROFILER_SAMPLE_RATE=1.0, PROFILER_MAX_PROFILES=2)
+    def test_muestreo_conserva_los_mas_recientes(self):
+        _, client = crear_usuario('lectura_muestreo', 'lectura')
+        for _ in range(3):
+            client.get('/api/letras/proximas_vencer/')
+        self.assertEqual(len([f for f in os.listdir(self.tmpdir) if f.endswith('.json')]), 2)
+
+
+class TrazasTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command('generar_datos', empresas=2, vendedores=2, proveedores=3, pedidos=4,
+                     letras=12, semilla=7, stdout=StringIO())
+
+    def setUp(self):
+        from core.tracing import instrument
+        instrument()
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'trazas.jsonl')
+        self.override = override_settings(TRACING_ENABLED=True, TRACING_EXPORT_PATH=self.path)
+        self.override.enable()
+        # Cliente nuevo: su cadena de middlewares se monta ya instrumentada
+        self.admin, self.client = crear_usuario('admin_trazas', 'admin')
+
+    def tearDown(self):
+        self.override.disable()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def leer_spans(self):
+        with open(self.path) as f:
+            lineas = [json.loads(linea) for linea in f]
+        self.assertEqual(len(lineas), 1)
+        return lineas[0]['resourceSpans'][0]['scopeSpans'][0]['spans']
+
+    def test_spans_de_cada_fase(self):
+        response = self.client.get('/api/pedidos/')
+        spans = self.leer_spans()
+        self.assertTrue(all(s['traceId'] == response['X-Trace-Id'] for s in spans))
+
+        nombres = {s['name'] for s in spans}
+        for esperado in ('GET /api/pedidos/', 'middleware ActivityLogMiddleware', 'view PedidoViewSet.list',
+                         'drf.authentication', 'serializer PedidoSerializer(many)',
+                         'handler _get_response', 'render JSONRenderer'):
+            self.assertIn(esperado, nombres)
+        self.assertTrue(any(n.startswith('drf.permissions') for n in nombres))
+        self.assertTrue(any(s['name'] == 'db SELECT' and s['kind'] == 3 for s in spans))
+
+        # Todos los spans cuelgan de otro span de la misma traza menos la raíz
+        ids = {s['spanId'] for s in spans}
+        raices = [s for s in spans if 'parentSpanId' not in s]
+        self.assertEqual([r['name'] for r in raices], ['GET /api/pedidos/'])
+        self.assertTrue(all(s['parentSpanId'] in ids for s in spans if s not in raices))
+
+    def test_continua_traceparent(self):
+        trace_id, parent_id = '4bf92f3577b34da6a3ce929d0e0e4736', '00f067aa0ba902b7'
+        response = self.client.get('/api/letras/proximas_vencer/',
+                                   HTTP_TRACEPARENT=f'00-{trace_id}-{parent_id}-01')
+        self.assertEqual(response['X-Trace-Id'], trace_id)
+        raiz = next(s for s in self.leer_spans() if s['kind'] == 2)
+        self.assertEqual(raiz['parentSpanId'], parent_id)
+
+    def test_sin_trazas_no_exporta(self):
+        with override_settings(TRACING_ENABLED=False):
+            response = self.client.get('/api/letras/proximas_vencer/')
+        self.assertNotIn('X-Trace-Id', response)
+        self.assertFalse(os.path.exists(self.path))
+
+
+class BusquedaTests(TestCase):
+
+    def setUp(self):
+        self.admin, self.client = crear_usuario('admin_busqueda', 'admin')
+        self.pacifico = Proveedor.objects.create(nombre='Importaciones Pacífico', identificador='PAC')
+        self.andina = Proveedor.objects.create(nombre='Textil Andina', notas='Importa del Pacífico')
+        self.pedido = Pedido.objects.create(proveedor=self.pacifico, monto_total_pedido=1000,
+                                            fecha_pedido='2026-01-10', numero_pedido='P-7781')
+        Pedido.objects.create(proveedor=self.andina, monto_total_pedido=500, fecha_pedido='2026-01-12',
+                              numero_pedido='P-9000')
+
+    def test_prefijo_sin_tildes_y_ranking(self):
+        resultados = buscar('importa pacif', ['proveedor'])
+        # Ambos coinciden; el documento más corto (bm25) va primero
+        self.assertEqual([r['id'] for r in resultados], [str(self.pacifico.pk), str(self.andina.pk)])
+        self.assertEqual(resultados[0]['titulo'], 'Importaciones Pacífico')
+        self.assertGreater(resultados[0]['rango'], resultados[1]['rango'])
+
+    def test_senales_mantienen_el_indice(self):
+        self.pacifico.nombre = 'Comercial Huascarán'
+        self.pacifico.save()
+        # El pedido copia el nombre de su proveedor y se reindexa con él
+        self.assertEqual([r['id'] for r in buscar('huascaran', ['pedido'])], [str(self.pedido.pk)])
+        self.assertFalse(buscar('importaciones', ['pedido']))
+
+        # Guardar solo campos no indexados no reescribe el índice
+        antes = IndiceBusqueda.objects.get(tipo='pedido', objeto_id=str(self.pedido.pk)).actualizado
+        self.pedido.monto_pagado = 10
+        self.pedido.save(update_fields=['monto_pagado'])
+        self.assertEqual(IndiceBusqueda.objects.get(tipo='pedido', objeto_id=str(self.pedido.pk)).actualizado, antes)
+
+        self.pedido.delete()
+        self.assertFalse(buscar('huascaran', ['pedido']))
+
+    def test_endpoint_buscar(self):
+        response = self.client.get('/api/buscar/', {'q': 'P-7781'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([(r['tipo'], r['id']) for r in response.json()['results']],
+                         [('pedido', str(self.pedido.pk))])
+        self.assertEqual(self.client.get('/api/buscar/', {'q': 'x', 'tipo': 'cliente'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/buscar/').status_code, 400)
+
+    def test_search_de_listado_usa_el_indice(self):
+        response = self.client.get('/api/pedidos/', {'search': 'pacif'})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        if isinstance(data, dict):
+            data = data['results']
+        self.assertEqual([p['id'] for p in data], [str(self.pedido.pk)])
+
+    def pedidos(self, texto):
+        response = self.client.get('/api/pedidos/', {'search': texto})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        return {p['id'] for p in (data['results'] if isinstance(data, dict) else data)}
+
+    def test_search_de_listado_sin_limite(self):
+        extra = Pedido.objects.create(proveedor=self.pacifico, monto_total_pedido=10, fecha_pedido='2026-01-01',
+                                      numero_pedido='P-1')
+        # Con un solo resultado ordenado por relevancia, el resto igual aparece
+        with mock.patch('calendarBackend.busqueda.MAX_RESULTADOS_RANGO', 1):
+            self.assertEqual(self.pedidos('pacifico'), {str(self.pedido.pk), str(extra.pk)})
+
+    def test_search_de_listado_por_subcadena(self):
+        otro = Pedido.objects.create(proveedor=self.andina, monto_total_pedido=10, fecha_pedido='2026-01-01',
+                                     numero_pedido='P-27781')
+        # '7781' es prefijo en el índice de P-7781 y solo subcadena de P-27781
+        self.assertEqual(self.pedidos('7781'), {str(self.pedido.pk), str(otro.pk)})
+        self.assertEqual(self.pedidos('781'), {str(self.pedido.pk), str(otro.pk)})
+        # El índice no encuentra nada: se busca por subcadena como SearchFilter
+        self.assertEqual(self.pedidos('portaciones'), {str(self.pedido.pk)})
+        self.assertEqual(self.pedidos('inexistente'), set())
+
+    def test_search_de_listado_dentro_del_presupuesto(self):
+        empresa = Empresa.objects.create(nombre='Empresa Norte', ruc='20111111111')
+        distribucion = DistribucionFinal.objects.create(pedido=self.pedido, empresa=empresa, monto_final=1000)
+        Letra.objects.create(distribucion=distribucion, monto=500, fecha_pago=date(2026, 3, 10),
+                             numero_unico='L-14950')
+        # Los tests corren con QUERY_BUDGET_MODE='raise': superar el presupuesto sería un 500
+        for texto in ('pacif', '778', 'portaciones', '1495'):
+            self.assertEqual(self.client.get('/api/letras/', {'search': texto}).status_code, 200)
+            self.assertEqual(self.client.get('/api/proveedores/', {'search': texto}).status_code, 200)
+        data = self.client.get('/api/letras/', {'search': '1495'}).json()
+        self.assertEqual([l['numero_unico'] for l in (data['results'] if isinstance(data, dict) else data)],
+                         ['L-14950'])
+
+    def test_reconstruir_indice(self):
+        IndiceBusqueda.objects.all().delete()
+        call_command('indexar_busqueda', stdout=StringIO())
+        self.assertEqual(IndiceBusqueda.objects.filter(tipo='pedido').count(), 2)
+        self.assertEqual(len(buscar('textil andina')), 2)
+
+
+class AutocompletarTests(TestCase):
+
+    def setUp(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir, ignore_errors=True)
+        override = override_settings(AUTOCOMPLETAR_STORE_PATH=os.path.join(tmpdir, 'autocompletar.sqlite3'))
+        override.enable()
+        self.addCleanup(override.disable)
+        autocompletado.limpiar()
+        self.addCleanup(autocompletado.limpiar)
+        self.admin, self.client = crear_usuario('admin_autocompletar', 'admin')
+        self.pacifico = Proveedor.objects.create(nombre='Importaciones Pacífico', identificador='PAC',
+                                                 ruc='20123456789')
+        self.andina = Proveedor.objects.create(nombre='Textil Andina')
+        Proveedor.objects.create(nombre='Pacífico Inactivo', activo=False)
+        Empresa.objects.create(nombre='Comercial Pacífico', ruc='20555555551')
+
+    def nombres(self, **params):
+        response = self.client.get('/api/autocompletar/', params)
+        self.assertEqual(response.status_code, 200)
+        return [(r['tipo'], r['nombre']) for r in response.json()]
+
+    def test_prefijo_sin_tildes(self):
+        self.assertEqual(self.nombres(q='PACIF', tipo='proveedor'), [('proveedor', 'Importaciones Pacífico')])
+        self.assertEqual(self.nombres(q='pac', tipo='proveedor'), [('proveedor', 'Importaciones Pacífico')])
+        self.assertEqual(self.nombres(q='20123', tipo='proveedor'), [('proveedor', 'Importaciones Pacífico')])
+        self.assertEqual(len(self.nombres(q='pacif', tipo='proveedor', inactivos='1')), 2)
+        self.assertEqual(self.nombres(q='pacif', tipo='empresa,proveedor', limite=1),
+                         [('empresa', 'Comercial Pacífico')])
+        self.assertEqual(self.client.get('/api/autocompletar/', {'q': 'x', 'tipo': 'pedido'}).status_code, 400)
+
+    def test_consultas_sin_base_de_datos_una_vez_construido(self):
+        self.nombres(q='tex')
+        with self.assertNumQueries(0):
+            autocompletado.buscar('tex')
+
+    def test_actualiza_al_guardar(self):
+        self.nombres(q='tex')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.andina.nombre = 'Textiles del Sur'
+            self.andina.save()
+        self.assertEqual(self.nombres(q='sur', tipo='proveedor'), [('proveedor', 'Textiles del Sur')])
+        self.assertEqual(self.nombres(q='andina'), [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.andina.delete()
+        self.assertEqual(self.nombres(q='textil'), [])
+
+    def test_otro_worker_reconstruye_por_version(self):
+        self.nombres(q='tex')
+        # Un guardado en otro proceso solo cambia la versión compartida
+        Proveedor.objects.filter(pk=self.andina.pk).update(nombre='Textil Norteña')
+        incrementar_version('proveedor')
+        self.assertEqual(self.nombres(q='nortena', tipo='proveedor'), [('proveedor', 'Textil Norteña')])
+
+    def test_cambio_local_tras_cambio_de_otro_worker(self):
+        self.nombres(q='zz')
+        # Otro worker crea un proveedor (solo cambia la versión compartida)...
+        Proveedor.objects.bulk_create([Proveedor(nombre='ZZ Xeno')])
+        incrementar_version('proveedor')
+        # ...y después este worker guarda otro: su índice no vio el primero
+        with self.captureOnCommitCallbacks(execute=True):
+            Proveedor.objects.create(nombre='ZZ Yota')
+        self.assertEqual(self.nombres(q='zz', tipo='proveedor'),
+                         [('proveedor', 'ZZ Xeno'), ('proveedor', 'ZZ Yota')])
+
+    def test_incrementos_concurrentes_no_se_pierden(self):
+        inicial = leer_version('empresa')
+        versiones = []
+
+        def incrementar():
+            for _ in range(20):
+                versiones.append(incrementar_version('empresa'))
+        hilos = [threading.Thread(target=incrementar) for _ in range(4)]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        self.assertEqual(sorted(versiones), list(range(inicial + 1, inicial + 81)))
+        self.assertEqual(leer_version('empresa'), inicial + 80)
+
+    def test_las_escrituras_no_modifican_la_lista_publicada(self):
+        self.nombres(q='tex')
+        indice = autocompletado.indices['proveedor']
+        claves = indice.claves
+        copia = list(claves)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.andina.nombre = 'Textiles del Sur'
+            self.andina.save()
+        self.assertEqual(claves, copia)
+        self.assertIsNot(indice.claves, claves)
+
+
+class DesnormalizacionTests(TestCase):
+
+    def setUp(self):
+        self.pacifico = Proveedor.objects.create(nombre='Importaciones Pacífico')
+        self.andina = Proveedor.objects.create(nombre='Textil Andina')
+        self.empresa = Empresa.objects.create(nombre='Empresa Norte', ruc='20111111111')
+        self.otra_empresa = Empresa.objects.create(nombre='Empresa Sur', ruc='20222222222')
+        self.pedido = Pedido.objects.create(proveedor=self.pacifico, monto_total_pedido=1000,
+                                            fecha_pedido=date(2026, 1, 10))
+        distribucion = DistribucionFinal.objects.create(pedido=self.pedido, empresa=self.empresa, monto_final=1000)
+        self.letra = Letra.objects.create(distribucion=distribucion, monto=500, fecha_pago=date(2026, 3, 10))
+        self.guia = GuiaDeRemision.objects.create(pedido=self.pedido, empresa=self.empresa,
+                                                  numero_guia='T001-1', fecha_emision=date(2026, 1, 15))
+        self.factura = Factura.objects.create(guia_remision=self.guia, numero_factura='F001-1',
+                                              monto_factura=400, fecha_emision=date(2026, 1, 15))
+
+    def copias(self):
+        self.letra.refresh_from_db()
+        self.factura.refresh_from_db()
+        return self.letra.proveedor_id, self.factura.empresa_id, self.factura.proveedor_id
+
+    def test_save_copia_proveedor_y_empresa(self):
+        self.assertEqual(self.copias(), (self.pacifico.pk, self.empresa.pk, self.pacifico.pk))
+
+    def test_cambio_de_dueno_se_propaga(self):
+        self.pedido.proveedor = self.andina
+        self.pedido.save()
+        self.guia.empresa = self.otra_empresa
+        self.guia.save()
+        self.assertEqual(self.copias(), (self.andina.pk, self.otra_empresa.pk, self.andina.pk))
+
+    def test_migracion_rellena_las_copias(self):
+        Letra.objects.update(proveedor=None)
+        Factura.objects.update(empresa=None, proveedor=None)
+        migracion = importlib.import_module('calendarBackend.migrations.0016_proveedor_empresa_desnormalizados')
+        migracion.rellenar(apps, SimpleNamespace(connection=connection))
+        self.assertEqual(self.copias(), (self.pacifico.pk, self.empresa.pk, self.pacifico.pk))
+
+    def test_filtro_por_proveedor_usa_indice_compuesto(self):
+        consulta = Letra.objects.filter(proveedor=self.pacifico, estado='pendiente', fecha_pago__gte='2026-01-01')
+        with connection.cursor() as cursor:
+            sql, params = consulta.query.sql_with_params()
+            cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+            plan = ' '.join(str(fila[-1]) for fila in cursor.fetchall())
+        self.assertIn('letra_prov_estado_fecha_idx', plan)
+
+
+class AsesorIndicesTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command('generar_datos', empresas=2, vendedores=3, proveedores=5, pedidos=60,
+                     letras=300, semilla=3, stdout=StringIO())
+
+    def test_propone_indice_y_migracion(self):
+        salida = StringIO()
+        informe = os.path.join(tempfile.mkdtemp(), 'asesor.json')
+        self.addCleanup(shutil.rmtree, os.path.dirname(informe))
+        call_command('asesor_indices', endpoint=['/api/letras/?estado=atrasado'], repeticiones=1,
+                     migracion=True, salida=informe, stdout=salida, stderr=StringIO())
+        ruta = salida.getvalue().rsplit('Migración para revisar: ', 1)[1].strip()
+        self.addCleanup(os.remove, ruta)
+
+        with open(informe) as f:
+            datos = json.load(f)
+        # Filtra por estado y ordena por fecha_pago: el índice (estado, fecha_pago) evita la ordenación
+        self.assertIn('temp_btree', {h['problema'] for h in datos['hallazgos'] if h['tabla'] == 'calendarBackend_letra'})
+        propuesta = next(p for p in datos['propuestas'] if p['modelo'] == 'Letra')
+        self.assertIn("fields=['estado', 'fecha_pago']", propuesta['indice'])
+        self.assertGreaterEqual(propuesta['ahorro_ms'], 0)
+        with open(ruta) as f:
+            self.assertIn("migrations.AddIndex(", f.read())
+        # No deja atrás el usuario staff ni el token del benchmark
+        self.assertFalse(User.objects.filter(username='benchmark_admin').exists())
+
+    @override_settings(STREAMING_JSON_CHUNK_SIZE=2)
+    def test_captura_las_consultas_de_todo_el_streaming(self):
+        proveedor = Pedido.objects.values('proveedor').annotate(n=Count('id')).order_by('-n')[0]
+        consultas = AsesorIndices().capturar({'origen': 'benchmark',
+                                              'endpoints': [f"/api/proveedores/{proveedor['proveedor']}/pedidos/"]})
+        # Los dos prefetch de letras (del pedido y de sus distribuciones) se
+        # repiten en cada bloque de 2 pedidos, también después del primero
+        letras = [c for c in consultas.values() if c.sql.startswith('SELECT') and 'FROM "calendarBackend_letra"' in c.sql]
+        self.assertEqual(sum(c.veces for c in letras), 2 * -(-proveedor['n'] // 2))
+
+
+class EventosTests(TestCase):
+
+    def setUp(self):
+        self.addCleanup(broadcaster.subscriptions.clear)
+        user, _ = crear_usuario('admin_eventos', 'admin')
+        self.token = Token.objects.get(user=user).key
+        self.proveedor = Proveedor.objects.create(nombre='Importaciones Pacífico')
+        self.pedido = Pedido.objects.create(proveedor=self.proveedor, monto_total_pedido=1000,
+                                            fecha_pedido=date(2026, 1, 10))
+
+    def cambiar_monto(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            pedido = Pedido.objects.get(pk=self.pedido.pk)
+            pedido.monto_total_pedido = 1500
+            pedido.save()
+
+    def test_flujo_envia_los_cambios(self):
+        async def escuchar():
+            client = AsyncClient()
+            sin_token = await client.get('/api/eventos/')
+            self.assertEqual(sin_token.status_code, 401)
+
+            response = await client.get('/api/eventos/', {'modelos': 'pedido'},
+                                        headers={'Authorization': f'Token {self.token}'})
+            self.assertEqual(response['Content-Type'], 'text/event-stream')
+            contenido = aiter(response.streaming_content)
+            self.assertEqual(await anext(contenido), b'retry: 3000\n\n')
+            await sync_to_async(self.cambiar_monto)()
+            mensaje = await asyncio.wait_for(anext(contenido), 5)
+            await contenido.aclose()
+            return mensaje.decode()
+
+        mensaje = async_to_sync(escuchar)()
+        self.assertIn('event: cambio', mensaje)
+        datos = json.loads(mensaje.split('data: ', 1)[1])
+        self.assertEqual(datos, {'model': 'pedido', 'id': str(self.pedido.pk), 'action': 'updated',
+                                 'fields': ['monto_total_pedido']})
+        self.assertEqual(broadcaster.subscriptions, set())
+
+    @override_settings(SSE_BUFFER_SIZE=2)
+    def test_cliente_lento_recibe_resync(self):
+        difusor = Broadcaster()
+
+        async def leer():
+            subscription, _ = difusor.subscribe()
+            for n in range(3):
+                difusor.publish({'n': n})
+            desbordado = await subscription.get(1)
+            ultimo = difusor.publish({'n': 3})
+            siguiente = await subscription.get(1)
+            _, perdidos = difusor.subscribe(last_event_id=f"{difusor.boot}-2")
+            return desbordado, siguiente, ultimo, perdidos
+
+        desbordado, siguiente, ultimo, perdidos = async_to_sync(leer)()
+        self.assertEqual(desbordado, ['resync'])
+        self.assertEqual(siguiente, [(ultimo, {'n': 3})])
+        self.assertEqual([data['n'] for _, data in perdidos], [2, 3])
+
+
+class SincronizacionTests(TestCase):
+
+    def setUp(self):
+        self.admin, self.client = crear_usuario('admin_sincronizacion', 'admin')
+        self.empresa = Empresa.objects.create(nombre='Empresa Norte', ruc='20111111111')
+        pedido = Pedido.objects.create(proveedor=Proveedor.objects.create(nombre='Importaciones Pacífico'),
+                                       monto_total_pedido=1000, fecha_pedido=date(2026, 1, 10))
+        self.distribucion = DistribucionFinal.objects.create(pedido=pedido, empresa=self.empresa, monto_final=1000)
+        self.letras = [
+            Letra.objects.create(distribucion=self.distribucion, monto=100, fecha_pago=date(2026, 3, dia))
+            for dia in (10, 11, 12)
+        ]
+
+    def test_since_devuelve_solo_lo_cambiado(self):
+        response = self.client.get('/api/letras/')
+        marca = response['X-Sync-Watermark']
+        self.assertEqual(len(response.json()), 3)
+
+        cambiada, borrada, atrasada = self.letras
+        borrada_id = str(borrada.pk)
+        cambiada.monto = 150
+        cambiada.save()
+        borrada.delete()
+        atrasada.estado = 'atrasado'
+        atrasada.save()
+        nueva = Letra.objects.create(distribucion=self.distribucion, monto=50, fecha_pago=date(2026, 4, 1))
+
+        datos = self.client.get('/api/letras/', {'since': marca, 'estado': 'pendiente'}).json()
+        self.assertEqual({l['id'] for l in datos['results']}, {str(cambiada.pk), str(nueva.pk)})
+        # Borrada o fuera del filtro: el cliente la quita del listado
+        self.assertEqual(set(datos['deleted']), {borrada_id, str(atrasada.pk)})
+
+        datos = self.client.get('/api/letras/', {'since': datos['watermark']}).json()
+        self.assertEqual((datos['results'], datos['deleted']), ([], []))
+        self.assertEqual(self.client.get('/api/letras/', {'since': 'ayer'}).status_code, 400)
+
+    def test_compactacion(self):
+        marca = int(self.client.get('/api/letras/')['X-Sync-Watermark'])
+        for monto in (110, 120, 130):
+            self.letras[0].monto = monto
+            self.letras[0].save()
+        RegistroCambio.objects.filter(id__lte=marca).update(creado=timezone.now() - timezone.timedelta(days=60))
+
+        call_command('compactar_cambios', dias=30, stdout=StringIO())
+        letra = str(self.letras[0].pk)
+        self.assertEqual(RegistroCambio.objects.filter(modelo='letra', objeto_id=letra).count(), 1)
+        self.assertEqual(self.client.get('/api/letras/', {'since': marca - 1}).status_code, 410)
+        datos = self.client.get('/api/letras/', {'since': marca}).json()
+        self.assertEqual([l['id'] for l in datos['results']], [letra])
+
+
+class VistasAsyncTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command('generar_datos', empresas=2, vendedores=3, proveedores=5, pedidos=30,
+                     letras=150, semilla=5, stdout=StringIO())
+
+    def setUp(self):
+        user, self.client = crear_usuario('admin_async', 'admin')
+        self.token = Token.objects.get(user=user).key
+
+    def get_async(self, ruta, params=None, token=True):
+        headers = {'Authorization': f'Token {self.token}'} if token else {}
+
+        async def get():
+            return await AsyncClient().get(ruta, params or {}, headers=headers)
+        return async_to_sync(get)()
+
+    def test_misma_respuesta_que_la_version_sincrona(self):
+        inicio = date.today().replace(day=1)
+        rango = {'fecha_desde': inicio, 'fecha_hasta': inicio + timedelta(days=31)}
+        pedido = Pedido.objects.values_list('id', flat=True).first()
+        pares = [
+            ('/api/dashboard/estadisticas/', '/api/async/dashboard/estadisticas/', {}),
+            ('/api/letras/', '/api/async/letras/', rango),
+            ('/api/letras/', '/api/async/letras/', {'estado': 'atrasado'}),
+            ('/api/letras/proximas_vencer/', '/api/async/letras/proximas_vencer/', {}),
+            (f'/api/pedidos/{pedido}/resumen/', f'/api/async/pedidos/{pedido}/resumen/', {}),
+        ]
+        for sincrona, asincrona, params in pares:
+            with self.subTest(ruta=asincrona, params=params):
+                response = self.get_async(asincrona, params)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.json(), self.client.get(sincrona, params).json())
+
+        self.assertEqual(self.get_async('/api/async/letras/', token=False).status_code, 401)
+        self.assertEqual(self.get_async('/api/async/pedidos/no-existe/resumen/').status_code, 404)
+
+    def test_benchmark_asgi(self):
+        salida = StringIO()
+        call_command('benchmark_api', asgi=True, peticiones=4, hilos=1, calentamiento=0, stdout=salida)
+        lineas = [linea for linea in salida.getvalue().splitlines() if linea.startswith('/api/')]
+        self.assertEqual(len(lineas), 8)
+        self.assertTrue(all("{'200': 4}" in linea for linea in lineas), lineas)
+
+
+class BatchTests(TestCase):
+
+    def setUp(self):
+        self.user, self.client = crear_usuario('lectura_batch', 'lectura')
+        empresa = Empresa.objects.create(nombre='Empresa Norte', ruc='20111111111')
+        pedido = Pedido.objects.create(proveedor=Proveedor.objects.create(nombre='Importaciones Pacífico'),
+                                       monto_total_pedido=1000, fecha_pedido=date(2026, 1, 10))
+        distribucion = DistribucionFinal.objects.create(pedido=pedido, empresa=empresa, monto_final=1000)
+        for dia in (10, 11):
+            Letra.objects.create(distribucion=distribucion, monto=100, fecha_pago=date(2026, 3, dia))
+
+    def test_agrupa_las_peticiones_de_la_pagina(self):
+        rutas = ['/api/empresas/', '/api/proveedores/', '/api/pedidos/?page=1', '/api/letras/']
+        actividades = UserActivity.objects.count()
+        response = self.client.post('/api/batch/', {
+            'requests': [{'method': 'GET', 'path': ruta} for ruta in rutas] + [
+                {'method': 'GET', 'path': '/api/letras/', 'params': {'estado': 'atrasado'}},
+                {'method': 'GET', 'path': '/api/admin/usuarios/'},
+                {'method': 'DELETE', 'path': '/api/letras/'},
+                {'method': 'GET', 'path': '/api/batch/'},
+                {'method': 'GET', 'path': '/api/no-existe/'},
+            ],
+            'snapshot': True,
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        respuestas = response.json()['responses']
+        for ruta, respuesta in zip(rutas, respuestas):
+            with self.subTest(ruta=ruta):
+                individual = self.client.get(ruta)
+                self.assertEqual(respuesta['status'], 200)
+                self.assertEqual(respuesta['body'], individual.json())
+                self.assertIn('X-Query-Count', respuesta['headers'])
+        self.assertIn('X-Sync-Watermark', respuestas[3]['headers'])
+        self.assertEqual(respuestas[4]['body'], [])
+        # Permisos de cada vista: un usuario de lectura no administra usuarios
+        self.assertEqual([r['status'] for r in respuestas[5:]], [403, 405, 400, 404])
+        self.assertEqual(UserActivity.objects.count(), actividades)
+
+    @override_settings(BATCH_MAX_REQUESTS=2)
+    def test_limite_de_subpeticiones(self):
+        peticiones = [{'method': 'GET', 'path': '/api/empresas/'}] * 3
+        response = self.client.post('/api/batch/', {'requests': peticiones}, format='json')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post('/api/batch/', {'requests': peticiones[:2]}, format='json')
+        self.assertEqual([r['status'] for r in response.json()['responses']], [200, 200])
+        self.assertEqual(APIClient().post('/api/batch/', {'requests': peticiones[:1]}, format='json').status_code, 401)
+
+
+class ConcurrenciaOptimistaTests(TestCase):
+
+    def setUp(self):
+        self.user, self.client = crear_usuario('admin_concurrencia', 'admin')
+        empresa = Empresa.objects.create(nombre='Empresa Norte', ruc='20111111111')
+        pedido = Pedido.objects.create(proveedor=Proveedor.objects.create(nombre='Importaciones Pacífico'),
+                                       monto_total_pedido=1000, fecha_pedido=date(2026, 1, 10))
+        self.distribucion = DistribucionFinal.objects.create(pedido=pedido, empresa=empresa, monto_final=1000)
+
+    def test_if_match(self):
+        ruta = f'/api/distribuciones-finales/{self.distribucion.pk}/'
+        etag = self.client.get(ruta)['ETag']
+
+        response = self.client.patch(ruta, {'monto_final': 900}, format='json', HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response['ETag'], self.client.get(ruta)['ETag'])
+
+        # Otro usuario editó la versión anterior: no se pisa el cambio
+        response = self.client.patch(ruta, {'monto_final': 800}, format='json', HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, 412)
+        self.assertEqual(response['ETag'], self.client.get(ruta)['ETag'])
+        self.distribucion.refresh_from_db()
+        self.assertEqual(self.distribucion.monto_final, 900)
+        self.assertEqual(self.client.patch(ruta, {'monto_final': 800}, format='json').status_code, 200)
+
+    def test_update_condicional(self):
+        # Dos escritores leen la misma versión; el segundo UPDATE no afecta filas
+        primera = DistribucionFinal.objects.get(pk=self.distribucion.pk)
+        segunda = DistribucionFinal.objects.get(pk=self.distribucion.pk)
+        for distribucion in (primera, segunda):
+            distribucion.version_esperada = distribucion.version
+        primera.monto_final = 700
+        primera.save()
+        self.assertEqual(primera.version, segunda.version + 1)
+        segunda.monto_final = 600
+        with self.assertRaises(ConflictoVersion):
+            segunda.save()
+        self.distribucion.refresh_from_db()
+        self.assertEqual((self.distribucion.monto_final, self.distribucion.version), (700, primera.version))
+
+
+class CamposParcialesTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command('generar_datos', empresas=2, vendedores=3, proveedores=5, pedidos=10,
+                     letras=40, semilla=7, stdout=StringIO())
+
+    def setUp(self):
+        self.user, self.client = crear_usuario('lectura_campos', 'lectura')
+
+    def get(self, ruta, params=None):
+        with CaptureQueriesContext(connection) as consultas:
+            response = self.client.get(ruta, params or {})
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json(), [consulta['sql'] for consulta in consultas]
+
+    def test_fields_y_omit(self):
+        completo, _ = self.get('/api/letras/')
+        parcial, consultas = self.get('/api/letras/', {'fields': 'monto,proveedor,dias_restantes'})
+        self.assertEqual(parcial, [
+            {campo: letra[campo] for campo in ('id', 'monto', 'proveedor', 'dias_restantes')} for letra in completo
+        ])
+        sql = next(c for c in consultas if 'FROM "calendarBackend_letra"' in c)
+        self.assertNotIn('"notas"', sql)
+        self.assertNotIn('"calendarBackend_empresa"', sql)
+        self.assertIn('"calendarBackend_proveedor"', sql)
+
+        proveedores, consultas = self.get('/api/proveedores/', {'omit': 'notas,pedidos_count,pedidos_pendientes'})
+        self.assertNotIn('notas', proveedores[0])
+        self.assertIn('monto_total_pedidos', proveedores[0])
+        self.assertFalse(any('COUNT(' in c for c in consultas))
+
+        response = self.client.get('/api/letras/', {'fields': 'monto,no_existe'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('no_existe', response.json()['fields'])
+
+    def test_omite_prefetch_de_campos_no_pedidos(self):
+        pedido = Pedido.objects.values_list('id', flat=True).first()
+        completo, consultas_completo = self.get(f'/api/pedidos/{pedido}/')
+        parcial, consultas = self.get(f'/api/pedidos/{pedido}/', {'fields': 'numero_pedido,letras_count'})
+        self.assertEqual(parcial, {'id': completo['id'], 'numero_pedido': completo['numero_pedido'],
+                                   'letras_count': completo['letras_count']})
+        self.assertLess(len(consultas), len(consultas_completo))
+        self.assertFalse(any('"calendarBackend_guiaderemision"' in c for c in consultas))
+
+
+class LecturaCompiladaTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command('generar_datos', empresas=2, vendedores=3, proveedores=5, pedidos=10,
+                     letras=40, semilla=11, stdout=StringIO())
+        # Letra sin pedido ni empresa: las relaciones nulas salen como en DRF
+        letra = Letra.objects.create(distribucion=DistribucionFinal.objects.first(), monto='12.50',
+                                     fecha_pago=date.today() + timedelta(days=5))
+        Letra.objects.filter(pk=letra.pk).update(pedido=None, empresa=None)
+
+    def setUp(self):
+        self.user, self.client = crear_usuario('lectura_compilada', 'lectura')
+        self.hoy = timezone.now().date()
+
+    def esperado(self, queryset, campos=None):
+        serializer = LetraSerializer(queryset, many=True, context={'hoy': self.hoy})
+        if campos:
+            for nombre in list(serializer.child.fields):
+                if nombre not in campos:
+                    serializer.child.fields.pop(nombre)
+        return json.loads(JSONRenderer().render(serializer.data))
+
+    def test_salida_identica_al_serializer(self):
+        queryset = Letra.objects.select_related('pedido__proveedor', 'empresa').order_by('fecha_pago', 'id')
+        compilado = serializar(LetraSerializer(context={'hoy': self.hoy}), queryset)
+        self.assertEqual(json.loads(JSONRenderer().render(compilado)), self.esperado(queryset))
+        self.assertTrue(any(fila['proveedor'] is None and fila['empresa'] is None for fila in compilado))
+
+        response = self.client.get('/api/letras/', {'ordering': 'fecha_pago'})
+        self.assertEqual(response.status_code, 200)
+        ids = [fila['id'] for fila in response.json()]
+        por_id = {fila['id']: fila for fila in self.esperado(Letra.objects.all())}
+        self.assertEqual(response.json(), [por_id[i] for i in ids])
+
+        response = self.client.get('/api/letras/', {'fields': 'monto,proveedor,dias_restantes'})
+        campos = ('id', 'monto', 'proveedor', 'dias_restantes')
+        self.assertEqual(response.json(), [{c: por_id[fila['id']][c] for c in campos} for fila in response.json()])
+
+        response = self.client.get('/api/letras/proximas_vencer/')
+        self.assertEqual(response.status_code, 200)
+        proximas = Letra.objects.filter(estado='pendiente', fecha_pago__gte=self.hoy,
+                                        fecha_pago__lte=self.hoy + timedelta(days=30))
+        self.assertEqual(sorted(fila['id'] for fila in response.json()),
+                         sorted(str(pk) for pk in proximas.values_list('id', flat=True)))
+        self.assertTrue(all(fila == por_id[fila['id']] for fila in response.json()))
+
+    def test_no_compila_campos_desconocidos(self):
+        # Un get_* sin leer_* obliga a usar el serializer normal
+        class SinLeer(LetraSerializer):
+            extra = serializers.SerializerMethodField()
+
+            def get_extra(self, obj):
+                return obj.monto
+
+        self.assertIsNotNone(compilar(LetraSerializer()))
+        self.assertIsNone(compilar(SinLeer()))
+        letras = Letra.objects.order_by('fecha_pago', 'id')[:3]
+        self.assertEqual([fila['extra'] for fila in serializar(SinLeer(), letras)],
+                         [letra.monto for letra in letras])
+
+    def test_benchmark_serializacion(self):
+        salida = StringIO()
+        call_command('benchmark_serializacion', repeticiones=1, json=True, stdout=salida)
+        resultado = json.loads(salida.getvalue())
+        self.assertTrue(resultado['salidas_iguales'])
+        self.assertEqual([r['filas'] for r in resultado['resultados']], [Letra.objects.count()] * 2)
+
+
+class StreamingJSONTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command('generar_datos', empresas=2, vendedores=3, proveedores=2, pedidos=12,
+                     letras=30, semilla=5, stdout=StringIO())
+
+    def setUp(self):
+        self.user, self.client = crear_usuario('lectura_streaming', 'lectura')
+
+    def cuerpo(self, ruta):
+        response = self.client.get(ruta)
+        self.assertEqual(response.status_code, 200)
+        return response.streaming, b''.join(response.streaming_content) if response.streaming else response.content
+
+    def test_listados_grandes_en_bloques(self):
+        proveedor = Pedido.objects.values('proveedor').annotate(n=Count('id')).order_by('-n')[0]['proveedor']
+        for ruta in ('/api/letras/?ordering=fecha_pago,id', '/api/distribuciones/no-asignadas/',
+                     f'/api/proveedores/{proveedor}/pedidos/'):
+            with self.subTest(ruta=ruta):
+                streaming, completo = self.cuerpo(ruta)
+                self.assertFalse(streaming)
+                with override_settings(STREAMING_JSON_CHUNK_SIZE=4):
+                    streaming, en_bloques = self.cuerpo(ruta)
+                self.assertTrue(streaming)
+                self.assertEqual(en_bloques, completo)
+
+    @override_settings(STREAMING_JSON_CHUNK_SIZE=4)
+    def test_lote_y_api_navegable_sin_streaming(self):
+        response = self.client.post('/api/batch/', {'requests': [{'method': 'GET', 'path': '/api/letras/'}]},
+                                    format='json')
+        self.assertEqual(response.json()['responses'][0]['status'], 200)
+        self.assertEqual(len(response.json()['responses'][0]['body']), Letra.objects.count())
+        self.assertFalse(self.client.get('/api/letras/', HTTP_ACCEPT='text/html').streaming)
+        # Un listado que cabe en un bloque se envía de una vez
+        self.assertFalse(self.client.get('/api/letras/', {'fecha_desde': '2100-01-01'}).streaming)
+
+    @override_settings(STREAMING_JSON_CHUNK_SIZE=4)
+    def test_asgi_envia_cada_bloque_al_leerlo(self):
+        token = Token.objects.get(user=self.user).key
+        completo = b''.join(self.client.get('/api/letras/?ordering=fecha_pago,id').streaming_content)
+
+        async def leer():
+            response = await AsyncClient().get('/api/letras/?ordering=fecha_pago,id',
+                                               headers={'Authorization': f'Token {token}'})
+            self.assertTrue(response.is_async)
+            partes = []
+            async for parte in response.streaming_content:
+                partes.append((parte, response.json_stream.chunks))
+            return partes
+        partes = async_to_sync(leer)()
+        self.assertEqual(b''.join(parte for parte, _ in partes), completo)
+        # El primer bloque sale antes de consultar el siguiente
+        self.assertEqual(partes[0][1], 1)
+        self.assertGreater(partes[-1][1], 1)
+
+    @override_settings(STREAMING_JSON_CHUNK_SIZE=4)
+    def test_consultas_de_cada_bloque_cuentan_en_el_presupuesto(self):
+        proveedor = Pedido.objects.values('proveedor').annotate(n=Count('id')).order_by('-n')[0]['proveedor']
+        ruta = f'/api/proveedores/{proveedor}/pedidos/'
+        self.assertTrue(self.client.get(ruta).streaming)
+        presupuesto = {**ProveedorViewSet.query_budget, 'pedidos': 12}
+        with mock.patch.object(ProveedorViewSet, 'query_budget', presupuesto):
+            response = self.client.get(ruta)
+            self.assertEqual(response.status_code, 200)
+            with self.assertRaises(QueryBudgetExceeded):
+                b''.join(response.streaming_content)
+
+
+class CompresionTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command('generar_datos', empresas=2, vendedores=3, proveedores=3, pedidos=10,
+                     letras=30, semilla=9, stdout=StringIO())
+
+    def setUp(self):
+        self.user, self.client = crear_usuario('lectura_compresion', 'lectura')
+
+    def test_negociacion(self):
+        self.assertEqual(negotiate('gzip, deflate, br'), 'br')
+        self.assertEqual(negotiate('gzip;q=1.0, br;q=0'), 'gzip')
+        self.assertEqual(negotiate('br;q=0.5, gzip'), 'gzip')
+        self.assertEqual(negotiate('*'), 'br')
+        self.assertIsNone(negotiate('identity'))
+        self.assertIsNone(negotiate(''))
+
+    def test_comprime_segun_accept_encoding(self):
+        original = self.client.get('/api/letras/')
+        self.assertNotIn('Content-Encoding', original)
+        self.assertIn('Accept-Encoding', original['Vary'])
+        for encoding, descomprimir in (('br', brotli.decompress), ('gzip', gzip.decompress)):
+            with self.subTest(encoding=encoding):
+                response = self.client.get('/api/letras/', HTTP_ACCEPT_ENCODING=f'{encoding}, deflate')
+                self.assertEqual(response['Content-Encoding'], encoding)
+                self.assertLess(len(response.content), len(original.content))
+                self.assertEqual(descomprimir(response.content), original.content)
+        # Por debajo de COMPRESSION_MIN_BYTES no se comprime
+        pequena = self.client.get('/api/letras/', {'fecha_desde': '2100-01-01'}, HTTP_ACCEPT_ENCODING='br')
+        self.assertNotIn('Content-Encoding', pequena)
+
+    @override_settings(STREAMING_JSON_CHUNK_SIZE=4)
+    def test_streaming_y_metricas(self):
+        original = b''.join(self.client.get('/api/letras/').streaming_content)
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir, ignore_errors=True)
+        self.addCleanup(registry.reset)
+        with override_settings(METRICS_ENABLED=True, METRICS_STORE_PATH=os.path.join(tmpdir, 'metricas.sqlite3')):
+            response = self.client.get('/api/letras/', HTTP_ACCEPT_ENCODING='gzip')
+            self.assertTrue(response.streaming)
+            self.assertEqual(response['Content-Encoding'], 'gzip')
+            self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), original)
+            texto = render_prometheus()
+        etiquetas = 'encoding="gzip",route="/api/letras/"'
+        self.assertIn(f'calendarwebapp_compression_input_bytes_total{{{etiquetas}}} {len(original)}', texto)
+        self.assertIn(f'calendarwebapp_compression_responses_total{{{etiquetas}}} 1', texto)
+        self.assertIn('calendarwebapp_compression_cpu_seconds_total', texto)
+
+    def test_no_recomprime(self):
+        request = RequestFactory().get('/api/respaldos/1/descargar/', HTTP_ACCEPT_ENCODING='gzip, br')
+        respaldo = gzip.compress(b'INSERT INTO letra VALUES (1);\n' * 500)
+        for content_type in ('application/gzip', 'application/sql'):
+            with self.subTest(content_type=content_type):
+                response = CompressionMiddleware(
+                    lambda r: HttpResponse(respaldo, content_type=content_type)
+                )(request)
+                self.assertNotIn('Content-Encoding', response)
+                self.assertEqual(response.content, respaldo)
+
+
+class ConfiguracionConexionesTests(TestCase):
+
+    def cargar_settings(self, **entorno):
+        """Evalúa core/settings.py con estas variables de entorno, sin tocar la configuración activa"""
+        entorno = {'DATABASE_PROFILE': 'postgres', 'DATABASE_URL': 'postgres://app:clave@db:5432/app', **entorno}
+        with mock.patch.dict(os.environ, entorno):
+            return runpy.run_path(os.path.join(settings.BASE_DIR, 'core', 'settings.py'))
+
+    def test_pool_repartido_entre_workers(self):
+        config = self.cargar_settings(WEB_CONCURRENCY='4', DB_POOL_TOTAL='20', DB_POOL_MIN='8')
+        default = config['DATABASES']['default']
+        self.assertEqual(default['ENGINE'], 'django.db.backends.postgresql')
+        self.assertEqual(default['CONN_MAX_AGE'], 0)
+        self.assertTrue(default['CONN_HEALTH_CHECKS'])
+        self.assertEqual(default['OPTIONS']['pool']['max_size'], 5)
+        self.assertEqual(default['OPTIONS']['pool']['min_size'], 5)
+        self.assertLessEqual(config['WEB_CONCURRENCY'] * config['DB_POOL_MAX'], config['DB_POOL_TOTAL'])
+
+    def test_pool_insuficiente_para_los_workers(self):
+        with self.assertRaisesMessage(ImproperlyConfigured, 'DB_POOL_TOTAL >= 10'):
+            self.cargar_settings(WEB_CONCURRENCY='5', DB_POOL_TOTAL='8')
+
+    def test_perfiles_sin_pool(self):
+        config = self.cargar_settings(DB_POOL='0', CONN_MAX_AGE='120')
+        self.assertEqual(config['DATABASES']['default']['CONN_MAX_AGE'], 120)
+        self.assertNotIn('pool', config['DATABASES']['default'].get('OPTIONS', {}))
+
+        config = self.cargar_settings(DATABASE_PROFILE='sqlite')
+        self.assertEqual(config['DATABASES']['default']['ENGINE'], 'core.db_backends.sqlite3')
+        self.assertEqual(config['DATABASES']['default']['OPTIONS']['transaction_mode'], 'IMMEDIATE')
+        config = self.cargar_settings(DATABASE_PROFILE='sqlite', SQLITE_CONCURRENCY='0')
+        self.assertEqual(config['DATABASES']['default']['ENGINE'], 'django.db.backends.sqlite3')
+
+    def test_estado_conexiones(self):
+        _, superadmin = crear_usuario('superadmin_conexiones', 'superadmin')
+        _, admin = crear_usuario('admin_conexiones', 'admin')
+        self.assertEqual(admin.get('/api/admin/conexiones/estado/').status_code, 403)
+
+        response = superadmin.get('/api/admin/conexiones/estado/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['profile'], 'sqlite')
+        self.assertEqual(response.data['pid'], os.getpid())
+        default = next(base for base in response.data['databases'] if base['alias'] == 'default')
+        self.assertEqual((default['vendor'], default['pooled']), ('sqlite', False))
+
+        pool = SimpleNamespace(min_size=2, max_size=5, timeout=10.0, get_stats=lambda: {'pool_size': 3})
+        with mock.patch.object(connections['default'], 'pool', pool, create=True):
+            response = superadmin.get('/api/admin/conexiones/estado/')
+        default = next(base for base in response.data['databases'] if base['alias'] == 'default')
+        self.assertTrue(default['pooled'])
+        self.assertEqual(default['pool'], {'min_size': 2, 'max_size': 5, 'timeout': 10.0,
+                                           'stats': {'pool_size': 3}})
+
+
+class EscriturasConcurrentesSQLiteTests(SimpleTestCase):
+    """Backend core/db_backends/sqlite3 sobre un archivo temporal (no la base de pruebas)"""
+
+    alias = 'sqlite_concurrente'
+    # '__all__' se resuelve en setUpClass, cuando el alias ya existe; con el
+    # alias en 'databases' el runner lo buscaría antes de crearlo
+    databases = '__all__'
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directorio = tempfile.mkdtemp()
+        cls.path = os.path.join(cls.directorio, 'concurrente.sqlite3')
+        connections.settings[cls.alias] = connections.configure_settings({
+            'default': {},
+            cls.alias: BenchmarkEscrituras().configurar('concurrente', cls.path, 5),
+        })[cls.alias]
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections[cls.alias].close()
+        del connections[cls.alias]
+        del connections.settings[cls.alias]
+        shutil.rmtree(cls.directorio, ignore_errors=True)
+
+    def setUp(self):
+        self.conexion = connections[self.alias]
+        self.addCleanup(self.conexion.close)
+        with self.conexion.cursor() as cursor:
+            cursor.execute("DROP TABLE IF EXISTS letra")
+            cursor.execute("CREATE TABLE letra (id INTEGER PRIMARY KEY, monto INTEGER)")
+
+    def candado_libre(self):
+        # El candado es reentrante: hay que probarlo desde otro hilo
+        resultado = []
+
+        def probar():
+            candado = get_write_lock(self.path)
+            resultado.append(candado.acquire(timeout=0))
+            if resultado[0]:
+                candado.release()
+
+        hilo = threading.Thread(target=probar)
+        hilo.start()
+        hilo.join()
+        return resultado[0]
+
+    def insertar(self):
+        with connections[self.alias].cursor() as cursor:
+            cursor.execute("INSERT INTO letra (monto) VALUES (0)")
+
+    def test_escritores_concurrentes_sin_bloqueos(self):
+        errores = []
+
+        def escritor(indice):
+            try:
+                for n in range(40):
+                    if n % 2:
+                        self.insertar()
+                    else:
+                        # Lee y luego escribe en la misma transacción, como Letra.save()
+                        with transaction.atomic(using=self.alias):
+                            with connections[self.alias].cursor() as cursor:
+                                cursor.execute("SELECT COALESCE(MAX(monto), 0) FROM letra")
+                                cursor.execute("INSERT INTO letra (monto) VALUES (%s)", [cursor.fetchone()[0] + 1])
+            except OperationalError as e:
+                errores.append(str(e))
+            finally:
+                connections[self.alias].close()
+
+        hilos = [threading.Thread(target=escritor, args=(i,)) for i in range(6)]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        self.assertEqual(errores, [])
+        with self.conexion.cursor() as cursor:
+            cursor.execute("SELECT COUNT(*), MAX(monto) FROM letra")
+            # Las transacciones no se pisan: cada lectura ve la escritura anterior
+            self.assertEqual(cursor.fetchone(), (6 * 40, 6 * 20))
+        self.assertTrue(self.candado_libre())
+
+    def test_candado_liberado_tras_commit(self):
+        with transaction.atomic(using=self.alias):
+            self.insertar()
+            self.assertTrue(self.conexion.holds_write_lock)
+            self.assertFalse(self.candado_libre())
+        self.assertFalse(self.conexion.holds_write_lock)
+        self.assertTrue(self.candado_libre())
+
+        # Escritura suelta en autocommit
+        self.insertar()
+        self.assertFalse(self.conexion.holds_write_lock)
+        self.assertTrue(self.candado_libre())
+
+    def test_candado_liberado_tras_rollback(self):
+        with self.assertRaises(ZeroDivisionError):
+            with transaction.atomic(using=self.alias):
+                self.insertar()
+                1 / 0
+        self.assertFalse(self.conexion.holds_write_lock)
+        self.assertTrue(self.candado_libre())
+        with self.conexion.cursor() as cursor:
+            cursor.execute("SELECT COUNT(*) FROM letra")
+            self.assertEqual(cursor.fetchone()[0], 0)
+
+    def test_candado_liberado_al_cerrar(self):
+        # Sin autocommit sqlite3 abre una transacción implícita que conserva el candado
+        self.conexion.set_autocommit(False)
+        self.insertar()
+        self.assertTrue(self.conexion.holds_write_lock)
+        self.assertFalse(self.candado_libre())
+        self.conexion.close()
+        self.assertFalse(self.conexion.holds_write_lock)
+        self.assertTrue(self.candado_libre())
@@ -11,8 +11,12 @@ from .views import (
     DistribucionFinalViewSet,
     distribuciones_pendientes,
     crear_letras_masivamente,
-    dashboard_estadisticas
+    batch,
+    dashboard_estadisticas,
+    buscar,
+    autocompletar
 )
+from . import views_async
 
 router = routers.DefaultRouter()
 router.register('empresas', EmpresaViewSet)
@@ -31,7 +35,16 @@ distribuciones_router.register('distribuciones', DistribucionFinalViewSet, basen
 urlpatterns = [
     path('distribuciones/no-asignadas/', distribuciones_pendientes),
     path('letras/bulk_create/', crear_letras_masivamente),
+    path('batch/', batch, name='batch'),
     path('dashboard/estadisticas/', dashboard_estadisticas, name='dashboard-estadisticas'),
+    path('buscar/', buscar, name='buscar'),
+    path('autocompletar/', autocompletar, name='autocompletar'),
+    path('eventos/', views_async.eventos, name='eventos'),
+    # Variantes async de los endpoints de lectura pesados (ver views_async.py)
+    path('async/dashboard/estadisticas/', views_async.dashboard_estadisticas, name='async-dashboard-estadisticas'),
+    path('async/letras/', views_async.letras, name='async-letras'),
+    path('async/letras/proximas_vencer/', views_async.proximas_vencer, name='async-proximas-vencer'),
+    path('async/pedidos/<str:pk>/resumen/', views_async.resumen_pedido, name='async-resumen-pedido'),
     path('', include(router.urls)),
     path('', include(distribuciones_router.urls)),
 ]
\ No newline at end of file
@@ -1,5 +1,5 @@
 from rest_framework import viewsets, permissions, status, filters, serializers
-from django.db.models import Prefetch, Count, Sum, Q
+from django.db.models import Prefetch, Count, Sum, Q, F, OuterRef, Subquery
 from django.utils import timezone
 from rest_framework.decorators import api_view, permission_classes, action
 from rest_framework.response import Response
@@ -31,9 +31,34 @@ from .serializers import (
 
 # Importamos los permisos personalizados de la app de autenticación
 from authentication.views import IsSuperAdmin, IsAdminUser
+from core.batch import BatchError, execute_batch, parse_batch
+from core.db_routers import ReplicaReadMixin, solo_lectura, usar_replica
+from core.json_stream import json_list_response
+from core.query_budget import presupuesto_consultas
+from .busqueda import IndiceSearchFilter, RelevanciaOrderingFilter, buscar as buscar_en_indice, DOCUMENTOS
+from .autocompletar import autocompletado, FUENTES
+from .sincronizacion import SincronizacionMixin
+from .concurrencia import ConcurrenciaOptimistaMixin
+from .campos_parciales import CamposParcialesMixin
+from .lectura_compilada import LecturaCompiladaMixin
+
+# Relaciones que anida PedidoSerializer
+PEDIDO_PREFETCH = (
+    'letras__empresa',
+    'guias_remision__empresa',
+    'guias_remision__facturas',
+    'distribuciones_finales__empresa',
+    'distribuciones_finales__letras',
+)
 
 # Mixin para aplicar permisos basados en roles
-class RoleBasedPermissionMixin:
+# (los usuarios de solo lectura leen de la réplica, si está configurada;
+# los listados admiten ?since=, ver sincronizacion.py; las escrituras
+# If-Match, ver concurrencia.py, las lecturas ?fields=/?omit=, ver
+# campos_parciales.py, y los listados grandes se serializan desde
+# values_list(), ver lectura_compilada.py)
+class RoleBasedPermissionMixin(SincronizacionMixin, LecturaCompiladaMixin, ConcurrenciaOptimistaMixin,
+                               CamposParcialesMixin, ReplicaReadMixin):
     def get_permissions(self):
         """
         - Superadmin y Admin pueden hacer todo
@@ -55,9 +80,20 @@ class RoleBasedPermissionMixin:
         serializer.save(updated_by=self.request.user)
 
 
+def _total_por_empresa(modelo, total, **filtro):
+    """Subconsulta con un total de las filas de modelo de cada empresa"""
+    return Subquery(
+        modelo.objects.filter(empresa=OuterRef('pk'), **filtro).order_by()
+        .values('empresa').annotate(total=total).values('total')
+    )
+
+
 class EmpresaViewSet(RoleBasedPermissionMixin, viewsets.ModelViewSet):
     queryset = Empresa.objects.all()
     serializer_class = EmpresaSerializer
+    # Consultas máximas por acción: número o (base, por elemento); ver core/query_budget.py.
+    # Los listados incluyen la consulta de la marca de sincronización (sincronizacion.py)
+    query_budget = {'list': 4, 'retrieve': 10}
     filter_backends = [filters.SearchFilter, filters.OrderingFilter]
     search_fields = ['nombre', 'ruc']
     ordering_fields = ['nombre', 'created_at']
@@ -65,7 +101,18 @@ class EmpresaViewSet(RoleBasedPermissionMixin, viewsets.ModelViewSet):
     
     def get_queryset(self):
         """Optimiza las consultas para reducir el número de queries"""
-        queryset = Empresa.objects.all()
+        # Los totales van en subconsultas: con joins a letras y facturas a la
+        # vez las sumas se multiplicarían
+        totales = {
+            'total_letras': ('suma_letras', _total_por_empresa(Letra, Sum('monto'))),
+            'total_facturado': ('suma_facturas', _total_por_empresa(Factura, Sum('monto_factura'))),
+            'letras_pendientes': ('num_letras_pendientes',
+                                  _total_por_empresa(Letra, Count('pk'), estado='pendiente')),
+            'facturas_emitidas': ('num_facturas', _total_por_empresa(Factura, Count('pk'))),
+        }
+        queryset = Empresa.objects.annotate(**{
+            anotacion: expresion for campo, (anotacion, expresion) in totales.items() if self.campo_incluido(campo)
+        })
         
         # Si estamos obteniendo el detalle, hacemos prefetch de relaciones
         if self.action == 'retrieve':
@@ -80,6 +127,7 @@ class EmpresaViewSet(RoleBasedPermissionMixin, viewsets.ModelViewSet):
 class VendedorViewSet(RoleBasedPermissionMixin, viewsets.ModelViewSet):
     queryset = Vendedor.objects.all()
     serializer_class = VendedorSerializer
+    query_budget = {'list': 4, 'retrieve': 4}
     filter_backends = [filters.SearchFilter, filters.OrderingFilter]
     search_fields = ['nombre', 'telefono', 'email']
     ordering_fields = ['nombre', 'created_at']
@@ -87,6 +135,8 @@ class VendedorViewSet(RoleBasedPermissionMixin, viewsets.ModelViewSet):
     
     def get_queryset(self):
         queryset = Vendedor.objects.all()
+        if self.campo_incluido('proveedores_count'):
+            queryset = queryset.annotate(num_proveedores=Count('proveedor'))
         
         # Filtrar vendedores activos si se especifica en la URL
         activo = self.request.query_params.get('activo', None)
@@ -99,13 +149,28 @@ class VendedorViewSet(RoleBasedPermissionMixin, viewsets.ModelViewSet):
 class ProveedorViewSet(RoleBasedPermissionMixin, viewsets.ModelViewSet):
     queryset = Proveedor.objects.all()
     serializer_class = ProveedorSerializer
-    filter_backends = [filters.SearchFilter, filters.OrderingFilter]
+    # 'pedidos' va en streaming si es largo: cada bloque repite los 8
+    # prefetch_related de PEDIDO_PREFETCH (ver core/query_budget.py)
+    query_budget = {'list': 4, 'retrieve': 3, 'listado_ordenado': 3, 'pedidos': (12, 0, 8)}
+    filter_backends = [IndiceSearchFilter, RelevanciaOrderingFilter]
+    search_index = 'proveedor'  # ?search= usa el índice de búsqueda (ver busqueda.py)
     search_fields = ['nombre', 'ruc', 'vendedor__nombre']
+    search_substring_fields = ['ruc', 'identificador']
     ordering_fields = ['nombre', 'created_at']
     ordering = ['nombre']
+    replica_actions = ['pedidos', 'listado_ordenado']
     
     def get_queryset(self):
-        queryset = Proveedor.objects.all().select_related('vendedor')
+        # Los totales de pedidos se anotan aquí para que el serializer no
+        # haga tres consultas por proveedor (solo los que se van a devolver)
+        totales = {
+            'pedidos_count': ('num_pedidos', Count('pedidos')),
+            'pedidos_pendientes': ('num_pedidos_pendientes', Count('pedidos', filter=Q(pedidos__completado=False))),
+            'monto_total_pedidos': ('suma_pedidos', Sum('pedidos__monto_total_pedido')),
+        }
+        queryset = Proveedor.objects.all().select_related('vendedor').annotate(**{
+            anotacion: expresion for campo, (anotacion, expresion) in totales.items() if self.campo_incluido(campo)
+        })
         
         # Filtrar por vendedor si se especifica en la URL
         vendedor_id = self.request.query_params.get('vendedor', None)
@@ -123,9 +188,11 @@ class ProveedorViewSet(RoleBasedPermissionMixin, viewsets.ModelViewSet):
     def pedidos(self, request, pk=None):
         """Endpoint para obtener los pedidos de un proveedor específico"""
         proveedor = self.get_object()
-        pedidos = Pedido.objects.filter(proveedor=proveedor).order_by('-fecha_pedido')
-        serializer = PedidoSerializer(pedidos, many=True)
-        return Response(serializer.data)
+        pedidos = Pedido.objects.filter(proveedor=proveedor).select_related(
+            'proveedor'
+        ).prefetch_related(*PEDIDO_PREFETCH).order_by('-fecha_pedido')
+        # Un proveedor con muchos pedidos se envía en streaming (ver core/json_stream.py)
+        return json_list_response(request, pedidos, lambda filas: PedidoSerializer(filas, many=True).data)
 
     @action(detail=False, methods=['get'])
     def listado_ordenado(self, request):
@@ -150,11 +217,15 @@ class StandardResultsSetPagination(PageNumberPagination):
 class PedidoViewSet(RoleBasedPermissionMixin, viewsets.ModelViewSet):
     queryset = Pedido.objects.all()
     serializer_class = PedidoSerializer
-    filter_backends = [filters.SearchFilter, filters.OrderingFilter]
+    query_budget = {'list': 13, 'retrieve': 10, 'resumen': 7}
+    filter_backends = [IndiceSearchFilter, RelevanciaOrderingFilter]
+    search_index = 'pedido'  # ?search= usa el índice de búsqueda (ver busqueda.py)
     search_fields = ['proveedor__nombre', 'descripcion', 'numero_pedido']
+    search_substring_fields = ['numero_pedido']
     ordering_fields = ['fecha_pedido', 'monto_total_pedido', 'estado', 'proveedor__nombre', 'es_contado']
     ordering = ['-fecha_pedido']
     pagination_class = StandardResultsSetPagination
+    replica_actions = ['resumen']
     
     def get_queryset(self):
         queryset = Pedido.objects.select_related('proveedor')
@@ -191,15 +262,10 @@ class PedidoViewSet(RoleBasedPermissionMixin, viewsets.ModelViewSet):
             es_contado = tipo.lower() == 'true'
             queryset = queryset.filter(es_contado=es_contado)
         
-        # Para consultas detalladas, optimizamos con prefetch
-        if self.action == 'retrieve':
-            queryset = queryset.prefetch_related(
-                'letras__empresa',
-                'guias_remision__empresa',
-                'guias_remision__facturas',
-                'distribuciones_finales__empresa',
-                'distribuciones_finales__letras'
-            )
+        # El serializer anida letras, guías y distribuciones: prefetch para
+        # el detalle y el listado
+        if self.action in ('list', 'retrieve'):
+            queryset = queryset.prefetch_related(*PEDIDO_PREFETCH)
             
         return queryset
     
@@ -249,13 +315,49 @@ class PedidoViewSet(RoleBasedPermissionMixin, viewsets.ModelViewSet):
         })
 
 
+def filtrar_letras(queryset, params):
+    """Filtros del listado de letras (también los usa la versión async del calendario)"""
+    # Filtrar por rango de fechas de pago
+    fecha_desde = params.get('fecha_desde', None)
+    fecha_hasta = params.get('fecha_hasta', None)
+    
+    if fecha_desde:
+        queryset = queryset.filter(fecha_pago__gte=fecha_desde)
+    if fecha_hasta:
+        queryset = queryset.filter(fecha_pago__lte=fecha_hasta)
+        
+    # Filtrar por empresa
+    empresa_id = params.get('empresa', None)
+    if empresa_id:
+        queryset = queryset.filter(empresa_id=empresa_id)
+        
+    # Filtrar por estado
+    estado = params.get('estado', None)
+    if estado:
+        queryset = queryset.filter(estado=estado)
+        
+    # Filtrar por proveedor (copia del proveedor del pedido, sin join)
+    proveedor_id = params.get('proveedor', None)
+    if proveedor_id:
+        queryset = queryset.filter(proveedor_id=proveedor_id)
+        
+    return queryset
+
+
 class LetraViewSet(RoleBasedPermissionMixin, viewsets.ModelViewSet):
     queryset = Letra.objects.all()
     serializer_class = LetraSerializer
-    filter_backends = [filters.SearchFilter, filters.OrderingFilter]
+    query_budget = {'list': 4, 'retrieve': 3, 'proximas_vencer': 3}
+    filter_backends = [IndiceSearchFilter, RelevanciaOrderingFilter]
+    search_index = 'letra'  # ?search= usa el índice de búsqueda (ver busqueda.py)
     search_fields = ['pedido__proveedor__nombre', 'empresa__nombre', 'numero_unico']
+    search_substring_fields = ['numero_unico']
     ordering_fields = ['fecha_pago', 'monto', 'estado']
     ordering = ['fecha_pago']
+    # El calendario consulta el listado completo de letras
+    replica_actions = ['list', 'proximas_vencer']
+    # ...y se serializa sin instancias del modelo (ver lectura_compilada.py)
+    lectura_compilada = ['list', 'proximas_vencer']
     
     def get_queryset(self):
         queryset = Letra.objects.select_related(
@@ -263,32 +365,7 @@ class LetraViewSet(RoleBasedPermissionMixin, viewsets.ModelViewSet):
             'empresa', 
             'distribucion'
         )
-        
-        # Filtrar por rango de fechas de pago
-        fecha_desde = self.request.query_params.get('fecha_desde', None)
-        fecha_hasta = self.request.query_params.get('fecha_hasta', None)
-        
-        if fecha_desde:
-            queryset = queryset.filter(fecha_pago__gte=fecha_desde)
-        if fecha_hasta:
-            queryset = queryset.filter(fecha_pago__lte=fecha_hasta)
-            
-        # Filtrar por empresa
-        empresa_id = self.request.query_params.get('empresa', None)
-        if empresa_id:
-            queryset = queryset.filter(empresa_id=empresa_id)
-            
-        # Filtrar por estado
-        estado = self.request.query_params.get('estado', None)
-        if estado:
-            queryset = queryset.filter(estado=estado)
-            
-        # Filtrar por proveedor (a través del pedido)
-        proveedor_id = self.request.query_params.get('proveedor', None)
-        if proveedor_id:
-            queryset = queryset.filter(pedido__proveedor_id=proveedor_id)
-            
-        return queryset
+        return filtrar_letras(queryset, self.request.query_params)
     
     @action(detail=True, methods=['post'])
     def marcar_pagada(self, request, pk=None):
@@ -327,15 +404,17 @@ class LetraViewSet(RoleBasedPermissionMixin, viewsets.ModelViewSet):
             fecha_pago__lte=limite
         ).select_related('pedido__proveedor', 'empresa').order_by('fecha_pago')
         
-        serializer = self.get_serializer(letras, many=True)
-        return Response(serializer.data)
+        return self.respuesta_lectura(letras)
 
 
 class GuiaDeRemisionViewSet(RoleBasedPermissionMixin, viewsets.ModelViewSet):
     queryset = GuiaDeRemision.objects.all()
     serializer_class = GuiaDeRemisionSerializer
-    filter_backends = [filters.SearchFilter, filters.OrderingFilter]
+    query_budget = {'list': 5, 'retrieve': 6}
+    filter_backends = [IndiceSearchFilter, RelevanciaOrderingFilter]
+    search_index = 'guia'  # ?search= usa el índice de búsqueda (ver busqueda.py)
     search_fields = ['numero_guia', 'pedido__proveedor__nombre', 'empresa__nombre']
+    search_substring_fields = ['numero_guia']
     ordering_fields = ['fecha_emision', 'estado']
     ordering = ['-fecha_emision']
     
@@ -366,8 +445,11 @@ class GuiaDeRemisionViewSet(RoleBasedPermissionMixin, viewsets.ModelViewSet):
 class FacturaViewSet(RoleBasedPermissionMixin, viewsets.ModelViewSet):
     queryset = Factura.objects.all()
     serializer_class = FacturaSerializer
-    filter_backends = [filters.SearchFilter, filters.OrderingFilter]
+    query_budget = {'list': 4, 'retrieve': 3}
+    filter_backends = [IndiceSearchFilter, RelevanciaOrderingFilter]
+    search_index = 'factura'  # ?search= usa el índice de búsqueda (ver busqueda.py)
     search_fields = ['numero_factura', 'guia_remision__numero_guia', 'guia_remision__empresa__nombre']
+    search_substring_fields = ['numero_factura']
     ordering_fields = ['fecha_emision', 'fecha_vencimiento', 'estado']
     ordering = ['-fecha_emision']
     
@@ -387,10 +469,15 @@ class FacturaViewSet(RoleBasedPermissionMixin, viewsets.ModelViewSet):
         if estado:
             queryset = queryset.filter(estado=estado)
             
-        # Filtrar por empresa (a través de la guía)
+        # Filtrar por empresa (copia de la empresa de la guía, sin join)
         empresa_id = self.request.query_params.get('empresa', None)
         if empresa_id:
-            queryset = queryset.filter(guia_remision__empresa_id=empresa_id)
+            queryset = queryset.filter(empresa_id=empresa_id)
+
+        # Filtrar por proveedor
+        proveedor_id = self.request.query_params.get('proveedor', None)
+        if proveedor_id:
+            queryset = queryset.filter(proveedor_id=proveedor_id)
             
         # Filtrar facturas vencidas
         vencidas = self.request.query_params.get('vencidas', None)
@@ -415,6 +502,7 @@ class FacturaViewSet(RoleBasedPermissionMixin, viewsets.ModelViewSet):
 class DistribucionFinalViewSet(RoleBasedPermissionMixin, viewsets.ModelViewSet):
     queryset = DistribucionFinal.objects.all()
     serializer_class = DistribucionFinalSerializer
+    query_budget = {'list': 4, 'retrieve': 6}
     filter_backends = [filters.SearchFilter, filters.OrderingFilter]
     search_fields = ['pedido__proveedor__nombre', 'empresa__nombre']
     ordering_fields = ['monto_final', 'pedido__fecha_pedido']
@@ -482,21 +570,25 @@ class DistribucionFinalViewSet(RoleBasedPermissionMixin, viewsets.ModelViewSet):
                 pedido.save(update_fields=['completado', 'estado'])
 
 
+@presupuesto_consultas(3)
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@usar_replica
 def distribuciones_pendientes(request):
     """Obtiene las distribuciones que aún tienen monto disponible para asignar letras"""
     
-    # Anotar cada distribución con el total de letras
+    # Anotar cada distribución con los totales de sus letras (los usa
+    # DistribucionFinalSerializer en vez de consultar por distribución)
     distribuciones = DistribucionFinal.objects.annotate(
-        total_letras=Sum('letras__monto')
+        suma_letras=Sum('letras__monto'),
+        num_letras_pendientes=Count('letras', filter=Q(letras__estado='pendiente')),
     ).filter(
-        Q(total_letras__lt=models.F('monto_final')) | 
-        Q(total_letras__isnull=True)
+        Q(suma_letras__lt=F('monto_final')) | 
+        Q(suma_letras__isnull=True)
     ).select_related('pedido__proveedor', 'empresa')
     
-    serializer = DistribucionFinalSerializer(distribuciones, many=True)
-    return Response(serializer.data)
+    return json_list_response(request, distribuciones,
+                              lambda filas: DistribucionFinalSerializer(filas, many=True).data)
 
 
 @api_view(['POST'])
@@ -552,8 +644,25 @@ def crear_letras_masivamente(request):
     return Response(serializer.data, status=status.HTTP_201_CREATED)
 
 
+@solo_lectura
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def batch(request):
+    """
+    Ejecuta varios GET de la API en una sola petición (ver core/batch.py).
+    Cuerpo: {"requests": [{"method", "path", "params"}, ...], "snapshot": bool}
+    """
+    try:
+        peticiones, snapshot = parse_batch(request.data)
+    except BatchError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    return Response({'responses': execute_batch(request, peticiones, snapshot)})
+
+
+@presupuesto_consultas(30)
 @api_view(['GET'])
 @permission_classes([permissions.IsAuthenticated])
+@usar_replica
 def dashboard_estadisticas(request):
     """
     Proporciona estadísticas para el dashboard
@@ -611,67 +720,71 @@ def dashboard_estadisticas(request):
     # Montos por tipo de pedido
     monto_pedidos_contado = Pedido.objects.filter(
         es_contado=True
-    ).aggregate(total=Sum('monto_total'))['total'] or 0
+    ).aggregate(total=Sum('monto_total_pedido'))['total'] or 0
     
     monto_pedidos_credito = Pedido.objects.filter(
         es_contado=False
-    ).aggregate(total=Sum('monto_total'))['total'] or 0
+    ).aggregate(total=Sum('monto_total_pedido'))['total'] or 0
     
     # Monto total de pedidos recientes
     monto_pedidos_recientes = Pedido.objects.filter(
         fecha_pedido__gte=hoy - timezone.timedelta(days=30)
-    ).aggregate(total=Sum('monto_total'))['total'] or 0
+    ).aggregate(total=Sum('monto_total_pedido'))['total'] or 0
     
     # Estadísticas por empresa (solo para admin y superadmin)
+    # Los totales se agrupan en una consulta por concepto en lugar de
+    # consultar por cada empresa o proveedor
     empresas_stats = []
     if request.user.perfil.es_admin:
+        letras_por_empresa = {
+            fila['empresa']: fila
+            for fila in Letra.objects.filter(estado='pendiente').order_by().values('empresa').annotate(
+                cantidad=Count('id'), total=Sum('monto')
+            )
+        }
+        facturas_por_empresa = dict(
+            Factura.objects.filter(estado='emitida').order_by().values_list(
+                'empresa'
+            ).annotate(cantidad=Count('id'))
+        )
         empresas = Empresa.objects.all()
         for empresa in empresas:
             # Letras pendientes y monto para esta empresa
-            letras_empresa = Letra.objects.filter(
-                empresa=empresa,
-                estado='pendiente'
-            )
-            monto_pendiente_empresa = letras_empresa.aggregate(total=Sum('monto'))['total'] or 0
-            
-            # Facturas pendientes
-            facturas_pendientes = Factura.objects.filter(
-                guia_remision__empresa=empresa,
-                estado='emitida'
-            ).count()
+            letras_empresa = letras_por_empresa.get(empresa.id, {})
             
             empresas_stats.append({
                 'id': empresa.id,
                 'nombre': empresa.nombre,
-                'letras_pendientes': letras_empresa.count(),
-                'monto_pendiente': float(monto_pendiente_empresa),
-                'facturas_pendientes': facturas_pendientes
+                'letras_pendientes': letras_empresa.get('cantidad', 0),
+                'monto_pendiente': float(letras_empresa.get('total') or 0),
+                'facturas_pendientes': facturas_por_empresa.get(empresa.id, 0)
             })
     
     # Estadísticas por proveedor (solo para admin y superadmin)
     proveedores_stats = []
     if request.user.perfil.es_admin:
+        pedidos_por_proveedor = dict(
+            Pedido.objects.filter(completado=False).order_by().values_list(
+                'proveedor'
+            ).annotate(cantidad=Count('id'))
+        )
+        letras_por_proveedor = {
+            fila['proveedor']: fila
+            for fila in Letra.objects.filter(estado='pendiente').order_by().values(
+                'proveedor'
+            ).annotate(cantidad=Count('id'), total=Sum('monto'))
+        }
         proveedores = Proveedor.objects.filter(activo=True)
         for proveedor in proveedores:
-            # Pedidos pendientes de este proveedor
-            pedidos_proveedor = Pedido.objects.filter(
-                proveedor=proveedor,
-                completado=False
-            )
-            
             # Letras pendientes asociadas a este proveedor
-            letras_proveedor = Letra.objects.filter(
-                pedido__proveedor=proveedor,
-                estado='pendiente'
-            )
-            monto_pendiente_proveedor = letras_proveedor.aggregate(total=Sum('monto'))['total'] or 0
+            letras_proveedor = letras_por_proveedor.get(proveedor.id, {})
             
             proveedores_stats.append({
                 'id': proveedor.id,
                 'nombre': proveedor.nombre,
-                'pedidos_pendientes': pedidos_proveedor.count(),
-                'letras_pendientes': letras_proveedor.count(),
-                'monto_pendiente': float(monto_pendiente_proveedor)
+                'pedidos_pendientes': pedidos_por_proveedor.get(proveedor.id, 0),
+                'letras_pendientes': letras_proveedor.get('cantidad', 0),
+                'monto_pendiente': float(letras_proveedor.get('total') or 0)
             })
             
     # Próximos vencimientos (letras a vencer en los próximos 7 días)
@@ -714,4 +827,62 @@ def dashboard_estadisticas(request):
         'empresas': empresas_stats,
         'proveedores': proveedores_stats,
         'proximos_vencimientos': proximos_vencimientos
-    })
\ No newline at end of file
+    })
+
+@presupuesto_consultas(3)
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+@usar_replica
+def buscar(request):
+    """
+    Búsqueda de texto completo en pedidos, letras, proveedores, guías y
+    facturas, ordenada por relevancia.
+    Parámetros: q (texto), tipo (uno o varios separados por coma), limite.
+    """
+    texto = request.query_params.get('q', '').strip()
+    if not texto:
+        return Response({'error': 'El parámetro q es obligatorio'}, status=status.HTTP_400_BAD_REQUEST)
+
+    tipos = [t for t in request.query_params.get('tipo', '').split(',') if t]
+    invalidos = [t for t in tipos if t not in DOCUMENTOS]
+    if invalidos:
+        return Response(
+            {'error': f"Tipo inválido: {', '.join(invalidos)}. Opciones: {', '.join(DOCUMENTOS)}"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    try:
+        limite = min(max(int(request.query_params.get('limite', 20)), 1), 100)
+    except ValueError:
+        return Response({'error': 'limite debe ser un número'}, status=status.HTTP_400_BAD_REQUEST)
+
+    resultados = buscar_en_indice(texto, tipos or None, limite)
+    return Response({'q': texto, 'count': len(resultados), 'results': resultados})
+
+
+@presupuesto_consultas(4)
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def autocompletar(request):
+    """
+    Sugerencias por prefijo para los selectores de proveedor, empresa y
+    vendedor, desde el índice en memoria (sin consultas salvo al construirlo).
+    Parámetros: q, tipo (uno o varios separados por coma), limite, inactivos=1.
+    """
+    tipos = [t for t in request.query_params.get('tipo', '').split(',') if t]
+    invalidos = [t for t in tipos if t not in FUENTES]
+    if invalidos:
+        return Response(
+            {'error': f"Tipo inválido: {', '.join(invalidos)}. Opciones: {', '.join(FUENTES)}"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    try:
+        limite = min(max(int(request.query_params.get('limite', 10)), 1), 50)
+    except ValueError:
+        return Response({'error': 'limite debe ser un número'}, status=status.HTTP_400_BAD_REQUEST)
+
+    resultados = autocompletado.buscar(
+        request.query_params.get('q', ''), tipos or None, limite,
+        incluir_inactivos=request.query_params.get('inactivos') == '1',
+    )
+    return Response(resultados)
@@ -0,0 +1,339 @@
+"""
+Vistas asíncronas para ASGI (core/asgi.py).
+
+Variantes async de los endpoints de lectura más pesados, bajo /api/async/,
+con las mismas respuestas que sus equivalentes síncronos de views.py:
+
+- dashboard/estadisticas/: las estadísticas generales se calculan con dos
+  agregados condicionales en lugar de quince consultas, y los bloques
+  independientes (generales, empresas, proveedores, vencimientos) se
+  lanzan a la vez con asyncio.gather.
+- letras/: el listado del calendario, con los filtros de LetraViewSet.
+- letras/proximas_vencer/ y pedidos/<pk>/resumen/.
+
+Usan el ORM async de Django. Sus consultas todavía se ejecutan en un hilo
+(el ORM async envuelve al síncrono), pero mientras esperan a la base de
+datos el bucle de eventos atiende otras peticiones: un dashboard lento no
+ocupa un worker entero como con gunicorn síncrono. Para eso la app se
+sirve por ASGI (start.sh: gunicorn con workers de uvicorn); con WSGI
+también funcionan, aunque sin esa ventaja. 'benchmark_api --asgi' compara
+el rendimiento concurrente de ambas versiones.
+
+Aquí también está el flujo de eventos SSE (/api/eventos/), que solo
+funciona con ASGI.
+"""
+import asyncio
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.handlers.asgi import ASGIRequest
+from django.db.models import Count, Sum, Q
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from core.db_routers import read_from, replica_alias_for
+from core.events import broadcaster, format_sse
+from core.query_budget import presupuesto_consultas
+from .models import Empresa, Proveedor, Pedido, Letra, Factura
+from .serializers import LetraSerializer
+from .views import filtrar_letras
+
+
+async def usuario_por_token(request):
+    """Usuario del token (cabecera Authorization o ?token=, porque EventSource no manda cabeceras)"""
+    cabecera = request.headers.get('Authorization', '')
+    clave = cabecera[6:].strip() if cabecera.startswith('Token ') else request.GET.get('token', '')
+    if not clave:
+        return None
+    try:
+        token = await Token.objects.select_related('user__perfil').aget(key=clave)
+    except Token.DoesNotExist:
+        return None
+    return token.user if token.user.is_active else None
+
+
+def vista_async(replica=False):
+    """
+    Solo GET y con token (401 si no). Con replica=True las lecturas van a
+    la réplica cuando el usuario puede usarla, como @usar_replica.
+    """
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(request, *args, **kwargs):
+            if request.method != 'GET':
+                return JsonResponse({'error': 'Método no permitido'}, status=405)
+            user = await usuario_por_token(request)
+            if user is None:
+                return JsonResponse({'error': 'Autenticación requerida'}, status=401)
+            request.user = user
+            alias = await sync_to_async(replica_alias_for)(request, marked=True) if replica else None
+            with read_from(alias):
+                return await func(request, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _json(datos):
+    """Respuesta JSON compacta, como la de DRF"""
+    return JsonResponse(datos, safe=False, json_dumps_params={'separators': (',', ':')})
+
+
+async def _lista(queryset):
+    return [objeto async for objeto in queryset]
+
+
+# Dashboard -------------------------------------------------------------------
+
+async def _estadisticas_letras(hoy):
+    pendiente = Q(estado='pendiente')
+    proxima = pendiente & Q(fecha_pago__gte=hoy, fecha_pago__lte=hoy + timezone.timedelta(days=30))
+    totales = await Letra.objects.aaggregate(
+        letras_pendientes=Count('id', filter=pendiente),
+        letras_proximas=Count('id', filter=proxima),
+        letras_atrasadas=Count('id', filter=Q(estado='atrasado')),
+        letras_pagadas_recientes=Count(
+            'id', filter=Q(estado='pagado', fecha_pago_real__gte=hoy - timezone.timedelta(days=30))
+        ),
+        monto_pendiente=Sum('monto', filter=pendiente),
+        monto_proximo=Sum('monto', filter=proxima),
+    )
+    for monto in ('monto_pendiente', 'monto_proximo'):
+        totales[monto] = float(totales[monto] or 0)
+    return totales
+
+
+async def _estadisticas_pedidos(hoy):
+    reciente = Q(fecha_pedido__gte=hoy - timezone.timedelta(days=30))
+    semana = Q(fecha_pedido__gte=hoy - timezone.timedelta(days=7))
+    totales = await Pedido.objects.aaggregate(
+        pedidos_pendientes=Count('id', filter=Q(completado=False)),
+        pedidos_recientes=Count('id', filter=reciente),
+        pedidos_contado=Count('id', filter=Q(es_contado=True)),
+        pedidos_credito=Count('id', filter=Q(es_contado=False)),
+        pedidos_recientes_contado=Count('id', filter=Q(es_contado=True) & semana),
+        pedidos_recientes_credito=Count('id', filter=Q(es_contado=False) & semana),
+        monto_pedidos_contado=Sum('monto_total_pedido', filter=Q(es_contado=True)),
+        monto_pedidos_credito=Sum('monto_total_pedido', filter=Q(es_contado=False)),
+        monto_pedidos_recientes=Sum('monto_total_pedido', filter=reciente),
+    )
+    for monto in ('monto_pedidos_contado', 'monto_pedidos_credito', 'monto_pedidos_recientes'):
+        totales[monto] = float(totales[monto] or 0)
+    return totales
+
+
+async def _estadisticas_empresas():
+    letras, facturas, empresas = await asyncio.gather(
+        _lista(Letra.objects.filter(estado='pendiente').order_by().values('empresa').annotate(
+            cantidad=Count('id'), total=Sum('monto')
+        )),
+        _lista(Factura.objects.filter(estado='emitida').order_by().values_list('empresa').annotate(
+            cantidad=Count('id')
+        )),
+        _lista(Empresa.objects.values_list('id', 'nombre')),
+    )
+    letras = {fila['empresa']: fila for fila in letras}
+    facturas = dict(facturas)
+    return [
+        {
+            'id': empresa_id,
+            'nombre': nombre,
+            'letras_pendientes': letras.get(empresa_id, {}).get('cantidad', 0),
+            'monto_pendiente': float(letras.get(empresa_id, {}).get('total') or 0),
+            'facturas_pendientes': facturas.get(empresa_id, 0),
+        }
+        for empresa_id, nombre in empresas
+    ]
+
+
+async def _estadisticas_proveedores():
+    pedidos, letras, proveedores = await asyncio.gather(
+        _lista(Pedido.objects.filter(completado=False).order_by().values_list('proveedor').annotate(
+            cantidad=Count('id')
+        )),
+        _lista(Letra.objects.filter(estado='pendiente').order_by().values('proveedor').annotate(
+            cantidad=Count('id'), total=Sum('monto')
+        )),
+        _lista(Proveedor.objects.filter(activo=True).values_list('id', 'nombre')),
+    )
+    pedidos = dict(pedidos)
+    letras = {fila['proveedor']: fila for fila in letras}
+    return [
+        {
+            'id': proveedor_id,
+            'nombre': nombre,
+            'pedidos_pendientes': pedidos.get(proveedor_id, 0),
+            'letras_pendientes': letras.get(proveedor_id, {}).get('cantidad', 0),
+            'monto_pendiente': float(letras.get(proveedor_id, {}).get('total') or 0),
+        }
+        for proveedor_id, nombre in proveedores
+    ]
+
+
+async def _proximos_vencimientos(hoy):
+    letras = await _lista(Letra.objects.filter(
+        estado='pendiente',
+        fecha_pago__gte=hoy,
+        fecha_pago__lte=hoy + timezone.timedelta(days=7)
+    ).select_related('empresa', 'pedido__proveedor').order_by('fecha_pago')[:10])
+    return [
+        {
+            'id': letra.id,
+            'fecha_pago': letra.fecha_pago,
+            'monto': float(letra.monto),
+            'empresa': letra.empresa.nombre if letra.empresa else None,
+            'proveedor': letra.pedido.proveedor.nombre if letra.pedido and letra.pedido.proveedor else None,
+            'dias_restantes': (letra.fecha_pago - hoy).days
+        }
+        for letra in letras
+    ]
+
+
+async def _vacia():
+    return []
+
+
+@presupuesto_consultas(10)
+@vista_async(replica=True)
+async def dashboard_estadisticas(request):
+    """Versión async de /api/dashboard/estadisticas/ (misma respuesta)"""
+    hoy = timezone.now().date()
+    es_admin = request.user.perfil.es_admin
+    letras, pedidos, empresas, proveedores, vencimientos = await asyncio.gather(
+        _estadisticas_letras(hoy),
+        _estadisticas_pedidos(hoy),
+        _estadisticas_empresas() if es_admin else _vacia(),
+        _estadisticas_proveedores() if es_admin else _vacia(),
+        _proximos_vencimientos(hoy),
+    )
+    return _json({
+        'estadisticas_generales': {**letras, **pedidos},
+        'empresas': empresas,
+        'proveedores': proveedores,
+        'proximos_vencimientos': vencimientos,
+    })
+
+
+# Calendario y reportes -------------------------------------------------------
+
+@presupuesto_consultas(3)
+@vista_async(replica=True)
+async def letras(request):
+    """
+    Versión async del listado de letras del calendario, con los mismos
+    filtros (fecha_desde, fecha_hasta, empresa, estado, proveedor).
+    """
+    queryset = filtrar_letras(
+        Letra.objects.select_related('pedido__proveedor', 'empresa', 'distribucion'), request.GET
+    ).order_by('fecha_pago')
+    return _json(LetraSerializer(await _lista(queryset), many=True).data)
+
+
+@presupuesto_consultas(3)
+@vista_async(replica=True)
+async def proximas_vencer(request):
+    """Versión async de /api/letras/proximas_vencer/"""
+    hoy = timezone.now().date()
+    queryset = Letra.objects.filter(
+        estado='pendiente',
+        fecha_pago__gte=hoy,
+        fecha_pago__lte=hoy + timezone.timedelta(days=30)
+    ).select_related('pedido__proveedor', 'empresa').order_by('fecha_pago')
+    return _json(LetraSerializer(await _lista(queryset), many=True).data)
+
+
+@presupuesto_consultas(5)
+@vista_async()
+async def resumen_pedido(request, pk):
+    """Versión async de /api/pedidos/<pk>/resumen/"""
+    try:
+        pedido = await Pedido.objects.select_related('proveedor').aget(pk=pk)
+    except (Pedido.DoesNotExist, ValidationError):
+        return JsonResponse({'detail': 'No encontrado.'}, status=404)
+
+    distribuciones, letras = await asyncio.gather(
+        pedido.distribuciones_finales.aaggregate(total=Sum('monto_final')),
+        pedido.letras.aaggregate(
+            total=Sum('monto'),
+            pendientes=Count('id', filter=Q(estado='pendiente')),
+            pagadas=Count('id', filter=Q(estado='pagado')),
+        ),
+    )
+    return _json({
+        'id': pedido.id,
+        'proveedor': pedido.proveedor.nombre,
+        'monto_total_pedido': float(pedido.monto_total_pedido),
+        'monto_final_pedido': float(pedido.monto_final_pedido) if pedido.monto_final_pedido else None,
+        'monto_pagado': float(pedido.monto_pagado),
+        'porcentaje_pagado': float(pedido.monto_pagado / pedido.monto_total_pedido * 100) if pedido.monto_total_pedido else 0,
+        'total_distribuciones': float(distribuciones['total'] or 0),
+        'total_letras': float(letras['total'] or 0),
+        'letras_pendientes': letras['pendientes'],
+        'letras_pagadas': letras['pagadas'],
+        'estado': pedido.estado,
+        'completado': pedido.completado
+    })
+
+
+# Eventos SSE -----------------------------------------------------------------
+
+MODELOS_EVENTOS = ('letra', 'pedido', 'distribucionfinal', 'factura')
+
+
+@presupuesto_consultas(1)
+async def eventos(request):
+    """
+    Flujo Server-Sent Events con los cambios de letras, pedidos,
+    distribuciones y facturas, para refrescar calendario y dashboard sin
+    consultar cada pocos segundos. Cada evento 'cambio' lleva model, id,
+    action (created, updated, deleted) y fields (campos cambiados, o null si
+    no se conocen). Parámetros: modelos (separados por coma), token.
+    Solo funciona servido por ASGI.
+    """
+    if request.method != 'GET':
+        return JsonResponse({'error': 'Método no permitido'}, status=405)
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse({'error': 'El flujo de eventos necesita un servidor ASGI'}, status=501)
+    if await usuario_por_token(request) is None:
+        return JsonResponse({'error': 'Autenticación requerida'}, status=401)
+
+    modelos = [m for m in request.GET.get('modelos', '').split(',') if m]
+    invalidos = [m for m in modelos if m not in MODELOS_EVENTOS]
+    if invalidos:
+        return JsonResponse(
+            {'error': f"Modelo inválido: {', '.join(invalidos)}. Opciones: {', '.join(MODELOS_EVENTOS)}"},
+            status=400
+        )
+    filtro = (lambda data: data['model'] in modelos) if modelos else None
+    ultimo_id = request.headers.get('Last-Event-ID')
+    latido = getattr(settings, 'SSE_HEARTBEAT_SECONDS', 15)
+
+    async def flujo():
+        # La suscripción se crea aquí, en el bucle que va a leerla: con
+        # middlewares síncronos la vista corre en otro bucle temporal
+        subscription, perdidos = broadcaster.subscribe(filtro, ultimo_id)
+        try:
+            yield 'retry: 3000\n\n'
+            if perdidos is None:
+                yield format_sse(None, 'resync', {})
+            else:
+                for event_id, data in perdidos:
+                    yield format_sse(event_id, 'cambio', data)
+            while True:
+                pendientes = await subscription.get(latido)
+                if not pendientes:
+                    yield ': ping\n\n'
+                elif pendientes == ['resync']:
+                    yield format_sse(None, 'resync', {})
+                else:
+                    for event_id, data in pendientes:
+                        yield format_sse(event_id, 'cambio', data)
+        finally:
+            subscription.close()
+
+    response = StreamingHttpResponse(flujo(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # que nginx no acumule el flujo
+    return response
@@ -3,6 +3,16 @@ ASGI config for core project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+El flujo de eventos /api/eventos/ (Server-Sent Events) solo funciona
+servido por ASGI; bajo WSGI responde 501. En producción se sirve con
+gunicorn y workers de uvicorn (start.sh):
+
+    gunicorn core.asgi:application -k uvicorn.workers.UvicornWorker
+
+y en desarrollo con 'uvicorn core.asgi:application --reload'. Las
+variantes async de /api/async/ (calendarBackend/views_async.py) conviven
+con las vistas síncronas en el mismo servidor.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
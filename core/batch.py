@@ -0,0 +1,203 @@
+"""
+Peticiones agrupadas: /api/batch/ ejecuta varios GET de la API en una sola
+petición HTTP.
+
+Las páginas que cargan a la vez empresas, proveedores, pedidos, letras...
+pagan por cada petición la autenticación, los middlewares y el registro de
+actividad. Con el lote todo eso se hace una vez y cada subpetición se
+resuelve en el mismo proceso, llamando directamente a la vista:
+
+    POST /api/batch/
+    {
+        "requests": [
+            {"method": "GET", "path": "/api/empresas/"},
+            {"method": "GET", "path": "/api/letras/", "params": {"estado": "pendiente"}}
+        ],
+        "snapshot": true
+    }
+
+    {"responses": [{"path": "/api/empresas/", "status": 200, "headers": {...}, "body": [...]}, ...]}
+
+- El usuario ya autenticado se reutiliza en todas las subpeticiones, pero
+  cada vista comprueba sus propios permisos (un 403 solo afecta a su
+  subpetición).
+- Solo se admiten GET bajo /api/ (ni el propio lote ni las vistas async);
+  los errores de una subpetición van en su 'status', no en el del lote.
+- Cada subpetición cuenta sus consultas contra el presupuesto de su vista,
+  como lo haría QueryBudgetMiddleware.
+- Con "snapshot": true todas las subpeticiones leen dentro de una
+  transacción de solo lectura, así ven los mismos datos aunque otro
+  usuario escriba entretanto (ver read_snapshot).
+- BATCH_MAX_REQUESTS limita las subpeticiones por lote.
+"""
+import asyncio
+import json
+from contextlib import ExitStack, contextmanager
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.http import HttpRequest, QueryDict
+from django.urls import Resolver404, resolve
+
+from .query_budget import QueryCounter, check_query_budget
+
+
+class BatchError(Exception):
+    """Lote mal formado: se responde 400 sin ejecutar nada"""
+
+
+@contextmanager
+def read_snapshot():
+    """
+    Abre en cada base configurada una transacción de lectura que ve una
+    única foto de los datos:
+
+    - PostgreSQL: REPEATABLE READ, READ ONLY.
+    - SQLite: BEGIN DEFERRED con query_only; en WAL la foto se fija en la
+      primera lectura y no toma el candado de escritura del backend (las
+      transacciones normales empiezan con BEGIN IMMEDIATE).
+    - Otros motores: una transacción normal.
+
+    Si la conexión ya está en una transacción (tests, vistas atómicas) se
+    reutiliza esa.
+    """
+    with ExitStack() as stack:
+        for alias in connections:
+            stack.enter_context(_snapshot(connections[alias]))
+        yield
+
+
+@contextmanager
+def _snapshot(connection):
+    if connection.in_atomic_block:
+        yield
+        return
+    if connection.vendor == 'postgresql':
+        with transaction.atomic(using=connection.alias):
+            with connection.cursor() as cursor:
+                cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY')
+            yield
+        return
+    if connection.vendor != 'sqlite':
+        with transaction.atomic(using=connection.alias):
+            yield
+        return
+
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA query_only = ON')
+        cursor.execute('BEGIN DEFERRED')
+        try:
+            yield
+        finally:
+            cursor.execute('COMMIT')
+            cursor.execute('PRAGMA query_only = OFF')
+
+
+def parse_batch(data):
+    """Valida el cuerpo del lote y devuelve (subpeticiones, snapshot)"""
+    if not isinstance(data, dict) or not isinstance(data.get('requests'), list):
+        raise BatchError("El cuerpo debe ser un objeto con la lista 'requests'")
+    peticiones = data['requests']
+    maximo = getattr(settings, 'BATCH_MAX_REQUESTS', 20)
+    if not peticiones:
+        raise BatchError("'requests' está vacía")
+    if len(peticiones) > maximo:
+        raise BatchError(f"Como máximo {maximo} subpeticiones por lote")
+    for peticion in peticiones:
+        if not isinstance(peticion, dict) or not isinstance(peticion.get('path'), str):
+            raise BatchError("Cada subpetición debe ser un objeto con 'path'")
+        if not isinstance(peticion.get('params', {}), dict):
+            raise BatchError("'params' debe ser un objeto")
+    return peticiones, bool(data.get('snapshot', False))
+
+
+def _error(path, status, mensaje):
+    return {'path': path, 'status': status, 'headers': {}, 'body': {'error': mensaje}}
+
+
+def _build_request(request, path, query, match):
+    """Subpetición GET con el usuario (y token) de la petición del lote"""
+    sub = HttpRequest()
+    sub.method = 'GET'
+    sub.path = sub.path_info = path
+    sub.META = {
+        **request.META,
+        'REQUEST_METHOD': 'GET',
+        'PATH_INFO': path,
+        'QUERY_STRING': query.urlencode(),
+        'CONTENT_LENGTH': '0',
+    }
+    sub.GET = query
+    sub.resolver_match = match
+    sub.user = request.user
+    # DRF usa estos atributos en vez de volver a autenticar (ForcedAuthentication)
+    sub._force_auth_user = request.user
+    sub._force_auth_token = request.auth
+    # El lote necesita el cuerpo completo (ver core/json_stream.py)
+    sub.allow_streaming = False
+    return sub
+
+
+def _body(response):
+    data = getattr(response, 'data', None)
+    if data is not None:
+        return data
+    if hasattr(response, 'render') and not response.is_rendered:
+        response.render()
+    contenido = response.content.decode(response.charset or 'utf-8')
+    if response.get('Content-Type', '').startswith('application/json'):
+        return json.loads(contenido or 'null')
+    return contenido
+
+
+def execute_one(request, peticion, batch_path):
+    """Ejecuta una subpetición y devuelve su entrada de 'responses'"""
+    partes = urlsplit(peticion['path'])
+    path = partes.path
+    if str(peticion.get('method', 'GET')).upper() != 'GET':
+        return _error(path, 405, 'Solo se admiten subpeticiones GET')
+    if not path.startswith('/api/') or path == batch_path:
+        return _error(path, 400, 'Solo se admiten rutas de la API')
+    try:
+        match = resolve(path)
+    except Resolver404:
+        match = None
+    # La ruta comodín del frontend (index.html) también resuelve /api/...
+    if match is None or not match.route.startswith('api/'):
+        return _error(path, 404, 'Ruta no encontrada')
+    if asyncio.iscoroutinefunction(match.func):
+        return _error(path, 400, 'Las vistas async no se admiten en un lote')
+
+    query = QueryDict(partes.query, mutable=True)
+    for clave, valor in peticion.get('params', {}).items():
+        query.setlist(clave, [str(v) for v in valor] if isinstance(valor, list) else [str(valor)])
+    query._mutable = False
+    sub = _build_request(request, path, query, match)
+
+    mode = getattr(settings, 'QUERY_BUDGET_MODE', 'log')
+    counter = QueryCounter()
+    with ExitStack() as stack:
+        if mode != 'off':
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(counter))
+        response = match.func(sub, *match.args, **match.kwargs)
+    if mode != 'off':
+        check_query_budget(sub, response, counter.count, mode)
+
+    if response.streaming:
+        return _error(path, 400, 'Las respuestas en streaming no se admiten en un lote')
+    return {
+        'path': path,
+        'status': response.status_code,
+        'headers': {k: v for k, v in response.items() if k.startswith('X-')},
+        'body': _body(response),
+    }
+
+
+def execute_batch(request, peticiones, snapshot=False):
+    """Ejecuta las subpeticiones en orden (dentro de read_snapshot si se pide)"""
+    with ExitStack() as stack:
+        if snapshot:
+            stack.enter_context(read_snapshot())
+        return [execute_one(request, peticion, request.path) for peticion in peticiones]
@@ -0,0 +1,215 @@
+"""
+Compresión de las respuestas de la API (brotli o gzip).
+
+El listado completo de /api/letras/ puede pesar decenas de MB de JSON y
+whitenoise solo comprime los estáticos. CompressionMiddleware comprime las
+respuestas de /api/ según la cabecera Accept-Encoding del cliente:
+
+- Se elige 'br' si el cliente lo acepta y si no 'gzip' (respetando los q=;
+  'q=0' excluye una codificación). Sin ninguna de las dos, sin comprimir.
+- Las respuestas menores que COMPRESSION_MIN_BYTES no se comprimen (no
+  compensa la CPU); las que comprimidas no son más pequeñas tampoco.
+- Niveles configurables: COMPRESSION_BROTLI_QUALITY (0-11) y
+  COMPRESSION_GZIP_LEVEL (1-9). Los valores por defecto priorizan la CPU
+  sobre la última fracción de compresión, como corresponde a respuestas
+  dinámicas.
+- Las respuestas en streaming (core/json_stream.py) se comprimen bloque a
+  bloque, vaciando el compresor tras cada uno para no retrasar el primer
+  byte. Los eventos SSE no se tocan.
+- No se vuelve a comprimir lo que ya lo está: respuestas con
+  Content-Encoding, tipos comprimidos (respaldos .gz/.zip, binarios,
+  imágenes) o contenido que empieza con la firma de gzip, zip, bzip2, xz o
+  zstd. Tampoco con Cache-Control: no-transform.
+
+El ETag pasa a débil (W/"3"), como en GZipMiddleware de Django: If-Match
+acepta ambos (ver calendarBackend/concurrencia.py).
+
+Métricas (ver core/metrics.py), por ruta y codificación:
+calendarwebapp_compression_responses_total, _input_bytes_total y
+_output_bytes_total (los bytes ahorrados son la diferencia) y
+_cpu_seconds_total (tiempo de CPU del hilo dedicado a comprimir).
+"""
+import time
+import zlib
+
+import brotli
+from django.conf import settings
+from django.contrib.admindocs.views import simplify_regex
+from django.utils.cache import patch_vary_headers
+
+from .metrics import registry
+
+# En orden de preferencia cuando el cliente acepta varias con el mismo q
+ENCODINGS = ('br', 'gzip')
+
+# Tipos que ya vienen comprimidos (o que no ganan nada)
+COMPRESSED_TYPES = (
+    'application/gzip', 'application/x-gzip', 'application/zip', 'application/x-bzip2',
+    'application/x-xz', 'application/zstd', 'application/octet-stream', 'application/pdf',
+    'image/', 'audio/', 'video/', 'font/woff',
+)
+# Los eventos SSE deben llegar en cuanto se emiten
+SKIPPED_TYPES = ('text/event-stream',)
+
+# Firmas de formatos comprimidos
+MAGIC_NUMBERS = (b'\x1f\x8b', b'PK\x03\x04', b'BZh', b'\xfd7zXZ\x00', b'\x28\xb5\x2f\xfd')
+
+
+def negotiate(accept_encoding):
+    """'br', 'gzip' o None según Accept-Encoding y sus q="""
+    pesos = {}
+    for parte in (accept_encoding or '').split(','):
+        nombre, _, parametros = parte.partition(';')
+        nombre = nombre.strip().lower()
+        if not nombre:
+            continue
+        q = 1.0
+        for parametro in parametros.split(';'):
+            clave, _, valor = parametro.partition('=')
+            if clave.strip().lower() == 'q':
+                try:
+                    q = float(valor)
+                except ValueError:
+                    q = 0.0
+        pesos[nombre] = q
+    comodin = pesos.get('*', 0.0)
+    q, _, encoding = max((pesos.get(e, comodin), -i, e) for i, e in enumerate(ENCODINGS))
+    return encoding if q > 0 else None
+
+
+class Compressor:
+    """Compresor incremental de una codificación; acumula su tiempo de CPU"""
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+        self.cpu_seconds = 0.0
+        if encoding == 'br':
+            self._compressor = brotli.Compressor(
+                mode=brotli.MODE_TEXT, quality=getattr(settings, 'COMPRESSION_BROTLI_QUALITY', 4)
+            )
+        else:
+            # wbits=31: formato gzip (cabecera y CRC), no zlib
+            self._compressor = zlib.compressobj(getattr(settings, 'COMPRESSION_GZIP_LEVEL', 6), zlib.DEFLATED, 31)
+
+    def _medir(self, funcion, *args):
+        inicio = time.thread_time()
+        try:
+            return funcion(*args)
+        finally:
+            self.cpu_seconds += time.thread_time() - inicio
+
+    def compress(self, datos):
+        if self.encoding == 'br':
+            return self._medir(self._compressor.process, datos)
+        return self._medir(self._compressor.compress, datos)
+
+    def flush(self):
+        """Lo comprimido hasta ahora, para enviarlo sin cerrar el flujo"""
+        if self.encoding == 'br':
+            return self._medir(self._compressor.flush)
+        return self._medir(self._compressor.flush, zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        if self.encoding == 'br':
+            return self._medir(self._compressor.finish)
+        return self._medir(self._compressor.flush)
+
+
+def _compressible(response):
+    if response.has_header('Content-Encoding'):
+        return False
+    content_type = response.get('Content-Type', '').lower()
+    if content_type.startswith(COMPRESSED_TYPES + SKIPPED_TYPES):
+        return False
+    return 'no-transform' not in response.get('Cache-Control', '').lower()
+
+
+def _record(request, compressor, entrada, salida):
+    if not getattr(settings, 'METRICS_ENABLED', True):
+        return
+    match = getattr(request, 'resolver_match', None)
+    labels = {
+        'route': simplify_regex(match.route) if match and match.route else 'sin_ruta',
+        'encoding': compressor.encoding,
+    }
+    registry.inc('compression_responses_total', labels)
+    registry.inc('compression_input_bytes_total', labels, entrada)
+    registry.inc('compression_output_bytes_total', labels, salida)
+    registry.inc('compression_cpu_seconds_total', labels, compressor.cpu_seconds)
+    registry.flush()
+
+
+class CompressionMiddleware:
+    """
+    Comprime las respuestas de /api/. Va al principio de MIDDLEWARE: las
+    métricas de tamaño y las respuestas guardadas por Idempotency-Key se
+    quedan con el cuerpo sin comprimir.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if (not getattr(settings, 'COMPRESSION_ENABLED', True) or not request.path.startswith('/api/')
+                or not _compressible(response)):
+            return response
+        if not response.streaming and len(response.content) < getattr(settings, 'COMPRESSION_MIN_BYTES', 1024):
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = negotiate(request.META.get('HTTP_ACCEPT_ENCODING'))
+        if encoding is None:
+            return response
+        compressor = Compressor(encoding)
+
+        if response.streaming:
+            if response.is_async:
+                response.streaming_content = self._stream_async(request, response.streaming_content, compressor)
+            else:
+                response.streaming_content = self._stream(request, response.streaming_content, compressor)
+            del response['Content-Length']
+        else:
+            contenido = response.content
+            if contenido.startswith(MAGIC_NUMBERS):
+                return response
+            comprimido = compressor.compress(contenido) + compressor.finish()
+            if len(comprimido) >= len(contenido):
+                return response
+            response.content = comprimido
+            response['Content-Length'] = str(len(comprimido))
+            _record(request, compressor, len(contenido), len(comprimido))
+
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        response['Content-Encoding'] = encoding
+        return response
+
+    def _stream(self, request, contenido, compressor):
+        entrada = salida = 0
+        try:
+            for parte in contenido:
+                entrada += len(parte)
+                bloque = compressor.compress(parte) + compressor.flush()
+                salida += len(bloque)
+                yield bloque
+            final = compressor.finish()
+            salida += len(final)
+            yield final
+        finally:
+            _record(request, compressor, entrada, salida)
+
+    async def _stream_async(self, request, contenido, compressor):
+        entrada = salida = 0
+        try:
+            async for parte in contenido:
+                entrada += len(parte)
+                bloque = compressor.compress(parte) + compressor.flush()
+                salida += len(bloque)
+                yield bloque
+            final = compressor.finish()
+            salida += len(final)
+            yield final
+        finally:
+            _record(request, compressor, entrada, salida)
@@ -0,0 +1,139 @@
+"""
+Backend SQLite para varios workers/hilos escribiendo a la vez.
+
+Es el backend de Django con dos cambios:
+- Serializa las escrituras dentro del proceso: un candado por archivo de
+  base de datos que se toma al iniciar una transacción (BEGIN) o antes de
+  una escritura en autocommit, y se libera con el COMMIT/ROLLBACK. Los
+  hilos de un mismo worker hacen cola en vez de fallar con
+  "database is locked".
+- Las lecturas fuera de transacción no toman el candado; con WAL no
+  bloquean ni son bloqueadas por los escritores.
+
+Entre procesos (varios workers de gunicorn) la espera la resuelve SQLite
+con busy_timeout. Para que esa espera funcione las transacciones deben
+empezar con BEGIN IMMEDIATE (OPTIONS['transaction_mode']); con BEGIN
+DEFERRED una lectura que luego escribe falla al instante si otro proceso
+escribe, sin esperar.
+
+Los PRAGMA (journal_mode=WAL, synchronous, busy_timeout, mmap_size) se
+configuran en OPTIONS['init_command'], ver core/settings.py.
+"""
+import re
+import threading
+
+from django.db.backends.sqlite3 import base as sqlite3_base
+from django.db.backends.sqlite3.base import Database, SQLiteCursorWrapper
+
+WRITE_STATEMENT = re.compile(r'^\s*(INSERT|UPDATE|DELETE|REPLACE|CREATE|DROP|ALTER)\b', re.IGNORECASE)
+
+_write_locks = {}
+_write_locks_guard = threading.Lock()
+
+
+def get_write_lock(name):
+    """Candado de escritura compartido por todas las conexiones del proceso a 'name'"""
+    with _write_locks_guard:
+        return _write_locks.setdefault(str(name), threading.RLock())
+
+
+def wal_checkpoint(connection):
+    """
+    Vuelca el WAL al archivo principal, para copiar el .sqlite3 sin perder
+    las últimas escrituras. No hace nada con otros motores.
+    """
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+
+class SerializedCursorWrapper(SQLiteCursorWrapper):
+    """Toma el candado de escritura para las escrituras en autocommit"""
+
+    db_wrapper = None
+
+    def execute(self, query, params=None):
+        if not self._needs_lock(query):
+            return super().execute(query, params)
+        self.db_wrapper.acquire_write_lock()
+        try:
+            return super().execute(query, params)
+        finally:
+            self.db_wrapper.release_write_lock_if_idle()
+
+    def executemany(self, query, param_list):
+        if not self._needs_lock(query):
+            return super().executemany(query, param_list)
+        self.db_wrapper.acquire_write_lock()
+        try:
+            return super().executemany(query, param_list)
+        finally:
+            self.db_wrapper.release_write_lock_if_idle()
+
+    def _needs_lock(self, query):
+        return not self.db_wrapper.holds_write_lock and WRITE_STATEMENT.match(query) is not None
+
+
+class DatabaseWrapper(sqlite3_base.DatabaseWrapper):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._held_write_lock = None
+
+    @property
+    def holds_write_lock(self):
+        return self._held_write_lock is not None
+
+    def acquire_write_lock(self):
+        if self._held_write_lock is not None:
+            return
+        lock = get_write_lock(self.settings_dict['NAME'])
+        timeout = self.settings_dict['OPTIONS'].get('timeout', 5)
+        if not lock.acquire(timeout=timeout):
+            raise Database.OperationalError(
+                f"database is locked (esperando el candado de escritura más de {timeout}s)"
+            )
+        self._held_write_lock = lock
+
+    def release_write_lock(self):
+        lock, self._held_write_lock = self._held_write_lock, None
+        if lock is not None:
+            lock.release()
+
+    def release_write_lock_if_idle(self):
+        # Con autocommit desactivado, sqlite3 abre una transacción implícita
+        # en la primera escritura; el candado se conserva hasta el COMMIT.
+        if self.connection is None or not self.connection.in_transaction:
+            self.release_write_lock()
+
+    def create_cursor(self, name=None):
+        cursor = self.connection.cursor(factory=SerializedCursorWrapper)
+        cursor.db_wrapper = self
+        return cursor
+
+    def _start_transaction_under_autocommit(self):
+        self.acquire_write_lock()
+        try:
+            super()._start_transaction_under_autocommit()
+        except Exception:
+            self.release_write_lock()
+            raise
+
+    def _commit(self):
+        try:
+            return super()._commit()
+        finally:
+            self.release_write_lock_if_idle()
+
+    def _rollback(self):
+        try:
+            return super()._rollback()
+        finally:
+            self.release_write_lock()
+
+    def _close(self):
+        try:
+            return super()._close()
+        finally:
+            self.release_write_lock()
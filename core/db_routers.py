@@ -0,0 +1,194 @@
+"""
+Enrutamiento de lecturas hacia una réplica de la base de datos.
+
+Si existe el alias configurado en REPLICA_DATABASE_ALIAS (por defecto
+'replica', definido con la variable DATABASE_REPLICA_URL), las lecturas
+seguras se envían a la réplica y todas las escrituras siguen yendo a
+'default'. Fuera de una petición marcada, todo va a la base principal.
+
+Qué peticiones leen de la réplica:
+- GET/HEAD de las vistas marcadas: acciones listadas en 'replica_actions'
+  de los ViewSets (ReplicaReadMixin) o funciones decoradas con
+  @usar_replica (dashboard, reportes, calendario, exportaciones).
+- Cualquier GET/HEAD de un usuario de solo lectura.
+
+Leer lo propio escrito: tras un POST/PUT/PATCH/DELETE exitoso el usuario
+queda "pegado" a la base principal durante REPLICA_STICKY_SECONDS, para que
+no vea datos anteriores a su cambio mientras la réplica se pone al día. La
+marca se guarda en la caché REPLICA_STICKY_CACHE, compartida entre workers.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, connections
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+_read_alias = ContextVar('read_alias', default=None)
+
+
+def get_replica_alias():
+    """Devuelve el alias de la réplica si está configurada, o None"""
+    alias = getattr(settings, 'REPLICA_DATABASE_ALIAS', 'replica')
+    if alias in connections.settings:
+        return alias
+    return None
+
+
+def current_read_alias():
+    return _read_alias.get()
+
+
+class ReplicaRouter:
+    """
+    Router de Django: las lecturas usan el alias activo en el contexto
+    actual (si lo hay) y las escrituras siempre la base principal.
+    """
+
+    def db_for_read(self, model, **hints):
+        return _read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # La réplica contiene los mismos datos que la principal
+        return True
+
+
+# Marca de escritura reciente -----------------------------------------------
+
+def _sticky_cache():
+    return caches[getattr(settings, 'REPLICA_STICKY_CACHE', 'default')]
+
+
+def _sticky_key(user):
+    return f"replica:sticky:{user.pk}"
+
+
+def mark_recent_write(user):
+    """Fija al usuario a la base principal durante la ventana configurada"""
+    seconds = getattr(settings, 'REPLICA_STICKY_SECONDS', 15)
+    if seconds > 0:
+        _sticky_cache().set(_sticky_key(user), True, seconds)
+
+
+def has_recent_write(user):
+    return bool(_sticky_cache().get(_sticky_key(user)))
+
+
+# Decisión por petición -----------------------------------------------------
+
+def _es_usuario_lectura(user):
+    perfil = getattr(user, 'perfil', None)
+    return perfil is not None and perfil.es_lectura
+
+
+def replica_alias_for(request, marked=False):
+    """
+    Decide si una petición (ya autenticada) puede leer de la réplica.
+    'marked' indica que la vista o acción está marcada para la réplica.
+    """
+    alias = get_replica_alias()
+    if alias is None or request.method not in SAFE_METHODS:
+        return None
+
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        return alias if marked else None
+    if has_recent_write(user):
+        return None
+    try:
+        if marked or _es_usuario_lectura(user):
+            return alias
+    except Exception:
+        pass
+    return None
+
+
+@contextmanager
+def read_from(alias):
+    """Envía las lecturas del bloque al alias indicado (None = principal)"""
+    token = _read_alias.set(alias)
+    try:
+        yield alias
+    finally:
+        _read_alias.reset(token)
+
+
+def usar_replica(func):
+    """
+    Decorador para vistas de función de DRF que pueden leer de la réplica.
+    Debe ir debajo de @api_view para que el usuario ya esté autenticado:
+
+        @api_view(['GET'])
+        @permission_classes([IsAuthenticated])
+        @usar_replica
+        def dashboard_estadisticas(request): ...
+    """
+    @wraps(func)
+    def wrapper(request, *args, **kwargs):
+        with read_from(replica_alias_for(request, marked=True)):
+            return func(request, *args, **kwargs)
+    return wrapper
+
+
+def solo_lectura(func):
+    """
+    Marca una vista POST que no escribe (como /api/batch/, que agrupa GET)
+    para que ReplicaStickinessMiddleware no pegue al usuario a la principal.
+    En las vistas de función va encima de @api_view.
+    """
+    func.solo_lectura = True
+    return func
+
+
+class ReplicaReadMixin:
+    """
+    Mixin para ViewSets: decide el alias de lectura una vez autenticada la
+    petición y comprobados los permisos (que siempre leen de la principal).
+
+    'replica_actions' enumera las acciones que pueden leer de la réplica
+    para cualquier usuario; los usuarios de solo lectura la usan siempre.
+    """
+    replica_actions = []
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        marked = getattr(self, 'action', None) in self.replica_actions
+        alias = replica_alias_for(request, marked=marked)
+        if alias is not None:
+            self._replica_token = _read_alias.set(alias)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        token = getattr(self, '_replica_token', None)
+        if token is not None:
+            _read_alias.reset(token)
+            self._replica_token = None
+        return super().finalize_response(request, response, *args, **kwargs)
+
+
+class ReplicaStickinessMiddleware:
+    """
+    Marca al usuario tras una escritura exitosa. Va después del middleware
+    de autenticación; DRF propaga el usuario autenticado por token a la
+    petición de Django, así que aquí ya está disponible.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        match = getattr(request, 'resolver_match', None)
+        if (request.method not in SAFE_METHODS
+                and response.status_code < 400
+                and not getattr(getattr(match, 'func', None), 'solo_lectura', False)
+                and get_replica_alias() is not None):
+            user = getattr(request, 'user', None)
+            if user is not None and user.is_authenticated:
+                mark_recent_write(user)
+        return response
@@ -0,0 +1,141 @@
+"""
+Difusión de eventos de cambio a los clientes conectados por Server-Sent
+Events (SSE).
+
+Broadcaster reparte cada evento publicado entre las suscripciones del
+proceso. Cada suscripción tiene un búfer acotado (SSE_BUFFER_SIZE): si un
+cliente lento lo llena, se descartan sus eventos pendientes y recibe un
+evento 'resync' para que vuelva a cargar los datos en vez de bloquear o
+hacer crecer la memoria de los demás.
+
+Los eventos llevan un id '<arranque>-<n>' y el broadcaster guarda los
+últimos SSE_HISTORY. Un cliente que se reconecta con Last-Event-ID recibe
+los que se perdió si siguen en el historial y son de este mismo proceso;
+si no, recibe 'resync'.
+
+La difusión es por proceso: con varios workers cada cliente solo recibe
+los cambios hechos en el worker al que está conectado. Para el despliegue
+actual (un worker ASGI) es suficiente; con más workers haría falta un
+canal compartido (Redis pub/sub, LISTEN/NOTIFY de PostgreSQL).
+
+publish() se puede llamar desde cualquier hilo (las vistas síncronas
+corren en hilos aparte bajo ASGI); los consumidores esperan en su bucle
+de asyncio.
+"""
+import asyncio
+import itertools
+import json
+import threading
+import uuid
+from collections import deque
+
+from django.conf import settings
+
+
+def format_sse(event_id, event, data):
+    """Mensaje SSE con id, tipo de evento y datos en JSON de una línea"""
+    lineas = []
+    if event_id is not None:
+        lineas.append(f"id: {event_id}")
+    lineas.append(f"event: {event}")
+    lineas.append(f"data: {json.dumps(data, separators=(',', ':'), default=str)}")
+    return '\n'.join(lineas) + '\n\n'
+
+
+class Subscription:
+    """Búfer acotado de un cliente conectado"""
+
+    def __init__(self, broadcaster, filtro, maxlen):
+        self.broadcaster = broadcaster
+        self.filtro = filtro
+        self.buffer = deque()
+        self.maxlen = maxlen
+        self.overflowed = False
+        self.loop = asyncio.get_running_loop()
+        self.ready = asyncio.Event()
+
+    def push(self, event_id, data):
+        # Se llama con el lock del broadcaster tomado
+        if self.filtro is not None and not self.filtro(data):
+            return
+        if len(self.buffer) >= self.maxlen:
+            self.buffer.clear()
+            self.overflowed = True
+        else:
+            self.buffer.append((event_id, data))
+        self.loop.call_soon_threadsafe(self.ready.set)
+
+    async def get(self, timeout):
+        """
+        Lista de (id, datos) pendientes, ['resync'] si se desbordó, o []
+        si pasa 'timeout' sin eventos.
+        """
+        try:
+            await asyncio.wait_for(self.ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return []
+        with self.broadcaster.lock:
+            self.ready.clear()
+            if self.overflowed:
+                self.overflowed = False
+                return ['resync']
+            eventos = list(self.buffer)
+            self.buffer.clear()
+        return eventos
+
+    def close(self):
+        self.broadcaster.unsubscribe(self)
+
+
+class Broadcaster:
+    """Reparte los eventos entre las suscripciones y guarda el historial reciente"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.boot = uuid.uuid4().hex[:8]
+        self.counter = itertools.count(1)
+        self.subscriptions = set()
+        self.history = deque(maxlen=getattr(settings, 'SSE_HISTORY', 500))
+
+    def publish(self, data):
+        with self.lock:
+            event_id = f"{self.boot}-{next(self.counter)}"
+            self.history.append((event_id, data))
+            cerradas = []
+            for subscription in self.subscriptions:
+                try:
+                    subscription.push(event_id, data)
+                except RuntimeError:
+                    # Su bucle de eventos ya terminó sin cerrar la suscripción
+                    cerradas.append(subscription)
+            self.subscriptions.difference_update(cerradas)
+        return event_id
+
+    def subscribe(self, filtro=None, last_event_id=None):
+        """
+        Registra un cliente. Devuelve la suscripción y los eventos perdidos
+        desde last_event_id (o None si no se pueden recuperar).
+        """
+        subscription = Subscription(self, filtro, getattr(settings, 'SSE_BUFFER_SIZE', 100))
+        with self.lock:
+            self.subscriptions.add(subscription)
+            perdidos = [] if not last_event_id else self._since(last_event_id)
+        if perdidos and filtro is not None:
+            perdidos = [(event_id, data) for event_id, data in perdidos if filtro(data)]
+        return subscription, perdidos
+
+    def _since(self, last_event_id):
+        boot, _, numero = last_event_id.partition('-')
+        if boot != self.boot or not numero.isdigit():
+            return None
+        numero = int(numero)
+        if self.history and int(self.history[0][0].split('-')[1]) > numero + 1:
+            return None  # el historial ya no llega tan atrás
+        return [(event_id, data) for event_id, data in self.history if int(event_id.split('-')[1]) > numero]
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.subscriptions.discard(subscription)
+
+
+broadcaster = Broadcaster()
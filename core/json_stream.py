@@ -0,0 +1,174 @@
+"""
+Listados JSON en streaming para las respuestas grandes sin paginar.
+
+/api/letras/ (el calendario entero), proximas_vencer,
+distribuciones_pendientes y los pedidos de un proveedor armaban la lista
+completa en memoria, y después el JSON completo, antes de enviar el primer
+byte. json_list_response() lee el queryset con iterator() en bloques de
+STREAMING_JSON_CHUNK_SIZE filas y envía cada bloque serializado como parte
+de un único array JSON con StreamingHttpResponse:
+
+    return json_list_response(request, pedidos, lambda filas: PedidoSerializer(filas, many=True).data)
+
+- La memoria queda acotada por el bloque y el primer byte sale en cuanto
+  está serializado el primer bloque. Los prefetch_related se hacen por
+  bloque (iterator con chunk_size).
+- Si el listado cabe en un bloque se devuelve el Response de siempre: los
+  listados pequeños no cambian (presupuesto de consultas, idempotencia).
+- Solo con el renderer JSON (la API navegable usa el Response) y nunca en
+  las subpeticiones de /api/batch/, que necesitan el cuerpo completo.
+- Cada bloque se codifica con el JSONRenderer de DRF, así el cuerpo es
+  igual byte a byte al del Response.
+- El queryset se fija a la base que elige el router al crear la respuesta:
+  la réplica de lectura se decide durante la vista y el cuerpo se genera
+  después, al enviarlo.
+- Con ASGI el cuerpo es un generador async: cada bloque se lee y se
+  serializa con sync_to_async en el hilo de la petición. Un generador
+  síncrono lo consumiría Django entero con sync_to_async(list) antes de
+  enviar el primer byte.
+
+Las consultas de los bloques siguientes al primero se hacen al enviar el
+cuerpo, después de que los middlewares recibieron la respuesta. Los que
+cuentan consultas (presupuesto, métricas, consultas lentas) se registran
+con response.json_stream.observe(): sus execute_wrapper se activan
+mientras se genera cada bloque y su cierre se llama al terminar el cuerpo.
+Un error a mitad del envío ya no puede cambiar el estado (200): se
+registra y el array queda sin cerrar, de modo que el cliente recibe un
+JSON inválido y no un listado incompleto que parece válido.
+"""
+import logging
+from contextlib import ExitStack
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import connections
+from django.http import StreamingHttpResponse
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+logger = logging.getLogger(__name__)
+
+
+def streaming_allowed(request):
+    """Si la respuesta de esta petición puede ir en streaming"""
+    renderer = getattr(request, 'accepted_renderer', None)
+    return isinstance(renderer, JSONRenderer) and getattr(request, 'allow_streaming', True)
+
+
+class StreamState:
+    """
+    Estado de un listado en streaming (response.json_stream): filas y
+    bloques enviados y los observadores de consultas de los middlewares
+    """
+
+    def __init__(self, items):
+        self.items = items
+        self.chunks = 1
+        self._observers = []
+        self._finished = False
+
+    def observe(self, wrappers, on_finish):
+        """
+        wrappers: {alias: execute_wrapper} que cuentan también las consultas
+        de los bloques siguientes; on_finish() se llama al terminar el cuerpo
+        """
+        self._observers.append((wrappers, on_finish))
+
+    def capture(self):
+        stack = ExitStack()
+        for wrappers, _ in self._observers:
+            for alias, wrapper in wrappers.items():
+                stack.enter_context(connections[alias].execute_wrapper(wrapper))
+        return stack
+
+    def finish(self):
+        """Cierra los observadores una sola vez; el primer error se relanza al final"""
+        if self._finished:
+            return
+        self._finished = True
+        error = None
+        for _, on_finish in reversed(self._observers):
+            try:
+                on_finish()
+            except Exception as e:
+                error = error or e
+        if error is not None:
+            raise error
+
+
+def _chunks(request, state, primero, resto, serialize_chunk, size):
+    """Primer bloque ya codificado y una función que codifica el siguiente (None al terminar)"""
+    renderer = request.accepted_renderer
+    media_type = getattr(request, 'accepted_media_type', None)
+
+    def elementos(filas):
+        # '[...]' sin los corchetes: los elementos del bloque separados por comas
+        return renderer.render(serialize_chunk(filas), media_type).strip()[1:-1].strip()
+
+    def siguiente():
+        with state.capture():
+            bloque = list(islice(resto, size))
+            if not bloque:
+                return None
+            state.items += len(bloque)
+            state.chunks += 1
+            return b',' + elementos(bloque)
+
+    return b'[' + elementos(primero), siguiente
+
+
+def _stream(request, state, primero, siguiente):
+    try:
+        yield primero
+        try:
+            while (bloque := siguiente()) is not None:
+                yield bloque
+        except Exception:
+            logger.exception("Error generando el listado en streaming de %s", request.path)
+            return
+        yield b']'
+    finally:
+        state.finish()
+
+
+async def _stream_async(request, state, primero, siguiente):
+    # thread_sensitive: el cursor del queryset vive en el hilo de la petición
+    siguiente = sync_to_async(siguiente)
+    try:
+        yield primero
+        try:
+            while (bloque := await siguiente()) is not None:
+                yield bloque
+        except Exception:
+            logger.exception("Error generando el listado en streaming de %s", request.path)
+            return
+        yield b']'
+    finally:
+        await sync_to_async(state.finish)()
+
+
+def json_list_response(request, queryset, serialize_chunk, size=None):
+    """
+    Response con serialize_chunk(filas) si el queryset cabe en un bloque (o
+    no se puede hacer streaming); si no, StreamingHttpResponse con el array
+    JSON generado bloque a bloque. serialize_chunk recibe una lista de
+    filas del queryset (o el queryset entero) y devuelve una lista.
+    """
+    if not streaming_allowed(request):
+        return Response(serialize_chunk(queryset))
+    size = size or getattr(settings, 'STREAMING_JSON_CHUNK_SIZE', 500)
+    filas = queryset.using(queryset.db).iterator(chunk_size=size)
+    primero = list(islice(filas, size))
+    if len(primero) < size:
+        return Response(serialize_chunk(primero))
+    state = StreamState(len(primero))
+    inicio, siguiente = _chunks(request, state, primero, filas, serialize_chunk, size)
+    if isinstance(getattr(request, '_request', request), ASGIRequest):
+        contenido = _stream_async(request, state, inicio, siguiente)
+    else:
+        contenido = _stream(request, state, inicio, siguiente)
+    response = StreamingHttpResponse(contenido, content_type=request.accepted_renderer.media_type)
+    response.json_stream = state
+    return response
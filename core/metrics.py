@@ -0,0 +1,332 @@
+"""
+Métricas de la aplicación en formato Prometheus.
+
+Cada worker acumula en memoria contadores e histogramas y, cada
+METRICS_FLUSH_INTERVAL segundos, suma lo acumulado desde la última vez a un
+almacén SQLite local (METRICS_STORE_PATH) compartido por todos los workers
+de gunicorn de la máquina. /api/admin/metrics lee ese almacén, así que
+muestra el total de todos los workers y no solo el que atiende la petición.
+
+Métricas de cada petición (etiquetadas con la ruta de Django, no con la URL,
+para que los <pk> no multipliquen las series):
+
+- calendarwebapp_http_requests_total{route, method, status}
+- calendarwebapp_http_request_errors_total{route, method, kind}
+  ('exception' si la vista lanzó una excepción, 'server_error' para 5xx)
+- calendarwebapp_http_request_duration_seconds{route, method}
+- calendarwebapp_http_response_size_bytes{route}
+- calendarwebapp_db_queries_per_request{route}
+- calendarwebapp_db_query_duration_seconds{route}  (tiempo SQL por petición)
+- calendarwebapp_serializer_duration_seconds{route}
+- calendarwebapp_compression_*_total{route, encoding}  (ver core/compression.py)
+
+El almacén es un archivo SQLite aparte (módulo sqlite3, no el ORM), así las
+métricas no cuentan como consultas de la aplicación ni dependen de la base
+de datos configurada.
+"""
+import atexit
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.contrib.admindocs.views import simplify_regex
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+PREFIX = 'calendarwebapp_'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+SIZE_BUCKETS = (512, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+HELP = {
+    'http_requests_total': ('counter', 'Peticiones HTTP atendidas'),
+    'http_request_errors_total': ('counter', 'Peticiones terminadas con excepción o error 5xx'),
+    'http_request_duration_seconds': ('histogram', 'Duración de la petición'),
+    'http_response_size_bytes': ('histogram', 'Tamaño del cuerpo de la respuesta'),
+    'db_queries_per_request': ('histogram', 'Consultas SQL por petición'),
+    'db_query_duration_seconds': ('histogram', 'Tiempo en consultas SQL por petición'),
+    'serializer_duration_seconds': ('histogram', 'Tiempo serializando datos por petición'),
+    'compression_responses_total': ('counter', 'Respuestas de la API comprimidas'),
+    'compression_input_bytes_total': ('counter', 'Bytes de las respuestas antes de comprimir'),
+    'compression_output_bytes_total': ('counter', 'Bytes de las respuestas comprimidas'),
+    'compression_cpu_seconds_total': ('counter', 'Tiempo de CPU dedicado a comprimir'),
+}
+
+
+def _store_path():
+    return getattr(settings, 'METRICS_STORE_PATH', None) or os.path.join(
+        tempfile.gettempdir(), 'calendarwebapp_metrics.sqlite3'
+    )
+
+
+def _format_value(value):
+    return str(int(value)) if float(value).is_integer() else repr(value)
+
+
+def _label_key(labels):
+    return json.dumps(labels, sort_keys=True, separators=(',', ':'))
+
+
+class MetricsRegistry:
+    """
+    Acumula las métricas del proceso desde el último volcado al almacén.
+    Las muestras de histograma se guardan ya acumuladas por cubo ('le'),
+    de modo que sumar los deltas de varios workers sigue siendo correcto.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._last_flush = time.monotonic()
+
+    def _add(self, key, value):
+        self._pending[key] = self._pending.get(key, 0) + value
+
+    def inc(self, name, labels, value=1):
+        with self._lock:
+            self._add((name, _label_key(labels), ''), value)
+
+    def observe(self, name, labels, value, buckets):
+        key = _label_key(labels)
+        with self._lock:
+            for bound in buckets:
+                if value <= bound:
+                    self._add((name + '_bucket', key, _format_value(bound)), 1)
+            self._add((name + '_bucket', key, '+Inf'), 1)
+            self._add((name + '_sum', key, ''), value)
+            self._add((name + '_count', key, ''), 1)
+
+    def flush(self, force=False):
+        """Suma lo pendiente al almacén compartido (como mucho cada METRICS_FLUSH_INTERVAL)"""
+        interval = getattr(settings, 'METRICS_FLUSH_INTERVAL', 5)
+        if not force and time.monotonic() - self._last_flush < interval:
+            return
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._last_flush = time.monotonic()
+        if not pending:
+            return
+        try:
+            with _connect() as db:
+                db.executemany(
+                    "INSERT INTO metric (name, labels, le, value) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (name, labels, le) DO UPDATE SET value = value + excluded.value",
+                    [(name, labels, le, value) for (name, labels, le), value in pending.items()],
+                )
+        except sqlite3.Error:
+            # Las métricas nunca deben romper una petición: se devuelven a
+            # lo pendiente y se reintenta en el próximo volcado
+            logger.exception("No se pudieron guardar las métricas")
+            with self._lock:
+                for key, value in pending.items():
+                    self._add(key, value)
+
+    def reset(self):
+        with self._lock:
+            self._pending = {}
+
+
+registry = MetricsRegistry()
+atexit.register(registry.flush, force=True)
+
+
+@contextmanager
+def _connect():
+    db = sqlite3.connect(_store_path(), timeout=5)
+    try:
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS metric ("
+            " name TEXT NOT NULL, labels TEXT NOT NULL, le TEXT NOT NULL, value REAL NOT NULL,"
+            " PRIMARY KEY (name, labels, le))"
+        )
+        with db:
+            yield db
+    finally:
+        db.close()
+
+
+def read_store():
+    """Devuelve las filas (name, labels, le, value) del almacén compartido"""
+    with _connect() as db:
+        return db.execute("SELECT name, labels, le, value FROM metric ORDER BY name, labels, le").fetchall()
+
+
+def clear_store():
+    with _connect() as db:
+        db.execute("DELETE FROM metric")
+
+
+def _format_labels(labels, le):
+    pares = sorted(json.loads(labels).items())
+    if le:
+        pares.append(('le', le))
+    if not pares:
+        return ''
+    escapar = lambda v: str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{k}="{escapar(v)}"' for k, v in pares) + '}'
+
+
+def render_prometheus():
+    """Vuelca lo pendiente de este worker y genera el texto de exposición de Prometheus"""
+    registry.flush(force=True)
+    por_metrica = {}
+    for name, labels, le, value in read_store():
+        base = name
+        for sufijo in ('_bucket', '_sum', '_count'):
+            if name.endswith(sufijo) and name[:-len(sufijo)] in HELP:
+                base = name[:-len(sufijo)]
+        por_metrica.setdefault(base, []).append((name, labels, le, value))
+
+    lineas = []
+    for base in sorted(por_metrica):
+        tipo, ayuda = HELP.get(base, ('untyped', ''))
+        lineas.append(f"# HELP {PREFIX}{base} {ayuda}")
+        lineas.append(f"# TYPE {PREFIX}{base} {tipo}")
+        # Los cubos de un histograma deben ir en orden creciente de 'le'
+        filas = sorted(por_metrica[base], key=lambda f: (
+            f[1], f[0] != base + '_bucket', float(f[2]) if f[2] else 0,
+        ))
+        for name, labels, le, value in filas:
+            lineas.append(f"{PREFIX}{name}{_format_labels(labels, le)} {_format_value(value)}")
+    return '\n'.join(lineas) + '\n'
+
+
+# Medición por petición ----------------------------------------------------
+
+_request_stats = ContextVar('request_stats', default=None)
+
+
+class RequestStats:
+    def __init__(self):
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.serializer_seconds = 0.0
+        self.serializing = False
+
+    def __call__(self, execute, sql, params, many, context):
+        inicio = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.query_seconds += time.perf_counter() - inicio
+
+
+@contextmanager
+def medir_serializacion():
+    """
+    Suma el bloque al tiempo de serialización de la petición en curso. Para
+    lo que serializa sin Serializer.data (lectura_compilada.py); como en
+    los anidados, solo cuenta el bloque más externo.
+    """
+    stats = _request_stats.get()
+    if stats is None or stats.serializing:
+        yield
+        return
+    stats.serializing = True
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats.serializer_seconds += time.perf_counter() - inicio
+        stats.serializing = False
+
+
+def _install_serializer_timing():
+    """
+    Mide el tiempo de Serializer.data. Solo cuenta el serializer más externo
+    (los anidados se ejecutan dentro de él) y solo dentro de una petición.
+    """
+    from rest_framework.serializers import BaseSerializer
+
+    original = BaseSerializer.data
+    if getattr(original.fget, 'medido', False):
+        return
+
+    def data(self):
+        with medir_serializacion():
+            return original.fget(self)
+
+    data.medido = True
+    BaseSerializer.data = property(data)
+
+
+def _response_size(response):
+    if response.streaming:
+        return None
+    return len(response.content)
+
+
+class MetricsMiddleware:
+    """
+    Registra duración, consultas, serialización, tamaño y errores de cada
+    petición. Debe ir de los primeros para medir también a los demás
+    middlewares (y los QueryBudgetExceeded del presupuesto de consultas).
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        _install_serializer_timing()
+
+    def __call__(self, request):
+        if not getattr(settings, 'METRICS_ENABLED', True):
+            return self.get_response(request)
+
+        stats = RequestStats()
+        token = _request_stats.set(stats)
+        inicio = time.perf_counter()
+        response = None
+        try:
+            with ExitStack() as stack:
+                for alias in connections:
+                    stack.enter_context(connections[alias].execute_wrapper(stats))
+                response = self.get_response(request)
+            return response
+        finally:
+            _request_stats.reset(token)
+            stream = getattr(response, 'json_stream', None)
+            if stream is not None:
+                # Listado en streaming: se registra al terminar el cuerpo, con
+                # las consultas de todos los bloques (core/json_stream.py)
+                stream.observe({alias: stats for alias in connections},
+                               lambda: self.record(request, response, stats, time.perf_counter() - inicio))
+            else:
+                self.record(request, response, stats, time.perf_counter() - inicio)
+
+    def record(self, request, response, stats, duracion):
+        match = getattr(request, 'resolver_match', None)
+        route = simplify_regex(match.route) if match and match.route else 'sin_ruta'
+        method = request.method
+        try:
+            if response is None:
+                registry.inc('http_requests_total', {'route': route, 'method': method, 'status': '500'})
+                registry.inc('http_request_errors_total', {'route': route, 'method': method, 'kind': 'exception'})
+            else:
+                status = response.status_code
+                registry.inc('http_requests_total', {'route': route, 'method': method, 'status': str(status)})
+                if status >= 500:
+                    registry.inc('http_request_errors_total',
+                                 {'route': route, 'method': method, 'kind': 'server_error'})
+                size = _response_size(response)
+                if size is not None:
+                    registry.observe('http_response_size_bytes', {'route': route}, size, SIZE_BUCKETS)
+            registry.observe('http_request_duration_seconds', {'route': route, 'method': method},
+                             duracion, LATENCY_BUCKETS)
+            registry.observe('db_queries_per_request', {'route': route}, stats.queries, QUERY_BUCKETS)
+            registry.observe('db_query_duration_seconds', {'route': route}, stats.query_seconds, LATENCY_BUCKETS)
+            if stats.serializer_seconds:
+                registry.observe('serializer_duration_seconds', {'route': route},
+                                 stats.serializer_seconds, LATENCY_BUCKETS)
+            registry.flush()
+        except Exception:
+            logger.exception("Error registrando métricas")
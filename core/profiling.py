@@ -0,0 +1,246 @@
+"""
+Perfilado de peticiones con cProfile bajo demanda.
+
+Una petición se perfila cuando:
+- un superadmin la marca con la cabecera 'X-Profile: 1' o el parámetro
+  '?_profile=1'. El middleware va antes de DRF, así que valida él mismo el
+  token: sin token de superadmin la marca se ignora y no se perfila, o
+- cae en la muestra aleatoria PROFILER_SAMPLE_RATE (0.0 a 1.0) del tráfico.
+
+Cada perfil se guarda en PROFILER_STORE_LOCATION como:
+- <id>.prof: volcado de pstats (snakeviz, gprof2dot, pstats.Stats);
+- <id>.collapsed: pilas colapsadas 'a;b;c microsegundos', muestreadas
+  durante la petición, para flamegraph.pl o speedscope;
+- <id>.json: metadatos de la petición.
+
+Solo se conservan los PROFILER_MAX_PROFILES más recientes. La respuesta de
+una petición perfilada lleva la cabecera X-Profile-Id.
+"""
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import random
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+from types import SimpleNamespace
+
+from django.conf import settings
+from django.utils import timezone
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+
+logger = logging.getLogger(__name__)
+
+# Profundidad máxima de las pilas colapsadas
+COLLAPSED_MAX_DEPTH = 64
+
+
+def get_store_location():
+    location = getattr(settings, 'PROFILER_STORE_LOCATION', None) or os.path.join(
+        tempfile.gettempdir(), 'calendarwebapp_profiles'
+    )
+    os.makedirs(location, exist_ok=True)
+    return location
+
+
+def _label(filename, lineno, name):
+    base = str(settings.BASE_DIR)
+    if filename.startswith(base):
+        filename = os.path.relpath(filename, base)
+    elif 'site-packages' in filename:
+        filename = filename.split('site-packages' + os.sep, 1)[1]
+    return f"{name} ({filename}:{lineno})"
+
+
+class StackSampler(threading.Thread):
+    """
+    Muestrea la pila del hilo que atiende la petición cada
+    PROFILER_SAMPLE_INTERVAL_MS. cProfile solo guarda pares llamador-llamado
+    y no puede reconstruir pilas reales (todos los middlewares pasan por el
+    mismo envoltorio de Django), así que las pilas colapsadas salen de aquí.
+    Cada pila acumula los microsegundos transcurridos entre muestras.
+    """
+
+    def __init__(self, thread_id, stop_code):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.stop_code = stop_code
+        self.interval = getattr(settings, 'PROFILER_SAMPLE_INTERVAL_MS', 1) / 1000
+        self.stacks = {}
+        self._stop_event = threading.Event()
+
+    def run(self):
+        anterior = time.perf_counter()
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            ahora = time.perf_counter()
+            if self._stop_event.is_set():
+                break  # la petición ya terminó: el hilo está en stop()
+            if frame is not None:
+                self.add(frame, ahora - anterior)
+            anterior = ahora
+
+    def add(self, frame, seconds):
+        stack = []
+        while frame is not None and frame.f_code is not self.stop_code:
+            code = frame.f_code
+            stack.append(_label(code.co_filename, code.co_firstlineno, code.co_name))
+            frame = frame.f_back
+        if frame is None or not stack:
+            return  # fuera de la petición perfilada
+        key = ';'.join(reversed(stack[-COLLAPSED_MAX_DEPTH:]))
+        self.stacks[key] = self.stacks.get(key, 0) + seconds
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def collapsed(self):
+        return ''.join(
+            f"{stack} {round(seconds * 1_000_000)}\n"
+            for stack, seconds in sorted(self.stacks.items()) if round(seconds * 1_000_000) > 0
+        )
+
+
+def save_profile(profiler, sampler, info):
+    """Guarda el perfil en los tres formatos y devuelve su id"""
+    profile_id = f"{timezone.now():%Y%m%d%H%M%S}-{uuid.uuid4().hex[:8]}"
+    location = get_store_location()
+    base = os.path.join(location, profile_id)
+
+    profiler.dump_stats(base + '.prof')
+    stats = pstats.Stats(base + '.prof')
+    with open(base + '.collapsed', 'w') as f:
+        f.write(sampler.collapsed())
+    info.update(id=profile_id, total_calls=stats.total_calls, profile_seconds=round(stats.total_tt, 6))
+    with open(base + '.json', 'w') as f:
+        json.dump(info, f, indent=2)
+
+    prune(location)
+    return profile_id
+
+
+def prune(location):
+    maximo = getattr(settings, 'PROFILER_MAX_PROFILES', 200)
+    ids = sorted(name[:-5] for name in os.listdir(location) if name.endswith('.json'))
+    for profile_id in ids[:-maximo] if len(ids) > maximo else []:
+        delete_profile(profile_id)
+
+
+def _path(profile_id, extension):
+    # El id llega de la URL: no debe poder salirse del directorio
+    if not profile_id or os.path.basename(profile_id) != profile_id:
+        return None
+    path = os.path.join(get_store_location(), profile_id + extension)
+    return path if os.path.exists(path) else None
+
+
+def list_profiles():
+    location = get_store_location()
+    perfiles = []
+    for name in sorted(os.listdir(location), reverse=True):
+        if name.endswith('.json'):
+            with open(os.path.join(location, name)) as f:
+                perfiles.append(json.load(f))
+    return perfiles
+
+
+def get_profile(profile_id, top=30, orden='cumulative'):
+    """Metadatos del perfil y las funciones más costosas en texto de pstats"""
+    path = _path(profile_id, '.json')
+    if path is None:
+        return None
+    with open(path) as f:
+        info = json.load(f)
+    salida = io.StringIO()
+    pstats.Stats(_path(profile_id, '.prof'), stream=salida).sort_stats(orden).print_stats(top)
+    info['resumen'] = salida.getvalue()
+    return info
+
+
+def profile_file(profile_id, formato):
+    return _path(profile_id, {'pstats': '.prof', 'collapsed': '.collapsed'}[formato])
+
+
+def delete_profile(profile_id):
+    for extension in ('.json', '.prof', '.collapsed'):
+        path = _path(profile_id, extension)
+        if path:
+            os.remove(path)
+
+
+def _authenticate(request):
+    # Como en IdempotencyMiddleware: la autenticación de DRF ocurre dentro
+    # de la vista, después de decidir si se perfila
+    try:
+        resultado = TokenAuthentication().authenticate(request)
+    except AuthenticationFailed:
+        return None
+    return resultado[0] if resultado else None
+
+
+class ProfilerMiddleware:
+    """
+    Perfila las peticiones marcadas o muestreadas. Va de los primeros para
+    que el perfil incluya también al resto de middlewares.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not getattr(settings, 'PROFILER_ENABLED', True):
+            return self.get_response(request)
+
+        solicitado = request.headers.get('X-Profile') == '1' or request.GET.get('_profile') == '1'
+        if solicitado and self.is_superadmin(_authenticate(request)):
+            trigger = 'solicitado'
+        elif random.random() < getattr(settings, 'PROFILER_SAMPLE_RATE', 0.0):
+            trigger = 'muestreo'
+        else:
+            return self.get_response(request)
+
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Ya hay otro perfilador activo en este hilo
+            return self.get_response(request)
+        sampler = StackSampler(threading.get_ident(), ProfilerMiddleware.__call__.__code__)
+        sampler.start()
+        inicio = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            profiler.disable()
+            sampler.stop()
+        duracion = time.perf_counter() - inicio
+
+        user = getattr(request, 'user', None)
+        try:
+            response['X-Profile-Id'] = save_profile(profiler, sampler, {
+                'created': timezone.now().isoformat(),
+                'method': request.method,
+                'path': request.get_full_path(),
+                'status': response.status_code,
+                'duration_ms': round(duracion * 1000, 3),
+                'trigger': trigger,
+                'user': user.username if user is not None and user.is_authenticated else None,
+            })
+        except OSError:
+            logger.exception("No se pudo guardar el perfil de %s", request.path)
+        return response
+
+    def is_superadmin(self, user):
+        from authentication.views import IsSuperAdmin
+
+        if user is None:
+            return False
+        return IsSuperAdmin().has_permission(SimpleNamespace(user=user), None)
@@ -0,0 +1,261 @@
+"""
+Presupuesto de consultas por endpoint.
+
+Cada vista declara cuántas consultas SQL puede hacer por petición y el
+middleware lo comprueba. Así un N+1 nuevo en un serializer se detecta en
+los tests o en staging en vez de en producción.
+
+Formas de declarar el presupuesto:
+
+- En un ViewSet, con el atributo 'query_budget': un número, una tupla
+  (base, por_elemento) o (base, por_elemento, por_bloque), o un
+  diccionario por acción:
+
+      query_budget = {'list': (4, 0), 'retrieve': 6, 'resumen': 8}
+
+- En una acción o en una vista de función, con el decorador (en las vistas
+  de función va encima de @api_view):
+
+      @presupuesto_consultas(5, por_elemento=1)
+      @api_view(['GET'])
+      def mi_vista(request): ...
+
+'por_elemento' se multiplica por los elementos devueltos (la lista o
+'results' si está paginada), así el presupuesto de un listado escala con el
+tamaño de página.
+
+'por_bloque' son las consultas de cada bloque de un listado en streaming
+(core/json_stream.py) después del primero, típicamente sus
+prefetch_related. Esas consultas se hacen al enviar el cuerpo y se
+comprueban al terminarlo: las cabeceras ya salieron, así que solo se
+registra el aviso (o se lanza la excepción en modo 'raise').
+
+QUERY_BUDGET_MODE decide qué hacer al superarlo:
+- 'off': no cuenta nada.
+- 'log': registra un aviso (por defecto).
+- 'header': además añade X-Query-Budget-Exceeded a la respuesta.
+- 'raise': lanza QueryBudgetExceeded (tests y staging).
+Con cualquier modo distinto de 'off' las respuestas de /api/ llevan
+X-Query-Count y, si hay presupuesto, X-Query-Budget.
+"""
+import logging
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.urls import get_resolver
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def presupuesto_consultas(maximo, por_elemento=0, por_bloque=0):
+    """Declara el presupuesto de una acción de ViewSet o de una vista de función"""
+    def decorator(func):
+        func.query_budget = (maximo, por_elemento, por_bloque)
+        return func
+    return decorator
+
+
+def _normalize(budget):
+    if budget is None:
+        return None
+    if isinstance(budget, int):
+        return (budget, 0, 0)
+    return tuple(budget) + (0,) * (3 - len(budget))
+
+
+def get_query_budget(view_func, method):
+    """
+    Devuelve (base, por_elemento, por_bloque) declarado para la vista y el método HTTP,
+    o None si no hay presupuesto.
+    """
+    budget = getattr(view_func, 'query_budget', None)
+    if budget is not None:
+        return _normalize(budget)
+
+    cls = getattr(view_func, 'cls', None)
+    if cls is None:
+        return None
+    actions = getattr(view_func, 'actions', None) or {}
+    action = actions.get(method.lower())
+    handler = getattr(cls, action or method.lower(), None)
+    budget = getattr(handler, 'query_budget', None)
+    if budget is not None:
+        return _normalize(budget)
+
+    declared = getattr(cls, 'query_budget', None)
+    if isinstance(declared, dict):
+        return _normalize(declared.get(action))
+    return _normalize(declared)
+
+
+def count_items(response):
+    """Elementos devueltos por una respuesta de DRF (0 si no es un listado)"""
+    stream = getattr(response, 'json_stream', None)
+    if stream is not None:
+        return stream.items
+    data = getattr(response, 'data', None)
+    if isinstance(data, dict) and isinstance(data.get('results'), list):
+        return len(data['results'])
+    if isinstance(data, list):
+        return len(data)
+    return 0
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class QueryBudgetMiddleware:
+    """
+    Cuenta las consultas de cada petición a /api/ (en todas las bases) y
+    las compara con el presupuesto de la vista. Debe ir antes de los
+    middlewares que consultan la base, para contarlas también.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        mode = getattr(settings, 'QUERY_BUDGET_MODE', 'log')
+        if mode == 'off' or not request.path.startswith('/api/'):
+            return self.get_response(request)
+
+        counter = QueryCounter()
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(counter))
+            response = self.get_response(request)
+
+        stream = getattr(response, 'json_stream', None)
+        if stream is not None:
+            # Los bloques siguientes consultan al enviar el cuerpo: se cuentan
+            # y se comprueban al terminar (ya sin poder cambiar las cabeceras)
+            stream.observe({alias: counter for alias in connections},
+                           lambda: check_streamed_budget(request, response, counter.count, mode))
+        return check_query_budget(request, response, counter.count, mode)
+
+
+def check_query_budget(request, response, count, mode):
+    """
+    Anota X-Query-Count (y X-Query-Budget) en la respuesta y aplica el modo
+    si la vista de 'request.resolver_match' superó su presupuesto. También
+    la usan las subpeticiones de /api/batch/ (core/batch.py).
+    """
+    response['X-Query-Count'] = str(count)
+    match = getattr(request, 'resolver_match', None)
+    budget = get_query_budget(match.func, request.method) if match else None
+    if budget is None:
+        return response
+
+    limit = budget[0] + budget[1] * count_items(response)
+    response['X-Query-Budget'] = str(limit)
+    if count > limit:
+        message = (
+            f"{request.method} {request.path} hizo {count} consultas "
+            f"(presupuesto {limit})"
+        )
+        if mode == 'raise':
+            raise QueryBudgetExceeded(message)
+        logger.warning(message)
+        if mode == 'header':
+            response['X-Query-Budget-Exceeded'] = f"{count}/{limit}"
+    return response
+
+
+def check_streamed_budget(request, response, count, mode):
+    """
+    Comprueba el presupuesto con las consultas de todo el cuerpo de un
+    listado en streaming (core/json_stream.py). Las cabeceras ya se
+    enviaron: se registra el aviso y en modo 'raise' se lanza igual.
+    """
+    match = getattr(request, 'resolver_match', None)
+    budget = get_query_budget(match.func, request.method) if match else None
+    if budget is None:
+        return
+    stream = response.json_stream
+    limit = budget[0] + budget[1] * stream.items + budget[2] * (stream.chunks - 1)
+    if count > limit:
+        message = (
+            f"{request.method} {request.path} hizo {count} consultas "
+            f"(presupuesto {limit}, en streaming)"
+        )
+        if mode == 'raise':
+            raise QueryBudgetExceeded(message)
+        logger.warning(message)
+
+
+# Barrido para tests ------------------------------------------------------
+
+def iter_api_get_endpoints(prefix='/api/'):
+    """
+    Recorre las rutas que aceptan GET bajo 'prefix' y devuelve tuplas
+    (ruta con marcadores como <pk>, función de la vista).
+    """
+    from django.contrib.admindocs.views import extract_views_from_urlpatterns, simplify_regex
+
+    vistos = set()
+    for func, regex, namespace, name in extract_views_from_urlpatterns(get_resolver().url_patterns):
+        path = simplify_regex(regex)
+        # Las variantes con sufijo de formato (.json) son la misma vista
+        if not path.startswith(prefix) or 'format>' in path or path in vistos:
+            continue
+        cls = getattr(func, 'cls', None)
+        if cls is None:
+            continue
+        actions = getattr(func, 'actions', None)
+        if actions is not None and 'get' not in actions:
+            continue
+        if actions is None and not hasattr(cls, 'get'):
+            continue
+        vistos.add(path)
+        yield path, func
+
+
+def sweep_query_budgets(client, prefix='/api/', valores=None):
+    """
+    Hace un GET a cada endpoint bajo 'prefix' y devuelve una lista de
+    diccionarios con ruta, estado, consultas, presupuesto y si se superó.
+
+    Los <pk> se rellenan con el primer objeto del queryset del ViewSet;
+    'valores' permite dar otros valores por marcador o por ruta completa.
+    Las rutas que no se pueden completar se devuelven con estado None.
+    """
+    from django.test.utils import override_settings
+
+    valores = valores or {}
+    resultados = []
+    with override_settings(QUERY_BUDGET_MODE='header'):
+        for path, func in iter_api_get_endpoints(prefix):
+            url = valores.get(path, path)
+            if '<pk>' in url and 'pk' not in valores:
+                queryset = getattr(func.cls, 'queryset', None)
+                pk = queryset.values_list('pk', flat=True).first() if queryset is not None else None
+                if pk is not None:
+                    url = url.replace('<pk>', str(pk))
+            for marcador, valor in valores.items():
+                url = url.replace(f'<{marcador}>', str(valor))
+
+            resultado = {'path': path, 'url': url, 'budget': get_query_budget(func, 'GET')}
+            if '<' in url:
+                resultado.update(status=None, queries=None, limit=None, exceeded=False)
+            else:
+                response = client.get(url)
+                limit = response.get('X-Query-Budget')
+                resultado.update(
+                    status=response.status_code,
+                    queries=int(response['X-Query-Count']),
+                    limit=int(limit) if limit else None,
+                    exceeded='X-Query-Budget-Exceeded' in response,
+                )
+            resultados.append(resultado)
+    return resultados
@@ -1,6 +1,9 @@
 from pathlib import Path
 import os 
+import sys
+import tempfile
 import dj_database_url
+from corsheaders.defaults import default_headers
 import environ
 
 env = environ.Env()
@@ -59,7 +62,14 @@ CKEDITOR_CONFIGS = {
 CKEDITOR_UPLOAD_PATH = "/media/"
 
 MIDDLEWARE = [
+    'core.tracing.TracingMiddleware',  # Trazas por petición (TRACING_ENABLED)
     'corsheaders.middleware.CorsMiddleware',
+    'core.compression.CompressionMiddleware',  # br/gzip en las respuestas de /api/
+    'core.profiling.ProfilerMiddleware',  # Perfilado bajo demanda (cabecera X-Profile)
+    'core.metrics.MetricsMiddleware',  # Latencias, consultas y errores (ver /api/admin/metrics)
+    'core.slow_queries.SlowQueryMiddleware',  # Consultas y peticiones lentas
+    'administracion.idempotency.IdempotencyMiddleware',  # Reintentos con Idempotency-Key
+    'core.query_budget.QueryBudgetMiddleware',  # Presupuesto de consultas por endpoint
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware', 
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -69,8 +79,57 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'administracion.middleware.ActivityLogMiddleware',  # Middleware para registro de actividad
+    'core.db_routers.ReplicaStickinessMiddleware',  # Leer lo propio escrito tras usar la réplica
 ]
 
+# Qué hacer cuando un endpoint supera su presupuesto de consultas
+# ('off', 'log', 'header' o 'raise'; ver core/query_budget.py). Los tests
+# siempre fallan al superarlo; en staging use QUERY_BUDGET_MODE=raise.
+QUERY_BUDGET_MODE = os.environ.get('QUERY_BUDGET_MODE', 'log')
+if sys.argv[1:2] == ['test']:
+    QUERY_BUDGET_MODE = 'raise'
+
+# Métricas por ruta acumuladas entre workers en un SQLite local (ver core/metrics.py)
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') == '1'
+METRICS_STORE_PATH = os.environ.get(
+    'METRICS_STORE_PATH', os.path.join(tempfile.gettempdir(), 'calendarwebapp_metrics.sqlite3')
+)
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 5))  # segundos
+
+# Registro de consultas y peticiones lentas (ver core/slow_queries.py)
+SLOW_QUERY_ENABLED = os.environ.get('SLOW_QUERY_ENABLED', '1') == '1'
+SLOW_QUERY_THRESHOLD_MS = float(os.environ.get('SLOW_QUERY_THRESHOLD_MS', 100))
+SLOW_REQUEST_THRESHOLD_MS = float(os.environ.get('SLOW_REQUEST_THRESHOLD_MS', 1000))
+SLOW_QUERY_STORE_PATH = os.environ.get(
+    'SLOW_QUERY_STORE_PATH', os.path.join(tempfile.gettempdir(), 'calendarwebapp_slow_queries.sqlite3')
+)
+SLOW_QUERY_MAX_RECORDS = int(os.environ.get('SLOW_QUERY_MAX_RECORDS', 5000))  # por tipo, los más recientes
+SLOW_QUERY_STACK_DEPTH = int(os.environ.get('SLOW_QUERY_STACK_DEPTH', 8))
+
+# Perfilado con cProfile por petición (ver core/profiling.py)
+PROFILER_ENABLED = os.environ.get('PROFILER_ENABLED', '1') == '1'
+PROFILER_SAMPLE_RATE = float(os.environ.get('PROFILER_SAMPLE_RATE', 0))  # fracción del tráfico
+PROFILER_STORE_LOCATION = os.environ.get(
+    'PROFILER_STORE_LOCATION', os.path.join(tempfile.gettempdir(), 'calendarwebapp_profiles')
+)
+PROFILER_MAX_PROFILES = int(os.environ.get('PROFILER_MAX_PROFILES', 200))
+PROFILER_SAMPLE_INTERVAL_MS = float(os.environ.get('PROFILER_SAMPLE_INTERVAL_MS', 1))  # pilas colapsadas
+
+# Trazas por petición en JSONL con formato OTLP (ver core/tracing.py)
+TRACING_ENABLED = os.environ.get('TRACING_ENABLED', '0') == '1'
+TRACING_SAMPLE_RATE = float(os.environ.get('TRACING_SAMPLE_RATE', 1))
+TRACING_EXPORT_PATH = os.environ.get(
+    'TRACING_EXPORT_PATH', os.path.join(tempfile.gettempdir(), 'calendarwebapp_traces.jsonl')
+)
+TRACING_EXPORT_MAX_BYTES = int(os.environ.get('TRACING_EXPORT_MAX_BYTES', 50 * 1024 * 1024))
+TRACING_MAX_SPANS = int(os.environ.get('TRACING_MAX_SPANS', 2000))  # por traza
+
+if sys.argv[1:2] == ['test']:
+    # Los tests no deben mezclar sus peticiones con los registros reales
+    METRICS_ENABLED = False
+    SLOW_QUERY_ENABLED = False
+    PROFILER_SAMPLE_RATE = 0
+
 ROOT_URLCONF = 'core.urls'
 
 TEMPLATES = [
@@ -90,18 +149,133 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'core.wsgi.application'
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# Perfil de base de datos: 'sqlite' (desarrollo y sitios pequeños, por
+# defecto) o 'postgres' (producción, con DATABASE_URL). Se elige con
+# DATABASE_PROFILE. SQLITE_CONCURRENCY=0 vuelve al SQLite estándar de Django.
+DATABASE_PROFILE = os.environ.get('DATABASE_PROFILE', 'sqlite')
+
+if DATABASE_PROFILE == 'postgres':
+    DATABASES = {
+        'default': dj_database_url.parse(
+            os.environ['DATABASE_URL'],
+            conn_health_checks=True,
+        )
     }
-}
+    if os.environ.get('DB_POOL', '1') == '1':
+        # Pool de psycopg 3 por proceso. El presupuesto total de conexiones
+        # (DB_POOL_TOTAL) se reparte entre los workers de gunicorn
+        # (WEB_CONCURRENCY), así N workers nunca superan max_connections.
+        WEB_CONCURRENCY = max(1, int(os.environ.get('WEB_CONCURRENCY', 2)))
+        DB_POOL_TOTAL = int(os.environ.get('DB_POOL_TOTAL', 20))
+        DB_POOL_MAX = DB_POOL_TOTAL // WEB_CONCURRENCY
+        if DB_POOL_MAX < 2:
+            # Con menos de 2 conexiones por worker el pool no sirve, y
+            # subirlas haría que los workers juntos superen DB_POOL_TOTAL
+            from django.core.exceptions import ImproperlyConfigured
+            raise ImproperlyConfigured(
+                f"DB_POOL_TOTAL={DB_POOL_TOTAL} no alcanza para {WEB_CONCURRENCY} workers "
+                f"(mínimo 2 conexiones por worker: DB_POOL_TOTAL >= {2 * WEB_CONCURRENCY})"
+            )
+        DATABASES['default']['CONN_MAX_AGE'] = 0  # el pool no admite conexiones persistentes
+        DATABASES['default'].setdefault('OPTIONS', {})['pool'] = {
+            'min_size': min(int(os.environ.get('DB_POOL_MIN', 2)), DB_POOL_MAX),
+            'max_size': DB_POOL_MAX,
+            'timeout': float(os.environ.get('DB_POOL_TIMEOUT', 10)),  # espera máxima por una conexión
+            'max_idle': float(os.environ.get('DB_POOL_MAX_IDLE', 300)),
+            'max_lifetime': float(os.environ.get('DB_POOL_MAX_LIFETIME', 1800)),
+            'name': 'default',
+        }
+        # Con CONN_HEALTH_CHECKS Django pasa check=ConnectionPool.check_connection,
+        # así el pool descarta conexiones rotas antes de entregarlas.
+    else:
+        # Sin pool: conexiones persistentes por worker con chequeo de salud
+        DATABASES['default']['CONN_MAX_AGE'] = int(os.environ.get('CONN_MAX_AGE', 600))
+elif os.environ.get('SQLITE_CONCURRENCY', '1') == '1':
+    # SQLite con varios workers: WAL, espera ante bloqueos y escrituras
+    # serializadas dentro de cada proceso (core/db_backends/sqlite3)
+    SQLITE_BUSY_TIMEOUT = float(os.environ.get('SQLITE_BUSY_TIMEOUT', 20))  # segundos
+    SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+    DATABASES = {
+        'default': {
+            'ENGINE': 'core.db_backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+            'OPTIONS': {
+                'timeout': SQLITE_BUSY_TIMEOUT,
+                'transaction_mode': 'IMMEDIATE',
+                'init_command': (
+                    'PRAGMA journal_mode=WAL;'
+                    'PRAGMA synchronous=NORMAL;'
+                    f'PRAGMA busy_timeout={int(SQLITE_BUSY_TIMEOUT * 1000)};'
+                    f'PRAGMA mmap_size={SQLITE_MMAP_SIZE}'
+                ),
+            },
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+        }
+    }
+
+# Réplica de lectura opcional para dashboard, reportes y usuarios de solo
+# lectura (ver core/db_routers.py)
+DATABASE_REPLICA_URL = os.environ.get('DATABASE_REPLICA_URL')
+if DATABASE_REPLICA_URL:
+    DATABASES['replica'] = dj_database_url.parse(DATABASE_REPLICA_URL)
+    # En los tests la réplica apunta a la misma base que la principal
+    DATABASES['replica']['TEST'] = {'MIRROR': 'default'}
+
+DATABASE_ROUTERS = ['core.db_routers.ReplicaRouter']
+REPLICA_DATABASE_ALIAS = 'replica'
+# Segundos que un usuario lee de la principal después de escribir
+REPLICA_STICKY_SECONDS = int(os.environ.get('REPLICA_STICKY_SECONDS', 15))
+REPLICA_STICKY_CACHE = 'compartida'
 
-#DATABASES = {
-   # 'default': dj_database_url.config(
-   #    default='sqlite:///db.sqlite3',
-   # )
-#}
+# SQLite local donde los workers comparten la versión del índice de autocompletado
+AUTOCOMPLETAR_STORE_PATH = os.environ.get(
+    'AUTOCOMPLETAR_STORE_PATH', os.path.join(tempfile.gettempdir(), 'calendarwebapp_autocompletar.sqlite3')
+)
+
+# Eventos de cambio por SSE (/api/eventos/, ver core/events.py). Solo
+# funciona servido por ASGI (core/asgi.py).
+SSE_BUFFER_SIZE = int(os.environ.get('SSE_BUFFER_SIZE', 100))  # eventos pendientes por cliente
+SSE_HISTORY = int(os.environ.get('SSE_HISTORY', 500))  # eventos recuperables con Last-Event-ID
+SSE_HEARTBEAT_SECONDS = float(os.environ.get('SSE_HEARTBEAT_SECONDS', 15))
+
+# Sincronización incremental de listados (?since=, ver calendarBackend/sincronizacion.py)
+SYNC_MAX_CAMBIOS = 1000  # con más cambios desde la marca se pide recargar el listado (410)
+SYNC_RETENCION_DIAS = int(os.environ.get('SYNC_RETENCION_DIAS', 30))  # lo que conserva compactar_cambios
+
+# Idempotency-Key en POST/PUT/PATCH (ver administracion/idempotency.py)
+IDEMPOTENCY_TTL_HOURS = int(os.environ.get('IDEMPOTENCY_TTL_HOURS', 24))  # respuestas guardadas para reintentos
+IDEMPOTENCY_WAIT_SECONDS = float(os.environ.get('IDEMPOTENCY_WAIT_SECONDS', 10))  # espera a la petición en curso
+IDEMPOTENCY_LOCK_SECONDS = 60  # una reserva en curso más antigua se da por abandonada
+
+# Peticiones agrupadas (/api/batch/, ver core/batch.py)
+BATCH_MAX_REQUESTS = int(os.environ.get('BATCH_MAX_REQUESTS', 20))
+
+# Listados sin paginar en streaming: filas por bloque; los que caben en un
+# bloque se envían de una vez (ver core/json_stream.py)
+STREAMING_JSON_CHUNK_SIZE = int(os.environ.get('STREAMING_JSON_CHUNK_SIZE', 500))
+
+# Compresión br/gzip de las respuestas de /api/ (ver core/compression.py)
+COMPRESSION_ENABLED = os.environ.get('COMPRESSION_ENABLED', '1') == '1'
+COMPRESSION_MIN_BYTES = int(os.environ.get('COMPRESSION_MIN_BYTES', 1024))  # más pequeñas van sin comprimir
+COMPRESSION_BROTLI_QUALITY = int(os.environ.get('COMPRESSION_BROTLI_QUALITY', 4))  # 0-11
+COMPRESSION_GZIP_LEVEL = int(os.environ.get('COMPRESSION_GZIP_LEVEL', 6))  # 1-9
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Caché compartida entre los workers de gunicorn de la misma máquina
+    'compartida': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('SHARED_CACHE_LOCATION', os.path.join(tempfile.gettempdir(), 'calendarwebapp_cache')),
+    },
+}
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -132,6 +306,16 @@ STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR,'media')
 
+# Respaldos incrementales deduplicados (administracion/backup_store.py)
+# Para guardarlos con django-storages (S3, etc.) defina STORAGES['backups'];
+# si no, se usa esta carpeta local.
+BACKUP_STORE_LOCATION = os.environ.get('BACKUP_STORE_LOCATION', os.path.join(BASE_DIR, 'backups', 'store'))
+BACKUP_RETENTION = {
+    'daily': int(os.environ.get('BACKUP_KEEP_DAILY', 7)),
+    'weekly': int(os.environ.get('BACKUP_KEEP_WEEKLY', 4)),
+    'monthly': int(os.environ.get('BACKUP_KEEP_MONTHLY', 6)),
+}
+
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
@@ -157,6 +341,9 @@ CORS_ORIGIN_WHITELIST = [
     'http://127.0.0.1:3000',
     'https://calendarwebapp-wauo.onrender.com',
 ]
+# Cabeceras propias que envía el frontend además de las estándar
+CORS_ALLOW_HEADERS = (*default_headers, 'idempotency-key', 'if-match')
+CORS_EXPOSE_HEADERS = ['ETag']  # versión del objeto (calendarBackend/concurrencia.py)
 CSRF_TRUSTED_ORIGINS = [
     'http://localhost:3000',
     'http://localhost:8000',
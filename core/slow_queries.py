@@ -0,0 +1,289 @@
+"""
+Registro de consultas y peticiones lentas.
+
+SlowQueryMiddleware envuelve la ejecución SQL de cada petición (en todas las
+bases). Las consultas que tardan más de SLOW_QUERY_THRESHOLD_MS se guardan
+con:
+
+- el SQL (recortado) y su huella: el SQL normalizado, sin literales ni
+  parámetros, que agrupa todas las ejecuciones de la misma consulta;
+- la forma de los parámetros (cantidad y tipos, nunca sus valores);
+- la duración y la vista que la originó;
+- la pila de Python recortada a los marcos del proyecto.
+
+Las peticiones que superan SLOW_REQUEST_THRESHOLD_MS se guardan aparte con
+su número de consultas y tiempo SQL.
+
+Todo va a un SQLite local (SLOW_QUERY_STORE_PATH) compartido por los
+workers, que solo conserva los SLOW_QUERY_MAX_RECORDS registros más
+recientes de cada tipo. Se escribe una vez al terminar la petición.
+"""
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import tempfile
+import time
+import traceback
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+SQL_MAX_LENGTH = 2000
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PLACEHOLDER_RE = re.compile(r'%s|\?')
+_IN_LIST_RE = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_SPACES_RE = re.compile(r'\s+')
+
+
+def normalize_sql(sql):
+    """SQL sin literales ni parámetros, con las listas IN (...) colapsadas"""
+    sql = _STRING_RE.sub('?', sql)
+    sql = _NUMBER_RE.sub('?', sql)
+    sql = _PLACEHOLDER_RE.sub('?', sql)
+    sql = _IN_LIST_RE.sub('(...)', sql)
+    return _SPACES_RE.sub(' ', sql).strip()
+
+
+def fingerprint(sql):
+    return hashlib.sha1(normalize_sql(sql).encode()).hexdigest()[:16]
+
+
+def params_shape(params, many):
+    """Describe los parámetros sin guardar sus valores: 'int, str' o '250 x (int, str)'"""
+    if params is None:
+        return ''
+    if many:
+        params = list(params)
+        first = params[0] if params else ()
+        return f"{len(params)} x ({params_shape(first, False)})"
+    if isinstance(params, dict):
+        return ', '.join(f"{k}: {type(v).__name__}" for k, v in params.items())
+    return ', '.join(type(v).__name__ for v in params)
+
+
+def project_stack():
+    """Marcos de la pila que pertenecen al proyecto (sin librerías ni este módulo)"""
+    base = str(settings.BASE_DIR)
+    depth = getattr(settings, 'SLOW_QUERY_STACK_DEPTH', 8)
+    frames = [
+        f"{os.path.relpath(frame.filename, base)}:{frame.lineno} en {frame.name}"
+        for frame in traceback.extract_stack()
+        if frame.filename.startswith(base) and 'site-packages' not in frame.filename
+        # Los envoltorios de ejecución SQL de core/ no aportan nada
+        and not frame.filename.endswith(('slow_queries.py', 'metrics.py', 'query_budget.py', 'manage.py'))
+    ]
+    return '\n'.join(frames[-depth:])
+
+
+# Almacén ---------------------------------------------------------------------
+
+def _store_path():
+    return getattr(settings, 'SLOW_QUERY_STORE_PATH', None) or os.path.join(
+        tempfile.gettempdir(), 'calendarwebapp_slow_queries.sqlite3'
+    )
+
+
+@contextmanager
+def _connect():
+    db = sqlite3.connect(_store_path(), timeout=5)
+    db.row_factory = sqlite3.Row
+    try:
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS slow_query ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT, created TEXT NOT NULL,"
+            " fingerprint TEXT NOT NULL, sql TEXT NOT NULL, normalized TEXT NOT NULL,"
+            " params TEXT NOT NULL, duration_ms REAL NOT NULL, alias TEXT NOT NULL,"
+            " view TEXT NOT NULL, method TEXT NOT NULL, path TEXT NOT NULL, stack TEXT NOT NULL)"
+        )
+        db.execute("CREATE INDEX IF NOT EXISTS slow_query_fingerprint ON slow_query (fingerprint)")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS slow_request ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT, created TEXT NOT NULL,"
+            " view TEXT NOT NULL, method TEXT NOT NULL, path TEXT NOT NULL, status INTEGER NOT NULL,"
+            " duration_ms REAL NOT NULL, queries INTEGER NOT NULL, sql_ms REAL NOT NULL)"
+        )
+        with db:
+            yield db
+    finally:
+        db.close()
+
+
+def save(queries, request_info=None):
+    """Guarda las consultas (y la petición) lentas y descarta las más antiguas"""
+    maximo = getattr(settings, 'SLOW_QUERY_MAX_RECORDS', 5000)
+    try:
+        with _connect() as db:
+            if queries:
+                db.executemany(
+                    "INSERT INTO slow_query (created, fingerprint, sql, normalized, params, duration_ms,"
+                    " alias, view, method, path, stack) VALUES (:created, :fingerprint, :sql, :normalized,"
+                    " :params, :duration_ms, :alias, :view, :method, :path, :stack)",
+                    queries,
+                )
+                db.execute("DELETE FROM slow_query WHERE id <= (SELECT MAX(id) FROM slow_query) - ?", [maximo])
+            if request_info:
+                db.execute(
+                    "INSERT INTO slow_request (created, view, method, path, status, duration_ms, queries, sql_ms)"
+                    " VALUES (:created, :view, :method, :path, :status, :duration_ms, :queries, :sql_ms)",
+                    request_info,
+                )
+                db.execute("DELETE FROM slow_request WHERE id <= (SELECT MAX(id) FROM slow_request) - ?", [maximo])
+    except sqlite3.Error:
+        logger.exception("No se pudo guardar el registro de consultas lentas")
+
+
+ORDENES = {
+    'total': 'total_ms DESC',
+    'max': 'max_ms DESC',
+    'veces': 'veces DESC',
+    'media': 'media_ms DESC',
+}
+
+
+def top_queries(orden='total', limite=20, vista=None):
+    """Consultas lentas agrupadas por huella, de la que más tiempo consume a la que menos"""
+    filtro, params = '', []
+    if vista:
+        filtro, params = 'WHERE view = ?', [vista]
+    with _connect() as db:
+        grupos = db.execute(
+            f"SELECT fingerprint, normalized, COUNT(*) AS veces, SUM(duration_ms) AS total_ms,"
+            f" MAX(duration_ms) AS max_ms, AVG(duration_ms) AS media_ms, MAX(id) AS ultimo_id,"
+            f" MAX(created) AS ultima_vez, GROUP_CONCAT(DISTINCT view) AS vistas"
+            f" FROM slow_query {filtro} GROUP BY fingerprint ORDER BY {ORDENES[orden]} LIMIT ?",
+            params + [limite],
+        ).fetchall()
+        resultado = []
+        for grupo in grupos:
+            ejemplo = db.execute(
+                "SELECT sql, params, stack, view FROM slow_query WHERE id = ?", [grupo['ultimo_id']]
+            ).fetchone()
+            resultado.append({
+                'fingerprint': grupo['fingerprint'],
+                'sql_normalizado': grupo['normalized'],
+                'veces': grupo['veces'],
+                'total_ms': round(grupo['total_ms'], 3),
+                'max_ms': round(grupo['max_ms'], 3),
+                'media_ms': round(grupo['media_ms'], 3),
+                'ultima_vez': grupo['ultima_vez'],
+                'vistas': sorted(grupo['vistas'].split(',')),
+                'ejemplo': {
+                    'sql': ejemplo['sql'],
+                    'parametros': ejemplo['params'],
+                    'vista': ejemplo['view'],
+                    'pila': ejemplo['stack'].splitlines(),
+                },
+            })
+    return resultado
+
+
+def recent_requests(limite=50):
+    with _connect() as db:
+        filas = db.execute("SELECT * FROM slow_request ORDER BY id DESC LIMIT ?", [limite]).fetchall()
+    return [dict(fila) for fila in filas]
+
+
+def clear_store():
+    with _connect() as db:
+        db.execute("DELETE FROM slow_query")
+        db.execute("DELETE FROM slow_request")
+
+
+# Captura ---------------------------------------------------------------------
+
+class SlowQueryRecorder:
+    def __init__(self, alias, threshold_ms):
+        self.alias = alias
+        self.threshold = threshold_ms / 1000
+        self.records = []
+        self.queries = 0
+        self.sql_seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        inicio = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duracion = time.perf_counter() - inicio
+            self.queries += 1
+            self.sql_seconds += duracion
+            if duracion >= self.threshold:
+                self.records.append({
+                    'created': timezone.now().isoformat(),
+                    'fingerprint': fingerprint(sql),
+                    'sql': sql[:SQL_MAX_LENGTH],
+                    'normalized': normalize_sql(sql)[:SQL_MAX_LENGTH],
+                    'params': params_shape(params, many),
+                    'duration_ms': duracion * 1000,
+                    'alias': self.alias,
+                    'stack': project_stack(),
+                })
+
+
+class SlowQueryMiddleware:
+    """
+    Registra las consultas y peticiones lentas. La vista se identifica por
+    el nombre de la ruta (o su patrón si no tiene nombre).
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not getattr(settings, 'SLOW_QUERY_ENABLED', True):
+            return self.get_response(request)
+
+        threshold_ms = getattr(settings, 'SLOW_QUERY_THRESHOLD_MS', 100)
+        recorders = [SlowQueryRecorder(alias, threshold_ms) for alias in connections]
+        inicio = time.perf_counter()
+        with ExitStack() as stack:
+            for recorder in recorders:
+                stack.enter_context(connections[recorder.alias].execute_wrapper(recorder))
+            response = self.get_response(request)
+
+        stream = getattr(response, 'json_stream', None)
+        if stream is not None:
+            # Listado en streaming: los bloques siguientes consultan al enviar
+            # el cuerpo (core/json_stream.py); se guarda al terminar
+            stream.observe({recorder.alias: recorder for recorder in recorders},
+                           lambda: self.record(request, response, recorders, inicio))
+        else:
+            self.record(request, response, recorders, inicio)
+        return response
+
+    def record(self, request, response, recorders, inicio):
+        duracion_ms = (time.perf_counter() - inicio) * 1000
+        queries = [r for recorder in recorders for r in recorder.records]
+        lenta = duracion_ms >= getattr(settings, 'SLOW_REQUEST_THRESHOLD_MS', 1000)
+        if queries or lenta:
+            vista = self.view_name(request)
+            for query in queries:
+                query.update(view=vista, method=request.method, path=request.path)
+            request_info = None
+            if lenta:
+                request_info = {
+                    'created': timezone.now().isoformat(),
+                    'view': vista,
+                    'method': request.method,
+                    'path': request.path,
+                    'status': response.status_code,
+                    'duration_ms': duracion_ms,
+                    'queries': sum(r.queries for r in recorders),
+                    'sql_ms': sum(r.sql_seconds for r in recorders) * 1000,
+                }
+            save(queries, request_info)
+
+    def view_name(self, request):
+        match = getattr(request, 'resolver_match', None)
+        if match is None:
+            return 'sin_vista'
+        return match.view_name or match.route or match._func_path
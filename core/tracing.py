@@ -0,0 +1,399 @@
+"""
+Trazas ligeras de cada petición.
+
+Con TRACING_ENABLED, cada petición abre una traza con spans para:
+
+- cada middleware (anidados: el tiempo propio de uno es su span menos los
+  que contiene);
+- la vista de DRF, la autenticación y la comprobación de permisos;
+- cada consulta SQL (SQL normalizado, sin parámetros);
+- cada Serializer.data y el renderizado de la respuesta.
+
+El id de la traza se devuelve en la cabecera X-Trace-Id. Si la petición
+trae una cabecera W3C 'traceparent', la traza continúa la del llamador.
+
+Al terminar la petición la traza se escribe como una línea JSON en
+TRACING_EXPORT_PATH, con el formato OTLP/JSON (resourceSpans) que lee el
+receptor 'otlpjsonfile' del OpenTelemetry Collector. El archivo se rota al
+superar TRACING_EXPORT_MAX_BYTES.
+
+Sin TRACING_ENABLED al arrancar no se instala nada. Fuera de una traza,
+span() devuelve un objeto vacío y las funciones instrumentadas solo
+comprueban una variable de contexto.
+
+Uso en código propio:
+
+    with span('calcular_cronograma', pedido=pedido.id):
+        ...
+"""
+import inspect
+import json
+import logging
+import os
+import random
+import re
+import secrets
+import tempfile
+import threading
+import time
+from contextlib import ExitStack
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+SERVICE_NAME = 'calendarwebapp'
+
+# Tipos de span de OTLP
+KIND_INTERNAL = 1
+KIND_SERVER = 2
+KIND_CLIENT = 3
+
+STATUS_ERROR = 2
+
+_TRACEPARENT_RE = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$')
+
+_current = ContextVar('trace_span', default=None)
+_export_lock = threading.Lock()
+
+
+class Trace:
+    def __init__(self, trace_id=None):
+        self.trace_id = trace_id or secrets.token_hex(16)
+        self.spans = []
+        self.dropped = 0
+
+
+class Span:
+    __slots__ = ('trace', 'name', 'kind', 'span_id', 'parent_id', 'start', 'end', 'attributes', 'error')
+
+    def __init__(self, trace, name, kind=KIND_INTERNAL, parent_id=None, attributes=None):
+        self.trace = trace
+        self.name = name
+        self.kind = kind
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.start = time.time_ns()
+        self.end = None
+        self.attributes = attributes or {}
+        self.error = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def finish(self):
+        self.end = time.time_ns()
+        trace = self.trace
+        if len(trace.spans) < getattr(settings, 'TRACING_MAX_SPANS', 2000):
+            trace.spans.append(self)
+        else:
+            trace.dropped += 1
+
+
+class _NoopSpan:
+    """Lo que devuelve span() fuera de una traza: no hace nada"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attributes):
+        pass
+
+
+NOOP = _NoopSpan()
+
+
+class _SpanContext:
+    __slots__ = ('name', 'kind', 'attributes', 'span', 'token')
+
+    def __init__(self, name, kind, attributes):
+        self.name = name
+        self.kind = kind
+        self.attributes = attributes
+
+    def __enter__(self):
+        parent = _current.get()
+        self.span = Span(parent.trace, self.name, self.kind, parent.span_id, self.attributes)
+        self.token = _current.set(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.span.error = f"{exc_type.__name__}: {exc}"
+        self.span.finish()
+        _current.reset(self.token)
+        return False
+
+
+def span(name, kind=KIND_INTERNAL, **attributes):
+    """Abre un span hijo del actual; fuera de una traza no hace nada"""
+    if _current.get() is None:
+        return NOOP
+    return _SpanContext(name, kind, attributes)
+
+
+def traced(name=None):
+    """Decorador: ejecuta la función dentro de un span"""
+    def decorator(func):
+        nombre = name or func.__qualname__
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if _current.get() is None:
+                return func(*args, **kwargs)
+            with _SpanContext(nombre, KIND_INTERNAL, {}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def current_trace_id():
+    actual = _current.get()
+    return actual.trace.trace_id if actual is not None else None
+
+
+# Exportación -----------------------------------------------------------------
+
+def _attribute(key, value):
+    if isinstance(value, bool):
+        valor = {'boolValue': value}
+    elif isinstance(value, int):
+        valor = {'intValue': str(value)}
+    elif isinstance(value, float):
+        valor = {'doubleValue': value}
+    else:
+        valor = {'stringValue': str(value)}
+    return {'key': key, 'value': valor}
+
+
+def to_otlp(trace):
+    """Traza en formato OTLP/JSON (un objeto ExportTraceServiceRequest)"""
+    spans = []
+    for s in trace.spans:
+        item = {
+            'traceId': trace.trace_id,
+            'spanId': s.span_id,
+            'name': s.name,
+            'kind': s.kind,
+            'startTimeUnixNano': str(s.start),
+            'endTimeUnixNano': str(s.end),
+            'attributes': [_attribute(k, v) for k, v in s.attributes.items() if v is not None],
+            'status': {'code': STATUS_ERROR, 'message': s.error} if s.error else {},
+        }
+        if s.parent_id:
+            item['parentSpanId'] = s.parent_id
+        spans.append(item)
+    resource = [
+        _attribute('service.name', SERVICE_NAME),
+        _attribute('process.pid', os.getpid()),
+    ]
+    if trace.dropped:
+        resource.append(_attribute('calendarwebapp.dropped_spans', trace.dropped))
+    return {'resourceSpans': [{
+        'resource': {'attributes': resource},
+        'scopeSpans': [{'scope': {'name': 'core.tracing'}, 'spans': spans}],
+    }]}
+
+
+def _export_path():
+    return getattr(settings, 'TRACING_EXPORT_PATH', None) or os.path.join(
+        tempfile.gettempdir(), 'calendarwebapp_traces.jsonl'
+    )
+
+
+def export(trace):
+    """Añade la traza al archivo JSONL, rotándolo si supera el tamaño máximo"""
+    path = _export_path()
+    linea = (json.dumps(to_otlp(trace), separators=(',', ':')) + '\n').encode()
+    maximo = getattr(settings, 'TRACING_EXPORT_MAX_BYTES', 50 * 1024 * 1024)
+    with _export_lock:
+        try:
+            if os.path.getsize(path) + len(linea) > maximo:
+                os.replace(path, path + '.1')
+        except FileNotFoundError:
+            pass
+        # Una sola escritura en modo append: las líneas de varios workers no se mezclan
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, linea)
+        finally:
+            os.close(fd)
+
+
+# Middleware e instrumentación ----------------------------------------------
+
+class DatabaseSpans:
+    """Envoltorio de ejecución SQL que abre un span por consulta"""
+
+    def __init__(self, alias, vendor):
+        self.alias = alias
+        self.vendor = vendor
+
+    def __call__(self, execute, sql, params, many, context):
+        if _current.get() is None:
+            return execute(sql, params, many, context)
+        from core.slow_queries import normalize_sql
+
+        statement = normalize_sql(sql)
+        with _SpanContext(f"db {statement.split(' ', 1)[0]}", KIND_CLIENT, {
+            'db.system': self.vendor,
+            'db.name': self.alias,
+            'db.statement': statement[:1000],
+            'db.executemany': many or None,
+        }):
+            return execute(sql, params, many, context)
+
+
+class TracingMiddleware:
+    """
+    Abre la traza de la petición. Debe ir el primero de MIDDLEWARE para que
+    los spans del resto queden dentro.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not getattr(settings, 'TRACING_ENABLED', False) or \
+                random.random() >= getattr(settings, 'TRACING_SAMPLE_RATE', 1.0):
+            return self.get_response(request)
+
+        trace_id = parent_id = None
+        match = _TRACEPARENT_RE.match(request.headers.get('traceparent', ''))
+        if match:
+            trace_id, parent_id = match.groups()
+        trace = Trace(trace_id)
+        root = Span(trace, f"{request.method} {request.path}", KIND_SERVER, parent_id, {
+            'http.method': request.method,
+            'http.target': request.get_full_path(),
+        })
+        token = _current.set(root)
+        response = None
+        try:
+            with ExitStack() as stack:
+                for alias in connections:
+                    conn = connections[alias]
+                    stack.enter_context(conn.execute_wrapper(DatabaseSpans(alias, conn.vendor)))
+                response = self.get_response(request)
+            return response
+        except Exception as e:
+            root.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            _current.reset(token)
+            self.finish(request, response, trace, root)
+
+    def finish(self, request, response, trace, root):
+        resolver_match = getattr(request, 'resolver_match', None)
+        if resolver_match is not None and resolver_match.route:
+            from django.contrib.admindocs.views import simplify_regex
+
+            route = simplify_regex(resolver_match.route)
+            root.name = f"{request.method} {route}"
+            root.set(**{'http.route': route})
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            root.set(**{'enduser.id': user.pk})
+        if response is not None:
+            root.set(**{'http.status_code': response.status_code})
+            response['X-Trace-Id'] = trace.trace_id
+            if response.status_code >= 500 and root.error is None:
+                root.error = f"HTTP {response.status_code}"
+        root.finish()
+        try:
+            export(trace)
+        except OSError:
+            logger.exception("No se pudo exportar la traza %s", trace.trace_id)
+
+
+def _patch_property(cls, name, make_name):
+    """Envuelve una propiedad en un span (solo si hay una traza activa)"""
+    original = getattr(cls, name)
+    if getattr(original.fget, 'trazado', False):
+        return
+
+    def fget(self):
+        if _current.get() is None:
+            return original.fget(self)
+        with _SpanContext(make_name(self), KIND_INTERNAL, {}):
+            return original.fget(self)
+
+    fget.trazado = True
+    setattr(cls, name, property(fget, original.fset, original.fdel))
+
+
+def _patch_method(cls, name, make_name):
+    original = getattr(cls, name)
+    if getattr(original, 'trazado', False):
+        return
+
+    @wraps(original)
+    def method(self, *args, **kwargs):
+        if _current.get() is None:
+            return original(self, *args, **kwargs)
+        with _SpanContext(make_name(self), KIND_INTERNAL, {}):
+            return original(self, *args, **kwargs)
+
+    method.trazado = True
+    setattr(cls, name, method)
+
+
+def _view_span_name(view):
+    metodo = view.request.method.lower()
+    accion = getattr(view, 'action_map', None) or {}
+    return f"view {type(view).__name__}.{accion.get(metodo, metodo)}"
+
+
+def _serializer_span_name(serializer):
+    child = getattr(serializer, 'child', None)
+    if child is not None:
+        return f"serializer {type(child).__name__}(many)"
+    return f"serializer {type(serializer).__name__}"
+
+
+def instrument():
+    """
+    Instala los spans de middlewares, DRF y serializers. Se llama al
+    arrancar (AdministracionConfig.ready), antes de que Django monte la
+    cadena de middlewares, y solo si TRACING_ENABLED está activo.
+    """
+    from asgiref.sync import iscoroutinefunction
+    from django.core.handlers import base
+    from rest_framework.response import Response
+    from rest_framework.serializers import BaseSerializer
+    from rest_framework.views import APIView
+
+    original_convert = base.convert_exception_to_response
+    if not getattr(original_convert, 'trazado', False):
+        def convert_exception_to_response(get_response):
+            handler = original_convert(get_response)
+            if iscoroutinefunction(handler):
+                return handler
+            nombre = f"middleware {type(get_response).__name__}"
+            if inspect.ismethod(get_response):
+                nombre = f"handler {get_response.__name__}"  # BaseHandler._get_response: URL y vista
+
+            @wraps(handler)
+            def inner(request):
+                if _current.get() is None:
+                    return handler(request)
+                with _SpanContext(nombre, KIND_INTERNAL, {}):
+                    return handler(request)
+            return inner
+
+        convert_exception_to_response.trazado = True
+        base.convert_exception_to_response = convert_exception_to_response
+
+    _patch_method(APIView, 'dispatch', _view_span_name)
+    _patch_method(APIView, 'perform_authentication', lambda view: 'drf.authentication')
+    _patch_method(APIView, 'check_permissions', lambda view: 'drf.permissions ' + ','.join(
+        p.__name__ for p in view.permission_classes))
+    _patch_method(APIView, 'check_object_permissions', lambda view: 'drf.object_permissions')
+    _patch_property(BaseSerializer, 'data', _serializer_span_name)
+    _patch_property(Response, 'rendered_content', lambda response: f"render {type(response.accepted_renderer).__name__}")
@@ -0,0 +1,10 @@
+set -o errexit
+
+# ASGI: gunicorn gestiona los workers y uvicorn sirve cada uno con su bucle
+# de eventos. Así funcionan /api/eventos/ (SSE) y las vistas de /api/async/;
+# las vistas síncronas siguen igual. WEB_CONCURRENCY es también el número de
+# workers entre los que se reparte DB_POOL_TOTAL (ver core/settings.py).
+exec gunicorn core.asgi:application \
+    -k uvicorn.workers.UvicornWorker \
+    --workers "${WEB_CONCURRENCY:-2}" \
+    --bind "0.0.0.0:${PORT:-8000}"